@@ -188,22 +188,49 @@ def data_trajectory_extraction(ctx, name, only):
 
                 oetrajrec = record.get_value(OEField('OETraj', Types.Record))
 
-                prot_conf_id = oetrajrec.get_value(OEField("ProtTraj_OPLMD", Types.Int))
+                if oetrajrec.has_field(OEField("ProtTraj_OPLMD", Types.Int)):
 
-                shard = session.get_resource(Shard(collection=collection),  prot_conf_id)
+                    prot_conf_id = oetrajrec.get_value(OEField("ProtTraj_OPLMD", Types.Int))
 
-                with TemporaryDirectory() as output_directory:
-                    protein_fn = os.path.join(output_directory, "prot_traj_confs.oeb")
+                    shard = session.get_resource(Shard(collection=collection),  prot_conf_id)
+
+                    with TemporaryDirectory() as output_directory:
+                        protein_fn = os.path.join(output_directory, "prot_traj_confs.oeb")
+
+                        shard.download_to_file(protein_fn)
+
+                        protein_conf = oechem.OEMol()
+
+                        with oechem.oemolistream(protein_fn) as ifs:
+                            oechem.OEReadMolecule(ifs, protein_conf)
+
+                    oetrajrec.delete_field(OEField('ProtTraj_OPLMD', Types.Int))
+                    oetrajrec.set_value(Fields.protein_traj_confs, protein_conf)
+
+                # The trajectory stores are downloaded and referred by their local file names
+                if oetrajrec.has_field(Fields.traj_stores):
 
-                    shard.download_to_file(protein_fn)
+                    stores = oetrajrec.get_value(Fields.traj_stores)
 
-                    protein_conf = oechem.OEMol()
+                    def download_store(store_id, store_name):
+                        store_fn = str(collection_id) + '_' + str(store_id) + '_' + store_name + '.mdtraj'
 
-                    with oechem.oemolistream(protein_fn) as ifs:
-                        oechem.OEReadMolecule(ifs, protein_conf)
+                        if not os.path.isfile(store_fn):
+                            shard = session.get_resource(Shard(collection=collection), store_id)
+                            shard.download_to_file(store_fn)
 
-                oetrajrec.delete_field(OEField('ProtTraj_OPLMD', Types.Int))
-                oetrajrec.set_value(Fields.protein_traj_confs, protein_conf)
+                        return store_fn
+
+                    for store_name, store_id in stores.items():
+
+                        # The concatenated stores refer to the frame ranges of other stores
+                        if isinstance(store_id, dict):
+                            for part in store_id['stores']:
+                                part['file_id'] = download_store(part['file_id'], store_name)
+                        else:
+                            stores[store_name] = download_store(store_id, store_name)
+
+                    oetrajrec.set_value(Fields.traj_stores, stores)
 
                 new_record.set_value(OEField('OETraj', Types.Record), oetrajrec)
 
@@ -516,4 +543,14 @@ def traj_conf_extraction(ctx):
                 mol.SetTitle(name)
                 oechem.OEWriteConstMolecule(ofs, mol)
 
+        # The protein and water trajectories saved as trajectory stores
+        if oetraj_rec.has_field(Fields.traj_stores):
+
+            mdtrajrecord = MDDataRecord(oetraj_rec)
+
+            for store_name in oetraj_rec.get_value(Fields.traj_stores):
+                mol = mdtrajrecord.get_traj_store(store_name).to_oemol()
+                mol.SetTitle(store_name)
+                oechem.OEWriteConstMolecule(ofs, mol)
+
         ofs.close()
@@ -194,7 +194,7 @@ class ForceFieldCube(RecordPortsMixin, ComputeCube):
 
             mdrecord.set_parmed(flask_pmd_structure, shard_name="Parmed_" + flask_title + '_' + str(sys_id))
 
-            data_fn = os.path.basename(mdrecord.cwd) + '_' + flask_title+'_' + str(sys_id) + '-' + opt['suffix']+'.tar.gz'
+            data_fn = os.path.basename(mdrecord.cwd) + '_' + flask_title+'_' + str(sys_id) + '-' + opt['suffix'] + '.mdstage'
 
             if not mdrecord.add_new_stage(MDStageNames.ForceField,
                                           MDStageTypes.SETUP,
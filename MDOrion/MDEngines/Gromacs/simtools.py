@@ -33,8 +33,6 @@ import subprocess
 
 import parmed
 
-import copy
-
 from oeommtools import utils as oeommutils
 
 import tarfile
@@ -782,7 +780,7 @@ class GromacsSimulations(MDSimulations):
 
         gro_structure = parmed.gromacs.GromacsGroFile().parse(gro_fn, skip_bonds=True)
 
-        new_mdstate = copy.deepcopy(self.mdstate)
+        new_mdstate = self.mdstate.copy()
 
         new_mdstate.set_positions(gro_structure.positions)
 
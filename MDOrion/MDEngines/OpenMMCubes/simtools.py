@@ -29,12 +29,12 @@ from simtk.openmm import app
 
 from oeommtools import utils as oeommutils
 
+from openeye import oechem
+
 from platform import uname
 
 import os
 
-import copy
-
 from floe.api.orion import in_orion
 
 try:
@@ -53,11 +53,20 @@ import math
 
 import time
 
-from MDOrion.MDEngines.utils import (MDSimulations,
-                                     md_keys_converter)
-import tarfile
+from MDOrion.MDEngines.utils import MDSimulations
+
+from MDOrion.MDEngines.OpenMMCubes.utils import (get_system,
+                                                 save_checkpoint,
+                                                 load_checkpoint,
+                                                 step_for_clock_time,
+                                                 parse_trajectory_streams,
+                                                 trajectory_stream_fns)
+
+from MDOrion.Standards import MDFileNames
+
+from MDOrion.Standards.chunked_traj import ChunkedTrajectoryWriter
 
-from MDOrion.Standards import MDEngines, MDFileNames
+from MDOrion.Standards.stage_container import write_stage_container
 
 
 class OpenMMSimulations(MDSimulations):
@@ -100,11 +109,8 @@ class OpenMMSimulations(MDSimulations):
             # New Coordinates
             new_coords = coords + delta
             parmed_structure.coordinates = new_coords
-            positions = parmed_structure.positions
-            mdstate.set_positions(positions)
-
-        # Constraint type
-        constraints = md_keys_converter[MDEngines.OpenMM]['constraints'][opt['constraints']]
+            mdstate.set_positions(new_coords * unit.angstrom)
+            positions = mdstate.get_positions()
 
         # OpenMM system
         if box is not None:
@@ -122,55 +128,71 @@ class OpenMMSimulations(MDSimulations):
                                    "to {} A".format(opt['CubeTitle'], threshold))
 
                 cutoff_distance = threshold * unit.angstroms
-
-            self.system = parmed_structure.createSystem(nonbondedMethod=app.PME,
-                                                        nonbondedCutoff=cutoff_distance,
-                                                        constraints=eval("app.%s" % constraints),
-                                                        removeCMMotion=False,
-                                                        hydrogenMass=4.0 * unit.amu if opt['hmr'] else None)
         else:  # Vacuum
-            self.system = parmed_structure.createSystem(nonbondedMethod=app.NoCutoff,
-                                                        constraints=eval("app.%s" % constraints),
-                                                        removeCMMotion=False,
-                                                        hydrogenMass=4.0 * unit.amu if opt['hmr'] else None)
-        # Add Implicit Solvent Force
-        if opt['implicit_solvent'] != 'None':
-            opt['Logger'].info("[{}] Implicit Solvent Selected".format(opt['CubeTitle']))
-
-            implicit_force = parmed_structure.omm_gbsa_force(eval("app.%s" % opt['implicit_solvent']),
-                                                             temperature=opt['temperature'] * unit.kelvin,
-                                                             nonbondedMethod=app.PME,
-                                                             nonbondedCutoff=opt['nonbondedCutoff'] * unit.angstroms)
-            self.system.addForce(implicit_force)
+            cutoff_distance = None
+
+        # The System is recovered from the System cache if available. Only the stage
+        # specific forces (barostat and restraints) and frozen atoms are added on top of it
+        self.system = get_system(parmed_structure, opt, cutoff_distance=cutoff_distance)
 
         # OpenMM Integrator
         integrator = openmm.LangevinIntegrator(opt['temperature'] * unit.kelvin, 1 / unit.picoseconds, self.stepLen)
 
-        if opt['SimType'] == 'npt':
+        # The stage plan is a list of stage options sharing the same System and
+        # OpenMM Context. A single stage simulation is a plan with one stage
+        if opt.get('stage_plan'):
+            self.stage_opts = opt['stage_plan']
+        else:
+            self.stage_opts = [opt]
+
+        if any(stg_opt['SimType'] == 'npt' for stg_opt in self.stage_opts):
             if box is None:
                 raise ValueError("NPT simulation without box vector")
 
-            # Add Force Barostat to the system
-            self.system.addForce(
-                openmm.MonteCarloBarostat(opt['pressure'] * unit.atmospheres, opt['temperature'] * unit.kelvin, 25))
+            # Add Force Barostat to the system. The barostat is switched off
+            # by setting its frequency to zero in the non NPT plan stages
+            self.barostat = openmm.MonteCarloBarostat(opt['pressure'] * unit.atmospheres,
+                                                      opt['temperature'] * unit.kelvin, 25)
+            self.system.addForce(self.barostat)
+        else:
+            self.barostat = None
 
         # Apply restraints
-        if opt['restraints']:
+        self.restraint_sets = []
+
+        for stg_opt in self.stage_opts:
+
+            if not stg_opt['restraints']:
+                self.restraint_sets.append(set())
+                continue
+
             opt['Logger'].info("[{}] RESTRAINT mask applied to: {}"
-                               "\tRestraint weight: {}".format(opt['CubeTitle'],
-                                                               opt['restraints'],
-                                                               opt['restraintWt'] *
+                               "\tRestraint weight: {}".format(stg_opt['CubeTitle'],
+                                                               stg_opt['restraints'],
+                                                               stg_opt['restraintWt'] *
                                                                unit.kilocalories_per_mole / unit.angstroms ** 2))
             # Select atom to restraint
-            res_atom_set = oeommutils.select_oemol_atom_idx_by_language(opt['molecule'], mask=opt['restraints'])
-            opt['Logger'].info("[{}] Number of restraint atoms: {}".format(opt['CubeTitle'],
+            res_atom_set = set(oeommutils.select_oemol_atom_idx_by_language(opt['molecule'],
+                                                                            mask=stg_opt['restraints']))
+            opt['Logger'].info("[{}] Number of restraint atoms: {}".format(stg_opt['CubeTitle'],
                                                                            len(res_atom_set)))
+            self.restraint_sets.append(res_atom_set)
+
+        # The restraint force holds the atoms restrained in any of the plan stages. The per-particle
+        # "on" parameter selects the atoms restrained in the current stage
+        self.restraint_atoms = sorted(set().union(*self.restraint_sets))
+        self.restraint_force = None
+        self.reference_positions = None
+
+        if self.restraint_atoms:
             # define the custom force to restrain atoms to their starting positions
-            force_restr = openmm.CustomExternalForce('k_restr*periodicdistance(x, y, z, x0, y0, z0)^2')
+            force_restr = openmm.CustomExternalForce('k_restr*on*periodicdistance(x, y, z, x0, y0, z0)^2')
             # Add the restraint weight as a global parameter in kcal/mol/A^2
             force_restr.addGlobalParameter("k_restr",
                                            opt['restraintWt'] * unit.kilocalories_per_mole / unit.angstroms ** 2)
-            # Define the target xyz coords for the restraint as per-atom (per-particle) parameters
+            # Define the restraint switch and the target xyz coords for the restraint
+            # as per-atom (per-particle) parameters
+            force_restr.addPerParticleParameter("on")
             force_restr.addPerParticleParameter("x0")
             force_restr.addPerParticleParameter("y0")
             force_restr.addPerParticleParameter("z0")
@@ -189,17 +211,18 @@ class OpenMMSimulations(MDSimulations):
                 # Translation vector
                 delta = box_v / 2 - cog
                 # New Coordinates
-                corrected_reference_positions = coords + delta
+                self.reference_positions = coords + delta
 
-            for idx in range(0, len(positions)):
-                if idx in res_atom_set:
-                    if opt['restraint_to_reference']:
-                        xyz = corrected_reference_positions[idx]  # nanometers unit
-                    else:
-                        xyz = positions[idx].in_units_of(unit.nanometers) / unit.nanometers
-                    force_restr.addParticle(idx, xyz)
+            for idx in self.restraint_atoms:
+                on = 1.0 if idx in self.restraint_sets[0] else 0.0
+                if self.reference_positions is not None:
+                    xyz = self.reference_positions[idx]  # nanometers unit
+                else:
+                    xyz = positions[idx].value_in_unit(unit.nanometers)
+                force_restr.addParticle(idx, [on, xyz[0], xyz[1], xyz[2]])
 
             self.system.addForce(force_restr)
+            self.restraint_force = force_restr
 
         # Freeze atoms
         if opt['freeze']:
@@ -290,9 +313,18 @@ class OpenMMSimulations(MDSimulations):
             # Convert simulation time in steps
             opt['steps'] = int(round(opt['time'] / (self.stepLen.in_units_of(unit.nanoseconds) / unit.nanoseconds)))
 
-            # Set Reporters
-            for rep in getReporters(**opt):
-                simulation.reporters.append(rep)
+            # Set Reporters. The stage plan reporters are set stage by stage
+            if not opt.get('stage_plan'):
+                for rep in getReporters(**opt):
+                    simulation.reporters.append(rep)
+
+            # Resume from the checkpoint written by the previous continuation cycle. The
+            # current step is restored so that the reporters keep their reporting offsets
+            if opt.get('checkpoint_fn'):
+                opt['Logger'].info('[{}] RESUMING simulation from the checkpoint at step {}'.format(
+                    opt['CubeTitle'], opt['current_step']))
+                load_checkpoint(simulation, opt['checkpoint_fn'], opt)
+                simulation.currentStep = opt['current_step']
 
         # OpenMM platform information
         mmver = openmm.version.version
@@ -395,8 +427,24 @@ class OpenMMSimulations(MDSimulations):
                 info = '{:<25} = {:<10}'.format('Total trajectory frames', self.opt['trajectory_frames'])
                 self.str_logger += '\n' + info
 
-            # Start Simulation
-            self.omm_simulation.step(self.opt['steps'])
+            # Start Simulation. In a continuation cycle the simulation runs for the selected
+            # wall clock time and the Context is checkpointed to be resumed by the next cycle
+            if self.opt.get('cycle_run_time'):
+                self.opt['current_step'] = step_for_clock_time(self.omm_simulation,
+                                                               self.opt['steps'],
+                                                               self.opt['cycle_run_time'] * 3600.0)
+
+                self.opt['Logger'].info('[{}] Cycle completed at step {} of {}'.format(self.opt['CubeTitle'],
+                                                                                     self.opt['current_step'],
+                                                                                     self.opt['steps']))
+
+                save_checkpoint(self.omm_simulation, self.opt['checkpoint_out_fn'])
+
+                for rep in self.omm_simulation.reporters:
+                    if hasattr(rep, 'close'):
+                        rep.close()
+            else:
+                self.omm_simulation.step(self.opt['steps'])
 
             if box is not None:
                 state = self.omm_simulation.context.getState(getPositions=True,
@@ -417,32 +465,167 @@ class OpenMMSimulations(MDSimulations):
 
                     self.opt['str_logger'] += '\n' + log_string
 
-                # Save trajectory files
-                if self.opt['trajectory_interval'] or self.opt['trajectory_frames']:
+                # The chunks have been uploaded during the run, only the manifest is saved
+                if (self.opt['trajectory_interval'] or self.opt['trajectory_frames']) and \
+                        self.opt.get('trajectory_format') == 'chunked':
+
+                    self.opt['trj_fn'] = self.opt['out_fn'] + '_' + MDFileNames.trajectory_manifest
+
+                    for rep in self.omm_simulation.reporters:
+                        if isinstance(rep, ChunkedTrajectoryReporter):
+                            rep.write_manifest(self.opt['trj_fn'])
+
+                # Save trajectory files. The continuation cycle trajectory segments
+                # are joined by the cycle cube at the end of the last cycle
+                elif (self.opt['trajectory_interval'] or self.opt['trajectory_frames']) and \
+                        not self.opt.get('cycle_run_time'):
+
+                    # The trajectory files are saved in a seekable container
+                    self.opt['trj_fn'] = self.opt['out_fn'] + '_' + MDFileNames.trajectory_container
+
+                    trj_fns = [self.opt['omm_trj_fn']]
+
+                    for name, interval, mask in parse_trajectory_streams(self.opt.get('trajectory_streams', '')):
+                        trj_fns.extend(trajectory_stream_fns(self.opt['omm_trj_fn'], name))
 
-                    tar_fn = self.opt['trj_fn']
+                    for rep in self.omm_simulation.reporters:
+                        if hasattr(rep, 'close'):
+                            rep.close()
 
-                    with tarfile.open(tar_fn, mode='w:gz') as archive:
-                        archive.add(self.opt['omm_trj_fn'], arcname=os.path.basename(self.opt['omm_trj_fn']))
+                    # The HDF5 trajectories are already compressed
+                    write_stage_container(self.opt['trj_fn'], [(fn, fn.endswith('.npy')) for fn in trj_fns])
 
         self.omm_state = state
 
         return
 
+    def set_stage(self, stage_idx):
+        """
+        This method switches the OpenMM Context to the selected plan stage by
+        updating the restraint weight, the restrained particle set and the
+        barostat without creating a new Context
+
+        Parameters
+        ----------
+        stage_idx: Int
+            The plan stage index
+        """
+
+        stg_opt = self.stage_opts[stage_idx]
+        context = self.omm_simulation.context
+
+        if self.barostat is not None:
+            frequency = 25 if stg_opt['SimType'] == 'npt' else 0
+
+            # The barostat frequency is a System force property, the Context
+            # must be reinitialized to pick up the change
+            if self.barostat.getFrequency() != frequency:
+                self.barostat.setFrequency(frequency)
+                context.reinitialize(preserveState=True)
+
+            if frequency:
+                context.setParameter(openmm.MonteCarloBarostat.Pressure(),
+                                     (stg_opt['pressure'] * unit.atmospheres).value_in_unit(unit.bar))
+
+        if self.restraint_force is not None:
+
+            if self.reference_positions is None:
+                # Restraint to the stage starting positions
+                positions = context.getState(getPositions=True).getPositions(asNumpy=True).value_in_unit(
+                    unit.nanometers)
+            else:
+                positions = self.reference_positions
+
+            for k, idx in enumerate(self.restraint_atoms):
+                on = 1.0 if idx in self.restraint_sets[stage_idx] else 0.0
+                xyz = positions[idx]
+                self.restraint_force.setParticleParameters(k, idx, [on, xyz[0], xyz[1], xyz[2]])
+
+            self.restraint_force.updateParametersInContext(context)
+
+            k_restr = stg_opt['restraintWt'] * unit.kilocalories_per_mole / unit.angstroms ** 2
+            context.setParameter('k_restr', k_restr.value_in_unit(unit.kilojoules_per_mole / unit.nanometers ** 2))
+
+        return
+
+    def run_stage_plan(self):
+        """
+        This method runs all the plan stages in the same OpenMM Context. After each
+        stage the MD State is updated and collected together with the stage options
+        so that each stage can be saved as a separate MD stage
+
+        Returns
+        -------
+        results: list
+            The list of (stage options, MDState) tuples, one for each plan stage
+        """
+
+        results = []
+
+        velocities_ready = self.stage_opts[0]['SimType'] in ['nvt', 'npt']
+
+        for stage_idx, stg_opt in enumerate(self.stage_opts):
+
+            self.opt = stg_opt
+
+            self.set_stage(stage_idx)
+
+            self.omm_simulation.reporters = []
+            self.omm_simulation.currentStep = 0
+
+            if stg_opt['SimType'] in ['nvt', 'npt']:
+
+                if not velocities_ready:
+                    opt_vel = self.mdstate.get_velocities()
+                    if opt_vel is not None:
+                        self.omm_simulation.context.setVelocities(opt_vel)
+                    else:
+                        stg_opt['Logger'].info('[{}] GENERATING a new starting State'.format(stg_opt['CubeTitle']))
+                        self.omm_simulation.context.setVelocitiesToTemperature(stg_opt['temperature'] * unit.kelvin)
+                    velocities_ready = True
+
+                stg_opt['timestep'] = self.stepLen
+                stg_opt['steps'] = int(round(stg_opt['time'] / (self.stepLen.in_units_of(unit.nanoseconds) /
+                                                                unit.nanoseconds)))
+
+                stg_opt['omm_log_fn'] = os.path.join(stg_opt['out_directory'],
+                                                     stg_opt['suffix'] + '_trajectory.log')
+                stg_opt['omm_trj_fn'] = os.path.join(stg_opt['out_directory'],
+                                                     stg_opt['suffix'] + '_trajectory.h5')
+
+                for rep in getReporters(**stg_opt):
+                    self.omm_simulation.reporters.append(rep)
+
+            stg_opt['Logger'].info('[{}] START STAGE: {}'.format(stg_opt['CubeTitle'], stg_opt['stage_name']))
+
+            self.run()
+
+            for rep in self.omm_simulation.reporters:
+                if hasattr(rep, 'close'):
+                    rep.close()
+
+            self.omm_simulation.reporters = []
+
+            self.mdstate = self.update_state()
+
+            results.append((stg_opt, self.mdstate))
+
+        return results
+
     def update_state(self):
 
         if not hasattr(self, 'omm_state'):
             raise ValueError("The OpenMM State has not been defined. The MD simulation has not been performed")
 
-        new_mdstate = copy.deepcopy(self.mdstate)
+        new_mdstate = self.mdstate.copy()
 
-        new_mdstate.set_positions(self.omm_state.getPositions(asNumpy=False))
+        new_mdstate.set_positions(self.omm_state.getPositions(asNumpy=True))
 
         if self.mdstate.get_box_vectors() is not None:
             new_mdstate.set_box_vectors(self.omm_state.getPeriodicBoxVectors())
 
         if self.opt['SimType'] in ['nvt', 'npt']:
-            new_mdstate.set_velocities(self.omm_state.getVelocities(asNumpy=False))
+            new_mdstate.set_velocities(self.omm_state.getVelocities(asNumpy=True))
 
         return new_mdstate
 
@@ -460,7 +643,10 @@ class OpenMMSimulations(MDSimulations):
 
 def getReporters(totalSteps=None, outfname=None, **opt):
     """
-    Creates 3 OpenMM Reporters for the simulation.
+    Creates the OpenMM Reporters for the simulation: the state and progress
+    reporters, the full system trajectory reporter and the atom subset
+    trajectory stream reporters, if any. The trajectory velocities are not
+    saved since the last frame velocities are kept in the MD State.
 
     Parameters
     ----------
@@ -473,10 +659,11 @@ def getReporters(totalSteps=None, outfname=None, **opt):
 
     Returns
     -------
-    reporters : list of three openmm.app.simulation.reporters
+    reporters : list of openmm.app.simulation.reporters
         (0) state_reporter: writes energies to '.log' file.
         (1) progress_reporter: prints simulation progress to 'sys.stdout'
         (2) traj_reporter: writes trajectory to file. Supported format .nc, .dcd, .hdf5
+        (3...) stream_reporter: writes the atom subset trajectory streams to .hdf5 files
     # """
 
     totalSteps = opt['steps']
@@ -510,10 +697,6 @@ def getReporters(totalSteps=None, outfname=None, **opt):
         trajectory_steps = int(round(opt['trajectory_interval'] / (
                 opt['timestep'].in_units_of(unit.nanoseconds) / unit.nanoseconds)))
 
-        traj_reporter = mdtraj.reporters.HDF5Reporter(opt['omm_trj_fn'], trajectory_steps, velocities=True)
-
-        reporters.append(traj_reporter)
-
     elif opt['trajectory_frames']:
 
         if opt['steps'] < opt['trajectory_frames']:
@@ -522,13 +705,167 @@ def getReporters(totalSteps=None, outfname=None, **opt):
 
         trajectory_steps = int(math.floor(opt['steps'] / opt['trajectory_frames']))
 
-        traj_reporter = mdtraj.reporters.HDF5Reporter(opt['omm_trj_fn'], trajectory_steps, velocities=True)
+    if opt['trajectory_interval'] or opt['trajectory_frames']:
+
+        if opt.get('trajectory_format') == 'chunked':
+
+            if opt.get('trajectory_streams'):
+                raise ValueError("The trajectory streams are not supported by the chunked trajectory format")
+
+            # The chunks are written in the current working directory since locally they are
+            # not uploaded. In Orion they are removed as soon as they have been uploaded
+            chunk_dir = os.path.basename(opt['out_directory']) + '_' + \
+                os.path.splitext(os.path.basename(opt['omm_trj_fn']))[0] + '_chunks'
+
+            traj_reporter = ChunkedTrajectoryReporter(chunk_dir, trajectory_steps)
+        else:
+            traj_reporter = mdtraj.reporters.HDF5Reporter(opt['omm_trj_fn'], trajectory_steps, velocities=False)
 
         reporters.append(traj_reporter)
 
+    # Atom subset trajectory streams. Each stream writes the selected atoms at its own
+    # interval together with the atom indices in the full system topology
+    for name, interval, mask in parse_trajectory_streams(opt.get('trajectory_streams', '')):
+
+        stream_steps = int(round(interval / (opt['timestep'].in_units_of(unit.nanoseconds) / unit.nanoseconds)))
+
+        if stream_steps < 1:
+            raise ValueError("The trajectory stream {} interval is shorter than the time step: {}".format(name,
+                                                                                                      interval))
+
+        atom_indices = oeommutils.select_oemol_atom_idx_by_language(opt['molecule'], mask=mask)
+
+        # The distance masks can select part of a water molecule. The selected waters
+        # are completed so that the stream carries whole water molecules only
+        atom_indices = sorted(_whole_waters(opt['molecule'], atom_indices))
+
+        if not atom_indices:
+            raise ValueError("The trajectory stream {} mask does not select any atom: {}".format(name, mask))
+
+        stream_fn, indices_fn = trajectory_stream_fns(opt['omm_trj_fn'], name)
+
+        np.save(indices_fn, np.array(atom_indices, dtype=np.int64))
+
+        stream_reporter = mdtraj.reporters.HDF5Reporter(stream_fn, stream_steps,
+                                                        atomSubset=atom_indices,
+                                                        velocities=False)
+
+        reporters.append(stream_reporter)
+
     return reporters
 
 
+def _whole_waters(molecule, atom_indices):
+    # The atom indexes completed with the missing atoms of the partially selected waters
+    atom_indices = set(int(idx) for idx in atom_indices)
+
+    water_oxygens = oechem.OEAndAtom(oechem.OEIsWater(checkHydrogens=True), oechem.OEIsOxygen())
+
+    for at in molecule.GetAtoms(water_oxygens):
+        water_idx = [at.GetIdx()] + [nbr.GetIdx() for nbr in at.GetAtoms()]
+
+        if atom_indices.intersection(water_idx):
+            atom_indices.update(water_idx)
+
+    return atom_indices
+
+
+class ChunkedTrajectoryReporter(object):
+    """
+    ChunkedTrajectoryReporter writes the trajectory frames as fixed size, independently
+    compressed chunks with quantized coordinates. The completed chunks are uploaded
+    while the simulation is running and the trajectory is described by a manifest
+    holding the topology and chunk file ids.
+    """
+
+    def __init__(self, directory, reportInterval, chunk_frames=100, precision=1000):
+        """Create a ChunkedTrajectoryReporter.
+
+        Parameters
+        ----------
+        directory : string
+            The directory where the chunks are written
+        reportInterval : int
+            The interval (in time steps) at which to write frames
+        chunk_frames : int=100
+            The number of frames of each chunk
+        precision : int=1000
+            The number of coordinate quantization levels per nm
+        """
+        self._reportInterval = reportInterval
+        self._directory = directory
+        self._writer = ChunkedTrajectoryWriter(directory, chunk_frames=chunk_frames, precision=precision)
+        self._hasInitialized = False
+        self._periodic = False
+
+    def describeNextReport(self, simulation):
+        """Get information about the next report this object will generate.
+
+        Parameters
+        ----------
+        simulation : Simulation
+            The Simulation to generate a report for
+
+        Returns
+        -------
+        tuple
+            A five element tuple. The first element is the number of steps
+            until the next report. The remaining elements specify whether
+            that report will require positions, velocities, forces, and
+            energies respectively.
+        """
+        steps = self._reportInterval - simulation.currentStep % self._reportInterval
+        return (steps, True, False, False, False)
+
+    def report(self, simulation, state):
+        """Generate a report.
+
+        Parameters
+        ----------
+        simulation : Simulation
+            The Simulation to generate a report for
+        state : State
+            The current state of the simulation
+        """
+        xyz = state.getPositions(asNumpy=True).value_in_unit(unit.nanometers)
+
+        if not self._hasInitialized:
+            # The topology is saved with the first frame as mdtraj HDF5 file
+            topology_fn = os.path.join(self._directory, 'topology.h5')
+            trj = mdtraj.Trajectory(np.array([xyz]), mdtraj.Topology.from_openmm(simulation.topology))
+            trj.save_hdf5(topology_fn)
+            self._writer.set_topology(topology_fn)
+            self._periodic = simulation.topology.getUnitCellDimensions() is not None
+            self._hasInitialized = True
+
+        if self._periodic:
+            box = state.getPeriodicBoxVectors(asNumpy=True).value_in_unit(unit.nanometers)
+        else:
+            box = None
+
+        self._writer.append(xyz, state.getTime().value_in_unit(unit.picoseconds), box)
+
+    def close(self):
+        """Write the last chunk and wait for the chunk uploads.
+
+        Returns
+        -------
+        manifest : dict
+            The trajectory manifest
+        """
+        return self._writer.close()
+
+    def write_manifest(self, filename):
+        """Close the reporter and save the trajectory manifest.
+
+        Parameters
+        ----------
+        filename : string
+            The manifest file name
+        """
+        return self._writer.write_manifest(filename)
+
+
 class StateDataReporterName(object):
     """
     This class has been adapted From OpenMM 7.1.1 to print the system name that is in process
@@ -0,0 +1,162 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import pytest
+
+import os
+
+import io
+
+import tarfile
+
+import tempfile
+
+import logging
+
+import numpy as np
+
+from simtk import (unit,
+                   openmm)
+
+from MDOrion.MDEngines.OpenMMCubes.utils import (step_for_clock_time,
+                                                 save_checkpoint,
+                                                 load_checkpoint)
+
+
+class _FakeSimulation:
+
+    def __init__(self, current_step=0):
+        self.currentStep = current_step
+        self.chunks = []
+
+    def step(self, steps):
+        self.chunks.append(steps)
+        self.currentStep += steps
+
+
+class _ContextSimulation:
+
+    def __init__(self, seed=1):
+        # Two harmonically bonded particles in vacuum on the Reference platform
+        system = openmm.System()
+        system.addParticle(12.0)
+        system.addParticle(12.0)
+
+        bond = openmm.HarmonicBondForce()
+        bond.addBond(0, 1, 0.15, 1000.0)
+        system.addForce(bond)
+
+        integrator = openmm.LangevinIntegrator(300.0 * unit.kelvin, 1.0 / unit.picoseconds, 0.001 * unit.picoseconds)
+        integrator.setRandomNumberSeed(seed)
+
+        self.context = openmm.Context(system, integrator, openmm.Platform.getPlatformByName('Reference'))
+        self.context.setPositions([openmm.Vec3(0.0, 0.0, 0.0), openmm.Vec3(0.16, 0.0, 0.0)] * unit.nanometers)
+        self.context.setVelocitiesToTemperature(300.0 * unit.kelvin, seed)
+
+    def step(self, steps):
+        self.context.getIntegrator().step(steps)
+
+    def coordinates(self):
+        state = self.context.getState(getPositions=True, getVelocities=True)
+
+        return (state.getPositions(asNumpy=True).value_in_unit(unit.nanometers),
+                state.getVelocities(asNumpy=True).value_in_unit(unit.nanometers / unit.picoseconds))
+
+
+class CycleTests(unittest.TestCase):
+    """
+    Test the wall clock bounded continuation cycles
+    """
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_resume_to_completion(self):
+        simulation = _FakeSimulation(current_step=2500)
+
+        current_step = step_for_clock_time(simulation, 12000, 3600.0, chunk_steps=4000)
+
+        self.assertEqual(current_step, 12000)
+        self.assertEqual(simulation.chunks, [4000, 4000, 1500])
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_clock_time_over(self):
+        simulation = _FakeSimulation()
+
+        current_step = step_for_clock_time(simulation, 12000, 0.0, chunk_steps=4000)
+
+        self.assertEqual(current_step, 4000)
+
+
+class CheckpointTests(unittest.TestCase):
+    """
+    Test the cycle checkpoint archive round trip
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.opt = {'Logger': logging.getLogger(__name__), 'CubeTitle': 'CheckpointTest'}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_round_trip(self):
+        simulation = _ContextSimulation()
+        simulation.step(10)
+
+        filename = save_checkpoint(simulation, os.path.join(self.tmp_dir.name, 'checkpoint.tar.gz'))
+        positions, velocities = simulation.coordinates()
+
+        simulation.step(10)
+
+        # A new Context resumes bit for bit from the checkpoint
+        restored = _ContextSimulation(seed=2)
+        self.assertTrue(load_checkpoint(restored, filename, self.opt))
+
+        new_positions, new_velocities = restored.coordinates()
+        np.testing.assert_array_equal(new_positions, positions)
+        np.testing.assert_array_equal(new_velocities, velocities)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_state_fallback(self):
+        simulation = _ContextSimulation()
+        simulation.step(10)
+
+        filename = save_checkpoint(simulation, os.path.join(self.tmp_dir.name, 'checkpoint.tar.gz'))
+        positions, velocities = simulation.coordinates()
+
+        # Replace the binary checkpoint with an unreadable one
+        with tarfile.open(filename, mode='r:gz') as archive:
+            state_xml = archive.extractfile('state.xml').read()
+
+        with tarfile.open(filename, mode='w:gz') as archive:
+            for name, data in [('checkpoint.chk', b'corrupted'), ('state.xml', state_xml)]:
+                info = tarfile.TarInfo(name=name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+
+        restored = _ContextSimulation(seed=2)
+        self.assertFalse(load_checkpoint(restored, filename, self.opt))
+
+        new_positions, new_velocities = restored.coordinates()
+        np.testing.assert_allclose(new_positions, positions)
+        np.testing.assert_allclose(new_velocities, velocities)
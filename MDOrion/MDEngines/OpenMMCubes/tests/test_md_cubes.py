@@ -19,13 +19,18 @@ import unittest
 
 import os
 
+from unittest import mock
+
 from floe.test import CubeTestRunner
 
 import pytest
 
 from MDOrion.MDEngines.cubes import (MDMinimizeCube,
                                      MDNvtCube,
-                                     MDNptCube)
+                                     MDNptCube,
+                                     MDStagePlanCube)
+
+from MDOrion.MDEngines.utils import md_stage_plan
 
 from simtk import unit, openmm
 
@@ -33,7 +38,11 @@ from simtk.openmm import app
 
 import MDOrion
 
-from datarecord import read_records
+from datarecord import (read_records,
+                        OEField,
+                        Types)
+
+import json
 
 from openeye import oechem
 
@@ -347,3 +356,68 @@ class OmmNPTCubeTester(unittest.TestCase):
 
 if __name__ == "__main__":
         unittest.main()
+
+
+class OmmStagePlanCubeTester(unittest.TestCase):
+    """
+    Test the OpenMM Stage Plan cube
+    """
+
+    def setUp(self):
+        self.cube = MDStagePlanCube('StagePlan')
+        self.runner = CubeTestRunner(self.cube)
+        self.runner.start()
+
+        os.chdir(FILE_DIR)
+
+    @pytest.mark.local
+    def test_success(self):
+        print('Testing cube:', self.cube.name)
+
+        # A NVT stage followed by a NPT stage switches the barostat on in the same Context
+        self.cube.args.stage_plan = json.dumps([
+            {"stage_name": "Plan NVT", "SimType": "nvt", "time": 0.002,
+             "restraints": "noh (ligand or protein)", "restraintWt": 2.0, "suffix": "plan_nvt"},
+            {"stage_name": "Plan NPT", "SimType": "npt", "time": 0.002,
+             "restraints": "ca_protein or (noh ligand)", "restraintWt": 0.1, "suffix": "plan_npt"}])
+        self.cube.args.temperature = 300.0  # in K
+        self.cube.args.pressure = 1.0  # in atm
+        self.cube.args.nonbondedCutoff = 10.0  # in A
+        self.cube.args.constraints = "H-Bonds"
+        self.cube.begin()
+
+        # File name
+        ifs = oechem.oeifstream(os.path.join(FILE_DIR, "pP38_lig38a_2n_npt_5ns.oedb"))
+
+        for record in read_records(ifs):
+            pass
+
+        mdrecord = MDDataRecord(record)
+        n_stages = len(mdrecord.get_stages)
+
+        # The record level temperature overrides the cube parameter
+        record.set_value(OEField('temperature', Types.Float), 310.0)
+
+        # Process the molecules
+        with mock.patch('MDOrion.MDEngines.cubes.md_stage_plan', wraps=md_stage_plan) as plan_run:
+            self.cube.process(record, self.cube.intake.name)
+
+        # Assert that one molecule was emitted on the success port
+        self.assertEqual(self.runner.outputs['success'].qsize(), 1)
+        # Assert that zero molecules were emitted on the failure port
+        self.assertEqual(self.runner.outputs['failure'].qsize(), 0)
+
+        plan_opt = plan_run.call_args[0][2]
+        self.assertEqual([stg_opt['temperature'] for stg_opt in plan_opt['stage_plan']], [310.0, 310.0])
+
+        # Check out the output record
+        record = self.runner.outputs["success"].get()
+
+        mdrecord = MDDataRecord(record)
+
+        stages = mdrecord.get_stages
+        self.assertEqual(len(stages), n_stages + 2)
+        self.assertEqual(mdrecord.get_stages_names[-2:], ["Plan NVT", "Plan NPT"])
+
+        mdstate = mdrecord.get_stage_state()
+        self.assertIsNotNone(mdstate.get_velocities())
@@ -0,0 +1,54 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import pytest
+
+from MDOrion.MDEngines.OpenMMCubes.utils import (parse_trajectory_streams,
+                                                 trajectory_stream_fns)
+
+
+class TrajectoryStreamTests(unittest.TestCase):
+    """
+    Test the atom subset trajectory stream definitions
+    """
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_parse(self):
+        streams = parse_trajectory_streams("site:0.0004:ligand or protein; wat : 0.002 : water;")
+
+        self.assertEqual(streams, [('site', 0.0004, 'ligand or protein'),
+                                   ('wat', 0.002, 'water')])
+
+        self.assertEqual(parse_trajectory_streams(''), [])
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_parse_errors(self):
+        for streams in ["site:ligand", "site:0.0:ligand", "site:0.1:", "s-1:0.1:ligand", "a:0.1:ligand;a:0.2:water"]:
+            with self.assertRaises(ValueError):
+                parse_trajectory_streams(streams)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_file_names(self):
+        stream_fn, indices_fn = trajectory_stream_fns('/tmp/trajectory.h5', 'site')
+
+        self.assertEqual(stream_fn, '/tmp/trajectory_stream_site.h5')
+        self.assertEqual(indices_fn, '/tmp/trajectory_stream_site_atoms.npy')
@@ -0,0 +1,54 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import pytest
+
+from MDOrion.MDEngines.utils import stage_plan_groups
+
+
+def _stage(name, sim_type, hmr):
+    return {'stage_name': name, 'SimType': sim_type, 'hmr': hmr,
+            'constraints': 'H-Bonds', 'implicit_solvent': 'None', 'nonbondedCutoff': 10.0,
+            'freeze': '', 'restraint_to_reference': True, 'temperature': 300.0}
+
+
+class StagePlanTests(unittest.TestCase):
+    """
+    Test the stage plan grouping
+    """
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_groups(self):
+        plan = [_stage('min', 'min', False),
+                _stage('warmup', 'nvt', False),
+                _stage('equil1', 'npt', True),
+                _stage('equil2', 'npt', True)]
+
+        groups = stage_plan_groups(plan)
+
+        self.assertEqual(len(groups), 2)
+        self.assertEqual([stg['stage_name'] for stg in groups[0]], ['min', 'warmup'])
+        self.assertEqual([stg['stage_name'] for stg in groups[1]], ['equil1', 'equil2'])
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_wrong_type(self):
+        with self.assertRaises(ValueError):
+            stage_plan_groups([_stage('fec', 'fec', False)])
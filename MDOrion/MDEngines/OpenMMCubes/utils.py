@@ -0,0 +1,595 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+
+import hashlib
+
+import gzip
+
+import io
+
+import os
+
+import re
+
+import tarfile
+
+import time
+
+import numpy as np
+
+import mdtraj
+
+from simtk import (unit,
+                   openmm)
+
+from simtk.openmm import app
+
+from MDOrion.MDEngines.utils import md_keys_converter
+
+from MDOrion.Standards import MDEngines, MDFileNames
+
+from MDOrion.Standards.cache import LRUDiskCache
+
+
+# Parmed valence terms and the parameter type attributes used to fingerprint them
+_parmed_terms = [('bonds', 2, ['k', 'req']),
+                 ('angles', 3, ['k', 'theteq']),
+                 ('dihedrals', 4, ['phi_k', 'per', 'phase', 'scee', 'scnb']),
+                 ('rb_torsions', 4, ['c0', 'c1', 'c2', 'c3', 'c4', 'c5']),
+                 ('urey_bradleys', 2, ['k', 'req']),
+                 ('impropers', 4, ['psi_k', 'psi_eq']),
+                 ('adjusts', 2, ['rmin', 'epsilon', 'chgscale'])]
+
+
+def _term_values(term, n_atoms, attributes, type_lists):
+
+    atoms = [getattr(term, 'atom{}'.format(i)).idx for i in range(1, n_atoms + 1)]
+
+    if term.type is None:
+        params = [np.nan] * len(attributes)
+    elif isinstance(term.type, (list, tuple)):
+        # Parmed type lists (e.g. CHARMM multi-term dihedrals) are hashed separately
+        params = [np.nan] * len(attributes)
+        type_lists.append((atoms, [[getattr(t, att, None) for att in attributes] for t in term.type]))
+    else:
+        params = [getattr(term.type, att, np.nan) for att in attributes]
+
+    extra = [float(getattr(term, 'improper', False)), float(getattr(term, 'ignore_end', False))]
+
+    return atoms + params + extra
+
+
+def parmed_fingerprint(parmed_structure):
+    """
+    This function returns a hash of the parmed structure force field parameters.
+    Coordinates, velocities and box vectors are not part of the fingerprint so
+    structures that only differ for their state share the same fingerprint
+
+    Parameters
+    ----------
+    parmed_structure: Parmed Structure
+        The parmed structure to fingerprint
+
+    Returns
+    -------
+    fingerprint: String
+        The hex digest of the parmed force field parameters
+    """
+
+    hasher = hashlib.sha256()
+
+    atoms = np.array([(at.atomic_number, at.charge, at.mass, at.rmin, at.epsilon, at.rmin_14, at.epsilon_14)
+                      for at in parmed_structure.atoms], dtype=np.float64)
+    hasher.update(atoms.tobytes())
+
+    type_lists = []
+
+    for name, n_atoms, attributes in _parmed_terms:
+        terms = getattr(parmed_structure, name, [])
+        hasher.update(name.encode('utf-8'))
+        if len(terms):
+            values = np.array([_term_values(t, n_atoms, attributes, type_lists) for t in terms], dtype=np.float64)
+            hasher.update(values.tobytes())
+
+    hasher.update(str(type_lists).encode('utf-8'))
+
+    for cmap in parmed_structure.cmaps:
+        hasher.update(np.array([cmap.atom1.idx, cmap.atom2.idx, cmap.atom3.idx,
+                                cmap.atom4.idx, cmap.atom5.idx], dtype=np.float64).tobytes())
+        hasher.update(np.array(cmap.type.grid, dtype=np.float64).tobytes())
+
+    # NBFIX pair specific Lennard-Jones parameters
+    nbfix = sorted((at.atom_type.name, str(sorted(at.atom_type.nbfix.items())))
+                   for at in parmed_structure.atoms
+                   if getattr(at.atom_type, 'nbfix', None))
+    hasher.update(str(nbfix).encode('utf-8'))
+
+    hasher.update(str(parmed_structure.combining_rule).encode('utf-8'))
+    hasher.update(str(parmed_structure.nrexcl).encode('utf-8'))
+
+    return hasher.hexdigest()
+
+
+def system_cache_key(parmed_structure, opt, cutoff_distance=None):
+    """
+    This function returns the content address of the OpenMM System generated
+    from the parmed structure by using the options that define the System
+
+    Parameters
+    ----------
+    parmed_structure: Parmed Structure
+        The parmed structure used to generate the System
+    opt: python dictionary
+        The simulation options. The constraints, hmr, implicit_solvent, temperature
+        and nonbondedCutoff options are used to compose the key
+    cutoff_distance: Quantity or None
+        The non-bonded cutoff distance used in the System. If None the System is not periodic
+
+    Returns
+    -------
+    key: String
+        The System cache key
+    """
+
+    hasher = hashlib.sha256()
+
+    hasher.update(parmed_fingerprint(parmed_structure).encode('utf-8'))
+
+    if cutoff_distance is None:
+        cutoff = 'NoCutoff'
+    else:
+        cutoff = '{:.6f}'.format(cutoff_distance.value_in_unit(unit.angstrom))
+
+    options = [openmm.version.version,
+               cutoff,
+               opt['constraints'],
+               str(bool(opt['hmr'])),
+               opt['implicit_solvent']]
+
+    if opt['implicit_solvent'] != 'None':
+        options += ['{:.6f}'.format(opt['temperature']), '{:.6f}'.format(opt['nonbondedCutoff'])]
+
+    hasher.update('|'.join(options).encode('utf-8'))
+
+    return hasher.hexdigest()
+
+
+def create_system(parmed_structure, opt, cutoff_distance=None):
+    """
+    This function creates the OpenMM System from the parmed structure without
+    any stage specific force like barostats or restraints
+
+    Parameters
+    ----------
+    parmed_structure: Parmed Structure
+        The parmed structure used to generate the System
+    opt: python dictionary
+        The simulation options
+    cutoff_distance: Quantity or None
+        The non-bonded cutoff distance used in the System. If None NoCutoff is used
+
+    Returns
+    -------
+    system: OpenMM System
+        The OpenMM System
+    """
+
+    # Constraint type
+    constraints = md_keys_converter[MDEngines.OpenMM]['constraints'][opt['constraints']]
+
+    if cutoff_distance is not None:
+        system = parmed_structure.createSystem(nonbondedMethod=app.PME,
+                                               nonbondedCutoff=cutoff_distance,
+                                               constraints=eval("app.%s" % constraints),
+                                               removeCMMotion=False,
+                                               hydrogenMass=4.0 * unit.amu if opt['hmr'] else None)
+    else:  # Vacuum
+        system = parmed_structure.createSystem(nonbondedMethod=app.NoCutoff,
+                                               constraints=eval("app.%s" % constraints),
+                                               removeCMMotion=False,
+                                               hydrogenMass=4.0 * unit.amu if opt['hmr'] else None)
+    # Add Implicit Solvent Force
+    if opt['implicit_solvent'] != 'None':
+        opt['Logger'].info("[{}] Implicit Solvent Selected".format(opt['CubeTitle']))
+
+        implicit_force = parmed_structure.omm_gbsa_force(eval("app.%s" % opt['implicit_solvent']),
+                                                         temperature=opt['temperature'] * unit.kelvin,
+                                                         nonbondedMethod=app.PME,
+                                                         nonbondedCutoff=opt['nonbondedCutoff'] * unit.angstroms)
+        system.addForce(implicit_force)
+
+    return system
+
+
+def serialize_system(system):
+    """
+    This function serializes the OpenMM System in compressed XML bytes
+
+    Parameters
+    ----------
+    system: OpenMM System
+        The System to serialize
+
+    Returns
+    -------
+    data: bytes
+        The gzip compressed System XML
+    """
+    return gzip.compress(openmm.XmlSerializer.serialize(system).encode('utf-8'), compresslevel=1)
+
+
+def deserialize_system(data):
+    """
+    This function creates an OpenMM System from compressed XML bytes
+
+    Parameters
+    ----------
+    data: bytes
+        The gzip compressed System XML
+
+    Returns
+    -------
+    system: OpenMM System
+        The deserialized System
+    """
+    return openmm.XmlSerializer.deserialize(gzip.decompress(bytes(data)).decode('utf-8'))
+
+
+def get_system(parmed_structure, opt, cutoff_distance=None):
+    """
+    This function returns the OpenMM System for the parmed structure by looking it
+    up first in the local disk cache and then in the serialized System carried by
+    the MD record. If the System is not found it is created and cached. The System
+    key and serialized data are set in the opt dictionary (omm_system_key and
+    omm_system_data) so that the calling cube can store them on the record
+
+    Parameters
+    ----------
+    parmed_structure: Parmed Structure
+        The parmed structure used to generate the System
+    opt: python dictionary
+        The simulation options
+    cutoff_distance: Quantity or None
+        The non-bonded cutoff distance used in the System. If None NoCutoff is used
+
+    Returns
+    -------
+    system: OpenMM System
+        The OpenMM System without stage specific forces
+    """
+
+    key = system_cache_key(parmed_structure, opt, cutoff_distance=cutoff_distance)
+
+    cache = LRUDiskCache('omm_systems')
+
+    data = cache.get_bytes(key)
+
+    if data is not None:
+        opt['Logger'].info("[{}] OpenMM System found in the local cache".format(opt['CubeTitle']))
+
+    elif opt.get('omm_system_key') == key and opt.get('omm_system_data') is not None:
+        opt['Logger'].info("[{}] OpenMM System found on the record".format(opt['CubeTitle']))
+        data = opt['omm_system_data']
+        cache.put(key, data=bytes(data))
+
+    if data is not None:
+        try:
+            system = deserialize_system(data)
+        except Exception as e:
+            opt['Logger'].warn("[{}] The cached OpenMM System cannot be used: {}".format(opt['CubeTitle'], str(e)))
+            data = None
+
+    if data is None:
+        system = create_system(parmed_structure, opt, cutoff_distance=cutoff_distance)
+        data = serialize_system(system)
+        cache.put(key, data=data)
+
+    opt['omm_system_key'] = key
+    opt['omm_system_data'] = data
+
+    return system
+
+
+def system_from_record(mdrecord, opt):
+    """
+    This function sets in the opt dictionary the serialized OpenMM System carried
+    by the MD record, if any. The System data is recovered from the record only if
+    the System is not already present in the local disk cache
+
+    Parameters
+    ----------
+    mdrecord: MDDataRecord
+        The MD record
+    opt: python dictionary
+        The simulation options
+
+    Returns
+    -------
+    boolean: Bool
+        True if the MD record carries a serialized System otherwise False
+    """
+
+    if not mdrecord.has_omm_system:
+        return False
+
+    opt['omm_system_key'] = mdrecord.get_omm_system_key
+
+    if opt['omm_system_key'] not in LRUDiskCache('omm_systems'):
+        opt['omm_system_key'], opt['omm_system_data'] = mdrecord.get_omm_system
+
+    return True
+
+
+def system_to_record(mdrecord, opt):
+    """
+    This function sets on the MD record the serialized OpenMM System used by the
+    last simulation if it differs from the one already carried by the record
+
+    Parameters
+    ----------
+    mdrecord: MDDataRecord
+        The MD record
+    opt: python dictionary
+        The simulation options
+
+    Returns
+    -------
+    boolean: Bool
+        True if a new System has been set on the record otherwise False
+    """
+
+    if opt.get('omm_system_key') is None or opt.get('omm_system_data') is None:
+        return False
+
+    if mdrecord.has_omm_system and mdrecord.get_omm_system_key == opt['omm_system_key']:
+        return False
+
+    shard_name = "{}_{}_omm_system.xml.gz".format(opt['system_title'], opt['system_id'])
+
+    return mdrecord.set_omm_system(opt['omm_system_key'], bytes(opt['omm_system_data']), shard_name=shard_name)
+
+
+def save_checkpoint(simulation, filename):
+    """
+    This function saves the OpenMM Context checkpoint together with the portable
+    XML State in a tar archive. The checkpoint restores the Context bit for bit
+    but it can only be loaded on the same platform and OpenMM version while the
+    XML State is used as fallback on a different hardware
+
+    Parameters
+    ----------
+    simulation: OpenMM Simulation
+        The simulation to checkpoint
+    filename: String
+        The tar archive file name
+
+    Returns
+    -------
+    filename: String
+        The tar archive file name
+    """
+
+    context = simulation.context
+
+    state = context.getState(getPositions=True, getVelocities=True, getParameters=True, enforcePeriodicBox=False)
+
+    members = [('checkpoint.chk', context.createCheckpoint()),
+               ('state.xml', openmm.XmlSerializer.serialize(state).encode('utf-8'))]
+
+    with tarfile.open(filename, mode='w:gz') as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name=name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+    return filename
+
+
+def load_checkpoint(simulation, filename, opt):
+    """
+    This function restores the OpenMM Context from a tar archive written by
+    save_checkpoint. If the binary checkpoint cannot be loaded the Context is
+    restored from the XML State
+
+    Parameters
+    ----------
+    simulation: OpenMM Simulation
+        The simulation to restore
+    filename: String
+        The tar archive file name
+    opt: python dictionary
+        The simulation options
+
+    Returns
+    -------
+    checkpoint: Bool
+        True if the binary checkpoint has been loaded, False if the XML State has been used
+    """
+
+    with tarfile.open(filename, mode='r:gz') as archive:
+        checkpoint = archive.extractfile('checkpoint.chk').read()
+        state_xml = archive.extractfile('state.xml').read().decode('utf-8')
+
+    try:
+        simulation.context.loadCheckpoint(checkpoint)
+        return True
+    except Exception as e:
+        opt['Logger'].warn("[{}] The OpenMM checkpoint cannot be loaded, "
+                           "restarting from the saved State: {}".format(opt['CubeTitle'], str(e)))
+
+    simulation.context.setState(openmm.XmlSerializer.deserialize(state_xml))
+
+    return False
+
+
+def step_for_clock_time(simulation, total_steps, run_time, chunk_steps=5000):
+    """
+    This function runs the simulation up to the selected total number of steps
+    or until the selected wall clock time is over. The simulation is advanced in
+    chunks and a new chunk is started only if it is expected to end in time
+
+    Parameters
+    ----------
+    simulation: OpenMM Simulation
+        The simulation to run. The simulation current step is used as starting step
+    total_steps: Int
+        The total number of steps of the whole simulation
+    run_time: Float
+        The wall clock time in seconds
+    chunk_steps: Int
+        The number of steps between two wall clock time checks
+
+    Returns
+    -------
+    current_step: Int
+        The simulation current step
+    """
+
+    start_time = time.time()
+
+    while simulation.currentStep < total_steps:
+
+        chunk_start = time.time()
+
+        simulation.step(min(chunk_steps, total_steps - simulation.currentStep))
+
+        now = time.time()
+
+        if (now - start_time) + (now - chunk_start) >= run_time:
+            break
+
+    return simulation.currentStep
+
+
+def join_trajectory_segments(segment_fns, filename):
+    """
+    This function concatenates the HDF5 trajectory segments produced by the
+    continuation cycles in a single HDF5 trajectory
+
+    Parameters
+    ----------
+    segment_fns: list
+        The ordered list of the HDF5 segment file names
+    filename: String
+        The joined HDF5 trajectory file name
+
+    Returns
+    -------
+    filename: String
+        The joined HDF5 trajectory file name
+    """
+
+    segments = []
+
+    # Segments run without reaching a trajectory reporting step do not hold any frame
+    for fn in segment_fns:
+        try:
+            with mdtraj.formats.HDF5TrajectoryFile(fn) as trj_file:
+                n_frames = len(trj_file)
+        except Exception:
+            n_frames = 0
+
+        if n_frames:
+            segments.append(fn)
+
+    if not segments:
+        raise ValueError("No trajectory segments to join: {}".format(segment_fns))
+
+    trj = mdtraj.join([mdtraj.load_hdf5(fn) for fn in segments], check_topology=False)
+
+    trj.save_hdf5(filename)
+
+    return filename
+
+
+def parse_trajectory_streams(streams):
+    """
+    This function parses the atom subset trajectory stream definitions. The
+    definitions are separated by semicolons and each one of them is made of
+    the stream name, the stream saving interval in ns and the atom mask
+    selection written in the restraint mask language, separated by colons
+    e.g. "site:0.0004:ligand or (protein and noh)"
+
+    Parameters
+    ----------
+    streams: String
+        The stream definitions
+
+    Returns
+    -------
+    stream_list: list
+        The list of (name, interval, mask) tuples
+    """
+
+    stream_list = []
+
+    for definition in streams.split(';'):
+
+        if not definition.strip():
+            continue
+
+        tokens = definition.split(':', 2)
+
+        if len(tokens) != 3:
+            raise ValueError("The trajectory stream definition is not valid: {}".format(definition))
+
+        name, interval, mask = [tk.strip() for tk in tokens]
+
+        if not re.match(r'^\w+$', name):
+            raise ValueError("The trajectory stream name is not valid: {}".format(name))
+
+        if name in [stream[0] for stream in stream_list]:
+            raise ValueError("The trajectory stream name is duplicated: {}".format(name))
+
+        try:
+            interval = float(interval)
+        except ValueError:
+            raise ValueError("The trajectory stream interval is not valid: {}".format(interval))
+
+        if interval <= 0.0:
+            raise ValueError("The trajectory stream interval must be positive: {}".format(interval))
+
+        if not mask:
+            raise ValueError("The trajectory stream mask is empty: {}".format(name))
+
+        stream_list.append((name, interval, mask))
+
+    return stream_list
+
+
+def trajectory_stream_fns(trj_fn, name):
+    """
+    This function returns the file names of an atom subset trajectory stream
+
+    Parameters
+    ----------
+    trj_fn: String
+        The full system HDF5 trajectory file name
+    name: String
+        The stream name
+
+    Returns
+    -------
+    stream_fn, indices_fn: String, String
+        The stream HDF5 trajectory file name and the file name of the stream
+        atom indices in the full system topology
+    """
+
+    base = os.path.splitext(trj_fn)[0] + MDFileNames.trajectory_stream + name
+
+    return base + '.h5', base + '_atoms.npy'
@@ -24,12 +24,30 @@ from floe.api import (ParallelMixin,
                       parameters,
                       ComputeCube)
 
+from orionplatform.ports import RecordOutputPort
+
+from floe.api.orion import in_orion
+
 from MDOrion.Standards import (MDStageTypes,
-                               MDEngines, MDStageNames)
+                               MDEngines, MDStageNames,
+                               Fields, MDFileNames)
 
 from MDOrion.Standards.mdrecord import MDDataRecord
 
-from MDOrion.MDEngines.utils import md_simulation
+from MDOrion.Standards.transfer import get_transfer_manager
+
+from MDOrion.Standards.stage_container import write_stage_container
+
+from MDOrion.Standards.utils import (upload_file,
+                                     download_file,
+                                     delete_file)
+
+from MDOrion.MDEngines.utils import (md_simulation,
+                                     md_stage_plan)
+
+from MDOrion.MDEngines.OpenMMCubes.utils import (system_from_record,
+                                                 system_to_record,
+                                                 join_trajectory_segments)
 
 import copy
 
@@ -37,6 +55,10 @@ import textwrap
 
 import os
 
+import json
+
+import shutil
+
 
 class MDMinimizeCube(RecordPortsMixin, ComputeCube):
     title = 'Minimization Cube'
@@ -225,14 +247,22 @@ class MDMinimizeCube(RecordPortsMixin, ComputeCube):
             # Extract the Parmed structure and synchronize it with the last MD stage state
             parmed_structure = mdrecord.get_parmed(sync_stage_name='last')
 
+            # Recover the serialized OpenMM System carried by the record, if any
+            if opt['md_engine'] == MDEngines.OpenMM:
+                system_from_record(mdrecord, opt)
+
             # Run the MD simulation
             new_mdstate = md_simulation(mdstate, parmed_structure, opt)
 
+            # Save the OpenMM System on the record to skip its generation in the next stages
+            if opt['md_engine'] == MDEngines.OpenMM:
+                system_to_record(mdrecord, opt)
+
             # Update the flask coordinates
             flask.SetCoords(new_mdstate.get_oe_positions())
             mdrecord.set_flask(flask)
 
-            data_fn = os.path.basename(mdrecord.cwd) + '_' + opt['system_title'] + '_' + str(opt['system_id']) + '-' + opt['suffix'] + '.tar.gz'
+            data_fn = os.path.basename(mdrecord.cwd) + '_' + opt['system_title'] + '_' + str(opt['system_id']) + '-' + opt['suffix'] + '.mdstage'
 
             if not mdrecord.add_new_stage(self.title,
                                           MDStageTypes.MINIMIZATION,
@@ -374,6 +404,25 @@ class MDNvtCube(RecordPortsMixin, ComputeCube):
         zero the total number of generated frames will be calculated by just 
         using the trajectory interval and the md time step (2fs and 4fs hmr on)""")
 
+    trajectory_streams = parameters.StringParameter(
+        'trajectory_streams',
+        default='',
+        help_text="""Atom subset trajectory streams saved together with the
+        full system trajectory, each one at its own time interval. The stream
+        definitions are separated by semicolons and each one of them is made of
+        the stream name, the saving interval in ns and the atom mask selection,
+        separated by colons e.g. site:0.0004:ligand or protein. The mask
+        keywords are the same used for the restraints. OpenMM only""")
+
+    trajectory_format = parameters.StringParameter(
+        'trajectory_format',
+        default='h5',
+        choices=['h5', 'chunked'],
+        help_text="""The trajectory file format. The h5 trajectory is archived
+        and uploaded at the end of the simulation while the chunked trajectory
+        is written in compressed chunks with quantized coordinates which are
+        uploaded while the simulation is running. OpenMM only""")
+
     suffix = parameters.StringParameter(
         'suffix',
         default='nvt',
@@ -487,9 +536,17 @@ class MDNvtCube(RecordPortsMixin, ComputeCube):
             # Extract the Parmed structure and synchronize it with the last MD stage state
             parmed_structure = mdrecord.get_parmed(sync_stage_name='last')
 
+            # Recover the serialized OpenMM System carried by the record, if any
+            if opt['md_engine'] == MDEngines.OpenMM:
+                system_from_record(mdrecord, opt)
+
             # Run the MD simulation
             new_mdstate = md_simulation(mdstate, parmed_structure, opt)
 
+            # Save the OpenMM System on the record to skip its generation in the next stages
+            if opt['md_engine'] == MDEngines.OpenMM:
+                system_to_record(mdrecord, opt)
+
             # Update the system coordinates
             flask.SetCoords(new_mdstate.get_oe_positions())
             mdrecord.set_flask(flask)
@@ -505,7 +562,7 @@ class MDNvtCube(RecordPortsMixin, ComputeCube):
                 trajectory_fn = None
                 trajectory_engine = None
 
-            data_fn = opt['out_fn']+'.tar.gz'
+            data_fn = opt['out_fn'] + '.mdstage'
 
             if not mdrecord.add_new_stage(self.title,
                                           MDStageTypes.NVT,
@@ -516,7 +573,7 @@ class MDNvtCube(RecordPortsMixin, ComputeCube):
                                           log=opt['str_logger'],
                                           trajectory_fn=trajectory_fn,
                                           trajectory_engine=trajectory_engine,
-                                          trajectory_orion_ui=opt['system_title'] + '_' + str(opt['system_id']) + '-' + opt['suffix']+'.tar.gz'
+                                          trajectory_orion_ui=_trajectory_orion_ui(opt, opt['suffix'], trajectory_fn)
                                           ):
 
                 raise ValueError("Problems adding in the new NVT Stage")
@@ -654,6 +711,25 @@ class MDNptCube(RecordPortsMixin, ComputeCube):
             zero the total number of generated frames will be calculated by just 
             using the trajectory interval and the md time step (2fs and 4fs hmr on)""")
 
+    trajectory_streams = parameters.StringParameter(
+        'trajectory_streams',
+        default='',
+        help_text="""Atom subset trajectory streams saved together with the
+        full system trajectory, each one at its own time interval. The stream
+        definitions are separated by semicolons and each one of them is made of
+        the stream name, the saving interval in ns and the atom mask selection,
+        separated by colons e.g. site:0.0004:ligand or protein. The mask
+        keywords are the same used for the restraints. OpenMM only""")
+
+    trajectory_format = parameters.StringParameter(
+        'trajectory_format',
+        default='h5',
+        choices=['h5', 'chunked'],
+        help_text="""The trajectory file format. The h5 trajectory is archived
+        and uploaded at the end of the simulation while the chunked trajectory
+        is written in compressed chunks with quantized coordinates which are
+        uploaded while the simulation is running. OpenMM only""")
+
     suffix = parameters.StringParameter(
         'suffix',
         default='npt',
@@ -681,6 +757,13 @@ class MDNptCube(RecordPortsMixin, ComputeCube):
            simulation data will be appended to the md simulation stages 
            otherwise the last MD stage will be overwritten""")
 
+    state_delta = parameters.BooleanParameter(
+        'state_delta',
+        default=True,
+        help_text="""If True the MD stage state is stored as a delta
+        from the state of the previous MD stage otherwise the full
+        state is stored""")
+
     md_engine = parameters.StringParameter(
         'md_engine',
         default='OpenMM',
@@ -765,9 +848,17 @@ class MDNptCube(RecordPortsMixin, ComputeCube):
             # Extract the Parmed structure and synchronize it with the last MD stage state
             parmed_structure = mdrecord.get_parmed(sync_stage_name='last')
 
+            # Recover the serialized OpenMM System carried by the record, if any
+            if opt['md_engine'] == MDEngines.OpenMM:
+                system_from_record(mdrecord, opt)
+
             # Run the MD simulation
             new_mdstate = md_simulation(mdstate, parmed_structure, opt)
 
+            # Save the OpenMM System on the record to skip its generation in the next stages
+            if opt['md_engine'] == MDEngines.OpenMM:
+                system_to_record(mdrecord, opt)
+
             # Update the system coordinates
             flask.SetCoords(new_mdstate.get_oe_positions())
             mdrecord.set_flask(flask)
@@ -784,7 +875,7 @@ class MDNptCube(RecordPortsMixin, ComputeCube):
                 trajectory_fn = None
                 trajectory_engine = None
 
-            data_fn = opt['out_fn'] + '.tar.gz'
+            data_fn = opt['out_fn'] + '.mdstage'
 
             if not mdrecord.add_new_stage(self.title,
                                           MDStageTypes.NPT,
@@ -795,7 +886,8 @@ class MDNptCube(RecordPortsMixin, ComputeCube):
                                           log=opt['str_logger'],
                                           trajectory_fn=trajectory_fn,
                                           trajectory_engine=trajectory_engine,
-                                          trajectory_orion_ui=opt['system_title'] + '_' + str(opt['system_id']) + '-' + opt['suffix']+'.tar.gz'
+                                          trajectory_orion_ui=_trajectory_orion_ui(opt, opt['suffix'], trajectory_fn),
+                                          state_delta=opt['state_delta']
                                           ):
 
                 raise ValueError("Problems adding in the new NPT Stage")
@@ -814,6 +906,644 @@ class MDNptCube(RecordPortsMixin, ComputeCube):
         return
 
 
+_default_stage_plan = [
+    {"stage_name": "Minimization", "SimType": "min", "steps": 0,
+     "restraints": "noh (ligand or protein)", "restraintWt": 5.0,
+     "hmr": False, "save_md_stage": True, "suffix": "min"},
+    {"stage_name": "Warm Up", "SimType": "nvt", "time": 0.01,
+     "restraints": "noh (ligand or protein)", "restraintWt": 2.0, "reporter_interval": 0.001,
+     "hmr": False, "save_md_stage": True, "suffix": "warmup"},
+    {"stage_name": "Equilibration I", "SimType": "npt", "time": 0.01,
+     "restraints": "noh (ligand or protein)", "restraintWt": 1.0, "reporter_interval": 0.001,
+     "hmr": True, "save_md_stage": False, "suffix": "equil1"},
+    {"stage_name": "Equilibration II", "SimType": "npt", "time": 0.02,
+     "restraints": "noh (ligand or protein)", "restraintWt": 0.5, "reporter_interval": 0.001,
+     "hmr": True, "save_md_stage": False, "suffix": "equil2"},
+    {"stage_name": "Equilibration III", "SimType": "npt", "time": 0.1,
+     "restraints": "noh (ligand or protein)", "restraintWt": 0.2, "reporter_interval": 0.002,
+     "hmr": True, "save_md_stage": False, "suffix": "equil3"},
+    {"stage_name": "Equilibration IV", "SimType": "npt", "time": 0.1,
+     "restraints": "ca_protein or (noh ligand)", "restraintWt": 0.1, "reporter_interval": 0.002,
+     "hmr": True, "save_md_stage": False, "suffix": "equil4"}
+]
+
+# Stage option defaults used for the keys not defined in the stage plan
+_stage_plan_defaults = {"steps": 0, "time": 0.0, "restraints": "", "restraintWt": 0.0,
+                        "trajectory_interval": 0.0, "reporter_interval": 0.0, "trajectory_frames": 0,
+                        "trajectory_streams": "", "trajectory_format": "h5",
+                        "hmr": False, "save_md_stage": True}
+
+_stage_plan_types = {'min': MDStageTypes.MINIMIZATION,
+                     'nvt': MDStageTypes.NVT,
+                     'npt': MDStageTypes.NPT}
+
+
+class MDStagePlanCube(RecordPortsMixin, ComputeCube):
+    title = 'MD Stage Plan Cube'
+    # version = "0.1.4"
+    classification = [['MD Simulations']]
+    tags = ['OpenMM', 'Minimization', 'NVT', 'NPT']
+
+    description = """
+    This cube runs a plan of consecutive MD stages (e.g. minimization, warm up and 
+    the equilibration stages) on the provided system by using the same OpenMM 
+    Context as long as the stages share the same System options (hmr, constraints, 
+    implicit solvent, cutoff, frozen atoms and temperature). Between the stages only 
+    the restraint weight, the restrained atom set and the barostat are changed so the 
+    Context creation and the stage serialization costs are paid once. Each plan stage 
+    is saved as a MD stage on the output record exactly as the single stage MD cubes 
+    do. The plan is a JSON list of stages where each stage defines at least the 
+    stage_name and the SimType (min, nvt or npt) keys. The other stage keys (time, 
+    steps, restraints, restraintWt, reporter_interval, trajectory_interval, hmr, 
+    pressure, save_md_stage and suffix) override the cube parameters.
+    """
+
+    uuid = "e5d6c8a1-1f0b-4b53-9d55-3a3c1b8f0e62"
+
+    # Override defaults for some parameters
+    parameter_overrides = {
+        "gpu_count": {"default": 1},
+        "instance_type": {"default": "g3.4xlarge"},  # Gpu Family selection
+        "memory_mb": {"default": 14000},
+        "spot_policy": {"default": "Allowed"},
+        "prefetch_count": {"default": 1},  # 1 molecule at a time
+        "item_count": {"default": 1}  # 1 molecule at a time
+    }
+
+    stage_plan = parameters.StringParameter(
+        'stage_plan',
+        default=json.dumps(_default_stage_plan),
+        help_text="""JSON list of the MD stages to run. Each stage must define 
+        the stage_name and SimType (min, nvt or npt) keys""")
+
+    temperature = parameters.DecimalParameter(
+        'temperature',
+        default=300.0,
+        help_text="Temperature (Kelvin)")
+
+    pressure = parameters.DecimalParameter(
+        'pressure',
+        default=1.0,
+        help_text="Pressure (atm)")
+
+    restraint_to_reference = parameters.BooleanParameter(
+        'restraint_to_reference',
+        default=True,
+        help_text='If True the starting reference system coordinates will be used '
+                  'to restraint the system')
+
+    freeze = parameters.StringParameter(
+        'freeze',
+        default='',
+        help_text="""Mask selection to freeze atoms along the MD simulation.
+        Possible keywords are: ligand, protein, water, ions, ca_protein,
+        cofactors. The selection can be refined by using logical tokens:
+        not, noh, and, or, diff, around""")
+
+    nonbondedCutoff = parameters.DecimalParameter(
+        'nonbondedCutoff',
+        default=10,
+        help_text="""The non-bonded cutoff in angstroms.
+        This is ignored if non-bonded method is NoCutoff""")
+
+    constraints = parameters.StringParameter(
+        'constraints',
+        default='H-Bonds',
+        choices=['None', 'H-Bonds', 'H-Angles', 'All-Bonds'],
+        help_text="""None, H-Bonds, H-Angles, or All-Bonds
+        Which type of constraints to add to the system.
+        None means no bonds are constrained.
+        HBonds means bonds with hydrogen are constrained, etc.""")
+
+    implicit_solvent = parameters.StringParameter(
+        'implicit_solvent',
+        default='None',
+        choices=['None', 'HCT', 'OBC1', 'OBC2', 'GBn', 'GBn2'],
+        help_text="Implicit Solvent Model")
+
+    center = parameters.BooleanParameter(
+        'center',
+        default=True,
+        help_text='Center the system to the OpenMM unit cell at the beginning of the plan')
+
+    verbose = parameters.BooleanParameter(
+        'verbose',
+        default=True,
+        help_text='Increase log file verbosity')
+
+    md_engine = parameters.StringParameter(
+        'md_engine',
+        default='OpenMM',
+        choices=['OpenMM'],
+        help_text='Select the MD available engine')
+
+    def begin(self):
+        self.opt = vars(self.args)
+        self.opt['Logger'] = self.log
+
+        try:
+            self.plan = json.loads(self.opt['stage_plan'])
+        except ValueError as e:
+            raise ValueError("The stage plan is not a valid JSON string: {}".format(str(e)))
+
+        if not isinstance(self.plan, list) or not self.plan:
+            raise ValueError("The stage plan must be a non empty list of stages: {}".format(self.plan))
+
+        for stage in self.plan:
+            for key in ['stage_name', 'SimType']:
+                if key not in stage:
+                    raise ValueError("The stage plan key {} is missing in the stage: {}".format(key, stage))
+            if stage['SimType'] not in _stage_plan_types:
+                raise ValueError("The stage plan simulation type is not supported: {}".format(stage['SimType']))
+
+        self.opt['SimType'] = self.plan[0]['SimType']
+
+        return
+
+    def process(self, record, port):
+        try:
+            # The copy of the dictionary option as local variable
+            # is necessary to avoid filename collisions due to
+            # the parallel cube processes
+            opt = dict(self.opt)
+            opt['CubeTitle'] = self.title
+
+            # Logger string
+            str_logger = '-'*32 + ' STAGE PLAN CUBE PARAMETERS ' + '-'*32
+            str_logger += "\n{:<25} = {:<10}".format("Cube Title", opt['CubeTitle'])
+
+            for k, v in sorted(self.parameters().items()):
+                tmp_default = copy.deepcopy(v)
+
+                if v.default is None:
+                    tmp_default.default = 'None'
+                elif isinstance(v, parameters.BooleanParameter):
+                    if v.default:
+                        tmp_default.default = 'True'
+                    else:
+                        tmp_default.default = 'False'
+                elif k != 'stage_plan':
+                    tmp_description = textwrap.fill(" ".join(v.description.split()),
+                                                    subsequent_indent=' ' * 39, width=80)
+                    str_logger += "\n{:<25} = {:<10} {}".format(k,
+                                                                getattr(self.args, tmp_default.name),
+                                                                tmp_description)
+
+            # Create the MD record to use the MD Record API
+            mdrecord = MDDataRecord(record)
+
+            system_title = mdrecord.get_title
+
+            opt['system_title'] = system_title
+            opt['system_id'] = mdrecord.get_flask_id
+
+            flask = mdrecord.get_stage_topology()
+            mdstate = mdrecord.get_stage_state()
+
+            # Update cube simulation parameters
+            for field in record.get_fields(include_meta=True):
+                field_name = field.get_name()
+                if field_name in ['temperature', 'pressure']:
+                    rec_value = record.get_value(field)
+                    opt[field_name] = rec_value
+                    opt['Logger'].info("{} Updating parameters for molecule: {} {} = {}".format(self.title,
+                                                                                                system_title,
+                                                                                                field_name,
+                                                                                                rec_value))
+
+            if opt['restraint_to_reference']:
+                opt['reference_state'] = mdrecord.get_stage_state(stg_name=MDStageNames.ForceField)
+
+            opt['out_directory'] = mdrecord.cwd
+            opt['molecule'] = flask
+            opt['Logger'].info('[{}] START STAGE PLAN: {}'.format(opt['CubeTitle'], system_title))
+
+            # Build the stage options
+            stage_plan = []
+
+            for stage in self.plan:
+                stg_opt = dict(opt)
+                del stg_opt['stage_plan']
+                stg_opt.update(_stage_plan_defaults)
+                stg_opt.update(stage)
+                stg_opt['CubeTitle'] = self.title + ' - ' + stage['stage_name']
+
+                stg_str_logger = str_logger + "\n{:<25} = {:<10}".format("Simulation Type", stg_opt['SimType'])
+                for k in sorted(stage.keys()):
+                    stg_str_logger += "\n{:<25} = {:<10}".format(k, str(stage[k]))
+                stg_opt['str_logger'] = stg_str_logger
+
+                stg_opt['out_fn'] = os.path.basename(opt['out_directory']) + '_' + \
+                    opt['system_title'] + '_' + \
+                    str(opt['system_id']) + '-' + \
+                    stg_opt.get('suffix', stg_opt['SimType'])
+
+                stg_opt['suffix'] = stg_opt.get('suffix', stg_opt['SimType'])
+
+                # Trajectory file name if any generated
+                stg_opt['trj_fn'] = stg_opt['out_fn'] + '_' + 'traj.tar.gz'
+
+                stage_plan.append(stg_opt)
+
+            opt['stage_plan'] = stage_plan
+
+            # Extract the Parmed structure and synchronize it with the last MD stage state
+            parmed_structure = mdrecord.get_parmed(sync_stage_name='last')
+
+            # Recover the serialized OpenMM System carried by the record, if any
+            system_from_record(mdrecord, opt)
+
+            # Run the MD stage plan
+            results = md_stage_plan(mdstate, parmed_structure, opt)
+
+            for stg_opt, new_mdstate in results:
+
+                # Update the system coordinates
+                flask.SetCoords(new_mdstate.get_oe_positions())
+
+                # Trajectory
+                if stg_opt['SimType'] != 'min' and (stg_opt['trajectory_interval'] or stg_opt['trajectory_frames']):
+                    trajectory_fn = stg_opt['trj_fn']
+                    trajectory_engine = MDEngines.OpenMM
+                else:  # Empty Trajectory
+                    trajectory_fn = None
+                    trajectory_engine = None
+
+                data_fn = stg_opt['out_fn'] + '.mdstage'
+
+                if not mdrecord.add_new_stage(stg_opt['stage_name'],
+                                              _stage_plan_types[stg_opt['SimType']],
+                                              flask,
+                                              new_mdstate,
+                                              data_fn,
+                                              append=stg_opt['save_md_stage'],
+                                              log=stg_opt['str_logger'],
+                                              trajectory_fn=trajectory_fn,
+                                              trajectory_engine=trajectory_engine,
+                                              trajectory_orion_ui=_trajectory_orion_ui(opt, stg_opt['suffix'],
+                                                                                  trajectory_fn)):
+
+                    raise ValueError("Problems adding in the new {} Stage".format(stg_opt['stage_name']))
+
+            mdrecord.set_flask(flask)
+
+            # Save the OpenMM System on the record to skip its generation in the next stages
+            system_to_record(mdrecord, opt)
+
+            self.success.emit(mdrecord.get_record)
+
+            del mdrecord
+
+        except Exception as e:
+
+            print("Failed to complete", str(e), flush=True)
+            self.opt['Logger'].info('Exception {} {}'.format(str(e), self.title))
+            self.log.error(traceback.format_exc())
+            self.failure.emit(record)
+
+        return
+
+
+class MDCycleProxyCube(RecordPortsMixin, ComputeCube):
+    title = 'MD Cycle Proxy Cube'
+    # version = "0.1.4"
+    classification = [["Proxy"]]
+    tags = ['OpenMM', 'NPT', 'Cycle']
+
+    description = """
+    This cube is used to implement a cycle with the MD NPT Cycle Cube. The
+    cube initializes the continuation cycle state on the input records and
+    checks the current state of the simulation. Records whose simulation
+    is not completed are forwarded to the cycle cube through the success
+    port while the completed ones are emitted on the completed port.
+    """
+
+    uuid = "8f4c1c7e-3b0e-4d2a-9f63-2e6a4d7b5c91"
+
+    # Override defaults for some parameters
+    parameter_overrides = {
+        "memory_mb": {"default": 14000},
+        "spot_policy": {"default": "Prohibited"},
+        "prefetch_count": {"default": 1},  # 1 molecule at a time
+        "item_count": {"default": 1}  # 1 molecule at a time
+    }
+
+    completed = RecordOutputPort('completed')
+
+    def begin(self):
+        self.opt = vars(self.args)
+        self.opt['Logger'] = self.log
+
+        return
+
+    def process(self, record, port):
+        try:
+            if record.has_value(Fields.md_cycle):
+                cycle = record.get_value(Fields.md_cycle)
+            else:
+                # The total number of steps is set by the cycle cube in the first cycle
+                cycle = {'cycle_id': 0,
+                         'current_step': 0,
+                         'total_steps': None,
+                         'checkpoint': None,
+                         'stale_files': [],
+                         'trajectory_segments': [],
+                         'log': ''}
+
+                record.set_value(Fields.md_cycle, cycle)
+
+            self.opt['Logger'].info("{} cycle {} current step {} total steps {}".format(self.title,
+                                                                                     cycle['cycle_id'],
+                                                                                     cycle['current_step'],
+                                                                                     cycle['total_steps']))
+
+            if cycle['total_steps'] is not None and cycle['current_step'] >= cycle['total_steps']:
+                self.opt['Logger'].info("{} Finishing...".format(self.title))
+                # The NPT stage has been added, the cycle files are not referenced anymore
+                _delete_cycle_files(cycle.get('stale_files', []), self.opt)
+                record.delete_field(Fields.md_cycle)
+                self.completed.emit(record)
+            else:
+                self.opt['Logger'].info("{} Forwarding to Cycle...".format(self.title))
+                self.success.emit(record)
+
+        except Exception as e:
+
+            print("Failed to complete", str(e), flush=True)
+            self.opt['Logger'].info('Exception {} {}'.format(str(e), self.title))
+            self.log.error(traceback.format_exc())
+            self.failure.emit(record)
+
+        return
+
+
+class MDNptCycleCube(MDNptCube):
+    title = 'NPT Cycle Cube'
+    # version = "0.1.4"
+    classification = [['MD Simulations']]
+    tags = ['OpenMM', 'NPT', 'Cycle']
+
+    description = """
+    This cube performs a wall clock bounded segment of an NPT MD simulation
+    in a cycle with the MD Cycle Proxy Cube. At the end of each segment the
+    OpenMM Context is checkpointed and the checkpoint, the reached step and
+    the trajectory segment are saved on the record so that the next cycle
+    resumes the simulation from the last checkpoint. If the cube is restarted,
+    for example after a spot instance preemption, only the current segment is
+    lost. When the total simulation time is reached the trajectory segments
+    are joined and a new NPT stage is added to the record. The cube parameters
+    are the same as the NPT Cube ones. Currently only OpenMM is supported.
+    """
+
+    uuid = "2d3b9e4a-6c1f-4f7e-8b0a-5e9d7c3a1f24"
+
+    cube_run_time = parameters.DecimalParameter(
+        'cube_run_time',
+        default=10.0,
+        help_text="""The wall clock time in hours of each simulation cycle.
+        The time must be less or equal to 12hrs""")
+
+    def process(self, record, port):
+        try:
+            # The copy of the dictionary option as local variable
+            # is necessary to avoid filename collisions due to
+            # the parallel cube processes
+            opt = dict(self.opt)
+            opt['CubeTitle'] = self.title
+
+            if opt['md_engine'] != MDEngines.OpenMM:
+                raise ValueError("The MD cycles are supported by OpenMM only: {}".format(opt['md_engine']))
+
+            if opt['cube_run_time'] <= 0.0 or opt['cube_run_time'] > 12.0:
+                raise ValueError("The cycle run time must be in the range (0, 12] hrs: {}".format(opt['cube_run_time']))
+
+            if opt['trajectory_streams'] or opt['trajectory_format'] != 'h5':
+                raise ValueError("The MD cycles support the h5 trajectory format without streams only")
+
+            if not record.has_value(Fields.md_cycle):
+                raise ValueError("The MD cycle field is missing. The record must be processed "
+                                 "by the MD Cycle Proxy Cube")
+
+            cycle = record.get_value(Fields.md_cycle)
+
+            # The files replaced in the previous cycle are deleted only now that the
+            # record referencing the new ones has been emitted. If the instance is
+            # preempted the replayed input record still points to existing files
+            _delete_cycle_files(cycle.get('stale_files', []), opt)
+            cycle['stale_files'] = []
+
+            # Logger string
+            str_logger = '-'*32 + ' NPT CYCLE CUBE PARAMETERS ' + '-'*32
+            str_logger += "\n{:<25} = {:<10}".format("Cube Title", opt['CubeTitle'])
+
+            for k, v in sorted(self.parameters().items()):
+                tmp_default = copy.deepcopy(v)
+
+                if v.default is None:
+                    tmp_default.default = 'None'
+                elif isinstance(v, parameters.BooleanParameter):
+                    if v.default:
+                        tmp_default.default = 'True'
+                    else:
+                        tmp_default.default = 'False'
+                else:
+                    tmp_description = textwrap.fill(" ".join(v.description.split()),
+                                                    subsequent_indent=' ' * 39, width=80)
+                    str_logger += "\n{:<25} = {:<10} {}".format(k,
+                                                                getattr(self.args, tmp_default.name),
+                                                                tmp_description)
+
+            str_logger += "\n{:<25} = {:<10}".format("Simulation Type", opt['SimType'])
+
+            # Create the MD record to use the MD Record API
+            mdrecord = MDDataRecord(record)
+
+            system_title = mdrecord.get_title
+
+            opt['system_title'] = system_title
+            opt['system_id'] = mdrecord.get_flask_id
+
+            flask = mdrecord.get_stage_topology()
+            mdstate = mdrecord.get_stage_state()
+
+            # Update cube simulation parameters
+            for field in record.get_fields(include_meta=True):
+                field_name = field.get_name()
+                if field_name in ['temperature', 'pressure']:
+                    rec_value = record.get_value(field)
+                    opt[field_name] = rec_value
+                    opt['Logger'].info("{} Updating parameters for molecule: {} {} = {}".format(self.title,
+                                                                                                system_title,
+                                                                                                field_name,
+                                                                                                rec_value))
+
+            if opt['restraint_to_reference']:
+                opt['reference_state'] = mdrecord.get_stage_state(stg_name=MDStageNames.ForceField)
+
+            opt['out_directory'] = mdrecord.cwd
+            opt['molecule'] = flask
+            opt['str_logger'] = ''
+            opt['Logger'].info('[{}] START NPT CYCLE {} SIMULATION: {}'.format(opt['CubeTitle'],
+                                                                               cycle['cycle_id'],
+                                                                               system_title))
+
+            opt['out_fn'] = os.path.basename(opt['out_directory']) + '_' + \
+                            opt['system_title'] + '_' + \
+                            str(opt['system_id']) + '-' + \
+                            opt['suffix']
+
+            # Trajectory file name if any generated
+            opt['trj_fn'] = opt['out_fn'] + '_' + 'traj.tar.gz'
+
+            # Continuation cycle options
+            opt['cycle_run_time'] = opt['cube_run_time']
+            opt['current_step'] = cycle['current_step']
+            opt['checkpoint_out_fn'] = opt['out_fn'] + '_cycle_{}_checkpoint.tar.gz'.format(cycle['cycle_id'])
+
+            if cycle['checkpoint'] is not None:
+                opt['checkpoint_fn'] = download_file(cycle['checkpoint'],
+                                                     os.path.join(opt['out_directory'], 'checkpoint.tar.gz'))
+
+            if cycle['cycle_id'] == 0:
+                cycle['log'] = str_logger
+
+            # Extract the Parmed structure and synchronize it with the last MD stage state
+            parmed_structure = mdrecord.get_parmed(sync_stage_name='last')
+
+            # Recover the serialized OpenMM System carried by the record, if any
+            system_from_record(mdrecord, opt)
+
+            # Run the MD simulation segment
+            new_mdstate = md_simulation(mdstate, parmed_structure, opt)
+
+            cycle['log'] += opt['str_logger']
+            cycle['current_step'] = opt['current_step']
+            cycle['total_steps'] = opt['steps']
+
+            # The previous cycle checkpoint is deleted by the next cycle
+            if cycle['checkpoint'] is not None:
+                cycle['stale_files'].append(cycle['checkpoint'])
+
+            # The checkpoint and the trajectory segment are uploaded in parallel
+            checkpoint_upload = get_transfer_manager().submit(_cycle_upload, opt['checkpoint_out_fn'])
+
+            trajectory = opt['trajectory_interval'] or opt['trajectory_frames']
+
+            if trajectory:
+                segment_fn = opt['out_fn'] + '_cycle_{}_traj.h5'.format(cycle['cycle_id'])
+                shutil.move(opt['omm_trj_fn'], segment_fn)
+                cycle['trajectory_segments'].append(get_transfer_manager().submit(_cycle_upload,
+                                                                                  segment_fn).result())
+
+            cycle['checkpoint'] = checkpoint_upload.result()
+
+            cycle['cycle_id'] += 1
+
+            if cycle['current_step'] >= cycle['total_steps']:
+
+                opt['Logger'].info('[{}] NPT CYCLES COMPLETED: {}'.format(opt['CubeTitle'], system_title))
+
+                if trajectory:
+                    segment_fns = get_transfer_manager().map(download_file,
+                                                             cycle['trajectory_segments'],
+                                                             [os.path.join(opt['out_directory'],
+                                                                           'segment_{}.h5'.format(idx))
+                                                              for idx in range(len(cycle['trajectory_segments']))])
+
+                    join_trajectory_segments(segment_fns, opt['omm_trj_fn'])
+
+                    trajectory_fn = opt['out_fn'] + '_' + MDFileNames.trajectory_container
+
+                    write_stage_container(trajectory_fn, [(opt['omm_trj_fn'], False)])
+                    trajectory_engine = MDEngines.OpenMM
+
+                else:  # Empty Trajectory
+                    trajectory_fn = None
+                    trajectory_engine = None
+
+                # Save the OpenMM System on the record to skip its generation in the next stages
+                system_to_record(mdrecord, opt)
+
+                # Update the system coordinates
+                flask.SetCoords(new_mdstate.get_oe_positions())
+                mdrecord.set_flask(flask)
+
+                data_fn = opt['out_fn'] + '.mdstage'
+
+                if not mdrecord.add_new_stage(self.title,
+                                              MDStageTypes.NPT,
+                                              flask,
+                                              new_mdstate,
+                                              data_fn,
+                                              append=opt['save_md_stage'],
+                                              log=cycle['log'],
+                                              trajectory_fn=trajectory_fn,
+                                              trajectory_engine=trajectory_engine,
+                                              trajectory_orion_ui=_trajectory_orion_ui(opt, opt['suffix'], trajectory_fn),
+                                              state_delta=opt['state_delta']
+                                              ):
+
+                    raise ValueError("Problems adding in the new NPT Stage")
+
+                # The cycle files are not needed anymore. They are deleted by the
+                # proxy cube after the record has been emitted
+                cycle['stale_files'].extend([cycle['checkpoint']] + cycle['trajectory_segments'])
+
+                cycle['checkpoint'] = None
+                cycle['trajectory_segments'] = []
+                cycle['log'] = ''
+
+            out_record = mdrecord.get_record
+            out_record.set_value(Fields.md_cycle, cycle)
+
+            self.success.emit(out_record)
+
+            del mdrecord
+
+        except Exception as e:
+
+            print("Failed to complete", str(e), flush=True)
+            self.opt['Logger'].info('Exception {} {}'.format(str(e), self.title))
+            self.log.error(traceback.format_exc())
+            self.failure.emit(record)
+
+        return
+
+
+def _delete_cycle_files(file_ids, opt):
+    # A replayed record can reference files already deleted before
+    # the instance was preempted
+    for file_id in file_ids:
+        try:
+            delete_file(file_id)
+        except Exception as e:
+            opt['Logger'].warn("The cycle file {} cannot be deleted: {}".format(file_id, str(e)))
+
+    return
+
+
+def _trajectory_orion_ui(opt, suffix, trajectory_fn):
+    # The Orion trajectory file name carries the extension of the uploaded file:
+    # the stage container, the chunked trajectory manifest or the Gromacs tar archive
+    name = opt['system_title'] + '_' + str(opt['system_id']) + '-' + suffix
+
+    if trajectory_fn is None or trajectory_fn.endswith('.tar.gz'):
+        return name + '.tar.gz'
+
+    return name + os.path.splitext(trajectory_fn)[1]
+
+
+def _cycle_upload(filename):
+    # In Orion the cycle files are uploaded and removed from the local
+    # directory, otherwise the local file name is used as file id
+    file_id = upload_file(filename, orion_ui_name=os.path.basename(filename))
+
+    if in_orion():
+        os.remove(filename)
+
+    return file_id
+
+
 class ParallelMDMinimizeCube(ParallelMixin, MDMinimizeCube):
     title = "Parallel " + MDMinimizeCube.title
     description = "(Parallel) " + MDMinimizeCube.description
@@ -831,3 +1561,9 @@ class ParallelMDNptCube(ParallelMixin,  MDNptCube):
     description = "(Parallel) " + MDNptCube.description
     uuid = "94728422-e840-49ba-9006-f6170dad54ba"
 
+
+
+class ParallelMDStagePlanCube(ParallelMixin,  MDStagePlanCube):
+    title = "Parallel " + MDStagePlanCube.title
+    description = "(Parallel) " + MDStagePlanCube.description
+    uuid = "5b7a0a7e-2f4c-4a57-8a57-0c1c8e3f9d14"
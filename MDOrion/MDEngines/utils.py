@@ -32,7 +32,11 @@ import os
 
 from simtk import unit
 
-import itertools
+import numpy as np
+
+import json
+
+import struct
 
 md_keys_converter = {'OpenMM':
 
@@ -48,44 +52,161 @@ md_keys_converter = {'OpenMM':
 
 
 class MDState(object):
+    """
+    The MD State holds the system positions, velocities and box vectors as
+    contiguous float64 numpy arrays in nm, nm/ps and nm units respectively.
+    The getter methods return OpenMM Quantity views built lazily on the arrays.
+    The state can be serialized in a versioned binary format whose arrays can
+    be memory mapped by the readers
+    """
+
+    # Binary format identifiers
+    _magic = b'MDSTATE\x00'
+    _version = 1
+    _alignment = 64
 
     def __init__(self, parmed_structure):
 
-        if not parmed_structure.positions:
+        coords = parmed_structure.coordinates
+
+        if coords is None or len(coords) == 0:
             raise RuntimeError('Atom positions are not defined')
-        else:
-            # The returned object is an OpenMM Quantity with units
-            self.__positions__ = parmed_structure.positions
+
+        # Parmed stores the coordinates as a numpy array in unit of angstrom
+        positions = np.array(coords, dtype=np.float64).reshape(-1, 3) / 10.0
 
         if parmed_structure.velocities is None:
-            self.__velocities__ = None
+            velocities = None
         else:
             # Parmed stores the velocities as a numpy array in unit of angstrom/picoseconds
-            self.__velocities__ = parmed_structure.velocities * simtk.unit.angstrom/simtk.unit.picosecond
-            # The returned object is an OpenMM Quantity with units
+            velocities = np.array(parmed_structure.velocities, dtype=np.float64).reshape(-1, 3) / 10.0
 
         if parmed_structure.box_vectors is None:
-            self.__box_vectors__ = None
+            box_vectors = None
+        else:
+            box_vectors = _box_array(parmed_structure.box_vectors)
+
+        self._set_arrays(positions, velocities, box_vectors)
+
+    def _set_arrays(self, positions, velocities, box_vectors):
+
+        self._positions = positions
+        self._velocities = velocities
+        self._box_vectors = box_vectors
+
+        # Lazily built Quantity views
+        self._positions_q = None
+        self._velocities_q = None
+        self._box_vectors_q = None
+
+    @classmethod
+    def from_arrays(cls, positions, velocities=None, box_vectors=None):
+        """
+        This method creates a MD State from numpy arrays
+
+        Parameters
+        ----------
+        positions: numpy array
+            The (n_atoms, 3) positions in nm
+        velocities: numpy array or None
+            The (n_atoms, 3) velocities in nm/ps
+        box_vectors: numpy array or None
+            The (3, 3) box vectors in nm
+
+        Returns
+        -------
+        state: MDState
+            The new MD State
+        """
+
+        state = cls.__new__(cls)
+
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+
+        if velocities is not None:
+            velocities = np.asarray(velocities, dtype=np.float64).reshape(-1, 3)
+            if velocities.shape != positions.shape:
+                raise ValueError("Velocities and positions shapes do not match: {} vs {}".format(velocities.shape,
+                                                                                                 positions.shape))
+        if box_vectors is not None:
+            box_vectors = np.asarray(box_vectors, dtype=np.float64).reshape(3, 3)
+
+        state._set_arrays(positions, velocities, box_vectors)
+
+        return state
+
+    def copy(self):
+        """
+        This method returns a copy of the MD State
+        """
+        return MDState.from_arrays(self._positions.copy(),
+                                   None if self._velocities is None else self._velocities.copy(),
+                                   None if self._box_vectors is None else self._box_vectors.copy())
+
+    def __getstate__(self):
+        return {'version': self._version,
+                'positions': np.asarray(self._positions),
+                'velocities': None if self._velocities is None else np.asarray(self._velocities),
+                'box_vectors': None if self._box_vectors is None else np.asarray(self._box_vectors)}
+
+    def __setstate__(self, state):
+
+        if '__positions__' in state:
+            # Legacy MD States store lists of Vec3 OpenMM Quantities
+            positions = np.array(state['__positions__'].value_in_unit(unit.nanometers), dtype=np.float64)
+
+            velocities = state.get('__velocities__')
+            if velocities is not None:
+                velocities = np.array(velocities.value_in_unit(unit.nanometers / unit.picoseconds),
+                                      dtype=np.float64)
+
+            box_vectors = state.get('__box_vectors__')
+            if box_vectors is not None:
+                box_vectors = _box_array(box_vectors)
+
+            self._set_arrays(positions.reshape(-1, 3),
+                             None if velocities is None else velocities.reshape(-1, 3),
+                             box_vectors)
         else:
-            self.__box_vectors__ = parmed_structure.box_vectors
+            self._set_arrays(state['positions'], state['velocities'], state['box_vectors'])
 
     def get_positions(self):
-        return self.__positions__
+        if self._positions_q is None:
+            self._positions_q = unit.Quantity(self._positions, unit.nanometers)
+        return self._positions_q
 
     def get_oe_positions(self):
-        pos = self.__positions__.in_units_of(unit.angstrom) / unit.angstrom
-        pos = list(itertools.chain.from_iterable(pos))
-        return pos
+        return (self._positions * 10.0).ravel().tolist()
 
     def get_velocities(self):
-        return self.__velocities__
+        if self._velocities is None:
+            return None
+        if self._velocities_q is None:
+            self._velocities_q = unit.Quantity(self._velocities, unit.nanometers / unit.picoseconds)
+        return self._velocities_q
 
     def get_box_vectors(self):
-        return self.__box_vectors__
+        if self._box_vectors is None:
+            return None
+        if self._box_vectors_q is None:
+            # The box vectors are returned as a list of Vec3 as OpenMM does
+            self._box_vectors_q = unit.Quantity([simtk.openmm.Vec3(*row) for row in self._box_vectors.tolist()],
+                                                unit.nanometers)
+        return self._box_vectors_q
+
+    def get_positions_array(self):
+        return self._positions
+
+    def get_velocities_array(self):
+        return self._velocities
+
+    def get_box_vectors_array(self):
+        return self._box_vectors
 
     def set_positions(self, positions):
         if isinstance(positions, simtk.unit.quantity.Quantity):
-            self.__positions__ = positions
+            self._positions = np.array(positions.value_in_unit(unit.nanometers), dtype=np.float64).reshape(-1, 3)
+            self._positions_q = None
         else:
             raise ValueError("It was not possible to set the positions")
 
@@ -93,7 +214,9 @@ class MDState(object):
 
     def set_velocities(self, velocities):
         if isinstance(velocities, simtk.unit.quantity.Quantity):
-            self.__velocities__ = velocities
+            self._velocities = np.array(velocities.value_in_unit(unit.nanometers / unit.picoseconds),
+                                        dtype=np.float64).reshape(-1, 3)
+            self._velocities_q = None
         else:
             raise ValueError("It was not possible to set the velocities")
 
@@ -101,12 +224,257 @@ class MDState(object):
 
     def set_box_vectors(self, box_vectors):
         if isinstance(box_vectors, simtk.unit.quantity.Quantity):
-            self.__box_vectors__ = box_vectors
+            self._box_vectors = _box_array(box_vectors)
+            self._box_vectors_q = None
         else:
             raise ValueError("It was not possible to set the box vectors")
 
         return
 
+    def delta(self, reference):
+        """
+        This method returns the lossless delta of the MD State with respect to the
+        passed reference state. The delta arrays hold the XOR of the float64 bit
+        patterns with the bytes grouped by significance, so that the sign, exponent
+        and leading mantissa bits shared by the two states compress to runs of zeros
+
+        Parameters
+        ----------
+        reference: MDState
+            The reference MD State
+
+        Returns
+        -------
+        delta: MDState
+            The delta MD State to be reverted by using from_delta
+        """
+
+        return MDState.from_arrays(_delta_array(self._positions, reference._positions),
+                                   _delta_array(self._velocities, reference._velocities),
+                                   _delta_array(self._box_vectors, reference._box_vectors))
+
+    @classmethod
+    def from_delta(cls, delta, reference):
+        """
+        This method rebuilds the MD State from its delta and the reference state
+        used to create the delta
+
+        Parameters
+        ----------
+        delta: MDState
+            The delta MD State
+        reference: MDState
+            The reference MD State
+
+        Returns
+        -------
+        state: MDState
+            The rebuilt MD State
+        """
+
+        return cls.from_arrays(_undelta_array(delta._positions, reference._positions),
+                               _undelta_array(delta._velocities, reference._velocities),
+                               _undelta_array(delta._box_vectors, reference._box_vectors))
+
+    def to_bytes(self):
+        """
+        This method serializes the MD State in the versioned binary format. The
+        format is made of a magic string, the format version and a JSON header
+        followed by the raw little endian float64 arrays aligned to 64 bytes
+
+        Returns
+        -------
+        data: bytes
+            The serialized MD State
+        """
+
+        arrays = [(name, arr) for name, arr in [('positions', self._positions),
+                                                ('velocities', self._velocities),
+                                                ('box_vectors', self._box_vectors)] if arr is not None]
+
+        def _header(offsets):
+            return json.dumps({'dtype': '<f8',
+                               'arrays': {name: {'offset': off, 'shape': list(arr.shape)}
+                                          for (name, arr), off in zip(arrays, offsets)}}).encode('utf-8')
+
+        # The header length depends on the array offsets which depend on the
+        # header length. The offsets are updated until they are stable
+        offsets = [0] * len(arrays)
+
+        while True:
+            pos = _align(len(self._magic) + 8 + len(_header(offsets)), self._alignment)
+            new_offsets = []
+            for name, arr in arrays:
+                new_offsets.append(pos)
+                pos = _align(pos + arr.size * 8, self._alignment)
+
+            if new_offsets == offsets:
+                break
+
+            offsets = new_offsets
+
+        header = _header(offsets)
+
+        buffer = bytearray(pos)
+        head = self._magic + struct.pack('<II', self._version, len(header)) + header
+        buffer[:len(head)] = head
+
+        for (name, arr), off in zip(arrays, offsets):
+            data = np.ascontiguousarray(arr, dtype='<f8').tobytes()
+            buffer[off:off + len(data)] = data
+
+        return bytes(buffer)
+
+    @classmethod
+    def _read_header(cls, head):
+
+        if bytes(head[:len(cls._magic)]) != cls._magic:
+            raise ValueError("The data is not a binary MD State")
+
+        version, header_len = struct.unpack('<II', bytes(head[len(cls._magic):len(cls._magic) + 8]))
+
+        if version > cls._version:
+            raise ValueError("The MD State binary format version is not supported: {}".format(version))
+
+        start = len(cls._magic) + 8
+
+        return json.loads(bytes(head[start:start + header_len]).decode('utf-8')), start + header_len
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        This method creates a MD State from the binary format. The arrays are
+        read-only views on the passed data
+
+        Parameters
+        ----------
+        data: bytes
+            The serialized MD State
+
+        Returns
+        -------
+        state: MDState
+            The MD State
+        """
+
+        header, size = cls._read_header(memoryview(data))
+
+        arrays = {}
+        for name, info in header['arrays'].items():
+            count = int(np.prod(info['shape']))
+            arrays[name] = np.frombuffer(data, dtype=header['dtype'],
+                                         count=count, offset=info['offset']).reshape(info['shape'])
+
+        state = cls.__new__(cls)
+        state._set_arrays(arrays['positions'], arrays.get('velocities'), arrays.get('box_vectors'))
+
+        return state
+
+    @staticmethod
+    def is_binary(data):
+        """
+        This method returns True if the passed bytes are a binary MD State
+        """
+        return bytes(data[:len(MDState._magic)]) == MDState._magic
+
+    def save(self, filename):
+        """
+        This method saves the MD State in the binary format
+
+        Parameters
+        ----------
+        filename: String
+            The file name
+        """
+
+        with open(filename, 'wb') as f:
+            f.write(self.to_bytes())
+
+        return filename
+
+    @classmethod
+    def load(cls, filename, mmap=True, offset=0):
+        """
+        This method loads a MD State saved in the binary format
+
+        Parameters
+        ----------
+        filename: String
+            The file name
+        mmap: Bool
+            If True the arrays are read-only memory maps of the file
+        offset: Int
+            The byte offset of the MD State in the file e.g. a stage container member
+
+        Returns
+        -------
+        state: MDState
+            The MD State
+        """
+
+        if not mmap:
+            with open(filename, 'rb') as f:
+                f.seek(offset)
+                return cls.from_bytes(f.read())
+
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            head = f.read(len(cls._magic) + 8)
+            head += f.read(struct.unpack('<II', head[len(cls._magic):])[1])
+
+        header, size = cls._read_header(head)
+
+        arrays = {}
+        for name, info in header['arrays'].items():
+            arrays[name] = np.memmap(filename, dtype=header['dtype'], mode='r',
+                                     offset=offset + info['offset'], shape=tuple(info['shape']))
+
+        state = cls.__new__(cls)
+        state._set_arrays(arrays['positions'], arrays.get('velocities'), arrays.get('box_vectors'))
+
+        return state
+
+
+def _align(pos, alignment):
+    return ((pos + alignment - 1) // alignment) * alignment
+
+
+def _delta_array(array, reference):
+    # XOR of the bit patterns with the bytes grouped by significance
+    if array is None:
+        return None
+
+    if reference is None or reference.shape != array.shape:
+        raise ValueError("The reference state arrays do not match the state arrays")
+
+    xor = np.bitwise_xor(np.ascontiguousarray(array, dtype=np.float64).view(np.uint64),
+                         np.ascontiguousarray(reference, dtype=np.float64).view(np.uint64))
+
+    shuffled = np.ascontiguousarray(xor.view(np.uint8).reshape(-1, 8).T)
+
+    return shuffled.ravel().view(np.float64).reshape(array.shape)
+
+
+def _undelta_array(delta, reference):
+    # Inverse of _delta_array
+    if delta is None:
+        return None
+
+    if reference is None or reference.shape != delta.shape:
+        raise ValueError("The reference state arrays do not match the delta arrays")
+
+    xor = np.ascontiguousarray(np.ascontiguousarray(delta, dtype=np.float64).ravel().view(np.uint8).reshape(8, -1).T)
+
+    state = np.bitwise_xor(xor.view(np.uint64).ravel(),
+                           np.ascontiguousarray(reference, dtype=np.float64).view(np.uint64).ravel())
+
+    return state.view(np.float64).reshape(delta.shape)
+
+
+def _box_array(box_vectors):
+    # Box vectors as a (3, 3) numpy array in nm
+    return np.array(box_vectors.value_in_unit(unit.nanometers), dtype=np.float64).reshape(3, 3)
+
 
 class MDSimulations(ABC):
     @abstractmethod
@@ -220,6 +588,20 @@ def md_simulation(mdstate, ff_parameters, opt):
 
         from MDOrion.MDEngines.Gromacs.simtools import GromacsSimulations
 
+        # The atom subset streams are written by OpenMM only. The full system trajectory
+        # is saved at the shortest stream interval to keep the analyzed frame rate
+        if opt.get('trajectory_streams') and opt['trajectory_interval']:
+
+            from MDOrion.MDEngines.OpenMMCubes.utils import parse_trajectory_streams
+
+            interval = min(stream[1] for stream in parse_trajectory_streams(opt['trajectory_streams']))
+
+            opt['Logger'].warn("[{}] The trajectory streams are not supported by Gromacs. The trajectory "
+                               "interval is set to {} ns".format(opt['CubeTitle'], min(interval,
+                                                                                       opt['trajectory_interval'])))
+
+            opt['trajectory_interval'] = min(interval, opt['trajectory_interval'])
+
         MDSim = GromacsSimulations(mdstate, ff_parameters, opt)
 
         MDSim.run()
@@ -232,3 +614,83 @@ def md_simulation(mdstate, ff_parameters, opt):
 
     else:
         raise ValueError("The selected MD engine is not currently supported: {}".format(opt['md_engine']))
+
+
+# Options defining the OpenMM System and Context shared by consecutive plan stages
+_stage_plan_shared_keys = ['hmr', 'constraints', 'implicit_solvent', 'nonbondedCutoff',
+                           'freeze', 'restraint_to_reference', 'temperature']
+
+
+def stage_plan_groups(stage_plan):
+    """
+    This function splits the stage plan in groups of consecutive stages that can
+    share the same OpenMM System and Context
+
+    Parameters
+    ----------
+    stage_plan: list
+        The list of stage option dictionaries
+
+    Returns
+    -------
+    groups: list
+        The list of stage groups
+    """
+
+    groups = []
+
+    for stg_opt in stage_plan:
+
+        if stg_opt['SimType'] not in ['min', 'nvt', 'npt']:
+            raise ValueError("The stage plan simulation type is not supported: {}".format(stg_opt['SimType']))
+
+        if groups and all(groups[-1][0][k] == stg_opt[k] for k in _stage_plan_shared_keys):
+            groups[-1].append(stg_opt)
+        else:
+            groups.append([stg_opt])
+
+    return groups
+
+
+@local_cluster
+def md_stage_plan(mdstate, ff_parameters, opt):
+
+    if opt['md_engine'] != 'OpenMM':
+        raise ValueError("The stage plan is not supported by the selected MD engine: {}".format(opt['md_engine']))
+
+    from MDOrion.MDEngines.OpenMMCubes.simtools import OpenMMSimulations
+
+    results = []
+
+    for group_idx, group in enumerate(stage_plan_groups(opt['stage_plan'])):
+
+        opt['Logger'].info("Stage plan group {}: {}".format(group_idx,
+                                                           [stg_opt['stage_name'] for stg_opt in group]))
+
+        group_opt = dict(group[0])
+        group_opt['stage_plan'] = group
+
+        if group_idx > 0:
+            # The system is centered only at the beginning of the plan
+            group_opt['center'] = False
+            ff_parameters.positions = mdstate.get_positions()
+            ff_parameters.velocities = mdstate.get_velocities()
+            ff_parameters.box_vectors = mdstate.get_box_vectors()
+
+        group_opt['omm_system_key'] = opt.get('omm_system_key')
+        group_opt['omm_system_data'] = opt.get('omm_system_data')
+
+        MDSim = OpenMMSimulations(mdstate, ff_parameters, group_opt)
+
+        group_results = MDSim.run_stage_plan()
+
+        MDSim.clean_up()
+
+        opt['omm_system_key'] = group_opt['omm_system_key']
+        opt['omm_system_data'] = group_opt['omm_system_data']
+
+        results.extend(group_results)
+
+        mdstate = group_results[-1][1]
+
+    return results
@@ -0,0 +1,370 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+
+import os
+
+import hashlib
+
+import tempfile
+
+import shutil
+
+import fcntl
+
+from contextlib import contextmanager
+
+
+class LRUDiskCache(object):
+    """
+    This class implements a content addressed cache on the local disk. The cache
+    entries are files named by hashing the passed keys. Every time an entry is
+    read its modification time is updated and, when the total cache size exceeds
+    the selected limit, the least recently used entries are evicted
+
+    The cache directory and its size limit can be set by using the environment
+    variables OE_MDORION_CACHE_DIR and OE_MDORION_CACHE_SIZE_MB
+
+    The cache can be shared by several processes: the entries are populated
+    under a per-key file lock so that only one process downloads a missing entry,
+    and the eviction runs under an exclusive cache lock while the readers link
+    the entries under a shared one
+    """
+
+    def __init__(self, name, cache_dir=None, max_size_mb=None):
+        """
+        The Initialization function used to create the cache
+
+        Parameters
+        ----------
+        name: String
+            The cache name used to create the cache sub-directory
+        cache_dir: String or None
+            The cache root directory. If None the OE_MDORION_CACHE_DIR environment
+            variable is used and if it is not set the system temporary directory is used
+        max_size_mb: Int or None
+            The maximum cache size in MB. If None the OE_MDORION_CACHE_SIZE_MB environment
+            variable is used and if it is not set the size limit is 4096 MB
+        """
+
+        if cache_dir is None:
+            cache_dir = os.environ.get('OE_MDORION_CACHE_DIR',
+                                       os.path.join(tempfile.gettempdir(), 'mdorion_cache'))
+
+        if max_size_mb is None:
+            max_size_mb = int(os.environ.get('OE_MDORION_CACHE_SIZE_MB', 4096))
+
+        if max_size_mb <= 0:
+            raise ValueError("The cache size must be a positive number: {}".format(max_size_mb))
+
+        self.directory = os.path.join(cache_dir, name)
+        self.lock_directory = os.path.join(self.directory, '.locks')
+        self.max_size = max_size_mb * 1024 * 1024
+
+        os.makedirs(self.lock_directory, exist_ok=True)
+
+    @contextmanager
+    def _lock(self, name, shared=False):
+        # Advisory inter-process lock held on a file of the lock directory
+        fd = os.open(os.path.join(self.lock_directory, name), os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def path(self, key):
+        """
+        This method returns the file name associated with the passed key
+
+        Parameters
+        ----------
+        key: String or Int
+            The cache entry key
+
+        Returns
+        -------
+        filename: String
+            The cache entry file name
+        """
+        return os.path.join(self.directory, hashlib.sha1(str(key).encode('utf-8')).hexdigest())
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key))
+
+    def get(self, key):
+        """
+        This method returns the file name of the cache entry selected by its key
+        and marks the entry as recently used
+
+        Parameters
+        ----------
+        key: String or Int
+            The cache entry key
+
+        Returns
+        -------
+        filename: String or None
+            The cache entry file name if the key is in the cache otherwise None
+        """
+
+        fn = self.path(key)
+
+        try:
+            os.utime(fn, None)
+        except OSError:
+            return None
+
+        return fn
+
+    def get_bytes(self, key):
+        """
+        This method returns the content of the cache entry selected by its key
+
+        Parameters
+        ----------
+        key: String or Int
+            The cache entry key
+
+        Returns
+        -------
+        data: bytes or None
+            The cache entry content if the key is in the cache otherwise None
+        """
+
+        fn = self.get(key)
+
+        if fn is None:
+            return None
+
+        try:
+            with open(fn, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def link(self, key, filename):
+        """
+        This method hard links the cache entry selected by its key to the passed
+        file name. If the hard link cannot be created, e.g. the cache is on a
+        different file system, the entry is copied. The linked files must be
+        treated as read-only since they share the cache entry content
+
+        Parameters
+        ----------
+        key: String or Int
+            The cache entry key
+        filename: String
+            The destination file name
+
+        Returns
+        -------
+        boolean: Bool
+            True if the key is in the cache and the entry has been linked otherwise False
+        """
+
+        with self._lock('cache.lock', shared=True):
+
+            fn = self.get(key)
+
+            if fn is None:
+                return False
+
+            if os.path.lexists(filename):
+                os.remove(filename)
+
+            try:
+                os.link(fn, filename)
+            except OSError:
+                shutil.copyfile(fn, filename)
+
+        return True
+
+    def fetch(self, key, filename, download):
+        """
+        This method makes the entry selected by its key available as the passed
+        file name. If the key is not in the cache the download function is called
+        to create the file and the file is added to the cache. The per-key lock
+        makes concurrent processes wait for the first download instead of
+        repeating it
+
+        Parameters
+        ----------
+        key: String or Int
+            The cache entry key
+        filename: String
+            The destination file name
+        download: callable
+            The function called with the destination file name to create the file
+
+        Returns
+        -------
+        filename: String
+            The destination file name
+        """
+
+        with self._lock(os.path.basename(self.path(key)) + '.lock'):
+
+            if self.link(key, filename):
+                return filename
+
+            download(filename)
+
+            self.put(key, filename=filename, hardlink=True)
+
+        return filename
+
+    def put(self, key, filename=None, data=None, hardlink=False):
+        """
+        This method adds a new entry to the cache by copying the passed file or
+        by writing the passed bytes. The entry is atomically renamed into the cache
+        so concurrent readers never see partially written entries
+
+        Parameters
+        ----------
+        key: String or Int
+            The cache entry key
+        filename: String or None
+            The file to copy in the cache
+        data: bytes or None
+            The bytes to write in the cache
+        hardlink: Bool
+            If True the passed file is hard linked in the cache instead of being copied,
+            when possible
+
+        Returns
+        -------
+        filename: String
+            The cache entry file name
+        """
+
+        if (filename is None) == (data is None):
+            raise ValueError("A file name or the data bytes must be passed to the cache")
+
+        fn = self.path(key)
+
+        fd, tmp_fn = tempfile.mkstemp(dir=self.directory, prefix='.tmp_')
+
+        try:
+            linked = False
+
+            if hardlink and filename is not None:
+                os.close(fd)
+                os.remove(tmp_fn)
+                try:
+                    os.link(filename, tmp_fn)
+                    linked = True
+                except OSError:
+                    fd = os.open(tmp_fn, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+
+            if not linked:
+                with os.fdopen(fd, 'wb') as f:
+                    if data is not None:
+                        f.write(data)
+                    else:
+                        with open(filename, 'rb') as fr:
+                            shutil.copyfileobj(fr, f)
+
+            os.replace(tmp_fn, fn)
+        except Exception:
+            if os.path.isfile(tmp_fn):
+                os.remove(tmp_fn)
+            raise
+
+        self.evict()
+
+        return fn
+
+    def evict(self):
+        """
+        This method removes the least recently used cache entries until the
+        cache size is below its limit
+
+        Returns
+        -------
+        count: Int
+            The number of evicted entries
+        """
+
+        with self._lock('cache.lock'):
+            return self._evict()
+
+    def _evict(self):
+
+        entries = []
+        total = 0
+
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.tmp_') or not entry.is_file():
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+
+        count = 0
+
+        for mtime, size, fn in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(fn)
+            except OSError:
+                continue
+            total -= size
+            count += 1
+
+        return count
+
+    def clear(self):
+        """
+        This method removes all the cache entries
+        """
+        with self._lock('cache.lock'):
+            for entry in os.scandir(self.directory):
+                if entry.is_file():
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+
+# Process-wide cache of the files and shards downloaded from Orion
+_file_cache = None
+
+
+def get_file_cache():
+    """
+    This function returns the process-wide cache used for the files and the
+    shards downloaded from Orion. File and shard contents are immutable so
+    their ids are used as cache keys
+
+    Returns
+    -------
+    cache: LRUDiskCache
+        The download cache
+    """
+
+    global _file_cache
+
+    if _file_cache is None:
+        _file_cache = LRUDiskCache('orion_files')
+
+    return _file_cache
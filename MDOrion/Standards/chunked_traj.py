@@ -0,0 +1,483 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import os
+
+import json
+
+import numpy as np
+
+import mdtraj
+
+from orionclient.session import in_orion
+
+from MDOrion.Standards import utils
+
+from MDOrion.Standards.transfer import get_transfer_manager
+
+
+# Chunked trajectory format identifiers
+_format_name = 'MDOrionChunkedTrajectory'
+_format_version = 1
+
+
+def quantize_frames(xyz, precision):
+    """
+    This function quantizes the frame coordinates with the selected precision,
+    like the XTC format does, and delta encodes the quantized coordinates along
+    the frames. The first frame is stored as it is so that each chunk can be
+    decoded independently. The small deltas are efficiently compressed
+
+    Parameters
+    ----------
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) frame coordinates in nm
+    precision: Int
+        The number of quantization levels per nm (1000 => 0.001 nm)
+
+    Returns
+    -------
+    q_xyz: numpy array
+        The delta encoded int32 quantized coordinates
+    """
+
+    q_xyz = np.round(np.asarray(xyz, dtype=np.float64) * precision).astype(np.int32)
+
+    if len(q_xyz) > 1:
+        q_xyz[1:] = np.diff(q_xyz, axis=0)
+
+    return q_xyz
+
+
+def dequantize_frames(q_xyz, precision):
+    """
+    This function decodes the quantized coordinates written by quantize_frames
+
+    Parameters
+    ----------
+    q_xyz: numpy array
+        The delta encoded int32 quantized coordinates
+    precision: Int
+        The number of quantization levels per nm
+
+    Returns
+    -------
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) frame coordinates in nm
+    """
+
+    return (np.cumsum(q_xyz, axis=0, dtype=np.int64) / float(precision)).astype(np.float32)
+
+
+def write_chunk(filename, xyz, time, box_vectors, precision):
+    """
+    This function writes a compressed trajectory chunk
+
+    Parameters
+    ----------
+    filename: String
+        The chunk file name. The .npz extension is appended if missing
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) frame coordinates in nm
+    time: numpy array
+        The frame times in ps
+    box_vectors: numpy array or None
+        The (n_frames, 3, 3) box vectors in nm
+    precision: Int
+        The number of quantization levels per nm
+
+    Returns
+    -------
+    filename: String
+        The chunk file name
+    """
+
+    arrays = {'xyz': quantize_frames(xyz, precision),
+              'time': np.asarray(time, dtype=np.float64),
+              'precision': np.array(precision, dtype=np.int64)}
+
+    if box_vectors is not None:
+        arrays['box_vectors'] = np.asarray(box_vectors, dtype=np.float32)
+
+    np.savez_compressed(filename, **arrays)
+
+    if not filename.endswith('.npz'):
+        filename += '.npz'
+
+    return filename
+
+
+def read_chunk(filename):
+    """
+    This function reads a trajectory chunk written by write_chunk
+
+    Parameters
+    ----------
+    filename: String
+        The chunk file name
+
+    Returns
+    -------
+    xyz, time, box_vectors: numpy array, numpy array, numpy array or None
+        The frame coordinates in nm, the frame times in ps and the box vectors in nm
+    """
+
+    with np.load(filename) as chunk:
+        xyz = dequantize_frames(chunk['xyz'], int(chunk['precision']))
+        time = chunk['time']
+        box_vectors = chunk['box_vectors'] if 'box_vectors' in chunk.files else None
+
+    return xyz, time, box_vectors
+
+
+class ChunkedTrajectoryWriter(object):
+    """
+    This class writes a trajectory as a sequence of fixed size, independently
+    compressed frame chunks. Each completed chunk is uploaded in a background
+    thread while the simulation keeps running. The chunk file ids, together
+    with the topology file id, are collected in the trajectory manifest
+    """
+
+    def __init__(self, directory, chunk_frames=100, precision=1000, upload=None, remove_uploaded=None):
+        """
+        The Initialization function used to create the writer
+
+        Parameters
+        ----------
+        directory: String
+            The directory where the chunk files are written
+        chunk_frames: Int
+            The number of frames of each chunk
+        precision: Int
+            The number of quantization levels per nm
+        upload: callable or None
+            The function used to upload a file which returns the file id. If None
+            the Standards upload_file function is used
+        remove_uploaded: Bool or None
+            If True the chunk files are removed after their upload. If None the
+            files are removed only in Orion
+        """
+
+        if chunk_frames < 1:
+            raise ValueError("The number of chunk frames must be positive: {}".format(chunk_frames))
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.chunk_frames = chunk_frames
+        self.precision = precision
+        self.upload = upload if upload is not None else utils.upload_file
+        self.remove_uploaded = in_orion() if remove_uploaded is None else remove_uploaded
+
+        self.n_atoms = None
+        self.n_frames = 0
+        self.topology = None
+        self.chunks = []
+
+        self._xyz = []
+        self._time = []
+        self._box = []
+
+        self._futures = []
+        self._closed = False
+
+    def _submit(self, filename):
+
+        def _upload():
+            file_id = self.upload(filename)
+            if self.remove_uploaded:
+                os.remove(filename)
+            return file_id
+
+        return get_transfer_manager().submit(_upload)
+
+    def set_topology(self, topology_fn):
+        """
+        This method uploads the topology file of the trajectory
+
+        Parameters
+        ----------
+        topology_fn: String
+            The topology file name, an mdtraj HDF5 file
+        """
+        self.topology = self._submit(topology_fn)
+
+    def append(self, xyz, time, box_vectors=None):
+        """
+        This method appends a frame to the trajectory. When the number of
+        buffered frames reaches the chunk size a new chunk is written
+
+        Parameters
+        ----------
+        xyz: numpy array
+            The (n_atoms, 3) frame coordinates in nm
+        time: Float
+            The frame time in ps
+        box_vectors: numpy array or None
+            The (3, 3) frame box vectors in nm
+        """
+
+        if self._closed:
+            raise ValueError("The chunked trajectory writer has been closed")
+
+        xyz = np.asarray(xyz, dtype=np.float32)
+
+        if self.n_atoms is None:
+            self.n_atoms = xyz.shape[0]
+        elif xyz.shape[0] != self.n_atoms:
+            raise ValueError("The frame number of atoms is not consistent: {} vs {}".format(xyz.shape[0],
+                                                                                          self.n_atoms))
+
+        self._xyz.append(xyz)
+        self._time.append(time)
+        self._box.append(box_vectors)
+
+        self.n_frames += 1
+
+        if len(self._xyz) >= self.chunk_frames:
+            self.flush()
+
+    def flush(self):
+        """
+        This method writes the buffered frames in a new chunk and submits its upload
+        """
+
+        if not self._xyz:
+            return
+
+        box = None if any(b is None for b in self._box) else np.array(self._box)
+
+        fn = os.path.join(self.directory, 'chunk_{:06d}.npz'.format(len(self._futures)))
+
+        write_chunk(fn, np.array(self._xyz), np.array(self._time), box, self.precision)
+
+        first_frame = self.n_frames - len(self._xyz)
+
+        self.chunks.append({'first_frame': first_frame, 'n_frames': len(self._xyz)})
+        self._futures.append(self._submit(fn))
+
+        self._xyz = []
+        self._time = []
+        self._box = []
+
+    def close(self):
+        """
+        This method writes the last chunk and waits for all the uploads
+
+        Returns
+        -------
+        manifest: python dictionary
+            The trajectory manifest
+        """
+
+        if not self._closed:
+            self.flush()
+            self._closed = True
+
+            for chunk, future in zip(self.chunks, self._futures):
+                chunk['file_id'] = future.result()
+
+            if self.topology is not None:
+                self.topology = self.topology.result()
+
+        return {'format': _format_name,
+                'version': _format_version,
+                'precision': self.precision,
+                'chunk_frames': self.chunk_frames,
+                'n_atoms': self.n_atoms,
+                'n_frames': self.n_frames,
+                'topology': self.topology,
+                'chunks': self.chunks}
+
+    def write_manifest(self, filename):
+        """
+        This method closes the writer and saves the trajectory manifest
+
+        Parameters
+        ----------
+        filename: String
+            The manifest file name
+
+        Returns
+        -------
+        filename: String
+            The manifest file name
+        """
+
+        with open(filename, 'w') as f:
+            json.dump(self.close(), f)
+
+        return filename
+
+
+def load_manifest(filename):
+    """
+    This function loads and checks a chunked trajectory manifest
+
+    Parameters
+    ----------
+    filename: String
+        The manifest file name
+
+    Returns
+    -------
+    manifest: python dictionary
+        The trajectory manifest
+    """
+
+    with open(filename, 'r') as f:
+        manifest = json.load(f)
+
+    if manifest.get('format') != _format_name:
+        raise ValueError("The file is not a chunked trajectory manifest: {}".format(filename))
+
+    if manifest['version'] > _format_version:
+        raise ValueError("The chunked trajectory version is not supported: {}".format(manifest['version']))
+
+    return manifest
+
+
+def download_chunked_trajectory(manifest_fn, directory):
+    """
+    This function downloads the topology and the chunks of a chunked trajectory
+    and writes a local manifest pointing to the downloaded files
+
+    Parameters
+    ----------
+    manifest_fn: String
+        The manifest file name
+    directory: String
+        The directory where the files are downloaded
+
+    Returns
+    -------
+    local_manifest_fn: String
+        The local manifest file name
+    """
+
+    manifest = load_manifest(manifest_fn)
+
+    if manifest['topology'] is not None:
+        manifest['topology'] = utils.download_file(manifest['topology'],
+                                                   os.path.join(directory, 'topology.h5'))
+
+    # The chunks are downloaded in parallel
+    chunk_fns = [os.path.join(directory, 'chunk_{:06d}.npz'.format(idx)) for idx in range(len(manifest['chunks']))]
+
+    file_ids = get_transfer_manager().map(utils.download_file,
+                                          [chunk['file_id'] for chunk in manifest['chunks']],
+                                          chunk_fns)
+
+    for chunk, file_id in zip(manifest['chunks'], file_ids):
+        chunk['file_id'] = file_id
+
+    local_manifest_fn = os.path.join(directory, 'local_' + os.path.basename(manifest_fn))
+
+    with open(local_manifest_fn, 'w') as f:
+        json.dump(manifest, f)
+
+    return local_manifest_fn
+
+
+def delete_chunked_trajectory(manifest_id, directory):
+    """
+    This function deletes the topology, the chunks and the manifest files of a
+    chunked trajectory
+
+    Parameters
+    ----------
+    manifest_id: String or Int
+        The manifest file name locally or its id in Orion
+    directory: String
+        The directory where the manifest is downloaded
+    """
+
+    manifest = load_manifest(utils.download_file(manifest_id, os.path.join(directory, 'manifest.json')))
+
+    for chunk in manifest['chunks']:
+        utils.delete_file(chunk['file_id'])
+
+    if manifest['topology'] is not None:
+        utils.delete_file(manifest['topology'])
+
+    utils.delete_file(manifest_id)
+
+    return True
+
+
+def iterload_chunked_trajectory(manifest_fn, atom_indices=None):
+    """
+    This function iterates over the chunks of a local chunked trajectory
+
+    Parameters
+    ----------
+    manifest_fn: String
+        The local manifest file name
+    atom_indices: numpy array or None
+        The indices of the atoms to load. If None all the atoms are loaded
+
+    Returns
+    -------
+    trajectory: generator
+        The mdtraj trajectory chunks
+    """
+
+    manifest = load_manifest(manifest_fn)
+
+    topology = mdtraj.load_topology(manifest['topology'])
+
+    if atom_indices is not None:
+        topology = topology.subset(atom_indices)
+
+    for chunk in manifest['chunks']:
+
+        xyz, time, box_vectors = read_chunk(chunk['file_id'])
+
+        if atom_indices is not None:
+            xyz = xyz[:, atom_indices]
+
+        trj = mdtraj.Trajectory(xyz, topology, time=time)
+
+        if box_vectors is not None:
+            trj.unitcell_vectors = box_vectors
+
+        yield trj
+
+
+def load_chunked_trajectory(manifest_fn, atom_indices=None):
+    """
+    This function loads a local chunked trajectory
+
+    Parameters
+    ----------
+    manifest_fn: String
+        The local manifest file name
+    atom_indices: numpy array or None
+        The indices of the atoms to load. If None all the atoms are loaded
+
+    Returns
+    -------
+    trajectory: mdtraj Trajectory
+        The trajectory
+    """
+
+    chunks = list(iterload_chunked_trajectory(manifest_fn, atom_indices=atom_indices))
+
+    if not chunks:
+        raise ValueError("The chunked trajectory does not have any frame: {}".format(manifest_fn))
+
+    return mdtraj.join(chunks, check_topology=False)
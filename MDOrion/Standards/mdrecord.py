@@ -5,8 +5,21 @@ from MDOrion.Standards import (Fields,
 
 from MDOrion.Standards import utils
 
+from MDOrion.Standards import chunked_traj
+
+from MDOrion.Standards.stage_container import (StageContainer,
+                                               is_stage_container,
+                                               write_stage_container)
+
+from MDOrion.Standards.traj_store import (OETrajStore,
+                                          OEConcatTrajStore)
+
+from MDOrion.MDEngines.utils import MDState
+
 import parmed
 
+import numpy as np
+
 import copy
 
 import os
@@ -31,19 +44,22 @@ import shutil
 from orionclient.types import (ShardCollection,
                                Shard)
 
-from orionclient.session import (in_orion,
-                                 OrionSession,
-                                 get_session)
+from orionclient.session import in_orion
 
 import glob
 
+import hashlib
 
-from orionclient.helpers.collections import (try_hard_to_create_shard,
-                                             try_hard_to_download_shard)
+
+from orionclient.helpers.collections import try_hard_to_create_shard
 
 from oemdtoolbox.ForceField.md_components import MDComponents
 
 
+# Stage trajectory format of the chunked trajectories
+_chunked_format = 'chunked'
+
+
 def mdstages(f):
 
     def wrapper(*pos, **named):
@@ -81,8 +97,13 @@ def stage_system(f):
 
             fn = utils.download_data(file_id, dir_stage, collection_id=mdrec.collection_id)
 
-            with tarfile.open(fn) as tar:
-                tar.extractall(path=dir_stage)
+            # The stage containers are accessed in place by member
+            # while the legacy tar archives are extracted
+            if is_stage_container(fn):
+                os.symlink(os.path.abspath(fn), os.path.join(dir_stage, MDFileNames.stage_container))
+            else:
+                with tarfile.open(fn) as tar:
+                    tar.extractall(path=dir_stage)
 
             mdrec.processed[stage_name] = dir_stage
 
@@ -619,22 +640,7 @@ class MDDataRecord(object):
             if self.rec.has_field(Fields.collection):
                 raise ValueError("Collection field already present on the record")
 
-            # session = APISession
-
-            session = OrionSession(
-                requests_session=get_session(
-                    retry_dict={
-                        403: 5,
-                        404: 20,
-                        409: 45,
-                        460: 15,
-                        500: 2,
-                        502: 45,
-                        503: 45,
-                        504: 45,
-                    }
-                )
-            )
+            session = utils.get_orion_session()
 
             collection = ShardCollection.create(session, name)
 
@@ -722,6 +728,19 @@ class MDDataRecord(object):
 
         return self.rec.get_value(Fields.md_stages)[idx]
 
+    def _delete_stage_trajectory(self, stage):
+        # The chunked trajectories are deleted together with their chunks
+        tid = stage.get_value(Fields.trajectory)
+
+        if stage.has_field(Fields.trajectory_format) and \
+                stage.get_value(Fields.trajectory_format) == _chunked_format:
+            with TemporaryDirectory() as output_directory:
+                chunked_traj.delete_chunked_trajectory(tid, output_directory)
+        else:
+            utils.delete_file(tid)
+
+        return True
+
     @mdstages
     def delete_stage_by_name(self, stg_name='last'):
         """
@@ -743,6 +762,13 @@ class MDDataRecord(object):
 
         stg_names = []
 
+        name = stages[-1].get_value(Fields.stage_name) if stg_name == 'last' else stg_name
+
+        for stage in stages:
+            if stage.has_field(Fields.state_reference) and stage.get_value(Fields.state_reference) == name:
+                raise ValueError("The MD stage state is the reference of the stage: {}".format(
+                    stage.get_value(Fields.stage_name)))
+
         if len(self.get_stages) == 1:
 
             stage = self.get_stage_by_idx(0)
@@ -751,8 +777,13 @@ class MDDataRecord(object):
             utils.delete_data(fid, collection_id=self.collection_id)
 
             if stage.get_value(Fields.trajectory) is not None:
-                tid = stage.get_value(Fields.trajectory)
-                utils.delete_file(tid)
+                self._delete_stage_trajectory(stage)
+
+            # The shared topologies are deleted together with the last stage
+            if self.rec.has_field(Fields.md_topologies):
+                for fid in self.rec.get_value(Fields.md_topologies).values():
+                    utils.delete_data(fid, collection_id=self.collection_id)
+                self.rec.delete_field(Fields.md_topologies)
 
             self.rec.delete_field(Fields.md_stages)
             self.processed = {}
@@ -766,8 +797,7 @@ class MDDataRecord(object):
             utils.delete_data(fid, collection_id=self.collection_id)
 
             if last_stage.get_value(Fields.trajectory) is not None:
-                tid = last_stage.get_value(Fields.trajectory)
-                utils.delete_file(tid)
+                self._delete_stage_trajectory(last_stage)
 
             del self.processed[name]
             del stages[-1]
@@ -784,8 +814,7 @@ class MDDataRecord(object):
                     utils.delete_data(fid, collection_id=self.collection_id)
 
                     if stage.get_value(Fields.trajectory) is not None:
-                        tid = stage.get_value(Fields.trajectory)
-                        utils.delete_file(tid)
+                        self._delete_stage_trajectory(stage)
 
                     del self.processed[name]
                     stages.remove(stage)
@@ -893,6 +922,34 @@ class MDDataRecord(object):
 
         dir_stage = self.processed[stage_name]
 
+        container_fn = os.path.join(dir_stage, MDFileNames.stage_container)
+
+        if os.path.isfile(container_fn):
+
+            with StageContainer(container_fn) as container:
+
+                if MDFileNames.state_binary in container:
+                    return container.load_state(MDFileNames.state_binary)
+
+                delta = container.load_state(MDFileNames.state_delta)
+
+            reference = self.get_stage_state(stg_name=stage.get_value(Fields.state_reference))
+
+            return MDState.from_delta(delta, reference)
+
+        # Stages saved as tar archives
+        state_fn = os.path.join(dir_stage, MDFileNames.state_binary)
+
+        if os.path.isfile(state_fn):
+            return MDState.load(state_fn)
+
+        state_fn = os.path.join(dir_stage, MDFileNames.state_delta)
+
+        if os.path.isfile(state_fn):
+            reference = self.get_stage_state(stg_name=stage.get_value(Fields.state_reference))
+            return MDState.from_delta(MDState.load(state_fn), reference)
+
+        # Stages saved with the legacy pickled MD State
         state_fn = os.path.join(dir_stage, MDFileNames.state)
 
         with open(state_fn, 'rb') as f:
@@ -924,15 +981,74 @@ class MDDataRecord(object):
 
         dir_stage = self.processed[stage_name]
 
-        topology_fn = os.path.join(dir_stage, MDFileNames.topology)
+        if stage.has_field(Fields.topology_hash):
+            topology = self._get_topology(stage.get_value(Fields.topology_hash))
+            topology.SetCoords(self.get_stage_state(stg_name=stage_name).get_oe_positions())
+            return topology
 
+        # Stages saved with the topology in the stage data
         topology = oechem.OEMol()
 
+        container_fn = os.path.join(dir_stage, MDFileNames.stage_container)
+
+        if os.path.isfile(container_fn):
+
+            with StageContainer(container_fn) as container:
+                data = container.read(MDFileNames.topology)
+
+            ifs = oechem.oemolistream()
+            ifs.SetFormat(oechem.OEFormat_OEB)
+
+            if not ifs.openstring(data):
+                raise ValueError("It was not possible to read the stage topology")
+
+            oechem.OEReadMolecule(ifs, topology)
+            ifs.close()
+
+            return topology
+
+        topology_fn = os.path.join(dir_stage, MDFileNames.topology)
+
         with oechem.oemolistream(topology_fn) as ifs:
             oechem.OEReadMolecule(ifs, topology)
 
         return topology
 
+    def prefetch_stage(self, stg_name='last', trajectory=False):
+        """
+        This method starts in background the download of the data associated
+        with the selected MD stage. The downloads are stored in the disk cache
+        so that the following stage accessors are served locally and the
+        transfers overlap with the work done in the meanwhile
+
+        Parameters
+        ----------
+        stg_name: String
+            The MD stage name
+        trajectory: Bool
+            If True the stage trajectory is prefetched together with the stage data
+
+        Returns
+        -------
+        boolean: Bool
+            True if the prefetch has been started otherwise False
+        """
+
+        if not in_orion():
+            return False
+
+        stage = self.get_stage_by_name(stg_name)
+
+        stage_name = stage.get_value(Fields.stage_name)
+
+        if not self.processed[stage_name]:
+            utils.prefetch_data(stage.get_value(Fields.mddata), collection_id=self.collection_id)
+
+        if trajectory and stage.has_field(Fields.trajectory):
+            utils.prefetch_file(stage.get_value(Fields.trajectory))
+
+        return True
+
     @stage_system
     @mdstages
     def get_stage_trajectory(self, stg_name='last'):
@@ -962,8 +1078,27 @@ class MDDataRecord(object):
         if not stage.has_field(Fields.trajectory):
             return None
 
+        if stage.has_field(Fields.trajectory_format) and \
+                stage.get_value(Fields.trajectory_format) == _chunked_format:
+            manifest_fn = utils.download_file(stage.get_value(Fields.trajectory),
+                                              os.path.join(traj_dir, MDFileNames.trajectory_manifest))
+
+            return chunked_traj.download_chunked_trajectory(manifest_fn, traj_dir)
+
         trj_tar = utils.download_file(stage.get_value(Fields.trajectory), os.path.join(traj_dir, MDFileNames.trajectory))
 
+        if is_stage_container(trj_tar):
+            # Only the system trajectory is extracted, the atom subset
+            # trajectory streams are extracted on demand
+            with StageContainer(trj_tar) as container:
+                names = sorted(name for name in container.names()
+                               if name.endswith('.h5') and MDFileNames.trajectory_stream not in name)
+
+                if not names:
+                    raise ValueError("Something went wrong recovering the trajectory")
+
+                return container.extract(names[0], traj_dir)
+
         with tarfile.open(trj_tar) as tar:
             tar.extractall(path=traj_dir)
 
@@ -972,7 +1107,9 @@ class MDDataRecord(object):
         md_engine = trj_meta.get_attribute(Meta.Annotation.Description)
 
         if md_engine == MDEngines.OpenMM and not stg_type == MDStageTypes.FEC:
-            traj_fn = glob.glob(os.path.join(traj_dir, '*.h5'))[0]
+            # The atom subset trajectory streams are skipped
+            traj_fn = [fn for fn in sorted(glob.glob(os.path.join(traj_dir, '*.h5')))
+                       if MDFileNames.trajectory_stream not in os.path.basename(fn)][0]
         elif md_engine == MDEngines.Gromacs:
             traj_fn = glob.glob(os.path.join(traj_dir, '*.trr'))[0]
         else:
@@ -985,6 +1122,53 @@ class MDDataRecord(object):
         else:
             raise ValueError("Something went wrong recovering the trajectory")
 
+    def get_stage_trajectory_streams(self, stg_name='last'):
+        """
+        This method returns the atom subset trajectory streams associated
+        with the md data. The streams are saved by OpenMM together with the
+        full system trajectory
+
+        Parameters
+        ----------
+        stg_name: String
+            The MD stage name
+
+        Returns
+        -------
+        streams: python dictionary
+            The dictionary mapping the stream names to (trajectory file name,
+            atom indices) tuples. The atom indices refer to the full system
+            topology. The dictionary is empty if no stream has been found
+        """
+
+        traj_fn = self.get_stage_trajectory(stg_name=stg_name)
+
+        streams = dict()
+
+        if traj_fn is None:
+            return streams
+
+        trj_tar = os.path.join(os.path.dirname(traj_fn), MDFileNames.trajectory)
+
+        if os.path.isfile(trj_tar) and is_stage_container(trj_tar):
+            with StageContainer(trj_tar) as container:
+                for name in container.names():
+                    if MDFileNames.trajectory_stream in name:
+                        container.extract(name, os.path.dirname(traj_fn))
+
+        base = os.path.splitext(traj_fn)[0] + MDFileNames.trajectory_stream
+
+        for stream_fn in sorted(glob.glob(base + '*.h5')):
+            name = os.path.splitext(stream_fn)[0][len(base):]
+            indices_fn = os.path.splitext(stream_fn)[0] + '_atoms.npy'
+
+            if not os.path.isfile(indices_fn):
+                raise ValueError("The trajectory stream atom indices have not been found: {}".format(indices_fn))
+
+            streams[name] = (stream_fn, np.load(indices_fn))
+
+        return streams
+
     def add_new_stage(self,
                       stage_name,
                       stage_type,
@@ -995,9 +1179,12 @@ class MDDataRecord(object):
                       log=None,
                       trajectory_fn=None,
                       trajectory_engine=None,
-                      trajectory_orion_ui='OrionFile'):
+                      trajectory_orion_ui='OrionFile',
+                      state_delta=False):
         """
-        This method add a new MD stage to the MD stage record
+        This method add a new MD stage to the MD stage record. The topology is
+        stored once per flask and the stages refer to it by its content address,
+        while the stage data holds only the stage state
 
         Parameters
         ----------
@@ -1023,6 +1210,8 @@ class MDDataRecord(object):
             The MD engine used to generate the new MD stage. Possible names: OpenMM or Gromacs
         trajectory_orion_ui: String
             The trajectory string name to be displayed in the Orion UI
+        state_delta: Bool
+            If True the state is stored as delta from the state of the previous stage
 
         Returns
         -------
@@ -1038,21 +1227,48 @@ class MDDataRecord(object):
         if log is not None:
             record.set_value(Fields.log_data, log)
 
+        # The topology coordinates are restored from the stage state so
+        # the topology can be shared only if the atoms match the state
+        topology_hash = None
+
+        if topology.NumAtoms() == topology.GetMaxAtomIdx() == len(mdstate.get_positions_array()):
+            top_shared_fn, topology_hash = self._write_topology(topology)
+            record.set_value(Fields.topology_hash, topology_hash)
+
+        reference = self._state_reference_name(append) if state_delta else None
+
         with TemporaryDirectory() as output_directory:
 
-            top_fn = os.path.join(output_directory, MDFileNames.topology)
+            # The float64 state arrays are deflated, the container reader
+            # decompresses the single state member in memory
+            members = []
+
+            if topology_hash is None:
+                top_fn = os.path.join(output_directory, MDFileNames.topology)
+
+                with oechem.oemolostream(top_fn) as ofs:
+                    oechem.OEWriteConstMolecule(ofs, topology)
 
-            with oechem.oemolostream(top_fn) as ofs:
-                oechem.OEWriteConstMolecule(ofs, topology)
+                members.append((top_fn, True))
 
-            state_fn = os.path.join(output_directory, MDFileNames.state)
+            if reference is not None:
+                try:
+                    delta = mdstate.delta(self.get_stage_state(stg_name=reference))
+                except ValueError:
+                    # The state arrays do not match the reference ones
+                    reference = None
 
-            with open(state_fn, 'wb') as f:
-                pickle.dump(mdstate, f)
+            if reference is not None:
+                state_fn = os.path.join(output_directory, MDFileNames.state_delta)
+                delta.save(state_fn)
+                record.set_value(Fields.state_reference, reference)
+                members.append((state_fn, True))
+            else:
+                state_fn = os.path.join(output_directory, MDFileNames.state_binary)
+                mdstate.save(state_fn)
+                members.append((state_fn, True))
 
-            with tarfile.open(data_fn, mode='w:gz') as archive:
-                archive.add(top_fn, arcname=os.path.basename(top_fn))
-                archive.add(state_fn, arcname=os.path.basename(state_fn))
+            write_stage_container(data_fn, members)
 
         if trajectory_fn is not None:
 
@@ -1063,6 +1279,10 @@ class MDDataRecord(object):
             trj_meta.set_attribute(Meta.Annotation.Description, trajectory_engine)
             trj_field = OEField(Fields.trajectory.get_name(), Fields.trajectory.get_type(), meta=trj_meta)
 
+            # The chunked trajectories are saved by using their manifest
+            if str(trajectory_fn).endswith(MDFileNames.trajectory_manifest):
+                record.set_value(Fields.trajectory_format, _chunked_format)
+
         if self.rec.has_field(Fields.md_stages):
 
             stage_names = self.get_stages_names
@@ -1107,10 +1327,102 @@ class MDDataRecord(object):
 
             self.rec.set_value(Fields.md_stages, [record])
 
+        # The topology is registered after a possible deletion of the overwritten stage
+        if topology_hash is not None:
+            self._store_topology(top_shared_fn, topology_hash, data_fn)
+
         self.processed[stage_name] = False
 
         return True
 
+    def _write_topology(self, topology):
+        # The topology is written without coordinates in the record working directory
+        # and its content address is the hash of the written file
+        top = oechem.OEMol(topology)
+        top.SetCoords([0.0] * (3 * top.GetMaxAtomIdx()))
+
+        tmp_fn = os.path.join(self.cwd, MDFileNames.topology)
+
+        with oechem.oemolostream(tmp_fn) as ofs:
+            oechem.OEWriteConstMolecule(ofs, top)
+
+        sha = hashlib.sha1()
+
+        with open(tmp_fn, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+
+        topology_hash = sha.hexdigest()
+
+        top_fn = os.path.join(self.cwd, 'topology_{}.oeb'.format(topology_hash))
+
+        os.replace(tmp_fn, top_fn)
+
+        return top_fn, topology_hash
+
+    def _store_topology(self, top_fn, topology_hash, data_fn):
+        # The topology is uploaded only if the record does not already carry it
+        topologies = self.rec.get_value(Fields.md_topologies) if self.rec.has_field(Fields.md_topologies) else {}
+
+        if topology_hash in topologies:
+            return topologies[topology_hash]
+
+        if not in_orion():
+            # Locally the file name is used as file id and the topology file
+            # must outlive the record working directory
+            fn = os.path.join(os.path.dirname(data_fn),
+                              os.path.basename(self.cwd) + '_topology_' + topology_hash[:16] + '.oeb')
+            shutil.copyfile(top_fn, fn)
+            top_fn = fn
+
+        topologies[topology_hash] = utils.upload_data(top_fn,
+                                                      collection_id=self.collection_id,
+                                                      shard_name=os.path.basename(top_fn))
+
+        self.rec.set_value(Fields.md_topologies, topologies)
+
+        return topologies[topology_hash]
+
+    def _get_topology(self, topology_hash):
+        # The shared topologies are downloaded once in the record working directory
+        top_fn = os.path.join(self.cwd, 'topology_{}.oeb'.format(topology_hash))
+
+        if not os.path.isfile(top_fn):
+
+            if not self.rec.has_field(Fields.md_topologies) or \
+                    topology_hash not in self.rec.get_value(Fields.md_topologies):
+                raise ValueError("The stage topology has not been found: {}".format(topology_hash))
+
+            file_id = self.rec.get_value(Fields.md_topologies)[topology_hash]
+
+            if in_orion():
+                utils.download_shard(file_id, self.collection_id, top_fn)
+            else:
+                top_fn = file_id
+
+        topology = oechem.OEMol()
+
+        with oechem.oemolistream(top_fn) as ifs:
+            oechem.OEReadMolecule(ifs, topology)
+
+        return topology
+
+    def _state_reference_name(self, append):
+        # The state deltas refer to full states only so that
+        # rebuilding a state never needs more than one reference
+        if not self.has_stages:
+            return None
+
+        stages = self.get_stages if append else self.get_stages[:-1]
+
+        if not stages:
+            return None
+
+        if stages[-1].has_field(Fields.state_reference):
+            return stages[-1].get_value(Fields.state_reference)
+
+        return stages[-1].get_value(Fields.stage_name)
+
     @property
     @mdstages
     def get_stages(self):
@@ -1186,8 +1498,13 @@ class MDDataRecord(object):
             utils.delete_data(fid, collection_id=self.collection_id)
 
             if stage.get_value(Fields.trajectory) is not None:
-                tid = stage.get_value(Fields.trajectory)
-                utils.delete_file(tid)
+                self._delete_stage_trajectory(stage)
+
+        # The shared topologies are deleted together with the stages
+        if self.rec.has_field(Fields.md_topologies):
+            for fid in self.rec.get_value(Fields.md_topologies).values():
+                utils.delete_data(fid, collection_id=self.collection_id)
+            self.rec.delete_field(Fields.md_topologies)
 
         self.processed = {}
         self.rec.delete_field(Fields.md_stages)
@@ -1217,35 +1534,16 @@ class MDDataRecord(object):
         pmd_structure = self.rec.get_value(Fields.pmd_structure)
 
         if in_orion():
-            # session = APISession
-
-            session = OrionSession(
-                requests_session=get_session(
-                    retry_dict={
-                        403: 5,
-                        404: 20,
-                        409: 45,
-                        460: 15,
-                        500: 2,
-                        502: 45,
-                        503: 45,
-                        504: 45,
-                    }
-                )
-            )
+            session = utils.get_orion_session()
 
             if self.collection_id is None:
                 raise ValueError("The Collection ID is None")
 
-            collection = session.get_resource(ShardCollection, self.collection_id)
-
-            shard = session.get_resource(Shard(collection=collection), pmd_structure)
-
             with TemporaryDirectory() as output_directory:
 
                 parmed_fn = os.path.join(output_directory, "parmed.pickle")
 
-                try_hard_to_download_shard(shard, parmed_fn)
+                utils.download_shard(pmd_structure, self.collection_id, parmed_fn, session=session)
 
                 with open(parmed_fn, 'rb') as f:
                     parm_dic = pickle.load(f)
@@ -1253,8 +1551,6 @@ class MDDataRecord(object):
                 pmd_structure = parmed.structure.Structure()
                 pmd_structure.__setstate__(parm_dic)
 
-            shard.close()
-
         if sync_stage_name is not None:
             mdstate = self.get_stage_state(stg_name=sync_stage_name)
 
@@ -1313,20 +1609,7 @@ class MDDataRecord(object):
                     fid = self.rec.get_value(Fields.pmd_structure)
                     utils.delete_data(fid, collection_id=self.collection_id)
 
-                session = OrionSession(
-                    requests_session=get_session(
-                        retry_dict={
-                            403: 5,
-                            404: 20,
-                            409: 45,
-                            460: 15,
-                            500: 2,
-                            502: 45,
-                            503: 45,
-                            504: 45,
-                        }
-                    )
-                )
+                session = utils.get_orion_session()
 
                 collection = session.get_resource(ShardCollection, self.collection_id)
 
@@ -1382,20 +1665,7 @@ class MDDataRecord(object):
             if self.collection_id is None:
                 raise ValueError("The Collection ID is None")
 
-            session = OrionSession(
-                requests_session=get_session(
-                    retry_dict={
-                        403: 5,
-                        404: 20,
-                        409: 45,
-                        460: 15,
-                        500: 2,
-                        502: 45,
-                        503: 45,
-                        504: 45,
-                    }
-                )
-            )
+            session = utils.get_orion_session()
 
             collection = session.get_resource(ShardCollection, self.collection_id)
 
@@ -1427,43 +1697,22 @@ class MDDataRecord(object):
 
         if in_orion():
 
-            # session = APISession
-
-            session = OrionSession(
-                requests_session=get_session(
-                    retry_dict={
-                        403: 5,
-                        404: 20,
-                        409: 45,
-                        460: 15,
-                        500: 2,
-                        502: 45,
-                        503: 45,
-                        504: 45,
-                    }
-                )
-            )
+            session = utils.get_orion_session()
 
             if self.collection_id is None:
                 raise ValueError("The Collection ID is None")
 
-            collection = session.get_resource(ShardCollection, self.collection_id)
-
-            shard = session.get_resource(Shard(collection=collection), protein_conf)
-
             with TemporaryDirectory() as output_directory:
 
                 protein_fn = os.path.join(output_directory, MDFileNames.trajectory_conformers)
 
-                try_hard_to_download_shard(shard, protein_fn)
+                utils.download_shard(protein_conf, self.collection_id, protein_fn, session=session)
 
                 protein_conf = oechem.OEMol()
 
                 with oechem.oemolistream(protein_fn) as ifs:
                     oechem.OEReadMolecule(ifs, protein_conf)
 
-            shard.close()
-
         return protein_conf
 
     def set_protein_traj(self, protein_conf, shard_name=""):
@@ -1502,22 +1751,7 @@ class MDDataRecord(object):
                     fid = self.rec.get_value(Fields.protein_traj_confs)
                     utils.delete_data(fid, collection_id=self.collection_id)
 
-                # session = APISession
-
-                session = OrionSession(
-                    requests_session=get_session(
-                        retry_dict={
-                            403: 5,
-                            404: 20,
-                            409: 45,
-                            460: 15,
-                            500: 2,
-                            502: 45,
-                            503: 45,
-                            504: 45,
-                        }
-                    )
-                )
+                session = utils.get_orion_session()
 
                 collection = session.get_resource(ShardCollection, self.collection_id)
 
@@ -1531,6 +1765,281 @@ class MDDataRecord(object):
 
         return True
 
+    def has_traj_store(self, name):
+        """
+        This method checks if the selected trajectory store is present on the record
+
+        Parameters
+        ----------
+        name: String
+            The trajectory store name e.g. protein or water
+
+        Returns
+        -------
+        boolean : Bool
+            True if the trajectory store is present on the record otherwise False
+        """
+
+        if not self.rec.has_field(Fields.traj_stores):
+            return False
+
+        return name in self.rec.get_value(Fields.traj_stores)
+
+    def get_traj_store(self, name, mmap=True):
+        """
+        This method returns the selected trajectory store. The store coordinates
+        are memory mapped from the downloaded store file
+
+        Parameters
+        ----------
+        name: String
+            The trajectory store name e.g. protein or water
+        mmap: Bool
+            If True the store coordinates are memory mapped
+
+        Returns
+        -------
+        store: OETrajStore
+            The trajectory store
+        """
+
+        if not self.has_traj_store(name):
+            raise ValueError("The trajectory store is not present on the record: {}".format(name))
+
+        entry = self.rec.get_value(Fields.traj_stores)[name]
+
+        # The concatenated stores refer to the frame ranges of other stores
+        if isinstance(entry, dict):
+            stores = []
+
+            for idx, part in enumerate(entry['stores']):
+                store = self._load_traj_store(part['file_id'], '{}_{}'.format(name, idx), mmap)
+                stores.append(store[part['start']:part['stop']])
+
+            return OEConcatTrajStore(stores, [part['pose_id'] for part in entry['stores']])
+
+        return self._load_traj_store(entry, name, mmap)
+
+    def _load_traj_store(self, file_id, name, mmap):
+        # The store files are downloaded in the record working directory
+        if in_orion():
+
+            if self.collection_id is None:
+                raise ValueError("The Collection ID is None")
+
+            store_fn = os.path.join(self.cwd, name + '_' + MDFileNames.trajectory_store)
+
+            utils.download_shard(file_id, self.collection_id, store_fn)
+        else:
+            store_fn = file_id
+
+        store = OETrajStore.load(store_fn, mmap=mmap)
+        store.source = (file_id, 0, store.n_frames)
+
+        return store
+
+    def set_traj_store(self, name, store, shard_name=""):
+        """
+        This method sets the trajectory store on the record. An already present
+        store with the same name is replaced
+
+        The concatenated stores of stores already saved on records are set by
+        their index of pose ids and frame ranges without uploading the frames
+
+        Parameters
+        -----------
+        name: String
+            The trajectory store name e.g. protein or water
+        store: OETrajStore
+            The trajectory store
+        shard_name: String
+            In Orion tha shard will be named by using the shard_name
+
+        Returns
+        -------
+        boolean: Bool
+            True if the setting was successful
+        """
+
+        if not isinstance(store, OETrajStore):
+            raise ValueError("The passed store is not a valid trajectory store: {}".format(type(store)))
+
+        stores = self.rec.get_value(Fields.traj_stores) if self.rec.has_field(Fields.traj_stores) else {}
+
+        # The stores referred by a concatenated store are owned by other records
+        if name in stores and not isinstance(stores[name], dict):
+            utils.delete_data(stores[name], collection_id=self.collection_id)
+
+        # Each referred frame range must carry one pose id
+        indexed = isinstance(store, OEConcatTrajStore) and \
+            all(part.source is not None and np.all(store.frames['pose_id'][start:stop] == pose_id)
+                for part, (pose_id, start, stop) in zip(store.stores, store.index))
+
+        if indexed:
+
+            stores[name] = {'stores': [{'file_id': part.source[0],
+                                        'start': part.source[1],
+                                        'stop': part.source[2],
+                                        'pose_id': pose_id} for part, pose_id in zip(store.stores, store.pose_ids)]}
+
+        elif in_orion():
+
+            with TemporaryDirectory() as output_directory:
+
+                store_fn = store.save(os.path.join(output_directory, MDFileNames.trajectory_store))
+
+                stores[name] = utils.upload_data(store_fn, collection_id=self.collection_id,
+                                                 shard_name=shard_name)
+        else:
+            # Locally the file name is used as file id and the store file
+            # must outlive the record working directory. The store is saved
+            # in the temporary directory rather than in the working directory
+            fd, store_fn = tempfile.mkstemp(prefix=name + '_', suffix='_' + MDFileNames.trajectory_store)
+            os.close(fd)
+
+            store.save(store_fn)
+
+            stores[name] = utils.upload_data(store_fn)
+
+        self.rec.set_value(Fields.traj_stores, stores)
+
+        return True
+
+    @property
+    def has_omm_system(self):
+        """
+        This method checks if the serialized OpenMM System is on the record
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        boolean : Bool
+            True if the serialized OpenMM System is on the record otherwise False
+        """
+
+        if self.rec.has_field(Fields.omm_system) and self.rec.has_field(Fields.omm_system_key):
+            return True
+        else:
+            return False
+
+    @property
+    def get_omm_system_key(self):
+        """
+        This method returns the content address of the serialized OpenMM System present on the record
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        key : String
+            The OpenMM System cache key
+        """
+
+        if not self.has_omm_system:
+            raise ValueError("The OpenMM System is not present on the record")
+
+        return self.rec.get_value(Fields.omm_system_key)
+
+    @property
+    def get_omm_system(self):
+        """
+        This method returns the serialized OpenMM System present on the record together
+        with its content address
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        key, data : String, bytes
+            The OpenMM System cache key and the gzip compressed System XML
+        """
+
+        if not self.has_omm_system:
+            raise ValueError("The OpenMM System is not present on the record")
+
+        key = self.rec.get_value(Fields.omm_system_key)
+        data = self.rec.get_value(Fields.omm_system)
+
+        if in_orion():
+
+            session = utils.get_orion_session()
+
+            if self.collection_id is None:
+                raise ValueError("The Collection ID is None")
+
+            with TemporaryDirectory() as output_directory:
+
+                system_fn = os.path.join(output_directory, "system.xml.gz")
+
+                utils.download_shard(data, self.collection_id, system_fn, session=session)
+
+                with open(system_fn, 'rb') as f:
+                    data = f.read()
+
+        return key, bytes(data)
+
+    def set_omm_system(self, key, data, shard_name=""):
+        """
+        This method sets the serialized OpenMM System on the record. Any
+        previously set System is replaced
+
+        Parameters
+        ----------
+        key: String
+            The OpenMM System cache key
+        data: bytes
+            The gzip compressed System XML
+        shard_name: String
+            In Orion tha shard will be named by using the shard_name
+
+        Returns
+        -------
+        boolean : Bool
+            True if the setting was successful
+        """
+
+        if not isinstance(key, str):
+            raise ValueError("The OpenMM System key must be a string: {}".format(key))
+
+        if not isinstance(data, (bytes, bytearray)):
+            raise ValueError("The OpenMM System data must be bytes: {}".format(type(data)))
+
+        if in_orion():
+
+            with TemporaryDirectory() as output_directory:
+
+                system_fn = os.path.join(output_directory, "system.xml.gz")
+
+                with open(system_fn, 'wb') as f:
+                    f.write(data)
+
+                if self.collection_id is None:
+                    raise ValueError("The Collection ID is None")
+
+                if self.rec.has_field(Fields.omm_system):
+                    fid = self.rec.get_value(Fields.omm_system)
+                    utils.delete_data(fid, collection_id=self.collection_id)
+
+                session = utils.get_orion_session()
+
+                collection = session.get_resource(ShardCollection, self.collection_id)
+
+                shard = try_hard_to_create_shard(collection, system_fn, name=shard_name)
+
+                shard.close()
+
+                self.rec.set_value(Fields.omm_system, shard.id)
+        else:
+            self.rec.set_value(Fields.omm_system, bytes(data))
+
+        self.rec.set_value(Fields.omm_system_key, key)
+
+        return True
+
     def __getattr__(self, name):
         try:
             return getattr(self.rec, name)
@@ -0,0 +1,195 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import os
+
+import shutil
+
+import tempfile
+
+from openeye import oechem
+
+from datarecord import (read_records,
+                        OEWriteRecord)
+
+
+class RecordSpillStore(object):
+    """
+    This class implements a local on-disk record store used by the aggregation
+    cubes to spill the incoming records instead of keeping them in memory. The
+    records are grouped by key and each record is written in its own binary
+    record file so that a group can be read back and released as soon as it
+    is complete
+    """
+
+    def __init__(self, directory=None):
+        """
+        The Initialization function used to create the store
+
+        Parameters
+        ----------
+        directory: String or None
+            The directory where the store directory is created. If None the
+            system temporary directory is used
+        """
+        self.directory = tempfile.mkdtemp(prefix='record_store_', dir=directory)
+
+        # Number of records spilled for each key
+        self._counts = dict()
+
+        # Total number of spilled records used to name the record files
+        self._total = 0
+
+    def __contains__(self, key):
+        return key in self._counts
+
+    def __len__(self):
+        return sum(self._counts.values())
+
+    def keys(self):
+        """
+        This method returns the keys of the spilled record groups in insertion order
+
+        Returns
+        -------
+        keys: python list
+            The group keys
+        """
+        return list(self._counts.keys())
+
+    def count(self, key):
+        """
+        This method returns the number of records spilled for the selected key
+
+        Parameters
+        ----------
+        key: Int or String
+            The group key
+
+        Returns
+        -------
+        count: Int
+            The number of spilled records
+        """
+        return self._counts.get(key, 0)
+
+    def _key_directory(self, key):
+        return os.path.join(self.directory, str(key))
+
+    def append(self, key, record):
+        """
+        This method spills the passed record in the selected group
+
+        Parameters
+        ----------
+        key: Int or String
+            The group key
+        record: OERecord
+            The record to spill
+
+        Returns
+        -------
+        count: Int
+            The number of records spilled for the key
+        """
+
+        key_dir = self._key_directory(key)
+
+        if key not in self._counts:
+            os.makedirs(key_dir, exist_ok=True)
+            self._counts[key] = 0
+
+        # The file names keep the arrival order of the records
+        fn = os.path.join(key_dir, '{:010d}.oedb'.format(self._total))
+
+        ofs = oechem.oeofstream(fn)
+        OEWriteRecord(ofs, record, fmt='binary')
+        ofs.close()
+
+        self._counts[key] += 1
+        self._total += 1
+
+        return self._counts[key]
+
+    def iter_records(self, key):
+        """
+        This method reads back one by one the records spilled for the selected key
+        in their arrival order
+
+        Parameters
+        ----------
+        key: Int or String
+            The group key
+
+        Returns
+        -------
+        records: generator
+            The spilled records
+        """
+
+        key_dir = self._key_directory(key)
+
+        for fn in sorted(os.listdir(key_dir)):
+            ifs = oechem.oeifstream(os.path.join(key_dir, fn))
+            for record in read_records(ifs):
+                yield record
+            ifs.close()
+
+    def pop(self, key):
+        """
+        This method reads back the records spilled for the selected key and
+        removes them from the store
+
+        Parameters
+        ----------
+        key: Int or String
+            The group key
+
+        Returns
+        -------
+        records: python list
+            The spilled records in their arrival order
+        """
+
+        if key not in self._counts:
+            raise ValueError("The record group is not present in the store: {}".format(key))
+
+        records = list(self.iter_records(key))
+
+        self.discard(key)
+
+        return records
+
+    def discard(self, key):
+        """
+        This method removes the records spilled for the selected key
+
+        Parameters
+        ----------
+        key: Int or String
+            The group key
+        """
+
+        shutil.rmtree(self._key_directory(key), ignore_errors=True)
+        self._counts.pop(key, None)
+
+    def close(self):
+        """
+        This method removes the store directory and all the spilled records
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self._counts = dict()
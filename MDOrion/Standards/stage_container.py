@@ -0,0 +1,258 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import os
+
+import io
+
+import struct
+
+import shutil
+
+import zipfile
+
+import numpy as np
+
+from MDOrion.MDEngines.utils import MDState
+
+
+# Size of the fixed part of the zip local file header
+_local_header_size = 30
+
+
+def is_stage_container(filename):
+    """
+    This function returns True if the passed file is a stage container
+    otherwise False e.g. for the legacy tar archives
+
+    Parameters
+    ----------
+    filename: String
+        The file name
+
+    Returns
+    -------
+    boolean: Bool
+        True if the file is a stage container
+    """
+    return zipfile.is_zipfile(filename)
+
+
+def write_stage_container(filename, members):
+    """
+    This function writes a stage container. The container is a zip archive
+    whose central directory is the member index. The members are compressed
+    individually so that each one can be read without decompressing the
+    others, and the stored (uncompressed) members can be memory mapped
+
+    Parameters
+    ----------
+    filename: String
+        The container file name
+    members: python list
+        The list of (file name, compress) tuples. The members are named by the
+        file base names. The already compressed files and the files to be
+        memory mapped must not be compressed
+
+    Returns
+    -------
+    filename: String
+        The container file name
+    """
+
+    with zipfile.ZipFile(filename, mode='w', allowZip64=True) as zf:
+        for fn, compress in members:
+            zf.write(fn,
+                     arcname=os.path.basename(fn),
+                     compress_type=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+
+    return filename
+
+
+class StageContainer(object):
+    """
+    This class implements the random access reader of the stage containers.
+    The members are read, extracted or memory mapped one by one without
+    extracting the whole container
+    """
+
+    def __init__(self, filename):
+        """
+        The Initialization function used to open the container
+
+        Parameters
+        ----------
+        filename: String
+            The container file name
+        """
+        self.filename = filename
+        self._zip = zipfile.ZipFile(filename, mode='r')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.names()
+
+    def close(self):
+        self._zip.close()
+
+    def names(self):
+        """
+        This method returns the container member names
+
+        Returns
+        -------
+        names: python list
+            The member names
+        """
+        return self._zip.namelist()
+
+    def read(self, name):
+        """
+        This method returns the content of the selected member
+
+        Parameters
+        ----------
+        name: String
+            The member name
+
+        Returns
+        -------
+        data: bytes
+            The member content
+        """
+        return self._zip.read(name)
+
+    def extract(self, name, directory):
+        """
+        This method extracts only the selected member in the passed directory
+
+        Parameters
+        ----------
+        name: String
+            The member name
+        directory: String
+            The destination directory
+
+        Returns
+        -------
+        filename: String
+            The extracted file name
+        """
+
+        fn = os.path.join(directory, os.path.basename(name))
+
+        with self._zip.open(name) as fr, open(fn, 'wb') as fw:
+            shutil.copyfileobj(fr, fw, 1 << 20)
+
+        return fn
+
+    def offset(self, name):
+        """
+        This method returns the byte offset of the selected member data in the
+        container file. Only the stored members can be accessed by offset
+
+        Parameters
+        ----------
+        name: String
+            The member name
+
+        Returns
+        -------
+        offset: Int
+            The member data offset
+        """
+
+        info = self._zip.getinfo(name)
+
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise ValueError("The container member is compressed and cannot be accessed by offset: {}".format(name))
+
+        # The local header length differs from the central directory one
+        with open(self.filename, 'rb') as f:
+            f.seek(info.header_offset)
+            header = f.read(_local_header_size)
+
+        name_len, extra_len = struct.unpack('<HH', header[26:30])
+
+        return info.header_offset + _local_header_size + name_len + extra_len
+
+    def load_state(self, name):
+        """
+        This method loads the MD State selected by its member name. The stored
+        states are memory mapped directly from the container file
+
+        Parameters
+        ----------
+        name: String
+            The member name
+
+        Returns
+        -------
+        state: MDState
+            The MD State
+        """
+
+        if self._zip.getinfo(name).compress_type == zipfile.ZIP_STORED:
+            return MDState.load(self.filename, offset=self.offset(name))
+
+        return MDState.from_bytes(self.read(name))
+
+    def load_array(self, name, mmap=True):
+        """
+        This method loads the numpy array selected by its member name. The
+        stored arrays can be memory mapped directly from the container file
+
+        Parameters
+        ----------
+        name: String
+            The member name
+        mmap: Bool
+            If True the stored array is memory mapped read-only
+
+        Returns
+        -------
+        array: numpy array
+            The numpy array
+        """
+
+        if not mmap or self._zip.getinfo(name).compress_type != zipfile.ZIP_STORED:
+            return np.load(io.BytesIO(self.read(name)))
+
+        offset = self.offset(name)
+
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            version = np.lib.format.read_magic(f)
+
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            data_offset = f.tell()
+
+        # The empty arrays cannot be memory mapped
+        if not np.prod(shape):
+            return np.empty(shape, dtype=dtype)
+
+        return np.memmap(self.filename, dtype=dtype, mode='r', shape=shape,
+                         order='F' if fortran_order else 'C', offset=data_offset)
@@ -61,9 +61,22 @@ class MDEngines:
 class MDFileNames:
     topology = 'topology.oeb'
     state = 'state.pickle'
+    # MD State binary format
+    state_binary = 'state.mdstate'
+    # MD State stored as delta from the state of a reference stage
+    state_delta = 'state.mddelta'
     trajectory = "trajectory.tar.gz"
+    # Infix of the atom subset trajectory stream files
+    trajectory_stream = "_stream_"
+    # Manifest of the chunked trajectories
+    trajectory_manifest = "trajectory_manifest.json"
     trajectory_conformers = "trajectory_confs.oeb"
+    # Memory mappable array trajectory stores
+    trajectory_store = "trajectory.mdtraj"
     mddata = "data.tar.gz"
+    # Seekable stage data and trajectory containers
+    stage_container = "data.mdstage"
+    trajectory_container = "traj.mdstage"
 
 
 # Orion Hidden meta data options
@@ -90,6 +103,9 @@ class Fields:
     # The ConfID field is used to identify a particular conformer
     confid = OEField("ConfID_OPLMD", Types.Int, meta=_metaIDHidden)
 
+    # The number of conformers of the ligand a conformer record belongs to
+    num_confs = OEField("NumConfs_OPLMD", Types.Int, meta=_metaHidden)
+
     # The Ligand field should be used to save in a record a ligand as an OEMolecule
     ligand = OEField("Ligand_OPLMD", Types.Chem.Mol, meta=OEFieldMeta(options=[Meta.Hints.Chem.Ligand,
                                                                                Meta.Display.Hidden]))
@@ -115,11 +131,36 @@ class Fields:
         trajectory = OEField("Trajectory_OPLMD", Types.Int, meta=_metaHidden)
         mddata = OEField("MDData_OPLMD", Types.Int, meta=_metaHidden)
         protein_traj_confs = OEField("ProtTraj_OPLMD", Types.Int, meta=_metaHidden)
+        omm_system = OEField("OMMSystem_OPLMD", Types.Int, meta=_metaHidden)
     else:
         pmd_structure = OEField('Structure_Parmed_OPLMD', ParmedData, meta=_metaHidden)
         trajectory = OEField("Trajectory_OPLMD", Types.String, meta=_metaHidden)
         mddata = OEField("MDData_OPLMD", Types.String, meta=_metaHidden)
         protein_traj_confs = OEField("ProtTraj_OPLMD", Types.Chem.Mol, meta=_metaHidden)
+        omm_system = OEField("OMMSystem_OPLMD", Types.Blob, meta=_metaHidden)
+
+    # The content address of the serialized OpenMM System carried by the record
+    omm_system_key = OEField("OMMSystem_Key_OPLMD", Types.String, meta=_metaHidden)
+
+    # The state of the OpenMM production continuation cycles: cycle counter, current
+    # and total steps, checkpoint file and trajectory segment files
+    md_cycle = OEField("MDCycle_OPLMD", Types.JSONObject, meta=_metaHidden)
+
+    # The trajectory format of the stage. If missing the trajectory is a tar archive
+    trajectory_format = OEField("Trajectory_format_OPLMD", Types.String, meta=_metaHidden)
+
+    # The array trajectory stores e.g. the protein and water analysis trajectories:
+    # store names mapped to their file ids
+    traj_stores = OEField("TrajStores_OPLMD", Types.JSONObject, meta=_metaHidden)
+
+    # The stage topologies stored once per flask: content addresses mapped to their file ids
+    md_topologies = OEField("MDTopologies_OPLMD", Types.JSONObject, meta=_metaHidden)
+
+    # The content address of the stage topology. If missing the topology is in the stage data
+    topology_hash = OEField("Topology_hash_OPLMD", Types.String, meta=_metaHidden)
+
+    # The name of the stage whose state is the reference of the stage state delta
+    state_reference = OEField("State_reference_OPLMD", Types.String, meta=_metaHidden)
 
     # The Stage Name
     stage_name = OEField('Stage_name_OPLMD', Types.String)
@@ -176,6 +217,9 @@ class Fields:
         # The TrajIntEDict Field is for the POD Dictionary containing Traj interaction energies
         oeintE_dict = OEField("TrajIntEDict", Types.JSONObject, meta=_metaHidden)
 
+        # The TrajIntEResidues Field is for the per frame protein residue-ligand interaction energies
+        oeintE_residues = OEField("TrajIntEResidues", Types.Blob, meta=_metaHidden)
+
         # The TrajPBSA Field is for the record containing Traj PBSA energies
         oepbsa_rec = OEField("TrajPBSA", Types.Record, meta=_metaHidden)
 
@@ -188,6 +232,9 @@ class Fields:
         # The TrajClusDict Field is for the POD Dictionary containing Traj ligand clustering results
         oeclus_dict = OEField("TrajClusDict", Types.JSONObject, meta=_metaHidden)
 
+        # The TrajClusDistances Field is for the cached ligand symmetry maps and torsion features
+        oeclus_distances = OEField("TrajClusDistances", Types.Blob, meta=_metaHidden)
+
         # The ClusPopDict Field is for the POD Dictionary containing conf/cluster population results
         cluspop_dict = OEField("ClusPopDict", Types.JSONObject, meta=_metaHidden)
 
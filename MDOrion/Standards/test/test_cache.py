@@ -0,0 +1,99 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import os
+
+import pytest
+
+from tempfile import TemporaryDirectory
+
+from MDOrion.Standards.cache import LRUDiskCache
+
+
+class LRUDiskCacheTests(unittest.TestCase):
+    """
+    Testing the local disk cache
+    """
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.cache = LRUDiskCache('test', cache_dir=self.tmp_dir.name, max_size_mb=1)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get('missing'))
+
+        self.cache.put('key', data=b'data')
+        self.assertTrue('key' in self.cache)
+        self.assertEqual(self.cache.get_bytes('key'), b'data')
+
+        fn = os.path.join(self.tmp_dir.name, 'file.txt')
+        with open(fn, 'wb') as f:
+            f.write(b'file')
+
+        self.cache.put(1234, filename=fn)
+        self.assertEqual(self.cache.get_bytes(1234), b'file')
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_lru_eviction(self):
+        block = b'x' * 400 * 1024
+
+        self.cache.put('first', data=block)
+        self.cache.put('second', data=block)
+
+        # Mark the first entry as recently used
+        os.utime(self.cache.path('second'), (0, 0))
+        self.cache.get('first')
+
+        self.cache.put('third', data=block)
+
+        self.assertTrue('first' in self.cache)
+        self.assertFalse('second' in self.cache)
+        self.assertTrue('third' in self.cache)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_fetch(self):
+        calls = []
+
+        def download(fn):
+            calls.append(fn)
+            with open(fn, 'wb') as f:
+                f.write(b'shard')
+
+        fn1 = os.path.join(self.tmp_dir.name, 'shard_1.dat')
+        fn2 = os.path.join(self.tmp_dir.name, 'shard_2.dat')
+
+        self.cache.fetch('shard:1:2', fn1, download)
+        self.cache.fetch('shard:1:2', fn2, download)
+
+        # The second fetch must be served by the cache
+        self.assertEqual(calls, [fn1])
+
+        with open(fn2, 'rb') as f:
+            self.assertEqual(f.read(), b'shard')
+
+        # Lock files are not accounted as cache entries
+        self.cache.clear()
+        self.assertFalse('shard:1:2' in self.cache)
+        self.assertTrue(os.path.isdir(self.cache.lock_directory))
@@ -0,0 +1,78 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import os
+
+import pytest
+
+import numpy as np
+
+from tempfile import TemporaryDirectory
+
+from MDOrion.Standards.chunked_traj import (ChunkedTrajectoryWriter,
+                                            load_manifest,
+                                            read_chunk)
+
+
+class ChunkedTrajectoryTests(unittest.TestCase):
+    """
+    Testing the chunked trajectory format
+    """
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_write_read(self):
+        rng = np.random.RandomState(0)
+        xyz = rng.uniform(0.0, 5.0, size=(25, 10, 3)).astype(np.float32)
+        box = np.tile(np.eye(3, dtype=np.float32) * 5.0, (25, 1, 1))
+
+        uploaded = []
+
+        def upload(filename):
+            uploaded.append(filename)
+            return filename
+
+        writer = ChunkedTrajectoryWriter(os.path.join(self.tmp_dir.name, 'chunks'),
+                                         chunk_frames=10, upload=upload, remove_uploaded=False)
+
+        for idx in range(len(xyz)):
+            writer.append(xyz[idx], idx * 4.0, box[idx])
+
+        manifest_fn = writer.write_manifest(os.path.join(self.tmp_dir.name, 'trajectory_manifest.json'))
+
+        manifest = load_manifest(manifest_fn)
+
+        self.assertEqual(manifest['n_frames'], 25)
+        self.assertEqual([chunk['n_frames'] for chunk in manifest['chunks']], [10, 10, 5])
+        self.assertEqual(len(uploaded), 3)
+
+        chunks = [read_chunk(chunk['file_id']) for chunk in manifest['chunks']]
+
+        new_xyz = np.concatenate([chunk[0] for chunk in chunks])
+        new_time = np.concatenate([chunk[1] for chunk in chunks])
+
+        # The quantization error is at most half of the precision step
+        self.assertTrue(np.max(np.abs(new_xyz - xyz)) <= 0.0005 + 1e-6)
+        self.assertTrue(np.allclose(new_time, np.arange(25) * 4.0))
+        self.assertTrue(np.allclose(chunks[0][2], box[:10]))
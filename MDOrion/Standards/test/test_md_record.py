@@ -16,17 +16,27 @@ from MDOrion.Standards import (Fields,
 
 import pytest
 
+from unittest import mock
+
 from tempfile import TemporaryDirectory
 
 import tarfile
 
+import zipfile
+
 import pickle
 
+import numpy as np
+
 
 from MDOrion.Standards.mdrecord import MDDataRecord
 
+from MDOrion.MDEngines.utils import MDState
+
 from datarecord import read_records
 
+import parmed
+
 PACKAGE_DIR = os.path.dirname(os.path.dirname(MDOrion.__file__))
 FILE_DIR = os.path.join(PACKAGE_DIR, "tests", "data")
 
@@ -211,9 +221,29 @@ class MDRecordTests(unittest.TestCase):
             with open(state_fn, 'rb') as f:
                 md_state = pickle.load(f)
 
-        self.assertEqual(md_state.get_positions(), self.mdrecord.get_stage_state().get_positions())
-        self.assertEqual(md_state.get_velocities(), self.mdrecord.get_stage_state().get_velocities())
-        self.assertEqual(md_state.get_box_vectors(), self.mdrecord.get_stage_state().get_box_vectors())
+        stage_state = self.mdrecord.get_stage_state()
+
+        self.assertTrue(np.array_equal(md_state.get_positions_array(), stage_state.get_positions_array()))
+        self.assertTrue(np.array_equal(md_state.get_velocities_array(), stage_state.get_velocities_array()))
+        self.assertTrue(np.array_equal(md_state.get_box_vectors_array(), stage_state.get_box_vectors_array()))
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_stage_state_binary(self):
+
+        state = self.mdrecord.get_stage_state()
+
+        new_state = MDState.from_bytes(state.to_bytes())
+
+        self.assertTrue(np.array_equal(state.get_positions_array(), new_state.get_positions_array()))
+        self.assertTrue(np.array_equal(state.get_velocities_array(), new_state.get_velocities_array()))
+        self.assertTrue(np.array_equal(state.get_box_vectors_array(), new_state.get_box_vectors_array()))
+
+        with TemporaryDirectory() as out_directory:
+            state_fn = state.save(os.path.join(out_directory, MDFileNames.state_binary))
+            mm_state = MDState.load(state_fn)
+            self.assertTrue(np.array_equal(state.get_positions_array(), mm_state.get_positions_array()))
+            self.assertEqual(len(mm_state.get_oe_positions()), 3 * len(state.get_positions_array()))
 
     @pytest.mark.travis
     @pytest.mark.local
@@ -280,6 +310,50 @@ class MDRecordTests(unittest.TestCase):
         self.assertEqual(new_last_stage.get_value(Fields.stage_name), 'Testing')
         self.assertEqual(new_last_stage.get_value(Fields.stage_type), MDStageTypes.FEC)
 
+        # The state member is deflated and read back exactly
+        with zipfile.ZipFile("test.tar.gz") as zf:
+            self.assertEqual(zf.getinfo(MDFileNames.state_binary).compress_type, zipfile.ZIP_DEFLATED)
+
+        new_state = new_mdrecord.get_stage_state(stg_name='Testing')
+        self.assertTrue(np.array_equal(md_state.get_positions_array(), new_state.get_positions_array()))
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_add_new_stage_shared_topology(self):
+        new_record = OERecord(self.record)
+        new_mdrecord = MDDataRecord(new_record)
+
+        topology = self.mdrecord.get_stage_topology()
+        md_state = self.mdrecord.get_stage_state()
+
+        self.assertTrue(new_mdrecord.add_new_stage("Testing",
+                                                   MDStageTypes.FEC,
+                                                   topology,
+                                                   md_state,
+                                                   "test_shared.tar.gz"))
+
+        self.assertTrue(new_mdrecord.add_new_stage("Testing Delta",
+                                                   MDStageTypes.FEC,
+                                                   topology,
+                                                   md_state,
+                                                   "test_delta.tar.gz",
+                                                   state_delta=True))
+
+        # The topology is stored once
+        self.assertEqual(len(new_mdrecord.get_value(Fields.md_topologies)), 1)
+
+        delta_stage = new_mdrecord.get_stage_by_name(stg_name='Testing Delta')
+        self.assertEqual(delta_stage.get_value(Fields.state_reference), 'Testing')
+
+        new_state = new_mdrecord.get_stage_state(stg_name='Testing Delta')
+
+        self.assertTrue(np.array_equal(md_state.get_positions_array(), new_state.get_positions_array()))
+        self.assertTrue(np.array_equal(md_state.get_velocities_array(), new_state.get_velocities_array()))
+        self.assertTrue(np.array_equal(md_state.get_box_vectors_array(), new_state.get_box_vectors_array()))
+
+        new_topology = new_mdrecord.get_stage_topology(stg_name='Testing Delta')
+        self.assertEqual(new_topology.NumAtoms(), topology.NumAtoms())
+
     @pytest.mark.travis
     @pytest.mark.local
     def test_get_stages(self):
@@ -365,3 +439,80 @@ class MDRecordTests(unittest.TestCase):
             mdrecord.get_protein_traj
 
         self.assertTrue(mdrecord.set_protein_traj(prot_mol))
+
+
+class _OrionRecord(object):
+    """
+    In Orion the record fields carry the shard ids of the stored data
+    """
+    def __init__(self, values):
+        self.values = values
+
+    def has_field(self, field):
+        return field.get_name() in self.values
+
+    def get_value(self, field):
+        return self.values[field.get_name()]
+
+
+class MDRecordOrionTests(unittest.TestCase):
+    """
+    Testing the MD Record API in Orion with the shard downloads mocked
+    """
+    def setUp(self):
+        structure = parmed.Structure()
+        structure.add_atom(parmed.Atom(name='C', type='CT', charge=0.1), 'LIG', 1)
+
+        protein = oechem.OEMol()
+        oechem.OESmilesToMol(protein, 'CCO')
+
+        self.shards = {1: pickle.dumps(structure.__getstate__()),
+                       2: oechem.OEWriteMolToBytes('.oeb', protein),
+                       3: b'system'}
+
+        self.record = _OrionRecord({Fields.collection.get_name(): 10,
+                                    Fields.pmd_structure.get_name(): 1,
+                                    Fields.protein_traj_confs.get_name(): 2,
+                                    Fields.omm_system.get_name(): 3,
+                                    Fields.omm_system_key.get_name(): 'key'})
+
+        patches = [mock.patch('MDOrion.Standards.mdrecord.in_orion', return_value=True),
+                   mock.patch('MDOrion.Standards.utils.get_orion_session'),
+                   mock.patch('MDOrion.Standards.utils.download_shard', side_effect=self._download_shard)]
+
+        self.download = [patch.start() for patch in patches][-1]
+
+        for patch in patches:
+            self.addCleanup(patch.stop)
+
+    def _download_shard(self, shard_id, collection_id, filename, session=None):
+        self.assertEqual(collection_id, 10)
+
+        with open(filename, 'wb') as f:
+            f.write(self.shards[shard_id])
+
+        return filename
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_get_parmed(self):
+        pmd = MDDataRecord(self.record).get_parmed()
+
+        self.assertEqual(len(pmd.atoms), 1)
+        self.assertEqual(pmd.atoms[0].residue.name, 'LIG')
+        self.assertEqual(self.download.call_count, 1)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_get_protein_traj(self):
+        protein = MDDataRecord(self.record).get_protein_traj
+
+        self.assertEqual(protein.NumAtoms(), 3)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_get_omm_system(self):
+        key, data = MDDataRecord(self.record).get_omm_system
+
+        self.assertEqual(key, 'key')
+        self.assertEqual(data, b'system')
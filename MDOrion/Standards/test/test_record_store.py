@@ -0,0 +1,59 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import os
+
+import pytest
+
+from datarecord import (OERecord,
+                        OEField,
+                        Types)
+
+from MDOrion.Standards.record_store import RecordSpillStore
+
+
+class RecordSpillStoreTests(unittest.TestCase):
+    """
+    Testing the on-disk record store
+    """
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_spill_and_pop(self):
+        field = OEField("Value", Types.Int)
+
+        store = RecordSpillStore()
+
+        for key, value in [(1, 10), (2, 20), (1, 11), (2, 21), (1, 12)]:
+            record = OERecord()
+            record.set_value(field, value)
+            store.append(key, record)
+
+        self.assertEqual(len(store), 5)
+        self.assertEqual(store.keys(), [1, 2])
+        self.assertEqual(store.count(1), 3)
+
+        records = store.pop(1)
+        self.assertEqual([rec.get_value(field) for rec in records], [10, 11, 12])
+        self.assertNotIn(1, store)
+        self.assertEqual(store.count(1), 0)
+
+        self.assertEqual([rec.get_value(field) for rec in store.iter_records(2)], [20, 21])
+
+        store.close()
+        self.assertFalse(os.path.isdir(store.directory))
@@ -0,0 +1,81 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import os
+
+import pytest
+
+import numpy as np
+
+from tempfile import TemporaryDirectory
+
+from MDOrion.MDEngines.utils import MDState
+
+from MDOrion.Standards.stage_container import (StageContainer,
+                                               is_stage_container,
+                                               write_stage_container)
+
+
+class StageContainerTests(unittest.TestCase):
+    """
+    Testing the seekable stage container
+    """
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_container_members(self):
+        positions = np.random.rand(100, 3)
+        velocities = np.random.rand(100, 3)
+        box = np.eye(3) * 5.0
+
+        state = MDState.from_arrays(positions, velocities, box)
+
+        with TemporaryDirectory() as output_directory:
+
+            state_fn = state.save(os.path.join(output_directory, 'state.mdstate'))
+
+            text_fn = os.path.join(output_directory, 'info.txt')
+            with open(text_fn, 'w') as f:
+                f.write('stage info ' * 100)
+
+            container_fn = write_stage_container(os.path.join(output_directory, 'data.mdstage'),
+                                                 [(state_fn, False), (text_fn, True)])
+
+            self.assertTrue(is_stage_container(container_fn))
+            self.assertFalse(is_stage_container(text_fn))
+
+            with StageContainer(container_fn) as container:
+
+                self.assertEqual(sorted(container.names()), ['info.txt', 'state.mdstate'])
+                self.assertEqual(container.read('info.txt'), b'stage info ' * 100)
+
+                # The compressed members cannot be memory mapped
+                with self.assertRaises(ValueError):
+                    container.offset('info.txt')
+
+                new_state = container.load_state('state.mdstate')
+
+                extract_dir = os.path.join(output_directory, 'extract')
+                os.mkdir(extract_dir)
+                fn = container.extract('info.txt', extract_dir)
+                self.assertEqual(os.listdir(extract_dir), ['info.txt'])
+                self.assertTrue(os.path.isfile(fn))
+
+            self.assertTrue(np.array_equal(positions, new_state.get_positions_array()))
+            self.assertTrue(np.array_equal(velocities, new_state.get_velocities_array()))
+            self.assertTrue(np.array_equal(box, new_state.get_box_vectors_array()))
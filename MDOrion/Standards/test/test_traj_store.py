@@ -0,0 +1,142 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import os
+
+import pytest
+
+import numpy as np
+
+from tempfile import TemporaryDirectory
+
+from openeye import oechem
+
+from MDOrion.Standards.traj_store import (OETrajStore,
+                                          OEConcatTrajStore)
+
+
+class TrajStoreTests(unittest.TestCase):
+    """
+    Testing the array trajectory store
+    """
+    def setUp(self):
+        self.mol = oechem.OEMol()
+        oechem.OESmilesToMol(self.mol, "CCOCC")
+
+        self.xyz = np.random.rand(10, self.mol.NumAtoms(), 3).astype(np.float32)
+
+        self.mol.DeleteConfs()
+        for frame in self.xyz:
+            self.mol.NewConf(oechem.OEFloatArray(frame.ravel()))
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_save_load(self):
+        store = OETrajStore.from_oemol(self.mol, pose_id=3, time=np.arange(10) * 2.0)
+
+        self.assertEqual(store.n_frames, 10)
+        self.assertEqual(store.n_atoms, self.mol.NumAtoms())
+        self.assertTrue(np.array_equal(store.xyz, self.xyz))
+
+        with TemporaryDirectory() as output_directory:
+
+            store_fn = store.save(os.path.join(output_directory, 'trajectory.mdtraj'))
+
+            new_store = OETrajStore.load(store_fn)
+
+            self.assertIsInstance(new_store.xyz, np.memmap)
+            self.assertTrue(np.array_equal(new_store.xyz, self.xyz))
+            self.assertTrue(np.array_equal(new_store.frames['pose_id'], [3] * 10))
+            self.assertTrue(np.array_equal(new_store.frames['time'], np.arange(10) * 2.0))
+            self.assertEqual(new_store.topology.NumAtoms(), self.mol.NumAtoms())
+
+            del new_store
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_slices(self):
+        store = OETrajStore.from_oemol(self.mol)
+
+        # The frame slices and contiguous atom subsets share the coordinates
+        frames = store[2:6]
+        self.assertEqual(frames.n_frames, 4)
+        self.assertTrue(np.shares_memory(frames.xyz, store.xyz))
+
+        atoms = frames.subset([1, 2, 3])
+        self.assertEqual(atoms.n_atoms, 3)
+        self.assertEqual(atoms.topology.NumAtoms(), 3)
+        self.assertTrue(np.shares_memory(atoms.xyz, store.xyz))
+        self.assertTrue(np.array_equal(atoms.xyz, self.xyz[2:6, 1:4]))
+
+        sparse = store.subset([0, 4])
+        self.assertTrue(np.array_equal(sparse.coords(5), self.xyz[5, [0, 4]]))
+
+        mol = atoms.to_oemol()
+        self.assertEqual(mol.NumConfs(), 4)
+
+        coords = oechem.OEFloatArray(3 * mol.GetMaxAtomIdx())
+        for conf, frame in zip(mol.GetConfs(), self.xyz[2:6, 1:4]):
+            conf.GetCoords(coords)
+            self.assertTrue(np.allclose(np.array(coords).reshape(-1, 3), frame))
+
+        cluster = store.take(np.arange(10) % 2 == 0)
+        self.assertTrue(np.array_equal(cluster.xyz, self.xyz[::2]))
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_concatenate(self):
+        store = OETrajStore.from_oemol(self.mol, pose_id=1)
+        other = OETrajStore.from_oemol(self.mol, pose_id=2)
+
+        frames = OETrajStore.concatenate_frames([store, other])
+        self.assertEqual(frames.n_frames, 20)
+        self.assertTrue(np.array_equal(frames.frames['pose_id'], [1] * 10 + [2] * 10))
+
+        atoms = OETrajStore.concatenate_atoms([store, other])
+        self.assertEqual(atoms.n_atoms, 2 * self.mol.NumAtoms())
+        self.assertEqual(atoms.topology.NumAtoms(), 2 * self.mol.NumAtoms())
+        self.assertTrue(np.array_equal(atoms.xyz, np.concatenate((self.xyz, self.xyz), axis=1)))
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_virtual_concatenation(self):
+        store = OETrajStore.from_oemol(self.mol)
+        other = OETrajStore.from_oemol(self.mol)[4:8]
+
+        concat = OEConcatTrajStore([store, other], [5, 7])
+
+        self.assertEqual(concat.n_frames, 14)
+        self.assertEqual(concat.index, [(5, 0, 10), (7, 10, 14)])
+        self.assertTrue(np.array_equal(concat.frames['pose_id'], [5] * 10 + [7] * 4))
+        self.assertTrue(np.array_equal(concat.xyz, np.concatenate((self.xyz, self.xyz[4:8]))))
+        self.assertTrue(np.array_equal(concat.coords(12), self.xyz[6]))
+
+        # The slices refer to the same stores
+        view = concat[8:12]
+        self.assertEqual(view.index, [(5, 0, 2), (7, 2, 4)])
+        self.assertTrue(np.shares_memory(view.stores[0].xyz, store.xyz))
+
+        # The nested concatenations are flattened
+        nested = OEConcatTrajStore([concat, store])
+        self.assertEqual(len(nested.stores), 3)
+        self.assertEqual(nested.index[1], (7, 10, 14))
+
+        selection = concat.take([1, 11, 13])
+        self.assertTrue(np.array_equal(selection.xyz, self.xyz[[1, 5, 7]]))
+        self.assertEqual(concat.to_oemol().NumConfs(), 14)
@@ -0,0 +1,95 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import os
+
+import pytest
+
+import threading
+
+import time
+
+from tempfile import TemporaryDirectory
+
+from MDOrion.Standards.transfer import TransferManager
+
+
+class TransferManagerTests(unittest.TestCase):
+    """
+    Testing the transfer manager
+    """
+    def setUp(self):
+        self.manager = TransferManager(max_workers=4)
+        self.tmp_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.manager.shutdown()
+        self.tmp_dir.cleanup()
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_background_and_prefetch(self):
+        fn = os.path.join(self.tmp_dir.name, 'data.bin')
+
+        started = threading.Event()
+
+        def download():
+            started.wait()
+            with open(fn, 'wb') as f:
+                f.write(b'data')
+            return fn
+
+        future = self.manager.prefetch('data', download)
+
+        # The same key is not prefetched again while its transfer is running
+        self.assertIs(self.manager.prefetch('data', download), future)
+
+        started.set()
+        self.assertEqual(future.result(), fn)
+
+        # The completed prefetch is forgotten
+        for i in range(100):
+            if not self.manager._prefetched:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(self.manager._prefetched, {})
+        self.assertIsNot(self.manager.prefetch('data', download), future)
+        self.manager.wait()
+
+        results = self.manager.map(lambda x, y: x + y, [1, 2, 3], [10, 20, 30])
+        self.assertEqual(results, [11, 22, 33])
+
+        self.manager.submit(os.remove, fn)
+        self.manager.wait()
+        self.assertFalse(os.path.isfile(fn))
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_wait_raises(self):
+        def fail():
+            raise IOError("transfer failure")
+
+        self.manager.submit(fail)
+
+        with self.assertRaises(IOError):
+            self.manager.wait()
+
+        with self.assertRaises(ValueError):
+            TransferManager(max_workers=0)
@@ -0,0 +1,535 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import os
+
+import numpy as np
+
+from tempfile import TemporaryDirectory
+
+from openeye import oechem
+
+from MDOrion.Standards.stage_container import (StageContainer,
+                                               write_stage_container)
+
+
+# Trajectory store member names
+_topology_name = 'topology.oeb'
+_coordinates_name = 'coordinates.npy'
+_frames_name = 'frames.npy'
+
+# Frame metadata table: the pose id of the frame and the frame time in ps
+frame_dtype = np.dtype([('pose_id', np.int32), ('time', np.float64)])
+
+
+class OETrajStore(object):
+    """
+    This class implements the array trajectory store: one topology OEMol and
+    a float32 (n_frames, n_atoms, 3) coordinate array in A together with the
+    frame metadata table. The coordinates are memory mapped from the store
+    file and the frame and atom slices are views on the same data. The
+    multi conformer OEMols are generated only on request
+    """
+
+    def __init__(self, topology, xyz, frames=None, atom_indices=None):
+        """
+        The Initialization function used to create the trajectory store
+
+        Parameters
+        ----------
+        topology: OEMol
+            The topology of the stored atoms
+        xyz: numpy array
+            The (n_frames, n_atoms, 3) coordinates in A
+        frames: numpy array or None
+            The frame metadata table with the frame_dtype data type. If None the
+            pose ids and times are set to zero
+        atom_indices: numpy array, slice or None
+            The atoms of the coordinate array the store refers to. It is used by
+            the atom subsets to avoid copying the coordinates
+        """
+
+        self.topology = topology
+
+        # The float32 arrays and memory maps are not copied
+        self._xyz = np.asarray(xyz, dtype=np.float32)
+        self._atom_indices = atom_indices
+
+        if frames is None:
+            frames = np.zeros(len(self._xyz), dtype=frame_dtype)
+
+        self.frames = frames
+
+        # The (file id, start frame, stop frame) of the stored data the store
+        # refers to. It is set on the stores loaded from a record
+        self.source = None
+
+        if len(self.frames) != len(self._xyz):
+            raise ValueError("The number of frames and frame metadata do not match: {} vs {}".format(
+                len(self._xyz), len(self.frames)))
+
+        if self.n_atoms != topology.GetMaxAtomIdx():
+            raise ValueError("The number of atoms and topology atoms do not match: {} vs {}".format(
+                self.n_atoms, topology.GetMaxAtomIdx()))
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, key):
+        """
+        The frame slices return a store view on the same coordinates
+        """
+        if not isinstance(key, slice):
+            raise ValueError("The trajectory store supports only frame slices: {}".format(key))
+
+        store = OETrajStore(self.topology, self._xyz[key], self.frames[key], self._atom_indices)
+
+        if self.source is not None and key.step in (None, 1):
+            file_id, start, stop = self.source
+            frames = range(start, stop)[key]
+            store.source = (file_id, frames.start, frames.stop)
+
+        return store
+
+    @property
+    def n_frames(self):
+        return len(self._xyz)
+
+    @property
+    def n_atoms(self):
+        if self._atom_indices is None:
+            return self._xyz.shape[1]
+
+        return len(range(self._xyz.shape[1])[self._atom_indices]) if isinstance(self._atom_indices, slice) \
+            else len(self._atom_indices)
+
+    @property
+    def xyz(self):
+        """
+        The (n_frames, n_atoms, 3) coordinates in A. The array is a view unless
+        the store is a subset of sparse atoms
+        """
+        if self._atom_indices is None:
+            return self._xyz
+
+        return self._xyz[:, self._atom_indices]
+
+    def coords(self, frame):
+        """
+        This method returns the coordinates of the selected frame
+
+        Parameters
+        ----------
+        frame: Int
+            The frame index
+
+        Returns
+        -------
+        xyz: numpy array
+            The (n_atoms, 3) frame coordinates in A
+        """
+        if self._atom_indices is None:
+            return self._xyz[frame]
+
+        return self._xyz[frame, self._atom_indices]
+
+    def take(self, frame_indices):
+        """
+        This method returns the store of the selected frames e.g. the frames of
+        a cluster. The selected coordinates are copied
+
+        Parameters
+        ----------
+        frame_indices: numpy array
+            The frame indexes or the boolean frame mask
+
+        Returns
+        -------
+        store: OETrajStore
+            The store of the selected frames
+        """
+        return OETrajStore(self.topology, self.xyz[frame_indices], self.frames[frame_indices])
+
+    def subset(self, atom_indices):
+        """
+        This method returns the store of the selected atoms. The coordinates are
+        not copied and the subset topology keeps the atom order
+
+        Parameters
+        ----------
+        atom_indices: numpy array
+            The increasing indexes of the selected atoms
+
+        Returns
+        -------
+        store: OETrajStore
+            The store of the selected atoms
+        """
+
+        atom_indices = np.asarray(atom_indices, dtype=np.int64)
+
+        if np.any(np.diff(atom_indices) <= 0):
+            raise ValueError("The atom indexes must be increasing")
+
+        bv = oechem.OEBitVector(self.topology.GetMaxAtomIdx())
+        for idx in atom_indices:
+            bv.SetBitOn(int(idx))
+
+        topology = oechem.OEMol()
+        oechem.OESubsetMol(topology, self.topology, oechem.OEAtomIdxSelected(bv))
+
+        # Contiguous atoms are selected by slice to keep the coordinate views
+        if len(atom_indices) and atom_indices[-1] - atom_indices[0] + 1 == len(atom_indices):
+            selection = slice(int(atom_indices[0]), int(atom_indices[-1]) + 1)
+        else:
+            selection = atom_indices
+
+        if self._atom_indices is not None:
+            parent = np.arange(self._xyz.shape[1])[self._atom_indices]
+            selection = parent[selection]
+
+        return OETrajStore(topology, self._xyz, self.frames, selection)
+
+    def to_oemol(self, start=None, stop=None):
+        """
+        This method generates the multi conformer OEMol of the selected frames,
+        one conformer per frame
+
+        Parameters
+        ----------
+        start: Int or None
+            The first frame. If None the trajectory start is used
+        stop: Int or None
+            The frame after the last one. If None the trajectory end is used
+
+        Returns
+        -------
+        mol: OEMol
+            The multi conformer OEMol
+        """
+
+        frames = range(self.n_frames)[start:stop]
+
+        if not len(frames):
+            raise ValueError("The trajectory store frame selection is empty: {} - {}".format(start, stop))
+
+        mol = oechem.OEMol(self.topology)
+        mol.DeleteConfs()
+
+        for frame in frames:
+            mol.NewConf(oechem.OEFloatArray(np.ascontiguousarray(self.coords(frame), dtype=np.float32).ravel()))
+
+        return mol
+
+    @classmethod
+    def from_oemol(cls, mol, pose_id=0, time=None):
+        """
+        This method creates the trajectory store from a multi conformer OEMol,
+        one frame per conformer
+
+        Parameters
+        ----------
+        mol: OEMol
+            The multi conformer OEMol
+        pose_id: Int
+            The pose id of the frames
+        time: numpy array or None
+            The frame times in ps. If None the times are set to zero
+
+        Returns
+        -------
+        store: OETrajStore
+            The trajectory store
+        """
+
+        xyz = np.empty((mol.NumConfs(), mol.GetMaxAtomIdx(), 3), dtype=np.float32)
+        coords = oechem.OEFloatArray(3 * mol.GetMaxAtomIdx())
+
+        for idx, conf in enumerate(mol.GetConfs()):
+            conf.GetCoords(coords)
+            xyz[idx] = np.array(coords).reshape(-1, 3)
+
+        frames = np.zeros(len(xyz), dtype=frame_dtype)
+        frames['pose_id'] = pose_id
+
+        if time is not None:
+            frames['time'] = time
+
+        topology = oechem.OEMol(mol.GetActive())
+
+        return cls(topology, xyz, frames)
+
+    @classmethod
+    def concatenate_frames(cls, stores):
+        """
+        This method concatenates the frames of trajectory stores with the same
+        topology e.g. the trajectories of the ligand poses
+
+        Parameters
+        ----------
+        stores: python list
+            The list of trajectory stores
+
+        Returns
+        -------
+        store: OETrajStore
+            The concatenated trajectory store
+        """
+
+        if not stores:
+            raise ValueError("The trajectory store list is empty")
+
+        for store in stores[1:]:
+            if store.n_atoms != stores[0].n_atoms:
+                raise ValueError("The trajectory stores have different number of atoms: {} vs {}".format(
+                    store.n_atoms, stores[0].n_atoms))
+
+        return cls(stores[0].topology,
+                   np.concatenate([store.xyz for store in stores]),
+                   np.concatenate([store.frames for store in stores]))
+
+    @classmethod
+    def concatenate_atoms(cls, stores):
+        """
+        This method concatenates the atoms of trajectory stores with the same
+        frames e.g. the protein and the water trajectories
+
+        Parameters
+        ----------
+        stores: python list
+            The list of trajectory stores
+
+        Returns
+        -------
+        store: OETrajStore
+            The concatenated trajectory store
+        """
+
+        if not stores:
+            raise ValueError("The trajectory store list is empty")
+
+        for store in stores[1:]:
+            if store.n_frames != stores[0].n_frames:
+                raise ValueError("The trajectory stores have different number of frames: {} vs {}".format(
+                    store.n_frames, stores[0].n_frames))
+
+        topology = oechem.OEMol(stores[0].topology)
+        for store in stores[1:]:
+            oechem.OEAddMols(topology, store.topology)
+
+        return cls(topology,
+                   np.concatenate([store.xyz for store in stores], axis=1),
+                   np.array(stores[0].frames))
+
+    def save(self, filename):
+        """
+        This method saves the trajectory store. The coordinates and the frame
+        table are stored uncompressed to be memory mapped
+
+        Parameters
+        ----------
+        filename: String
+            The store file name
+
+        Returns
+        -------
+        filename: String
+            The store file name
+        """
+
+        with TemporaryDirectory() as output_directory:
+
+            top_fn = os.path.join(output_directory, _topology_name)
+            with oechem.oemolostream(top_fn) as ofs:
+                oechem.OEWriteConstMolecule(ofs, self.topology)
+
+            xyz_fn = os.path.join(output_directory, _coordinates_name)
+            np.save(xyz_fn, np.ascontiguousarray(self.xyz, dtype=np.float32))
+
+            frames_fn = os.path.join(output_directory, _frames_name)
+            np.save(frames_fn, np.asarray(self.frames, dtype=frame_dtype))
+
+            write_stage_container(filename, [(top_fn, True), (xyz_fn, False), (frames_fn, False)])
+
+        return filename
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        """
+        This method loads the trajectory store
+
+        Parameters
+        ----------
+        filename: String
+            The store file name
+        mmap: Bool
+            If True the coordinates are memory mapped from the store file
+
+        Returns
+        -------
+        store: OETrajStore
+            The trajectory store
+        """
+
+        with StageContainer(filename) as container:
+
+            topology = oechem.OEMol()
+
+            with oechem.oemolistream() as ifs:
+                ifs.SetFormat(oechem.OEFormat_OEB)
+                ifs.openstring(container.read(_topology_name))
+                oechem.OEReadMolecule(ifs, topology)
+
+            xyz = container.load_array(_coordinates_name, mmap=mmap)
+            frames = container.load_array(_frames_name, mmap=False)
+
+        return cls(topology, xyz, frames)
+
+
+class OEConcatTrajStore(OETrajStore):
+    """
+    This class implements the virtual concatenation of trajectory stores with
+    the same topology e.g. the trajectories of the ligand poses. The frames
+    are not copied: the concatenated store refers to the stores through the
+    index of their pose ids and frame ranges
+    """
+
+    def __init__(self, stores, pose_ids=None):
+        """
+        The Initialization function used to create the concatenated store
+
+        Parameters
+        ----------
+        stores: python list
+            The list of trajectory stores
+        pose_ids: python list or None
+            The pose ids of the stores. If None the pose ids of the store
+            frames are used
+        """
+
+        if not stores:
+            raise ValueError("The trajectory store list is empty")
+
+        for store in stores[1:]:
+            if store.n_atoms != stores[0].n_atoms:
+                raise ValueError("The trajectory stores have different number of atoms: {} vs {}".format(
+                    store.n_atoms, stores[0].n_atoms))
+
+        if pose_ids is not None and len(pose_ids) != len(stores):
+            raise ValueError("The number of stores and pose ids do not match: {} vs {}".format(
+                len(stores), len(pose_ids)))
+
+        self.topology = stores[0].topology
+        self.source = None
+
+        self.frames = np.concatenate([store.frames for store in stores])
+
+        if pose_ids is not None:
+            self.frames['pose_id'] = np.repeat(pose_ids, [store.n_frames for store in stores])
+
+        # The concatenated stores are flattened so that the index refers to the stored data
+        self.stores = []
+
+        for store in stores:
+            if isinstance(store, OEConcatTrajStore):
+                self.stores += store.stores
+            else:
+                self.stores.append(store)
+
+        # First frame of each store
+        self.offsets = np.cumsum([0] + [store.n_frames for store in self.stores])
+
+    def __getitem__(self, key):
+        """
+        The contiguous frame slices return a concatenated store view on the same stores
+        """
+        if not isinstance(key, slice):
+            raise ValueError("The trajectory store supports only frame slices: {}".format(key))
+
+        frames = range(self.n_frames)[key]
+
+        if frames.step != 1:
+            return self.take(np.asarray(frames, dtype=np.int64))
+
+        stores = []
+        pose_ids = []
+
+        for store, start, pose_id in zip(self.stores, self.offsets[:-1], self.pose_ids):
+            first = max(frames.start - start, 0)
+            last = min(frames.stop - start, store.n_frames)
+
+            if first < last:
+                stores.append(store[first:last])
+                pose_ids.append(pose_id)
+
+        if not stores:
+            return OETrajStore(self.topology, np.empty((0, self.n_atoms, 3), dtype=np.float32))
+
+        return OEConcatTrajStore(stores, pose_ids)
+
+    @property
+    def n_frames(self):
+        return int(self.offsets[-1])
+
+    @property
+    def n_atoms(self):
+        return self.stores[0].n_atoms
+
+    @property
+    def pose_ids(self):
+        """
+        The pose id of each store
+        """
+        return [int(self.frames['pose_id'][start]) if stop > start else 0
+                for start, stop in zip(self.offsets[:-1], self.offsets[1:])]
+
+    @property
+    def index(self):
+        """
+        The (pose id, start frame, stop frame) of each store in the concatenated frames
+        """
+        return [(pose_id, int(start), int(stop))
+                for pose_id, start, stop in zip(self.pose_ids, self.offsets[:-1], self.offsets[1:])]
+
+    @property
+    def xyz(self):
+        """
+        The (n_frames, n_atoms, 3) coordinates in A. The concatenated coordinates are copied
+        """
+        return np.concatenate([store.xyz for store in self.stores])
+
+    def coords(self, frame):
+        idx = np.searchsorted(self.offsets, frame, side='right') - 1
+        return self.stores[idx].coords(frame - self.offsets[idx])
+
+    def take(self, frame_indices):
+        frame_indices = np.arange(self.n_frames)[frame_indices]
+
+        xyz = np.empty((len(frame_indices), self.n_atoms, 3), dtype=np.float32)
+
+        # The selected frames are gathered store by store
+        store_idx = np.searchsorted(self.offsets, frame_indices, side='right') - 1
+
+        for idx, store in enumerate(self.stores):
+            mask = store_idx == idx
+            if np.any(mask):
+                xyz[mask] = store.take(frame_indices[mask] - self.offsets[idx]).xyz
+
+        return OETrajStore(self.topology, xyz, self.frames[frame_indices])
+
+    def subset(self, atom_indices):
+        return OEConcatTrajStore([store.subset(atom_indices) for store in self.stores], self.pose_ids)
@@ -0,0 +1,199 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import os
+
+import threading
+
+import atexit
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TransferManager(object):
+    """
+    This class implements a thread pool shared by all the transfers of a cube
+    process. Uploads can run in background while the next compute step starts,
+    the data needed later can be prefetched and several files can be downloaded
+    in parallel
+
+    The number of transfer threads can be set by using the environment variable
+    OE_MDORION_TRANSFER_WORKERS
+    """
+
+    def __init__(self, max_workers=None):
+        """
+        The Initialization function used to create the transfer manager
+
+        Parameters
+        ----------
+        max_workers: Int or None
+            The number of transfer threads. If None the OE_MDORION_TRANSFER_WORKERS
+            environment variable is used and if it is not set 4 threads are used
+        """
+
+        if max_workers is None:
+            max_workers = int(os.environ.get('OE_MDORION_TRANSFER_WORKERS', 4))
+
+        if max_workers <= 0:
+            raise ValueError("The number of transfer threads must be a positive number: {}".format(max_workers))
+
+        self.max_workers = max_workers
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.RLock()
+        self._pending = []
+        self._prefetched = dict()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        This method runs the passed transfer function in background. The returned
+        future can be used to collect the result e.g. the uploaded file id
+
+        Parameters
+        ----------
+        func: callable
+            The transfer function
+        args, kwargs:
+            The transfer function arguments
+
+        Returns
+        -------
+        future: concurrent.futures.Future
+            The transfer future
+        """
+
+        future = self._executor.submit(func, *args, **kwargs)
+
+        with self._lock:
+            self._pending = [f for f in self._pending if not f.done()]
+            self._pending.append(future)
+
+        return future
+
+    def map(self, func, *iterables):
+        """
+        This method runs the passed transfer function in parallel over the passed
+        arguments and returns the results in order
+
+        Parameters
+        ----------
+        func: callable
+            The transfer function
+        iterables:
+            The transfer function arguments
+
+        Returns
+        -------
+        results: python list
+            The transfer results
+        """
+        return [f.result() for f in [self.submit(func, *args) for args in zip(*iterables)]]
+
+    def prefetch(self, key, func, *args, **kwargs):
+        """
+        This method starts in background a transfer needed later. The same key
+        is not prefetched again while its transfer is running. The completed
+        prefetches are forgotten, their data are served by the download cache
+
+        Parameters
+        ----------
+        key: String or Int
+            The prefetch key
+        func: callable
+            The transfer function
+        args, kwargs:
+            The transfer function arguments
+
+        Returns
+        -------
+        future: concurrent.futures.Future
+            The transfer future
+        """
+
+        with self._lock:
+            if key in self._prefetched:
+                return self._prefetched[key]
+
+            future = self.submit(func, *args, **kwargs)
+            self._prefetched[key] = future
+
+        future.add_done_callback(lambda f: self._prefetch_done(key, f))
+
+        return future
+
+    def _prefetch_done(self, key, future):
+        with self._lock:
+            if self._prefetched.get(key) is future:
+                del self._prefetched[key]
+
+    def wait(self):
+        """
+        This method waits for all the submitted transfers. The first transfer
+        error, if any, is raised
+        """
+
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+
+        for future in pending:
+            future.result()
+
+    def shutdown(self):
+        """
+        This method waits for all the submitted transfers and stops the transfer threads
+        """
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
+
+
+# Process-wide transfer manager
+_transfer_manager = None
+_transfer_manager_pid = None
+_transfer_manager_lock = threading.Lock()
+
+
+def get_transfer_manager():
+    """
+    This function returns the process-wide transfer manager. A new manager is
+    created in forked processes since the threads are not inherited
+
+    Returns
+    -------
+    manager: TransferManager
+        The transfer manager
+    """
+
+    global _transfer_manager, _transfer_manager_pid
+
+    with _transfer_manager_lock:
+        if _transfer_manager is None or _transfer_manager_pid != os.getpid():
+            _transfer_manager = TransferManager()
+            _transfer_manager_pid = os.getpid()
+
+        return _transfer_manager
+
+
+def _shutdown_transfer_manager():
+    if _transfer_manager is not None and _transfer_manager_pid == os.getpid():
+        _transfer_manager.shutdown()
+
+
+atexit.register(_shutdown_transfer_manager)
@@ -42,6 +42,14 @@ from orionclient.types import (Shard,
 from orionclient.helpers.collections import (try_hard_to_create_shard,
                                              try_hard_to_download_shard)
 
+from MDOrion.Standards.cache import get_file_cache
+
+from MDOrion.Standards.transfer import get_transfer_manager
+
+import threading
+
+from tempfile import TemporaryDirectory
+
 
 from openeye import oechem
 
@@ -89,12 +97,16 @@ class MDStateData(CustomHandler):
 
     @staticmethod
     def serialize(state):
-        pkl_obj = pickle.dumps(state)
-        return bytes(pkl_obj)
+        return state.to_bytes()
 
     @staticmethod
     def deserialize(data):
-        new_state = pickle.loads(bytes(data))
+        data = bytes(data)
+        # Legacy MD States are pickled
+        if MDState.is_binary(data):
+            new_state = MDState.from_bytes(data)
+        else:
+            new_state = pickle.loads(data)
         return new_state
 
 
@@ -152,26 +164,56 @@ class DesignUnit(CustomHandler):
         return design_unit
 
 
+# Pooled Orion session shared by the transfers of a cube process
+_orion_session = None
+_orion_session_pid = None
+_orion_session_lock = threading.Lock()
+
+
+def get_orion_session():
+    """
+    This function returns the Orion session shared by all the transfers of the
+    current process. Reusing the session keeps its connection pool alive and
+    avoids repeating the connection setup for each transfer. A new session is
+    created in forked processes
+
+    Returns
+    -------
+    session: OrionSession
+        The pooled Orion session
+    """
+
+    global _orion_session, _orion_session_pid
+
+    with _orion_session_lock:
+
+        if _orion_session is None or _orion_session_pid != os.getpid():
+
+            _orion_session = OrionSession(
+                requests_session=get_session(
+                    retry_dict={
+                        403: 5,
+                        404: 20,
+                        409: 45,
+                        460: 15,
+                        500: 2,
+                        502: 45,
+                        503: 45,
+                        504: 45,
+                    }
+                )
+            )
+
+            _orion_session_pid = os.getpid()
+
+        return _orion_session
+
+
 def upload_file(filename, orion_ui_name='OrionFile'):
 
     if in_orion():
 
-        # session = APISession
-
-        session = OrionSession(
-            requests_session=get_session(
-                retry_dict={
-                    403: 5,
-                    404: 20,
-                    409: 45,
-                    460: 15,
-                    500: 2,
-                    502: 45,
-                    503: 45,
-                    504: 45,
-                }
-            )
-        )
+        session = get_orion_session()
 
         file_upload = File.upload(session,
                                   orion_ui_name,
@@ -196,28 +238,14 @@ def download_file(file_id, filename):
 
     if in_orion():
 
-        # session = APISession
-
-        session = OrionSession(
-            requests_session=get_session(
-                retry_dict={
-                    403: 5,
-                    404: 20,
-                    409: 45,
-                    460: 15,
-                    500: 2,
-                    502: 45,
-                    503: 45,
-                    504: 45,
-                }
-            )
-        )
-
-        resource = session.get_resource(File, file_id)
+        session = get_orion_session()
 
-        resource.download_to_file(filename)
+        def download(fn):
+            resource = session.get_resource(File, file_id)
+            resource.download_to_file(fn)
 
-        fn_local = filename
+        # Orion files are immutable and their ids are used as cache keys
+        fn_local = get_file_cache().fetch("file:{}".format(file_id), filename, download)
 
     else:
         fn_local = file_id
@@ -232,22 +260,7 @@ def delete_file(file_id):
 
     if in_orion():
 
-        # session = APISession
-
-        session = OrionSession(
-            requests_session=get_session(
-                retry_dict={
-                    403: 5,
-                    404: 20,
-                    409: 45,
-                    460: 15,
-                    500: 2,
-                    502: 45,
-                    503: 45,
-                    504: 45,
-                }
-            )
-        )
+        session = get_orion_session()
 
         resource = session.get_resource(File, file_id)
 
@@ -266,22 +279,7 @@ def upload_data(filename, collection_id=None, shard_name=""):
         if collection_id is None:
             raise ValueError("The Collection ID is None")
 
-        # session = APISession
-
-        session = OrionSession(
-            requests_session=get_session(
-                retry_dict={
-                    403: 5,
-                    404: 20,
-                    409: 45,
-                    460: 15,
-                    500: 2,
-                    502: 45,
-                    503: 45,
-                    504: 45,
-                }
-            )
-        )
+        session = get_orion_session()
 
         collection = session.get_resource(ShardCollection, collection_id)
 
@@ -304,34 +302,13 @@ def download_data(file_id, path, collection_id=None):
         if collection_id is None:
             raise ValueError("The Collection ID is None")
 
-        # session = APISession
-
-        session = OrionSession(
-            requests_session=get_session(
-                retry_dict={
-                    403: 5,
-                    404: 20,
-                    409: 45,
-                    460: 15,
-                    500: 2,
-                    502: 45,
-                    503: 45,
-                    504: 45,
-                }
-            )
-        )
-
-        collection = session.get_resource(ShardCollection, collection_id)
-
-        shard = session.get_resource(Shard(collection=collection), file_id)
+        session = get_orion_session()
 
         from MDOrion.Standards import MDFileNames
 
         fn_local = os.path.join(path, MDFileNames.mddata)
 
-        try_hard_to_download_shard(shard, fn_local)
-
-        shard.close()
+        download_shard(file_id, collection_id, fn_local, session=session)
 
     else:
         fn_local = file_id
@@ -342,6 +319,105 @@ def download_data(file_id, path, collection_id=None):
     return fn_local
 
 
+def download_shard(shard_id, collection_id, filename, session=None):
+    """
+    This function downloads a shard of the passed collection to the passed
+    file name. The shards are immutable and the downloaded files are stored in
+    the process-wide disk cache so that repeated downloads of the same shard,
+    also from different processes on the same node, are served locally
+
+    Parameters
+    ----------
+    shard_id: Int
+        The shard id
+    collection_id: Int
+        The shard collection id
+    filename: String
+        The destination file name
+    session: OrionSession or None
+        The Orion session to use. If None the pooled session is used
+
+    Returns
+    -------
+    filename: String
+        The destination file name
+    """
+
+    if session is None:
+        session = get_orion_session()
+
+    def download(fn):
+        collection = session.get_resource(ShardCollection, collection_id)
+        shard = session.get_resource(Shard(collection=collection), shard_id)
+        try_hard_to_download_shard(shard, fn)
+        shard.close()
+
+    key = "shard:{}:{}".format(collection_id, shard_id)
+
+    return get_file_cache().fetch(key, filename, download)
+
+
+def prefetch_file(file_id):
+    """
+    This function starts the download of the passed file in background. The
+    downloaded file is stored in the disk cache and the following call to
+    download_file with the same id is served locally. Locally the function
+    does nothing since the file ids are file names
+
+    Parameters
+    ----------
+    file_id: String or Int
+        The file name locally or the file id in Orion
+
+    Returns
+    -------
+    future: concurrent.futures.Future or None
+        The prefetch future
+    """
+
+    if not in_orion():
+        return None
+
+    def prefetch():
+        with TemporaryDirectory() as output_directory:
+            download_file(file_id, os.path.join(output_directory, "prefetch"))
+
+    return get_transfer_manager().prefetch("file:{}".format(file_id), prefetch)
+
+
+def prefetch_data(file_id, collection_id=None):
+    """
+    This function starts the download of the passed shard in background. The
+    downloaded shard is stored in the disk cache and the following call to
+    download_data with the same id is served locally. Locally the function
+    does nothing since the file ids are file names
+
+    Parameters
+    ----------
+    file_id: String or Int
+        The file name locally or the shard id in Orion
+    collection_id: Int or None
+        The shard collection id
+
+    Returns
+    -------
+    future: concurrent.futures.Future or None
+        The prefetch future
+    """
+
+    if not in_orion():
+        return None
+
+    if collection_id is None:
+        raise ValueError("The Collection ID is None")
+
+    def prefetch():
+        with TemporaryDirectory() as output_directory:
+            download_shard(file_id, collection_id, os.path.join(output_directory, "prefetch"))
+
+    return get_transfer_manager().prefetch("shard:{}:{}".format(collection_id, file_id), prefetch)
+
+
 def delete_data(file_id, collection_id=None):
 
     if in_orion():
@@ -349,22 +425,7 @@ def delete_data(file_id, collection_id=None):
         if collection_id is None:
             raise ValueError("The Collection ID is None")
 
-        # session = APISession
-
-        session = OrionSession(
-            requests_session=get_session(
-                retry_dict={
-                    403: 5,
-                    404: 20,
-                    409: 45,
-                    460: 15,
-                    500: 2,
-                    502: 45,
-                    503: 45,
-                    504: 45,
-                }
-            )
-        )
+        session = get_orion_session()
 
         collection = session.get_resource(ShardCollection, collection_id)
 
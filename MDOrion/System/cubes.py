@@ -99,6 +99,10 @@ class IDSettingCube(RecordPortsMixin, ComputeCube):
             if not name:
                 name = 'SYS'
 
+            # The conformer number is used downstream to know when all the
+            # conformers of a ligand have been gathered
+            record.set_value(Fields.num_confs, flask.NumConfs())
+
             num_conf_counter = 0
             for conf in flask.GetConfs():
 
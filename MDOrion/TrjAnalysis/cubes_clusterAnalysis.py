@@ -27,7 +27,9 @@ from pathlib import Path
 
 from floereport import FloeReport, LocalFloeReport
 
-from orionclient.session import in_orion, OrionSession, get_session
+from orionclient.session import in_orion
+
+from MDOrion.Standards.utils import get_orion_session
 
 from orionclient.types import File
 
@@ -41,7 +43,13 @@ import MDOrion.TrjAnalysis.utils as utl
 import oetrajanalysis.OETrajBasicAnalysis_utils as oetrjutl
 import oetrajanalysis.Clustering_utils as clusutl
 
-import ensemble2img
+import MDOrion.TrjAnalysis.rmsd_utils as rmsdutl
+
+import MDOrion.TrjAnalysis.ensemble_utils as ensutl
+
+import MDOrion.TrjAnalysis.svg_utils as svgutl
+
+import MDOrion.TrjAnalysis.pbsa_utils as pbsautl
 
 from tempfile import TemporaryDirectory
 
@@ -59,6 +67,8 @@ from datarecord import (Types,
 
 from MDOrion.Standards.mdrecord import MDDataRecord
 
+from MDOrion.Standards.traj_store import OETrajStore
+
 import MDOrion.TrjAnalysis.TrajAnFloeReport_utils as flrpt
 
 import tarfile
@@ -245,6 +255,20 @@ class ClusterOETrajCube(RecordPortsMixin, ComputeCube):
         "item_count": {"default": 1}  # 1 molecule at a time
     }
 
+    max_dense_frames = parameters.IntegerParameter(
+        'max_dense_frames',
+        default=8000,
+        help_text="""The max number of trajectory frames clustered over the
+        full pairwise RMSD matrix. Above this threshold the frames are
+        clustered over a subset of landmark frames and the remaining
+        frames are assigned to the cluster of the nearest landmark""")
+
+    n_landmarks = parameters.IntegerParameter(
+        'n_landmarks',
+        default=4000,
+        help_text="""The number of landmark frames used to cluster the
+        trajectories longer than the max dense frames threshold""")
+
     def begin(self):
         self.opt = vars(self.args)
         self.opt['Logger'] = self.log
@@ -290,7 +314,41 @@ class ClusterOETrajCube(RecordPortsMixin, ComputeCube):
                 system_title, len(poseIdVec)) )
             torScale = 0.5
             epsScal = 0.05
-            clusResults = clusutl.ClusterLigTrajDBSCAN(ligand, poseIdVec, ligTraj, torScale, epsScal)
+
+            # The symmetry maps and the rotor torsions are computed once and cached for the
+            # downstream cluster cubes. The pairwise distances are computed only by the clustering
+            ligStore = OETrajStore.from_oemol(ligTraj)
+            atomIdx, symMaps = rmsdutl.symmetry_maps(ligand)
+            torsions = rmsdutl.torsion_angles(ligStore.xyz, rmsdutl.rotor_torsions(ligand))
+
+            nFrames = ligStore.n_frames
+
+            if nFrames <= opt['max_dense_frames']:
+                clusResults = clusutl.ClusterLigTrajDBSCAN(ligand, poseIdVec, ligTraj, torScale, epsScal)
+                clusterMethod = 'DBSCAN'
+            else:
+                # The landmark frames are clustered with the same clustering parameters and
+                # each frame takes the cluster of its nearest landmark
+                landmarks = rmsdutl.landmark_frames(nFrames, opt['n_landmarks'])
+                landmarkTraj = ligStore.take(landmarks).to_oemol()
+                clusResults = clusutl.ClusterLigTrajDBSCAN(ligand, np.asarray(poseIdVec)[landmarks].tolist(),
+                                                           landmarkTraj, torScale, epsScal)
+                del landmarkTraj
+
+                clusterVec = rmsdutl.assign_landmark_clusters(ligStore.xyz[:, atomIdx], torsions, landmarks,
+                                                              clusResults['ClusterVec'], symMaps, torScale)
+                nClusters = int(clusterVec.max()) + 1
+                clusResults['nFrames'] = nFrames
+                clusResults['nClusters'] = nClusters
+                clusResults['ClusterCounts'] = np.bincount(clusterVec[clusterVec >= 0],
+                                                           minlength=nClusters).tolist()
+                clusResults['nOutliers'] = int((clusterVec < 0).sum())
+                clusResults['ClusterVec'] = clusterVec.tolist()
+                clusterMethod = 'Landmark DBSCAN'
+
+            clusResults['ClusterMethod'] = clusterMethod
+            opt['Logger'].info('{} clustered with {} using {} symmetry maps and {} rotors'.format(
+                system_title, clusterMethod, len(symMaps), torsions.shape[1]))
 
             opt['Logger'].info('{} clustering completed finding {} clusters with {} outliers'.format(
                 system_title, clusResults['nClusters'], clusResults['nOutliers']) )
@@ -312,6 +370,8 @@ class ClusterOETrajCube(RecordPortsMixin, ComputeCube):
             #
             # store trajClus results dict (Plain Old Data only) on the record as a JSON object
             trajClus.set_value(Fields.Analysis.oeclus_dict, clusResults)
+            trajClus.set_value(Fields.Analysis.oeclus_distances,
+                               rmsdutl.save_distance_cache(atomIdx, symMaps, torsions))
             opt['Logger'].info('{} Saved clustering results in dict with keys:'.format(system_title) )
             for key in clusResults.keys():
                 opt['Logger'].info('{} : TrajClusDict key {}'.format(system_title, key) )
@@ -351,11 +411,18 @@ class MakeClusterTrajOEMols(RecordPortsMixin, ComputeCube):
     # Override defaults for some parameters
     parameter_overrides = {
         "memory_mb": {"default": 6000},
+        "cpu_count": {"default": 4},
         "spot_policy": {"default": "Allowed"},
         "prefetch_count": {"default": 1},  # 1 molecule at a time
         "item_count": {"default": 1}  # 1 molecule at a time
     }
 
+    max_svg_frames = parameters.IntegerParameter(
+        'max_svg_frames',
+        default=100,
+        help_text="""The max number of frames rendered in each interactive
+        ensemble SVG. The frames are selected by ligand RMSD diversity""")
+
     def begin(self):
         self.opt = vars(self.args)
         self.opt['Logger'] = self.log
@@ -402,18 +469,52 @@ class MakeClusterTrajOEMols(RecordPortsMixin, ComputeCube):
             opt['Logger'].info('{} got ligTraj with {} atoms, {} confs'.format(
                 system_title, ligTraj.NumAtoms(), ligTraj.NumConfs()))
 
-            # Extract the protTraj OEMol from the OETraj record
+            # Extract the protein traj store from the OETraj record
             mdtrajrecord = MDDataRecord(oetrajRecord)
-            protTraj = mdtrajrecord.get_protein_traj
-            opt['Logger'].info('{} got protTraj with {} atoms, {} confs'.format(
-                system_title, protTraj.NumAtoms(), protTraj.NumConfs()) )
+            protStore = mdtrajrecord.get_traj_store('protein')
+            opt['Logger'].info('{} got protein traj store with {} atoms, {} frames'.format(
+                system_title, protStore.n_atoms, protStore.n_frames) )
             del mdtrajrecord
 
-            # Generate average and median protein and ligand OEMols from ligTraj, protTraj
-            opt['Logger'].info('{} Generating entire trajectory median and average OEMols for protein and ligand '.
-                               format(system_title))
-            ligMedian, protMedian, ligAverage, protAverage = oetrjutl.AnalyseProteinLigandTrajectoryOEMols(
-                ligTraj, protTraj)
+            ligStore = OETrajStore.from_oemol(ligTraj)
+
+            # Per cluster and whole trajectory (last group) means and fluctuations
+            # in a single pass over the coordinates, grouped by cluster label
+            opt['Logger'].info('{} Generating cluster and entire trajectory median and average OEMols for protein '
+                               'and ligand'.format(system_title))
+            nMajorClusters = trajClus['nMajorClusters']
+            clusterVec = np.asarray(trajClus['ClusterVec'])
+            ligCounts, ligMean, ligMsf = ensutl.coordinate_moments(ligStore.xyz, clusterVec, nMajorClusters)
+            protCounts, protMean, protMsf = ensutl.coordinate_moments(protStore.xyz, clusterVec, nMajorClusters)
+
+            # The median frames are the ligand medoids of the member frames by the symmetry
+            # aware RMSD, using the symmetry maps cached by the clustering cube
+            if trajClusRecord.has_field(Fields.Analysis.oeclus_distances):
+                cache = rmsdutl.load_distance_cache(trajClusRecord.get_value(Fields.Analysis.oeclus_distances))
+                atomIdx, symMaps = cache['atom_idx'], cache['maps']
+            else:
+                atomIdx, symMaps = rmsdutl.symmetry_maps(ligTraj)
+
+            ligXyz = ligStore.xyz[:, atomIdx]
+
+            medianFrames = []
+            for clusID in range(nMajorClusters + 1):
+                members = np.arange(len(clusterVec)) if clusID == nMajorClusters \
+                    else np.flatnonzero(clusterVec == clusID)
+                medianFrames.append(rmsdutl.medoid(ligXyz, members, symMaps))
+
+            def average_median_mols(group):
+                ligAvg = ensutl.coordinates_to_oemol(ligStore.topology, ligMean[group],
+                                                     ensutl.bfactors(ligMsf[group]))
+                protAvg = ensutl.coordinates_to_oemol(protStore.topology, protMean[group],
+                                                      ensutl.bfactors(protMsf[group]))
+                frame = medianFrames[group]
+                ligMed = ligStore.to_oemol(frame, frame + 1)
+                protMed = protStore.to_oemol(frame, frame + 1)
+                return ligMed, protMed, ligAvg, protAvg
+
+            ligMedian, protMedian, ligAverage, protAverage = average_median_mols(nMajorClusters)
+            clusMols = [average_median_mols(clusID) for clusID in range(nMajorClusters)]
 
             # Add prot and lig medians and averages to OETraj record
             #oetrajRecord.set_value(OEField('LigMedian', Types.Chem.Mol), ligMedian)
@@ -421,37 +522,45 @@ class MakeClusterTrajOEMols(RecordPortsMixin, ComputeCube):
             oetrajRecord.set_value(OEField('LigAverage', Types.Chem.Mol), ligAverage)
             #oetrajRecord.set_value(OEField('ProtAverage', Types.Chem.Mol), protAverage)
 
-            # Generate interactive trajectory SVG for the whole trajectory and place on oetrajRecord
-            opt['Logger'].info('{} Generating entire trajectory interactive SVG'.format(system_title))
-            trajSVG = ensemble2img.run_ensemble2img(ligMedian, protMedian, ligTraj, protTraj)
+            # The interactive SVGs of the whole trajectory and of the major clusters are rendered
+            # in a process pool over a bounded number of diverse frames
+            def svg_job(ligRep, protRep, members):
+                frames = rmsdutl.diverse_frames(ligStore.xyz[:, atomIdx], members, opt['max_svg_frames'], symMaps)
+                return ligRep, protRep, ligStore.take(frames).to_oemol(), protStore.take(frames).to_oemol()
+
+            svgJobs = [svg_job(ligMedian, protMedian, np.arange(len(clusterVec)))]
+            for clusID, (ligMed, protMed, ligAvg, protAvg) in enumerate(clusMols):
+                svgJobs.append(svg_job(ligAvg, protAvg, np.flatnonzero(clusterVec == clusID)))
+
+            opt['Logger'].info('{} Generating {} interactive SVGs with {} processes'.format(
+                system_title, len(svgJobs), opt['cpu_count']))
+            svgs = svgutl.render_ensembles(svgJobs, max_workers=opt['cpu_count'])
+            del svgJobs
+
+            # Place the entire trajectory interactive SVG on oetrajRecord
+            trajSVG = svgs[0]
             TrajSVG_field = OEField('TrajSVG', Types.String, meta=OEFieldMeta().set_option(Meta.Hints.Image_SVG))
             oetrajRecord.set_value(TrajSVG_field, trajSVG)
             record.set_value(Fields.Analysis.oetraj_rec, oetrajRecord)
 
             # Generate per-cluster info for major clusters
-            nMajorClusters = trajClus['nMajorClusters']
-            byClusTrajSVG = []
+            byClusTrajSVG = svgs[1:]
             if nMajorClusters > 0:
                 opt['Logger'].info('{}: Making cluster mols for {} major clusters'.format(system_title,nMajorClusters))
                 clusLigAvgMol = oechem.OEMol(ligTraj)
                 clusLigAvgMol.DeleteConfs()
-                clusProtAvgMol = oechem.OEMol(protTraj)
+                clusProtAvgMol = oechem.OEMol(protStore.topology)
                 clusProtAvgMol.DeleteConfs()
                 clusLigMedMol = oechem.OEMol(ligTraj)
                 clusLigMedMol.DeleteConfs()
-                clusProtMedMol = oechem.OEMol(protTraj)
+                clusProtMedMol = oechem.OEMol(protStore.topology)
                 clusProtMedMol.DeleteConfs()
 
-                # for each major cluster generate SVG and average and median for protein and ligand
+                # for each major cluster generate average and median for protein and ligand
                 for clusID in range(nMajorClusters):
-                    opt['Logger'].info('Extracting cluster {} from {}'.format( clusID, system_title ))
-                    clusLig = clusutl.TrajOEMolFromCluster( ligTraj, trajClus['ClusterVec'], clusID)
-                    opt['Logger'].info( 'ligand cluster {} with {} confs'.format(clusID,clusLig.NumConfs()) )
-                    clusProt = clusutl.TrajOEMolFromCluster( protTraj, trajClus['ClusterVec'], clusID)
-                    opt['Logger'].info('protein cluster {} with {} confs'.format(clusID,clusProt.NumConfs()) )
-                    opt['Logger'].info('generating representative protein average and median confs')
-                    #
-                    ligMed, protMed, ligAvg, protAvg = oetrjutl.AnalyseProteinLigandTrajectoryOEMols( clusLig, clusProt)
+                    opt['Logger'].info('{} cluster {} with {} confs'.format(
+                        system_title, clusID, ligCounts[clusID]))
+                    ligMed, protMed, ligAvg, protAvg = clusMols[clusID]
                     confTitle = 'clus '+str(clusID)
                     conf = clusLigAvgMol.NewConf(ligAvg)
                     conf.SetTitle(confTitle)
@@ -461,10 +570,6 @@ class MakeClusterTrajOEMols(RecordPortsMixin, ComputeCube):
                     conf.SetTitle(confTitle)
                     conf = clusProtMedMol.NewConf(protMed)
                     conf.SetTitle(confTitle)
-                    #
-                    opt['Logger'].info('generating cluster SVG for cluster {}'.format(clusID) )
-                    clusSVG = ensemble2img.run_ensemble2img(ligAvg, protAvg, clusLig, clusProt)
-                    byClusTrajSVG.append(clusSVG)
 
                 # style the molecules and put the results on trajClus record
                 clusLigAvgMol.SetTitle('Average '+clusLigAvgMol.GetTitle())
@@ -612,16 +717,37 @@ class ClusterPopAnalysis(RecordPortsMixin, ComputeCube):
             popResults = clusutl.AnalyzeClustersByConfs(ligand, poseIdVec, clusResults)
 
             # Generate the cluster MMPBSA mean and standard error
-            MMPBSAbyClus = clusutl.MeanSerrByClusterEnsemble(popResults, PBSAdata['OEZap_MMPBSA6_Bind'])
+            # ignoring the frames skipped by the PBSA frame selection and weighting the sampled ones
+            pbsaWeights = PBSAdata.get('OEZap_Weight')
+            if all(PBSAdata.get('OEZap_Evaluated', [True])) and len(set(pbsaWeights or [1.0])) == 1:
+                MMPBSAbyClus = clusutl.MeanSerrByClusterEnsemble(popResults, PBSAdata['OEZap_MMPBSA6_Bind'])
+            else:
+                nMajor = clusResults['nMajorClusters']
+                clusCols = np.asarray(clusResults['ClusterVec'])
+                clusCols = np.where((clusCols >= 0) & (clusCols < nMajor), clusCols, nMajor)
+                MMPBSAbyClus = dict()
+                MMPBSAbyClus['ByClusMean'], MMPBSAbyClus['ByClusSerr'] = pbsautl.mean_serr_by_group(
+                    PBSAdata['OEZap_MMPBSA6_Bind'], clusCols, nMajor + 1, pbsaWeights)
+                MMPBSAbyClus['ByConfMean'], MMPBSAbyClus['ByConfSerr'] = pbsautl.mean_serr_by_group(
+                    PBSAdata['OEZap_MMPBSA6_Bind'], poseIdVec, popResults['nConfs'], pbsaWeights)
             popResults['OEZap_MMPBSA6_ByClusMean'] = MMPBSAbyClus['ByClusMean']
             popResults['OEZap_MMPBSA6_ByClusSerr'] = MMPBSAbyClus['ByClusSerr']
             popResults['OEZap_MMPBSA6_ByConfMean'] = MMPBSAbyClus['ByConfMean']
             popResults['OEZap_MMPBSA6_ByConfSerr'] = MMPBSAbyClus['ByConfSerr']
 
             # Generate by-cluster mean and serr RMSDs to the starting confs
-            ClusRMSDByConf = clusutl.ClusterRMSDByConf(ligand, ligTraj, clusResults)
-            popResults['confRMSDsByClusMean'] = ClusRMSDByConf['confRMSDsByClusMean']
-            popResults['confRMSDsByClusSerr'] = ClusRMSDByConf['confRMSDsByClusSerr']
+            # using the symmetry atom maps cached by the clustering cube
+            if oeclusRecord.has_field(Fields.Analysis.oeclus_distances):
+                cache = rmsdutl.load_distance_cache(oeclusRecord.get_value(Fields.Analysis.oeclus_distances))
+                atomIdx, symMaps = cache['atom_idx'], cache['maps']
+            else:
+                atomIdx, symMaps = rmsdutl.symmetry_maps(ligand)
+            ligXyz = OETrajStore.from_oemol(ligTraj).xyz[:, atomIdx]
+            confXyz = OETrajStore.from_oemol(ligand).xyz[:, atomIdx]
+            confRMSDsByClusMean, confRMSDsByClusSerr = rmsdutl.cluster_rmsd_by_conf(
+                confXyz, ligXyz, symMaps, clusResults['ClusterVec'], clusResults['nMajorClusters'])
+            popResults['confRMSDsByClusMean'] = confRMSDsByClusMean
+            popResults['confRMSDsByClusSerr'] = confRMSDsByClusSerr
 
             # Put these results on the record as a POD JSON object
             oeclusRecord.set_value(Fields.Analysis.cluspop_dict, popResults)
@@ -776,8 +902,15 @@ class TrajAnalysisReportDataset(RecordPortsMixin, ComputeCube):
                 if 'OEZap_MMPBSA6_Bind' not in PBSAdata.keys():
                     raise ValueError('{} could not find OEZap_MMPBSA6_Bind in PBSAdata'.format(system_title))
 
-                # Clean MMPBSA mean and serr to avoid nans and high zap energy values
-                avg_mmpbsa, serr_mmpbsa = clusutl.clean_mean_serr(PBSAdata['OEZap_MMPBSA6_Bind'])
+                # Clean MMPBSA mean and serr to avoid nans and high zap energy values. The sampled
+                # PBSA frames are weighted by the number of frames they stand for
+                pbsaWeights = PBSAdata.get('OEZap_Weight')
+                if pbsaWeights is None or len(set(w for w in pbsaWeights if w > 0)) <= 1:
+                    avg_mmpbsa, serr_mmpbsa = clusutl.clean_mean_serr(PBSAdata['OEZap_MMPBSA6_Bind'])
+                else:
+                    mean, serr = pbsautl.mean_serr_by_group(PBSAdata['OEZap_MMPBSA6_Bind'],
+                                                            np.zeros(len(pbsaWeights)), 1, pbsaWeights)
+                    avg_mmpbsa, serr_mmpbsa = mean[0], serr[0]
 
                 # Add to the record the MMPBSA mean and std
                 record.set_value(Fields.Analysis.mmpbsa_traj_mean, avg_mmpbsa)
@@ -1150,6 +1283,16 @@ class ExtractMDDataCube(RecordPortsMixin, ComputeCube):
                     with oechem.oemolostream(fn) as ofs:
                         oechem.OEWriteConstMolecule(ofs, prot)
 
+                elif name in "TrajStores_OPLMD":
+                    mdtrajrecord = MDDataRecord(oetraj_rec)
+                    for store_name, traj_title in [('protein', "ProteinTraj"), ('water', "WatTraj")]:
+                        if mdtrajrecord.has_traj_store(store_name):
+                            traj = mdtrajrecord.get_traj_store(store_name).to_oemol()
+                            traj.SetTitle(traj_title)
+                            fn = os.path.join(title, "{}_trajectory.oeb".format(store_name))
+                            with oechem.oemolostream(fn) as ofs:
+                                oechem.OEWriteConstMolecule(ofs, traj)
+
                 elif name in "WatTraj":
                     wat = oetraj_rec.get_value(fd)
                     wat.SetTitle("WatTraj")
@@ -1179,20 +1322,7 @@ class ExtractMDDataCube(RecordPortsMixin, ComputeCube):
             # Floe Report
             report_zip_fn = None
             if in_orion():
-                session = OrionSession(
-                    requests_session=get_session(
-                        retry_dict={
-                            403: 5,
-                            404: 20,
-                            409: 45,
-                            460: 15,
-                            500: 2,
-                            502: 45,
-                            503: 45,
-                            504: 45,
-                        }
-                    )
-                )
+                session = get_orion_session()
 
                 report_zip_fn = "floe_report.zip"
                 download_report(self.floe_report_collection_id, session, report_zip_fn)
@@ -1208,20 +1338,7 @@ class ExtractMDDataCube(RecordPortsMixin, ComputeCube):
 
             if in_orion():
 
-                session = OrionSession(
-                    requests_session=get_session(
-                        retry_dict={
-                            403: 5,
-                            404: 20,
-                            409: 45,
-                            460: 15,
-                            500: 2,
-                            502: 45,
-                            503: 45,
-                            504: 45,
-                        }
-                    )
-                )
+                session = get_orion_session()
 
                 file_upload = File.upload(session, self.opt['out_file_name'], tar_fn)
 
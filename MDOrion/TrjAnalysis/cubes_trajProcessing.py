@@ -29,7 +29,9 @@ from orionclient.session import in_orion
 
 import MDOrion.TrjAnalysis.utils as utl
 
-import oetrajanalysis.TrajMMPBSA_utils as mmpbsa
+import MDOrion.TrjAnalysis.pbsa_utils as pbsautl
+
+import MDOrion.TrjAnalysis.nonbonded_utils as nbutl
 
 from MDOrion.TrjAnalysis.water_utils import nmax_waters
 
@@ -37,6 +39,8 @@ from openeye import oechem
 
 import os
 
+import numpy as np
+
 import traceback
 
 from datarecord import (Types,
@@ -47,6 +51,11 @@ from datarecord import (Types,
 
 from MDOrion.Standards.mdrecord import MDDataRecord
 
+from MDOrion.Standards.record_store import RecordSpillStore
+
+from MDOrion.Standards.traj_store import (OETrajStore,
+                                          OEConcatTrajStore)
+
 
 class TrajToOEMolCube(RecordPortsMixin, ComputeCube):
     title = 'Traj to OEMol Cube'
@@ -65,7 +74,7 @@ class TrajToOEMolCube(RecordPortsMixin, ComputeCube):
 
     # Override defaults for some parameters
     parameter_overrides = {
-        "memory_mb": {"default": 32000},
+        "memory_mb": {"default": 14000},
         "spot_policy": {"default": "Allowed"},
         "prefetch_count": {"default": 1},  # 1 molecule at a time
         "item_count": {"default": 1}  # 1 molecule at a time
@@ -77,6 +86,20 @@ class TrajToOEMolCube(RecordPortsMixin, ComputeCube):
         help_text="""The cutoff distance in angstroms to select waters around the
         protein-ligand binding site for each trajectory frame""")
 
+    water_number = parameters.IntegerParameter(
+        'water_number',
+        default=30,
+        help_text="""The max number of waters to select around the protein-ligand
+        binding site for each trajectory frame""")
+
+    trajectory_stream = parameters.StringParameter(
+        'trajectory_stream',
+        default='analysis',
+        help_text="""The name of the atom subset trajectory stream to analyze.
+        If the MD stage carries the stream and the stream includes the protein
+        and ligand atoms and at least the max number of waters to select, the
+        stream is used in place of the full system trajectory""")
+
     def begin(self):
         self.opt = vars(self.args)
         self.opt['Logger'] = self.log
@@ -102,6 +125,9 @@ class TrajToOEMolCube(RecordPortsMixin, ComputeCube):
             #sys_id = mdrecord.get_flask_id
             opt['Logger'].info('{}: Attempting MD Traj conversion into OEMols'.format(system_title))
 
+            # The trajectory download overlaps with the stage data download
+            mdrecord.prefetch_stage(trajectory=True)
+
             traj_fn = mdrecord.get_stage_trajectory()
 
             opt['Logger'].info('{} Temp Directory: {}'.format(system_title, os.path.dirname(traj_fn)))
@@ -127,33 +153,66 @@ class TrajToOEMolCube(RecordPortsMixin, ComputeCube):
                 raise ValueError("Ligand Isomeric Smiles String check failure: {} vs {}".format(smi_lig_comp,
                                                                                                 smi_lig_ref))
 
-            ptraj, ltraj, wtraj = utl.extract_aligned_prot_lig_wat_traj(md_components, flask, traj_fn, opt,
-                                                                        water_cutoff=opt['water_cutoff'])
+            # The atom subset stream is analyzed in place of the full system trajectory if present
+            streams = mdrecord.get_stage_trajectory_streams()
+            stream_indices = None
+
+            if opt['trajectory_stream'] in streams:
+                stream_fn, stream_indices = streams[opt['trajectory_stream']]
+
+                set_up_flask, map_dic = md_components.create_flask
+                required = np.union1d(map_dic['protein'], map_dic['ligand'])
+
+                # The stream can carry only the waters near the ligand
+                n_waters = utl.count_stream_waters(flask, stream_indices)
+
+                if np.all(np.isin(required, stream_indices)) and n_waters >= opt['water_number']:
+                    opt['Logger'].info('{} Trajectory stream {} filename: {}'.format(system_title,
+                                                                                    opt['trajectory_stream'],
+                                                                                    stream_fn))
+                    traj_fn = stream_fn
+                else:
+                    opt['Logger'].warn('{} The trajectory stream {} does not include the protein and ligand atoms '
+                                       'and {} waters ({} waters found). The full system trajectory is used'.format(
+                                        system_title, opt['trajectory_stream'], opt['water_number'], n_waters))
+                    stream_indices = None
+
+            # The protein and water frames are written straight into the trajectory store
+            # arrays in the record working directory
+            pose_id = mdrecord.get_conf_id if mdrecord.has_conf_id else 0
+
+            pstore, ltraj, wstore = utl.extract_aligned_prot_lig_wat_stores(md_components, flask, traj_fn, opt,
+                                                                            mdrecord.cwd,
+                                                                            water_cutoff=opt['water_cutoff'],
+                                                                            nmax=opt['water_number'],
+                                                                            atom_indices=stream_indices,
+                                                                            pose_id=pose_id)
 
             ltraj.SetTitle(record.get_value(Fields.ligand_name))
-            ptraj.SetTitle(record.get_value(Fields.protein_name))
+            pstore.topology.SetTitle(record.get_value(Fields.protein_name))
 
-            opt['Logger'].info('{} #atoms, #confs in protein traj OEMol: {}, {}'.format(
-                system_title, ptraj.NumAtoms(), ptraj.NumConfs()))
+            opt['Logger'].info('{} #atoms, #frames in protein traj store: {}, {}'.format(
+                system_title, pstore.n_atoms, pstore.n_frames))
             opt['Logger'].info('{} #atoms, #confs in ligand traj OEMol: {}, {}'.format(
                 system_title, ltraj.NumAtoms(), ltraj.NumConfs()))
-            opt['Logger'].info('{} #atoms, #confs in water traj OEMol: {}, {}'.format(
-                system_title, wtraj.NumAtoms(), wtraj.NumConfs()))
+            opt['Logger'].info('{} #atoms, #frames in water traj store: {}, {}'.format(
+                system_title, wstore.n_atoms, wstore.n_frames))
 
             # Create new record with OETraj results
             oetrajRecord = OERecord()
 
             oetrajRecord.set_value(OEField('LigTraj', Types.Chem.Mol), ltraj)
 
-            if wtraj:
-                oetrajRecord.set_value(OEField('WatTraj', Types.Chem.Mol), wtraj)
-
             if in_orion():
                 oetrajRecord.set_value(Fields.collection, mdrecord.collection_id)
 
             mdrecord_traj = MDDataRecord(oetrajRecord)
 
-            mdrecord_traj.set_protein_traj(ptraj, shard_name="ProteinTrajConfs_")
+            # The protein and water trajectories are saved as array trajectory stores
+            mdrecord_traj.set_traj_store('protein', pstore, shard_name="ProteinTrajStore_")
+
+            if wstore.n_atoms > 0:
+                mdrecord_traj.set_traj_store('water', wstore, shard_name="WaterTrajStore_")
 
             record.set_value(Fields.Analysis.oetraj_rec, oetrajRecord)
 
@@ -283,6 +342,7 @@ class TrajPBSACube(RecordPortsMixin, ComputeCube):
     # Override defaults for some parameters
     parameter_overrides = {
         "memory_mb": {"default": 14000},
+        "cpu_count": {"default": 4},
         "spot_policy": {"default": "Allowed"},
         "prefetch_count": {"default": 1},  # 1 molecule at a time
         "item_count": {"default": 1}  # 1 molecule at a time
@@ -293,6 +353,43 @@ class TrajPBSACube(RecordPortsMixin, ComputeCube):
         default=False,
         help_text="""Enable MMPBSA calculation with explicit water""")
 
+    pbsa_stride = parameters.IntegerParameter(
+        'pbsa_stride',
+        default=1,
+        help_text="""The trajectory frame stride used to evaluate the PBSA
+        energies. The frames which are not evaluated are set to NaN""")
+
+    pbsa_start_time = parameters.DecimalParameter(
+        'pbsa_start_time',
+        default=0.0,
+        help_text="""The time in ns of the first trajectory frame used to
+        evaluate the PBSA energies""")
+
+    pbsa_end_time = parameters.DecimalParameter(
+        'pbsa_end_time',
+        default=0.0,
+        help_text="""The time in ns of the last trajectory frame used to
+        evaluate the PBSA energies. If zero the trajectory end is used""")
+
+    pbsa_converged_sampling = parameters.BooleanParameter(
+        'pbsa_converged_sampling',
+        default=False,
+        help_text="""Evaluate the PBSA energies on a stratified subset of the
+        selected frames, adding frames until the standard error of the mean
+        MMPBSA energy falls below the tolerance""")
+
+    pbsa_tolerance = parameters.DecimalParameter(
+        'pbsa_tolerance',
+        default=0.5,
+        help_text="""The standard error tolerance in kcal/mol of the
+        converged PBSA sampling""")
+
+    pbsa_strata = parameters.IntegerParameter(
+        'pbsa_strata',
+        default=10,
+        help_text="""The number of time contiguous frame strata of the
+        converged PBSA sampling""")
+
     def begin(self):
         self.opt = vars(self.args)
         self.opt['Logger'] = self.log
@@ -321,42 +418,22 @@ class TrajPBSACube(RecordPortsMixin, ComputeCube):
 
             mdtrajrecord = MDDataRecord(oetrajRecord)
 
-            if self.opt['explicit_water']:
-
-                water_traj = oetrajRecord.get_value(OEField('WatTraj', Types.Chem.Mol))
-                opt['Logger'].info('{} #atoms, #confs in water traj OEMol: {}, {}'
-                                   .format(system_title, water_traj.NumAtoms(), water_traj.NumConfs()))
-
-                protTraj = mdtrajrecord.get_protein_traj
-
-                prot_wat = oechem.OEMol(protTraj.GetActive())
-                oechem.OEAddMols(prot_wat, water_traj.GetActive())
+            prot_store = mdtrajrecord.get_traj_store('protein')
 
-                prot_wat.DeleteConfs()
-
-                for pr_conf, wat_conf in zip(protTraj.GetConfs(), water_traj.GetConfs()):
-                    pr_wat_conf = oechem.OEMol(pr_conf)
-                    oechem.OEAddMols(pr_wat_conf, wat_conf)
-                    pr_wat_conf_xyz = oechem.OEFloatArray(prot_wat.NumAtoms() * 3)
-                    pr_wat_conf.GetCoords(pr_wat_conf_xyz)
-                    prot_wat.NewConf(pr_wat_conf_xyz)
+            if self.opt['explicit_water']:
 
-                protTraj = prot_wat
-            else:
-                protTraj = mdtrajrecord.get_protein_traj
+                water_store = mdtrajrecord.get_traj_store('water')
+                opt['Logger'].info('{} #atoms, #confs in water traj store: {}, {}'
+                                   .format(system_title, water_store.n_atoms, water_store.n_frames))
 
-            opt['Logger'].info('{} #atoms, #confs in protein traj OEMol: {}, {}'
-                               .format(system_title, protTraj.NumAtoms(), protTraj.NumConfs()))
+                # The protein and water frames are joined on the coordinate arrays
+                prot_store = OETrajStore.concatenate_atoms([prot_store, water_store])
 
-            # Compute PBSA energies for the protein-ligand complex
-            PBSAdata = mmpbsa.TrajPBSA(ligTraj, protTraj)
-            if PBSAdata is None:
-                raise ValueError('{} Calculation of PBSA energies failed'.format(system_title))
+            opt['Logger'].info('{} #atoms, #confs in protein traj store: {}, {}'
+                               .format(system_title, prot_store.n_atoms, prot_store.n_frames))
 
-            # generate Surface Areas energy for buried SA based on 0.006 kcal/mol/A^2
-            PBSAdata['OEZap_SA6_Bind'] = [sa * -0.006 for sa in PBSAdata['OEZap_BuriedArea']]
-
-            # If the OETraj Interaction Energies has been done calculate MMPBSA values
+            # If the OETraj Interaction Energies has been done the MMPBSA values can be calculated
+            PLIntE = None
             if 'TrajIntE' in analysesDone:
                 opt['Logger'].info('{} found TrajIntE analyses'.format(system_title) )
 
@@ -375,6 +452,38 @@ class TrajPBSACube(RecordPortsMixin, ComputeCube):
                     opt['Logger'].info('{} found Protein-Ligand force field interaction energies'
                                        .format(system_title))
 
+            # Select the frames by time window and stride
+            end_time = opt['pbsa_end_time'] * 1000.0 if opt['pbsa_end_time'] > 0.0 else None
+            frames = pbsautl.select_frames(prot_store.frames['time'], opt['pbsa_stride'],
+                                           opt['pbsa_start_time'] * 1000.0, end_time)
+
+            # Compute PBSA energies for the protein-ligand complex
+            lig_store = OETrajStore.from_oemol(ligTraj)
+
+            if opt['pbsa_converged_sampling']:
+                opt['Logger'].info('{} sampling PBSA energies over {} frames to a {} kcal/mol standard error '
+                                   'with {} processes'.format(system_title, len(frames), opt['pbsa_tolerance'],
+                                                              opt['cpu_count']))
+
+                # The sampling converges the MMPBSA energy, or the PBSA contribution without
+                # the interaction energies
+                intE = np.zeros(prot_store.n_frames) if PLIntE is None else np.asarray(PLIntE)
+
+                def energy(data, batch_frames):
+                    return intE[batch_frames] + data['OEZap_PB_Desolvation'] - 0.006 * data['OEZap_BuriedArea']
+
+                PBSAdata = pbsautl.converged_traj_pbsa(lig_store, prot_store, frames, energy, opt['pbsa_tolerance'],
+                                                       n_strata=opt['pbsa_strata'], max_workers=opt['cpu_count'],
+                                                       logger=opt['Logger'])
+            else:
+                opt['Logger'].info('{} evaluating PBSA energies on {} of {} frames with {} processes'
+                                   .format(system_title, len(frames), prot_store.n_frames, opt['cpu_count']))
+                PBSAdata = pbsautl.parallel_traj_pbsa(lig_store, prot_store, frames, opt['cpu_count'])
+
+            # generate Surface Areas energy for buried SA based on 0.006 kcal/mol/A^2
+            PBSAdata['OEZap_SA6_Bind'] = [sa * -0.006 for sa in PBSAdata['OEZap_BuriedArea']]
+
+            if PLIntE is not None:
                 # Calculate  and store MMPB and MMPBSA energies on the trajPBSA record
                 PBSAdata['OEZap_MMPB_Bind'] = [eInt+eDesol for eInt, eDesol in
                                                zip(PLIntE, PBSAdata['OEZap_PB_Desolvation'])]
@@ -414,10 +523,10 @@ class TrajInteractionEnergyCube(RecordPortsMixin, ComputeCube):
     Protein-ligand interaction energies are calculated on an existing MD trajectory.
     The trajectory is taken from pre-existing protein and ligand trajectory OEMols.
     The forcefield used is taken from the parmed object associated with the trajectory
-    OEMols. The various energy components associated with the protein-ligand
-    interaction energies are attached to the record as per-frame vectors of floats.
-    This includes the MM interaction potential energies and their ligand, protein
-    and complex components. The energy units are in kcal/mol.
+    OEMols. The Coulomb and Lennard-Jones interaction energies of the ligand with the
+    protein and with the binding site waters are attached to the record as per-frame
+    vectors of floats, together with the protein-ligand interaction energies decomposed
+    by protein residue. The energy units are in kcal/mol.
     """
 
     uuid = "d10a770d-fcd2-4d09-bf00-00d6a00353de"
@@ -430,6 +539,12 @@ class TrajInteractionEnergyCube(RecordPortsMixin, ComputeCube):
         "item_count": {"default": 1}  # 1 molecule at a time
     }
 
+    intE_cutoff = parameters.DecimalParameter(
+        'intE_cutoff',
+        default=0.0,
+        help_text="""The cutoff distance in A of the nonbonded interaction
+        energies. If zero no cutoff is applied""")
+
     def begin(self):
         self.opt = vars(self.args)
         self.opt['Logger'] = self.log
@@ -462,22 +577,62 @@ class TrajInteractionEnergyCube(RecordPortsMixin, ComputeCube):
                                .format(system_title, ligTraj.NumAtoms(), ligTraj.NumConfs()))
 
             mdtrajrecord = MDDataRecord(oetrajRecord)
-            protTraj = mdtrajrecord.get_protein_traj
+            prot_store = mdtrajrecord.get_traj_store('protein')
 
-            opt['Logger'].info('{} #atoms, #confs in protein traj OEMol: {}, {}'.
-                               format(system_title, protTraj.NumAtoms(), protTraj.NumConfs()))
+            opt['Logger'].info('{} #atoms, #confs in protein traj store: {}, {}'.
+                               format(system_title, prot_store.n_atoms, prot_store.n_frames))
 
-            water_traj = oetrajRecord.get_value(OEField('WatTraj', Types.Chem.Mol))
-            opt['Logger'].info('{} #atoms, #confs in water traj OEMol: {}, {}'
-                               .format(system_title, water_traj.NumAtoms(), water_traj.NumConfs()))
+            water_store = mdtrajrecord.get_traj_store('water') if mdtrajrecord.has_traj_store('water') else None
+            if water_store is not None:
+                opt['Logger'].info('{} #atoms, #confs in water traj store: {}, {}'
+                                   .format(system_title, water_store.n_atoms, water_store.n_frames))
 
             prmed = mdrecord.get_parmed(sync_stage_name='last')
 
-            # Compute interaction energies for the protein, ligand, complex and water subsystems
-            intEdata = mmpbsa.ProtLigWatInteractionEFromParmedOETraj(prmed, ligTraj, protTraj, water_traj, opt)
+            # The protein and ligand trajectory atoms map onto the flask atoms of the parmed structure
+            set_up_flask, map_dic = mdrecord.get_md_components.create_flask
+            prot_idx = np.asarray(map_dic['protein'])
+            lig_idx = np.asarray(map_dic['ligand'])
+
+            lig_params = nbutl.nonbonded_parameters(prmed, lig_idx)
+            prot_params = nbutl.nonbonded_parameters(prmed, prot_idx)
+            prot_groups, res_labels = nbutl.residue_groups(prmed, prot_idx)
+
+            lig_xyz = OETrajStore.from_oemol(ligTraj).xyz[:, :len(lig_idx)]
+            cutoff = opt['intE_cutoff'] if opt['intE_cutoff'] > 0.0 else None
 
-            if intEdata is None:
-                raise ValueError('{} Calculation of Interaction Energies failed'.format(system_title))
+            # Compute the interaction energies of the ligand with the protein residues and the waters
+            res_coulomb, res_lj = nbutl.interaction_energies(lig_xyz, lig_params,
+                                                             prot_store.xyz[:, :len(prot_idx)], prot_params,
+                                                             groups_b=prot_groups, cutoff=cutoff)
+
+            if water_store is not None:
+                wat_params = nbutl.water_parameters(prmed, water_store.n_atoms // 3)
+                wat_coulomb, wat_lj = nbutl.interaction_energies(lig_xyz, lig_params, water_store.xyz, wat_params,
+                                                                 cutoff=cutoff)
+            else:
+                wat_coulomb = wat_lj = np.zeros((len(lig_xyz), 1))
+
+            prot_lig = res_coulomb.sum(axis=1) + res_lj.sum(axis=1)
+            wat_lig = wat_coulomb[:, 0] + wat_lj[:, 0]
+
+            intEdata = dict()
+            intEdata['protein_ligand_interE'] = prot_lig.tolist()
+            intEdata['protein_ligand_coulomb'] = res_coulomb.sum(axis=1).tolist()
+            intEdata['protein_ligand_lj'] = res_lj.sum(axis=1).tolist()
+            intEdata['water_ligand_interE'] = wat_lig.tolist()
+            intEdata['protein_and_water_ligand_interE'] = (prot_lig + wat_lig).tolist()
+
+            # The per residue decomposition is summarized on the dict and stored per frame on the record
+            res_total = res_coulomb + res_lj
+            intEdata['protein_residue_labels'] = res_labels
+            intEdata['protein_residue_ligand_interE_mean'] = res_total.mean(axis=0).tolist()
+            record.set_value(Fields.Analysis.oeintE_residues,
+                             nbutl.save_residue_energies(res_labels, res_coulomb, res_lj))
+
+            # Put the parmed charges on the ligand traj OEMol
+            for at in ligTraj.GetAtoms():
+                at.SetPartialCharge(float(lig_params[at.GetIdx(), 0]))
 
             # protein and ligand traj OEMols now have parmed charges on them; save these
             oetrajRecord.set_value(OEField('LigTraj', Types.Chem.Mol), ligTraj)
@@ -561,7 +716,7 @@ class ConfTrajsToLigTraj(RecordPortsMixin, ComputeCube):
             else:
                 opt['Logger'].info('{} found the conformer record'.format(system_title))
 
-            # set up ligand and LigTraj lists then loop over conformer records
+            # set up ligand and trajectory store lists then loop over conformer records
             poseIdVec = []
             ligTrajConfs = []
             protTrajConfs = []
@@ -577,67 +732,55 @@ class ConfTrajsToLigTraj(RecordPortsMixin, ComputeCube):
                 # Extract the ligand traj OEMol from the OETraj record
                 ligTraj = utl.RequestOEField( oetrajRecord, 'LigTraj', Types.Chem.Mol)
                 poseIdVec += [confid]*ligTraj.NumConfs()
-                ligTrajConfs.append(ligTraj)
+                ligTrajConfs.append(OETrajStore.from_oemol(ligTraj, pose_id=confid))
                 opt['Logger'].info('{} confID {}: adding ligTraj with {} atoms, {} confs'.format(
                     system_title, confid, ligTraj.NumAtoms(), ligTraj.NumConfs()) )
 
-                # Extract the activeSite water traj OEMol from the OETraj record
-                watTraj = utl.RequestOEField( oetrajRecord, 'WatTraj', Types.Chem.Mol)
+                # Extract the activeSite water and protein traj stores from the OETraj record
+                mdtrajrecord = MDDataRecord(oetrajRecord)
+
+                watTraj = mdtrajrecord.get_traj_store('water')
                 watTrajConfs.append(watTraj)
                 opt['Logger'].info('{} confID {}: adding watTraj with {} atoms, {} confs'.format(
-                    system_title, confid, watTraj.NumAtoms(), watTraj.NumConfs()) )
+                    system_title, confid, watTraj.n_atoms, watTraj.n_frames) )
 
-                # Extract the protTraj OEMol from the OETraj record
-                mdtrajrecord = MDDataRecord(oetrajRecord)
-                protTraj = mdtrajrecord.get_protein_traj
+                protTraj = mdtrajrecord.get_traj_store('protein')
                 protTrajConfs.append(protTraj)
                 opt['Logger'].info('{} confID {}: adding protTraj with {} atoms, {} confs'.format(
-                    system_title, confid, protTraj.NumAtoms(), protTraj.NumConfs()) )
+                    system_title, confid, protTraj.n_atoms, protTraj.n_frames) )
                 del mdtrajrecord
 
             if len(ligTrajConfs) < 1 or len(protTrajConfs) < 1:
                 raise ValueError('{} empty list of lig or protein trajectory OEMols'.format(system_title))
 
-            ligTraj = oechem.OEMol(ligTrajConfs[0])
-            xyz = oechem.OEFloatArray(3*ligTraj.GetMaxAtomIdx())
-            for trajMol in ligTrajConfs[1:]:
-                for conf in trajMol.GetConfs():
-                    conf.GetCoords(xyz)
-                    ligTraj.NewConf(xyz)
+            # The conformer trajectories are concatenated virtually: the water and protein
+            # stores refer to the conformer stores by pose id and frame range
+            confids = [utl.RequestOEFieldType(confrec, Fields.confid) for confrec in list_conf_rec]
+
+            ligTraj = OEConcatTrajStore(ligTrajConfs, confids).to_oemol()
             opt['Logger'].info('{} composite ligTraj has {} atoms, {} confs'.format(
                 system_title, ligTraj.NumAtoms(), ligTraj.NumConfs()) )
 
-            watTraj = oechem.OEMol(watTrajConfs[0])
-            xyz = oechem.OEFloatArray(3*watTraj.GetMaxAtomIdx())
-            for trajMol in watTrajConfs[1:]:
-                for conf in trajMol.GetConfs():
-                    conf.GetCoords(xyz)
-                    watTraj.NewConf(xyz)
+            watTraj = OEConcatTrajStore(watTrajConfs, confids)
             opt['Logger'].info('{} composite watTraj has {} atoms, {} confs'.format(
-                system_title, watTraj.NumAtoms(), watTraj.NumConfs()) )
-
-            protTraj = protTrajConfs[0]
-            xyz = oechem.OEFloatArray(3*protTraj.GetMaxAtomIdx())
-            for trajMol in protTrajConfs[1:]:
-                for conf in trajMol.GetConfs():
-                    conf.GetCoords(xyz)
-                    protTraj.NewConf(xyz)
+                system_title, watTraj.n_atoms, watTraj.n_frames) )
+
+            protTraj = OEConcatTrajStore(protTrajConfs, confids)
             opt['Logger'].info('{} composite protTraj has {} atoms, {} confs'.format(
-                system_title, protTraj.NumAtoms(), protTraj.NumConfs()))
+                system_title, protTraj.n_atoms, protTraj.n_frames))
 
             record.set_value(Fields.Analysis.poseIdVec, poseIdVec)
 
             # Create new record with OETraj results
             oetrajRecord = OERecord()
             oetrajRecord.set_value(OEField('LigTraj', Types.Chem.Mol), ligTraj)
-            if watTraj:
-                oetrajRecord.set_value(OEField('WatTraj', Types.Chem.Mol), watTraj)
 
             if in_orion():
                 collection_id = utl.RequestOEFieldType(record, Fields.collection)
                 oetrajRecord.set_value(Fields.collection, collection_id)
             mdrecord_traj = MDDataRecord(oetrajRecord)
-            mdrecord_traj.set_protein_traj(protTraj, shard_name="ProteinTrajConfs_")
+            mdrecord_traj.set_traj_store('protein', protTraj, shard_name="ProteinTrajStore_")
+            mdrecord_traj.set_traj_store('water', watTraj, shard_name="WaterTrajStore_")
 
             record.set_value(Fields.Analysis.oetraj_rec, oetrajRecord)
 
@@ -662,11 +805,14 @@ class ConformerGatheringData(RecordPortsMixin, ComputeCube):
     description = """
     This cube gathers together conformers related to the same ligand and their information
     in a new record containing the multi conformer ligand and each conformer record info.
+    The conformer records are spilled to a local record store and each ligand record is
+    emitted as soon as all its conformers have been gathered. The ligands with missing
+    conformers e.g. failed ones are emitted at the end
     """
 
     # Override defaults for some parameters
     parameter_overrides = {
-        "memory_mb": {"default": 32000},
+        "memory_mb": {"default": 6000},
         "spot_policy": {"default": "Prohibited"},
         "prefetch_count": {"default": 1},  # 1 molecule at a time
         "item_count": {"default": 1}  # 1 molecule at a time
@@ -678,8 +824,8 @@ class ConformerGatheringData(RecordPortsMixin, ComputeCube):
         self.opt = vars(self.args)
         self.opt['Logger'] = self.log
 
-        # This dictionary stores for each ligand all its conformers in a list
-        self.lig_sys_ids = dict()
+        # This store spills for each ligand all its conformer records
+        self.lig_sys_ids = RecordSpillStore()
 
     def process(self, record, port):
         try:
@@ -687,10 +833,11 @@ class ConformerGatheringData(RecordPortsMixin, ComputeCube):
 
             sys_id = mdrecord.get_lig_id
 
-            if sys_id not in self.lig_sys_ids.keys():
-                self.lig_sys_ids[sys_id] = [record]
-            else:
-                self.lig_sys_ids[sys_id].append(record)
+            count = self.lig_sys_ids.append(sys_id, record)
+
+            # The ligand is emitted as soon as all its conformers have arrived
+            if record.has_value(Fields.num_confs) and count == record.get_value(Fields.num_confs):
+                self.emit_ligand(self.lig_sys_ids.pop(sys_id))
 
         except Exception as e:
 
@@ -704,62 +851,73 @@ class ConformerGatheringData(RecordPortsMixin, ComputeCube):
     def end(self):
 
         try:
-            for sys_id, list_conf_rec in self.lig_sys_ids.items():
+            for sys_id in self.lig_sys_ids.keys():
 
-                # Save the first record to emit in failure cases
-                self.record = list_conf_rec
+                list_conf_rec = self.lig_sys_ids.pop(sys_id)
 
                 # catch case where for some reason the conf list list_conf_rec is empty
                 if len(list_conf_rec) < 1:
                     print('{} does not have any conformer data'.format(sys_id) )
                     continue
-                elif len(list_conf_rec) > 1:
-                    # Conformers for each ligand are sorted based on their confid in each ligand record
-                    list_conf_rec.sort(key=lambda x: x.get_value(Fields.confid))
-
-                new_rec = OERecord()
-                new_rec.set_value(Fields.Analysis.oetrajconf_rec, list_conf_rec)
-                # Get the first conf to move some general ligand data up to the top level
-                rec0 = list_conf_rec[0]
-                #   copy all the initial fields in Fields.ligInit_rec up to the top level
-                init_rec = rec0.get_value(Fields.ligInit_rec)
-
-                # TODO METADATA IS NOT COPIED?
-                for field in init_rec.get_fields():
-                    new_rec.set_value(field, init_rec.get_value(field))
-                #   next, fields that will simply be copied and not further used here
-                protein = rec0.get_value(Fields.protein)
-                new_rec.set_value(Fields.protein, protein)
-                ligid = rec0.get_value(Fields.ligid)
-                new_rec.set_value(Fields.ligid, ligid)
-                if in_orion():
-                    collection_id = rec0.get_value(Fields.collection)
-                    new_rec.set_value(Fields.collection, collection_id)
-                #   finally, fields that will be copied and also further used here
-                lig_multi_conf = oechem.OEMol(rec0.get_value(Fields.ligand))
-                protein_name = rec0.get_value(Fields.protein_name)
-
-                # MD Components copied at the ligi top level
-                new_rec.set_value(Fields.md_components, rec0.get_value(Fields.md_components))
-
-                # if >1 confs, add their confs to the parent ligand at the top level
-                for rec in list_conf_rec[1:]:
-                    lig_multi_conf.NewConf(rec.get_value(Fields.ligand))
-
-                # get name of initial molecule
-                init_mol = new_rec.get_value(OEField('Molecule', Types.Chem.Mol))
-                lig_title = init_mol.GetTitle()
-                lig_multi_conf.SetTitle(lig_title)
-                # regenerate protein-ligand title since all titles on conformers include conformer id
-                title = 'p' + protein_name + '_l' + lig_title
-                # set other fields on the new record
-                new_rec.set_value(Fields.title, title)
-                new_rec.set_value(Fields.ligand, lig_multi_conf)
-                new_rec.set_value(Fields.primary_molecule, lig_multi_conf)
-                new_rec.set_value(Fields.protein_name, protein_name)
-                new_rec.set_value(Fields.ligand_name, lig_title)
-
-                self.success.emit(new_rec)
+
+                self.emit_ligand(list_conf_rec)
+
+        finally:
+            self.lig_sys_ids.close()
+
+    def emit_ligand(self, list_conf_rec):
+
+        try:
+            # Save the first record to emit in failure cases
+            self.record = list_conf_rec[0]
+
+            if len(list_conf_rec) > 1:
+                # Conformers for each ligand are sorted based on their confid in each ligand record
+                list_conf_rec.sort(key=lambda x: x.get_value(Fields.confid))
+
+            new_rec = OERecord()
+            new_rec.set_value(Fields.Analysis.oetrajconf_rec, list_conf_rec)
+            # Get the first conf to move some general ligand data up to the top level
+            rec0 = list_conf_rec[0]
+            #   copy all the initial fields in Fields.ligInit_rec up to the top level
+            init_rec = rec0.get_value(Fields.ligInit_rec)
+
+            # TODO METADATA IS NOT COPIED?
+            for field in init_rec.get_fields():
+                new_rec.set_value(field, init_rec.get_value(field))
+            #   next, fields that will simply be copied and not further used here
+            protein = rec0.get_value(Fields.protein)
+            new_rec.set_value(Fields.protein, protein)
+            ligid = rec0.get_value(Fields.ligid)
+            new_rec.set_value(Fields.ligid, ligid)
+            if in_orion():
+                collection_id = rec0.get_value(Fields.collection)
+                new_rec.set_value(Fields.collection, collection_id)
+            #   finally, fields that will be copied and also further used here
+            lig_multi_conf = oechem.OEMol(rec0.get_value(Fields.ligand))
+            protein_name = rec0.get_value(Fields.protein_name)
+
+            # MD Components copied at the ligi top level
+            new_rec.set_value(Fields.md_components, rec0.get_value(Fields.md_components))
+
+            # if >1 confs, add their confs to the parent ligand at the top level
+            for rec in list_conf_rec[1:]:
+                lig_multi_conf.NewConf(rec.get_value(Fields.ligand))
+
+            # get name of initial molecule
+            init_mol = new_rec.get_value(OEField('Molecule', Types.Chem.Mol))
+            lig_title = init_mol.GetTitle()
+            lig_multi_conf.SetTitle(lig_title)
+            # regenerate protein-ligand title since all titles on conformers include conformer id
+            title = 'p' + protein_name + '_l' + lig_title
+            # set other fields on the new record
+            new_rec.set_value(Fields.title, title)
+            new_rec.set_value(Fields.ligand, lig_multi_conf)
+            new_rec.set_value(Fields.primary_molecule, lig_multi_conf)
+            new_rec.set_value(Fields.protein_name, protein_name)
+            new_rec.set_value(Fields.ligand_name, lig_title)
+
+            self.success.emit(new_rec)
 
         except Exception as e:
             print("Failed to complete", str(e), flush=True)
@@ -810,8 +968,10 @@ class NMaxWatersLigProt(RecordPortsMixin, ComputeCube):
     def begin(self):
         self.opt = vars(self.args)
         self.opt['Logger'] = self.log
-        self.nwaters = list()
-        self.records = list()
+
+        # The records are spilled to disk and only the running max number of waters is kept
+        self.max_waters = None
+        self.records = RecordSpillStore()
 
     def process(self, record, port):
         try:
@@ -837,8 +997,8 @@ class NMaxWatersLigProt(RecordPortsMixin, ComputeCube):
                 self.opt['Logger'].info("MMPBSA Explicit Water set off")
                 nmax = 0
 
-            self.nwaters.append(nmax)
-            self.records.append(record)
+            self.max_waters = nmax if self.max_waters is None else max(self.max_waters, nmax)
+            self.records.append(0, record)
 
         except Exception as e:
 
@@ -851,16 +1011,24 @@ class NMaxWatersLigProt(RecordPortsMixin, ComputeCube):
 
     def end(self):
 
-        max_waters = max(self.nwaters)
+        try:
+            if self.max_waters is None:
+                return
+
+            max_waters = self.max_waters
+
+            if max_waters == 0:
+                self.opt['Logger'].warn("[{}] Max number of waters is zero".format(self.title))
+            else:
+                self.opt['Logger'].info("[{}] Max number of Waters: {}".format(self.title, max_waters))
 
-        if max_waters == 0:
-            self.opt['Logger'].warn("[{}] Max number of waters is zero".format(self.title))
-        else:
-            self.opt['Logger'].info("[{}] Max number of Waters: {}".format(self.title, max_waters))
+            # The spilled records are read back one at a time
+            for rec in self.records.iter_records(0):
+                rec.set_value(Fields.Analysis.max_waters, max_waters)
+                self.success.emit(rec)
 
-        for rec in self.records:
-            rec.set_value(Fields.Analysis.max_waters, max_waters)
-            self.success.emit(rec)
+        finally:
+            self.records.close()
 
         return
 
@@ -0,0 +1,168 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+from openeye import oechem
+
+import numpy as np
+
+
+def coordinate_moments(xyz, labels, n_groups, chunk_size=500):
+    """
+    This function computes in a single pass over the trajectory frames the
+    per group coordinate means and the per atom mean square fluctuations.
+    The frames are grouped by label, e.g. the cluster labels, and the whole
+    trajectory is accumulated as an extra group
+
+    Parameters
+    ----------
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) coordinates. Memory mapped arrays are read
+        chunk by chunk
+    labels: list or numpy array
+        The (n_frames,) group labels. Frames with labels outside the range
+        [0, n_groups) only contribute to the whole trajectory group
+    n_groups: Int
+        The number of groups
+    chunk_size: Int
+        The number of frames read per chunk
+
+    Returns
+    -------
+    counts: numpy array
+        The (n_groups+1,) number of frames per group. The last entry is the
+        whole trajectory
+    mean: numpy array
+        The (n_groups+1, n_atoms, 3) mean coordinates
+    msf: numpy array
+        The (n_groups+1, n_atoms) mean square fluctuations in A^2
+    """
+
+    labels = np.asarray(labels, dtype=np.int64)
+    n_frames, n_atoms = xyz.shape[:2]
+
+    if len(labels) != n_frames:
+        raise ValueError("The number of labels does not match the number of frames: {} vs {}".format(
+            len(labels), n_frames))
+
+    sums = np.zeros((n_groups + 1, n_atoms * 3))
+    sumsq = np.zeros((n_groups + 1, n_atoms))
+
+    for start in range(0, n_frames, chunk_size):
+        chunk = np.asarray(xyz[start:start + chunk_size], dtype=np.float64)
+        lab = labels[start:start + chunk_size]
+
+        # Group membership matrix, the last row selects all the frames
+        member = np.zeros((n_groups + 1, len(chunk)))
+        member[lab[(lab >= 0) & (lab < n_groups)], np.flatnonzero((lab >= 0) & (lab < n_groups))] = 1.0
+        member[-1] = 1.0
+
+        sums += member @ chunk.reshape(len(chunk), -1)
+        sumsq += member @ (chunk ** 2).sum(axis=2)
+
+    counts = np.bincount(labels[(labels >= 0) & (labels < n_groups)], minlength=n_groups)
+    counts = np.append(counts, n_frames)
+
+    norm = np.maximum(counts, 1)[:, None]
+
+    mean = (sums / norm).reshape(n_groups + 1, n_atoms, 3)
+    msf = np.maximum(sumsq / norm - (mean ** 2).sum(axis=2), 0.0)
+
+    return counts, mean, msf
+
+
+def bfactors(msf):
+    """
+    This function converts the mean square fluctuations to B-factors
+
+    Parameters
+    ----------
+    msf: numpy array
+        The mean square fluctuations in A^2
+
+    Returns
+    -------
+    bfactors: numpy array
+        The B-factors in A^2
+    """
+
+    return 8.0 * np.pi ** 2 / 3.0 * np.asarray(msf)
+
+
+def closest_frame(xyz, ref, frames):
+    """
+    This function selects among the passed frames the one with the min in
+    place RMSD from the reference coordinates
+
+    Parameters
+    ----------
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) coordinates
+    ref: numpy array
+        The (n_atoms, 3) reference coordinates
+    frames: numpy array
+        The candidate frame indexes
+
+    Returns
+    -------
+    frame: Int
+        The closest frame index
+    """
+
+    frames = np.asarray(frames, dtype=np.int64)
+
+    msd = ((np.asarray(xyz[frames], dtype=np.float64) - ref) ** 2).sum(axis=(1, 2))
+
+    return int(frames[np.argmin(msd)])
+
+
+def coordinates_to_oemol(topology, coords, bfactor=None, title=None):
+    """
+    This function builds an OEMol from the topology and the passed
+    coordinates, optionally setting the per atom B-factors on the atom
+    residues
+
+    Parameters
+    ----------
+    topology: OEMol
+        The topology
+    coords: numpy array
+        The (n_atoms, 3) coordinates indexed by atom index
+    bfactor: numpy array or None
+        The (n_atoms,) B-factors indexed by atom index
+    title: String or None
+        The conformer title
+
+    Returns
+    -------
+    mol: OEMol
+        The molecule
+    """
+
+    mol = oechem.OEMol(topology)
+    mol.DeleteConfs()
+
+    conf = mol.NewConf(oechem.OEFloatArray(np.ascontiguousarray(coords, dtype=np.float32).ravel()))
+
+    if title is not None:
+        conf.SetTitle(title)
+
+    if bfactor is not None:
+        for at in mol.GetAtoms():
+            res = oechem.OEAtomGetResidue(at)
+            res.SetBFactor(float(bfactor[at.GetIdx()]))
+            oechem.OEAtomSetResidue(at, res)
+
+    return mol
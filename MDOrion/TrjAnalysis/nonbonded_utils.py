@@ -0,0 +1,247 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+import io
+
+import numpy as np
+
+from scipy import sparse
+
+
+# Coulomb constant in kcal/mol A / e^2
+COULOMB_CONSTANT = 332.0637
+
+
+def nonbonded_parameters(structure, atom_indices):
+    """
+    This function reads the charges and the Lennard-Jones parameters of the
+    selected atoms from a parmed structure
+
+    Parameters
+    ----------
+    structure: Parmed Structure
+        The parmed structure
+    atom_indices: list or numpy array
+        The structure atom indexes
+
+    Returns
+    -------
+    params: numpy array
+        The (n_atoms, 3) charges in e, sigma in A and epsilon in kcal/mol
+    """
+
+    atoms = structure.atoms
+
+    return np.array([[atoms[int(idx)].charge, atoms[int(idx)].sigma, atoms[int(idx)].epsilon]
+                     for idx in atom_indices], dtype=np.float64).reshape(-1, 3)
+
+
+def water_parameters(structure, n_waters):
+    """
+    This function reads the nonbonded parameters of the first water molecule
+    of a parmed structure and replicates them for the passed number of waters
+
+    Parameters
+    ----------
+    structure: Parmed Structure
+        The parmed structure
+    n_waters: Int
+        The number of water molecules
+
+    Returns
+    -------
+    params: numpy array
+        The (3*n_waters, 3) charges in e, sigma in A and epsilon in kcal/mol
+    """
+
+    for res in structure.residues:
+        if sorted(at.atomic_number for at in res.atoms) == [1, 1, 8]:
+            return np.tile(nonbonded_parameters(structure, [at.idx for at in res.atoms]), (n_waters, 1))
+
+    raise ValueError("No water molecule has been found in the structure: {}".format(structure.title))
+
+
+def residue_groups(structure, atom_indices):
+    """
+    This function groups the selected atoms by structure residue
+
+    Parameters
+    ----------
+    structure: Parmed Structure
+        The parmed structure
+    atom_indices: list or numpy array
+        The structure atom indexes
+
+    Returns
+    -------
+    groups: numpy array
+        The (n_atoms,) residue group index of each atom
+    labels: list
+        The residue labels as name, number and chain
+    """
+
+    residues = [structure.atoms[int(idx)].residue for idx in atom_indices]
+
+    order = {}
+    labels = []
+
+    for res in residues:
+        if res.idx not in order:
+            order[res.idx] = len(order)
+            labels.append('{}{}{}'.format(res.name, res.number, ':' + res.chain if res.chain else ''))
+
+    return np.array([order[res.idx] for res in residues], dtype=np.int64), labels
+
+
+def interaction_energies(xyz_a, params_a, xyz_b, params_b, groups_b=None, cutoff=None,
+                         frame_chunk=32, atom_block=1024):
+    """
+    This function computes the Coulomb and Lennard-Jones interaction energies
+    between two sets of atoms for all the trajectory frames. The atoms of the
+    second set are processed in blocks and the energies are decomposed by the
+    passed groups, e.g. the protein residues. The Lorentz-Berthelot mixing
+    rules are used. If a cutoff is passed the pairs beyond the cutoff are
+    excluded and the atom blocks out of the cutoff from the first set
+    bounding box are skipped
+
+    Parameters
+    ----------
+    xyz_a: numpy array
+        The (n_frames, n_a, 3) coordinates of the first set in A
+    params_a: numpy array
+        The (n_a, 3) charges, sigma and epsilon of the first set
+    xyz_b: numpy array
+        The (n_frames, n_b, 3) coordinates of the second set in A. Memory
+        mapped arrays are read chunk by chunk
+    params_b: numpy array
+        The (n_b, 3) charges, sigma and epsilon of the second set
+    groups_b: numpy array or None
+        The (n_b,) group index of the second set atoms. If None all the atoms
+        are in a single group
+    cutoff: Float or None
+        The cutoff distance in A. If None no cutoff is applied
+    frame_chunk: Int
+        The number of frames processed at a time
+    atom_block: Int
+        The number of second set atoms processed at a time
+
+    Returns
+    -------
+    coulomb, lj: numpy array
+        The (n_frames, n_groups) interaction energies in kcal/mol
+    """
+
+    n_frames, n_b = xyz_b.shape[:2]
+
+    if len(xyz_a) != n_frames:
+        raise ValueError("The number of frames does not match: {} vs {}".format(len(xyz_a), n_frames))
+
+    groups_b = np.zeros(n_b, dtype=np.int64) if groups_b is None else np.asarray(groups_b, dtype=np.int64)
+    n_groups = int(groups_b.max()) + 1 if n_b else 1
+
+    # Atom to group summation matrix
+    onehot = sparse.csr_matrix((np.ones(n_b), (np.arange(n_b), groups_b)), shape=(n_b, n_groups))
+
+    qa, sa, ea = (params_a[:, k] for k in range(3))
+    qb, sb, eb = (params_b[:, k] for k in range(3))
+
+    coulomb = np.zeros((n_frames, n_groups))
+    lj = np.zeros((n_frames, n_groups))
+
+    for fs in range(0, n_frames, frame_chunk):
+        fsl = slice(fs, min(fs + frame_chunk, n_frames))
+        a = np.asarray(xyz_a[fsl], dtype=np.float64)
+        b_chunk = np.asarray(xyz_b[fsl], dtype=np.float64)
+
+        if cutoff is not None:
+            lo = a.min(axis=(0, 1)) - cutoff
+            hi = a.max(axis=(0, 1)) + cutoff
+
+        for bs in range(0, n_b, atom_block):
+            bsl = slice(bs, min(bs + atom_block, n_b))
+            b = b_chunk[:, bsl]
+
+            if cutoff is not None and not np.any(np.all((b >= lo) & (b <= hi), axis=2)):
+                continue
+
+            r = np.sqrt(((a[:, :, None, :] - b[:, None, :, :]) ** 2).sum(axis=3))
+
+            sigma = 0.5 * (sa[:, None] + sb[None, bsl])
+            eps = np.sqrt(ea[:, None] * eb[None, bsl])
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                e_coul = COULOMB_CONSTANT * (qa[:, None] * qb[None, bsl]) / r
+                sr6 = (sigma / r) ** 6
+                e_lj = 4.0 * eps * (sr6 ** 2 - sr6)
+
+            if cutoff is not None:
+                out = r > cutoff
+                e_coul[out] = 0.0
+                e_lj[out] = 0.0
+
+            # Sum over the first set atoms, then over the second set groups
+            block = onehot[bsl]
+            coulomb[fsl] += block.T.dot(e_coul.sum(axis=1).T).T
+            lj[fsl] += block.T.dot(e_lj.sum(axis=1).T).T
+
+    return coulomb, lj
+
+
+def save_residue_energies(labels, coulomb, lj):
+    """
+    This function serializes the per residue interaction energies to a
+    compressed NumPy archive suitable to be stored on a record Blob field
+
+    Parameters
+    ----------
+    labels: list
+        The residue labels
+    coulomb: numpy array
+        The (n_frames, n_residues) Coulomb energies
+    lj: numpy array
+        The (n_frames, n_residues) Lennard-Jones energies
+
+    Returns
+    -------
+    blob: bytes
+        The serialized data
+    """
+
+    buf = io.BytesIO()
+    np.savez_compressed(buf, labels=np.array(labels),
+                        coulomb=np.asarray(coulomb, dtype=np.float32),
+                        lj=np.asarray(lj, dtype=np.float32))
+
+    return buf.getvalue()
+
+
+def load_residue_energies(blob):
+    """
+    This function deserializes the per residue interaction energies
+
+    Parameters
+    ----------
+    blob: bytes
+        The serialized data
+
+    Returns
+    -------
+    data: dict
+        The labels, coulomb and lj arrays
+    """
+
+    with np.load(io.BytesIO(bytes(blob))) as data:
+        return {key: data[key] for key in data.files}
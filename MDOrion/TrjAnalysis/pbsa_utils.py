@@ -0,0 +1,362 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import oetrajanalysis.TrajMMPBSA_utils as mmpbsa
+
+from MDOrion.TrjAnalysis.utils import (mol_from_bytes,
+                                      mol_to_bytes)
+
+
+def select_frames(times, stride=1, start_time=None, end_time=None):
+    """
+    This function selects the trajectory frames to evaluate by time window
+    and stride
+
+    Parameters
+    ----------
+    times: numpy array
+        The (n_frames,) frame times in ps
+    stride: Int
+        The frame stride applied to the frames in the time window
+    start_time: Float or None
+        The time window start in ps. If None the trajectory start is used
+    end_time: Float or None
+        The time window end in ps. If None the trajectory end is used
+
+    Returns
+    -------
+    frames: numpy array
+        The selected frame indexes
+    """
+
+    if stride < 1:
+        raise ValueError("The frame stride must be a positive integer: {}".format(stride))
+
+    times = np.asarray(times, dtype=np.float64)
+    window = np.ones(len(times), dtype=bool)
+
+    if start_time is not None:
+        window &= times >= start_time
+    if end_time is not None:
+        window &= times <= end_time
+
+    return np.flatnonzero(window)[::stride]
+
+
+def _traj_pbsa(job):
+    # Process pool worker, the frame chunk OEMols are passed as OEB bytes
+    lig_traj, prot_traj = (mol_from_bytes(data) for data in job)
+
+    data = mmpbsa.TrajPBSA(lig_traj, prot_traj)
+
+    if data is None:
+        raise ValueError("Calculation of PBSA energies failed on {} frames".format(lig_traj.NumConfs()))
+
+    return data
+
+
+def _evaluate_frames(lig_store, prot_store, frames, max_workers):
+    # The PBSA energy components of the passed frames, in frame order,
+    # evaluated over one contiguous frame chunk per process
+    chunks = [chunk for chunk in np.array_split(frames, min(max_workers, len(frames))) if len(chunk)]
+
+    jobs = [(mol_to_bytes(lig_store.take(chunk).to_oemol()), mol_to_bytes(prot_store.take(chunk).to_oemol()))
+            for chunk in chunks]
+
+    if len(jobs) == 1:
+        results = [_traj_pbsa(jobs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=len(jobs)) as executor:
+            results = list(executor.map(_traj_pbsa, jobs))
+
+    return {key: np.concatenate([np.asarray(res[key], dtype=np.float64) for res in results])
+            for key in results[0].keys()}
+
+
+def _pbsa_data(n_frames, frames, components, weights):
+    # The per frame PBSA data dict, the frames which are not evaluated are set to NaN
+    PBSAdata = dict()
+
+    for key, values in components.items():
+        data = np.full(n_frames, np.nan)
+        data[frames] = values
+        PBSAdata[key] = data.tolist()
+
+    evaluated = np.zeros(n_frames, dtype=bool)
+    evaluated[frames] = True
+    PBSAdata['OEZap_Evaluated'] = evaluated.tolist()
+
+    weight = np.zeros(n_frames)
+    weight[frames] = weights
+    PBSAdata['OEZap_Weight'] = weight.tolist()
+
+    return PBSAdata
+
+
+def _check_stores(lig_store, prot_store, frames):
+    if lig_store.n_frames != prot_store.n_frames:
+        raise ValueError("Ligand and protein frame mismatch: {} vs {}".format(
+            lig_store.n_frames, prot_store.n_frames))
+
+    if not len(frames):
+        raise ValueError("The PBSA frame selection is empty")
+
+
+def parallel_traj_pbsa(lig_store, prot_store, frames, max_workers=None):
+    """
+    This function computes the trajectory PBSA energies over the selected
+    frames in a process pool. The frames are split in one contiguous chunk
+    per worker so that each worker evaluates its consecutive frames in a
+    single TrajPBSA call. The frames which are not evaluated are set to NaN
+
+    Parameters
+    ----------
+    lig_store: OETrajStore
+        The ligand trajectory store
+    prot_store: OETrajStore
+        The protein trajectory store with the same frames
+    frames: numpy array
+        The frame indexes to evaluate
+    max_workers: Int or None
+        The max number of processes. If None the number of cpus is used
+
+    Returns
+    -------
+    PBSAdata: dict
+        The per frame PBSA energy components for all the trajectory frames.
+        The OEZap_Evaluated key flags the evaluated frames and the
+        OEZap_Weight key holds their statistical weights
+    """
+
+    frames = np.asarray(frames, dtype=np.int64)
+
+    _check_stores(lig_store, prot_store, frames)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    components = _evaluate_frames(lig_store, prot_store, frames, max_workers)
+
+    return _pbsa_data(lig_store.n_frames, frames, components, np.ones(len(frames)))
+
+
+def _spread_order(size):
+    # The positions 0..size-1 ordered by the van der Corput sequence so that
+    # any leading subset is evenly spread over the range
+    order = []
+    seen = np.zeros(size, dtype=bool)
+    k = 0
+
+    while len(order) < size:
+        vdc, denom, n = 0.0, 1.0, k
+        while n:
+            denom *= 2.0
+            n, rem = divmod(n, 2)
+            vdc += rem / denom
+
+        pos = int(vdc * size)
+        if not seen[pos]:
+            seen[pos] = True
+            order.append(pos)
+        k += 1
+
+    return order
+
+
+def stratified_serr(values, strata):
+    """
+    This function computes the standard error of the stratified mean
+
+    Parameters
+    ----------
+    values: list
+        The list of the evaluated values per stratum
+    strata: list
+        The list of the stratum sizes
+
+    Returns
+    -------
+    serr: Float
+        The standard error. It is infinite if a stratum with unevaluated
+        frames has less than two evaluated values
+    """
+
+    total = float(sum(strata))
+    var = 0.0
+
+    for vals, size in zip(values, strata):
+        if len(vals) == size:
+            continue
+        if len(vals) < 2:
+            return np.inf
+        # Finite population correction
+        var += (size / total) ** 2 * np.var(vals, ddof=1) / len(vals) * (1.0 - len(vals) / size)
+
+    return float(np.sqrt(var))
+
+
+def converged_traj_pbsa(lig_store, prot_store, frames, energy, tolerance, n_strata=10, batch_size=2,
+                        max_workers=None, logger=None):
+    """
+    This function computes the trajectory PBSA energies over a stratified
+    subset of the selected frames. The frames are split in time contiguous
+    strata and at each round batch_size new frames per stratum, evenly
+    spread over the stratum, are evaluated in a process pool. The sampling
+    stops when the standard error of the stratified mean of the energy falls
+    below the tolerance or all the frames are evaluated
+
+    Parameters
+    ----------
+    lig_store: OETrajStore
+        The ligand trajectory store
+    prot_store: OETrajStore
+        The protein trajectory store with the same frames
+    frames: numpy array
+        The frame indexes to sample
+    energy: callable
+        The function taking the PBSA components dict and the frame indexes
+        and returning the per frame energy to converge
+    tolerance: Float
+        The standard error tolerance in kcal/mol
+    n_strata: Int
+        The number of strata
+    batch_size: Int
+        The number of frames per stratum evaluated at each round
+    max_workers: Int or None
+        The max number of processes. If None the number of cpus is used
+    logger: Logger or None
+        The logger used to report the sampling progress
+
+    Returns
+    -------
+    PBSAdata: dict
+        The per frame PBSA energy components for all the trajectory frames.
+        The OEZap_Evaluated key flags the evaluated frames and the
+        OEZap_Weight key holds the stratum size over the evaluated frames
+        in the stratum
+    """
+
+    frames = np.asarray(frames, dtype=np.int64)
+
+    _check_stores(lig_store, prot_store, frames)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    strata = [stratum for stratum in np.array_split(frames, min(n_strata, len(frames))) if len(stratum)]
+    orders = [[stratum[pos] for pos in _spread_order(len(stratum))] for stratum in strata]
+    taken = [0] * len(strata)
+
+    evaluated = []
+    components = dict()
+    values = [[] for _ in strata]
+
+    while True:
+        batch = []
+        for idx, order in enumerate(orders):
+            new = order[taken[idx]:taken[idx] + max(batch_size, 2 - taken[idx])]
+            taken[idx] += len(new)
+            batch.append(new)
+
+        batch_frames = np.array([frame for new in batch for frame in new], dtype=np.int64)
+
+        if not len(batch_frames):
+            break
+
+        data = _evaluate_frames(lig_store, prot_store, batch_frames, max_workers)
+        batch_energy = np.asarray(energy(data, batch_frames), dtype=np.float64)
+
+        start = 0
+        for idx, new in enumerate(batch):
+            vals = batch_energy[start:start + len(new)]
+            values[idx].extend(vals[np.isfinite(vals)].tolist())
+            start += len(new)
+
+        evaluated.append(batch_frames)
+        for key, vals in data.items():
+            components.setdefault(key, []).append(vals)
+
+        serr = stratified_serr(values, [len(stratum) for stratum in strata])
+
+        if logger is not None:
+            logger.info('PBSA sampling: {} of {} frames evaluated, standard error {:.3f} kcal/mol'.format(
+                sum(taken), len(frames), serr))
+
+        if serr < tolerance:
+            break
+
+    evaluated = np.concatenate(evaluated)
+    components = {key: np.concatenate(vals) for key, vals in components.items()}
+
+    # The evaluated frames stand for their stratum
+    weight_by_stratum = np.array([len(stratum) / count for stratum, count in zip(strata, taken)])
+    stratum_of = np.zeros(lig_store.n_frames, dtype=np.int64)
+    for idx, stratum in enumerate(strata):
+        stratum_of[stratum] = idx
+
+    return _pbsa_data(lig_store.n_frames, evaluated, components, weight_by_stratum[stratum_of[evaluated]])
+
+
+def mean_serr_by_group(values, groups, n_groups, weights=None):
+    """
+    This function computes the weighted mean and standard error of the per
+    frame values by group ignoring the frames which have not been evaluated
+    (NaN). The standard error uses the Kish effective sample size
+
+    Parameters
+    ----------
+    values: list or numpy array
+        The (n_frames,) per frame values
+    groups: list or numpy array
+        The (n_frames,) group indexes in [0, n_groups)
+    n_groups: Int
+        The number of groups
+    weights: list or numpy array or None
+        The (n_frames,) per frame weights. If None uniform weights are used
+
+    Returns
+    -------
+    mean, serr: list
+        The (n_groups,) means and standard errors. Groups without
+        evaluated frames are set to NaN
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    groups = np.asarray(groups, dtype=np.int64)
+
+    weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    ok = np.isfinite(values) & (weights > 0)
+    g, v, w = groups[ok], values[ok], weights[ok]
+
+    sw = np.bincount(g, weights=w, minlength=n_groups)
+    sw2 = np.bincount(g, weights=w ** 2, minlength=n_groups)
+    swv = np.bincount(g, weights=w * v, minlength=n_groups)
+    swv2 = np.bincount(g, weights=w * v ** 2, minlength=n_groups)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = swv / sw
+        var = np.maximum(swv2 / sw - mean ** 2, 0.0)
+        n_eff = sw ** 2 / sw2
+        serr = np.sqrt(var / n_eff)
+
+    return mean.tolist(), serr.tolist()
@@ -0,0 +1,765 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+import os
+
+import io
+
+from concurrent.futures import ThreadPoolExecutor
+
+from openeye import oechem
+
+import numpy as np
+
+
+def symmetry_maps(mol, heavy_only=True, max_maps=24):
+    """
+    This function generates the symmetry equivalent atom maps of the passed
+    molecule. The maps are used to make the RMSD calculations invariant under
+    the exchange of topologically equivalent atoms (e.g. the oxygens of a
+    carboxylate or the carbons of a phenyl ring)
+
+    Parameters
+    ----------
+    mol: OEMol
+        The molecule
+    heavy_only: Bool
+        If True only the heavy atoms are selected
+    max_maps: Int
+        The max number of automorphisms to enumerate
+
+    Returns
+    -------
+    atom_idx: numpy array
+        The (n_sel,) selected atom indexes, sorted by atom index
+    maps: numpy array
+        The (n_maps, n_sel) atom maps as positions in atom_idx. The first map
+        is always the identity
+    """
+
+    pred = oechem.OEIsHeavy() if heavy_only else oechem.OEIsTrueAtom()
+
+    atom_idx = np.array(sorted(at.GetIdx() for at in mol.GetAtoms(pred)), dtype=np.int64)
+
+    if not len(atom_idx):
+        raise ValueError("No atoms have been selected for the molecule: {}".format(mol.GetTitle()))
+
+    # The subset molecule atoms follow the parent molecule atom order
+    query = oechem.OEMol()
+    oechem.OESubsetMol(query, mol, pred)
+
+    identity = np.arange(len(atom_idx))
+    maps = [identity]
+
+    ss = oechem.OESubSearch(query, oechem.OEExprOpts_DefaultAtoms, oechem.OEExprOpts_DefaultBonds)
+    ss.SetMaxMatches(max_maps)
+
+    for match in ss.Match(query, False):
+        perm = np.empty(len(atom_idx), dtype=np.int64)
+        for pair in match.GetAtoms():
+            perm[pair.pattern.GetIdx()] = pair.target.GetIdx()
+        if not any(np.array_equal(perm, m) for m in maps):
+            maps.append(perm)
+
+    return atom_idx, np.array(maps[:max_maps], dtype=np.int64)
+
+
+def inplace_rmsd(ref, xyz, maps=None):
+    """
+    This function computes the in place RMSD, without superposition, between
+    a reference structure and a batch of structures
+
+    Parameters
+    ----------
+    ref: numpy array
+        The (n_atoms, 3) reference coordinates
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) coordinates
+    maps: numpy array or None
+        The (n_maps, n_atoms) symmetry atom maps. The min RMSD over the maps
+        is returned
+
+    Returns
+    -------
+    rmsd: numpy array
+        The (n_frames,) RMSD values in A
+    """
+
+    ref = np.asarray(ref, dtype=np.float64)
+    xyz = np.asarray(xyz, dtype=np.float64)
+
+    if maps is None:
+        maps = np.arange(ref.shape[0])[None, :]
+
+    msd = np.full(len(xyz), np.inf)
+
+    for m in maps:
+        msd = np.minimum(msd, ((xyz - ref[m]) ** 2).sum(axis=(1, 2)))
+
+    return np.sqrt(msd / ref.shape[0])
+
+
+def _kabsch_msd(a, b):
+    """
+    This function computes the mean square deviation after optimal
+    superposition of centered structures, broadcasting over the leading
+    dimensions. Only the singular values of the correlation matrices are
+    computed and the reflection is removed by the determinant sign
+
+    Parameters
+    ----------
+    a: numpy array
+        The (..., n_atoms, 3) centered coordinates
+    b: numpy array
+        The (..., n_atoms, 3) centered coordinates
+
+    Returns
+    -------
+    msd: numpy array
+        The mean square deviations
+    """
+
+    h = np.einsum('...ki,...kj->...ij', a, b)
+
+    s = np.linalg.svd(h, compute_uv=False)
+    d = np.sign(np.linalg.det(h))
+
+    e = (a ** 2).sum(axis=(-2, -1)) + (b ** 2).sum(axis=(-2, -1)) - 2.0 * (s[..., 0] + s[..., 1] + d * s[..., 2])
+
+    return np.maximum(e, 0.0) / a.shape[-2]
+
+
+def superposed_rmsd(ref, xyz, maps=None):
+    """
+    This function computes the RMSD after optimal superposition (Kabsch)
+    between a reference structure and a batch of structures
+
+    Parameters
+    ----------
+    ref: numpy array
+        The (n_atoms, 3) reference coordinates
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) coordinates
+    maps: numpy array or None
+        The (n_maps, n_atoms) symmetry atom maps. The min RMSD over the maps
+        is returned
+
+    Returns
+    -------
+    rmsd: numpy array
+        The (n_frames,) RMSD values in A
+    """
+
+    ref = np.asarray(ref, dtype=np.float64)
+    ref = ref - ref.mean(axis=0)
+
+    xyz = np.asarray(xyz, dtype=np.float64)
+    xyz = xyz - xyz.mean(axis=1, keepdims=True)
+
+    if maps is None:
+        maps = np.arange(ref.shape[0])[None, :]
+
+    msd = np.full(len(xyz), np.inf)
+
+    for m in maps:
+        msd = np.minimum(msd, _kabsch_msd(xyz, ref[m][None]))
+
+    return np.sqrt(msd)
+
+
+def _condensed_index(n, i, j):
+    # The scipy squareform condensed index of the pairs i < j
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+
+def _pairwise_blocks(n, kernel, block_size, n_jobs):
+    """
+    This function fills a condensed pairwise matrix by evaluating the passed
+    kernel over the upper triangular blocks of frames. The blocks are
+    distributed over a pool of threads; the NumPy/LAPACK kernels release the
+    GIL so the blocks run on multiple cores
+
+    Parameters
+    ----------
+    n: Int
+        The number of frames
+    kernel: callable
+        The kernel taking two frame slices and returning the block matrix
+    block_size: Int
+        The number of frames per block
+    n_jobs: Int or None
+        The number of threads. If None the number of cpus is used
+
+    Returns
+    -------
+    condensed: numpy array
+        The (n*(n-1)/2,) condensed matrix
+    """
+
+    condensed = np.zeros(n * (n - 1) // 2, dtype=np.float32)
+
+    starts = range(0, n, block_size)
+    blocks = [(bi, bj) for bi in starts for bj in starts if bj >= bi]
+
+    def fill(block):
+        bi, bj = block
+        si = slice(bi, min(bi + block_size, n))
+        sj = slice(bj, min(bj + block_size, n))
+
+        values = kernel(si, sj)
+
+        ii, jj = np.meshgrid(np.arange(si.start, si.stop), np.arange(sj.start, sj.stop), indexing='ij')
+        upper = ii < jj
+
+        condensed[_condensed_index(n, ii[upper], jj[upper])] = values[upper]
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+        list(executor.map(fill, blocks))
+
+    return condensed
+
+
+def cross_rmsd(xyz_a, xyz_b, maps=None):
+    """
+    This function computes the symmetry aware in place RMSD matrix between
+    two batches of structures. The square deviations are evaluated as
+    |a - b|^2 = |a|^2 + |b|^2 - 2 a.b by matrix products
+
+    Parameters
+    ----------
+    xyz_a: numpy array
+        The (n_a, n_atoms, 3) coordinates
+    xyz_b: numpy array
+        The (n_b, n_atoms, 3) coordinates
+    maps: numpy array or None
+        The (n_maps, n_atoms) symmetry atom maps. The min RMSD over the maps
+        is returned
+
+    Returns
+    -------
+    rmsd: numpy array
+        The (n_a, n_b) RMSD matrix in A
+    """
+
+    xyz_a = np.asarray(xyz_a, dtype=np.float64)
+    xyz_b = np.asarray(xyz_b, dtype=np.float64)
+
+    n_atoms = xyz_a.shape[1]
+
+    if maps is None:
+        maps = np.arange(n_atoms)[None, :]
+
+    a = xyz_a.reshape(len(xyz_a), -1)
+    sq_a = (a ** 2).sum(axis=1)
+    sq_b = (xyz_b ** 2).sum(axis=(1, 2))
+
+    msd = np.full((len(xyz_a), len(xyz_b)), np.inf)
+
+    for m in maps:
+        b = xyz_b[:, m].reshape(len(xyz_b), -1)
+        msd = np.minimum(msd, sq_a[:, None] + sq_b[None, :] - 2.0 * a @ b.T)
+
+    return np.sqrt(np.maximum(msd, 0.0) / n_atoms)
+
+
+def pairwise_rmsd(xyz, maps=None, superpose=False, block_size=256, n_jobs=None):
+    """
+    This function computes the symmetry aware pairwise RMSD matrix of a batch
+    of structures in the scipy condensed form
+
+    Parameters
+    ----------
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) coordinates
+    maps: numpy array or None
+        The (n_maps, n_atoms) symmetry atom maps. The min RMSD over the maps
+        is returned
+    superpose: Bool
+        If True the RMSD is computed after optimal superposition, otherwise
+        in place
+    block_size: Int
+        The number of frames per block
+    n_jobs: Int or None
+        The number of threads. If None the number of cpus is used
+
+    Returns
+    -------
+    condensed: numpy array
+        The (n_frames*(n_frames-1)/2,) condensed RMSD matrix in A
+    """
+
+    xyz = np.asarray(xyz, dtype=np.float64)
+    n_frames, n_atoms = xyz.shape[:2]
+
+    if maps is None:
+        maps = np.arange(n_atoms)[None, :]
+
+    if superpose:
+        xyz = xyz - xyz.mean(axis=1, keepdims=True)
+
+        def kernel(si, sj):
+            a = xyz[si][:, None]
+            msd = np.full((a.shape[0], sj.stop - sj.start), np.inf)
+            for m in maps:
+                msd = np.minimum(msd, _kabsch_msd(a, xyz[sj][:, m][None]))
+            return np.sqrt(msd)
+    else:
+        def kernel(si, sj):
+            return cross_rmsd(xyz[si], xyz[sj], maps)
+
+    return _pairwise_blocks(n_frames, kernel, block_size, n_jobs)
+
+
+def rotor_torsions(mol):
+    """
+    This function selects the heavy atom quadruplets defining the torsion
+    angles of the rotatable bonds of the passed molecule
+
+    Parameters
+    ----------
+    mol: OEMol
+        The molecule
+
+    Returns
+    -------
+    torsions: numpy array
+        The (n_rotors, 4) atom indexes
+    """
+
+    torsions = []
+
+    for bond in mol.GetBonds(oechem.OEIsRotor()):
+        b, c = bond.GetBgn(), bond.GetEnd()
+
+        a = [nbr for nbr in b.GetAtoms(oechem.OEIsHeavy()) if nbr != c]
+        d = [nbr for nbr in c.GetAtoms(oechem.OEIsHeavy()) if nbr != b]
+
+        if not a or not d:
+            continue
+
+        a = min(a, key=lambda at: at.GetIdx())
+        d = min(d, key=lambda at: at.GetIdx())
+
+        torsions.append([a.GetIdx(), b.GetIdx(), c.GetIdx(), d.GetIdx()])
+
+    return np.array(torsions, dtype=np.int64).reshape(-1, 4)
+
+
+def torsion_angles(xyz, torsions):
+    """
+    This function computes the dihedral angles of a batch of structures
+
+    Parameters
+    ----------
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) coordinates indexed by atom index
+    torsions: numpy array
+        The (n_rotors, 4) atom indexes
+
+    Returns
+    -------
+    angles: numpy array
+        The (n_frames, n_rotors) dihedral angles in radians
+    """
+
+    xyz = np.asarray(xyz, dtype=np.float64)
+
+    p0, p1, p2, p3 = (xyz[:, torsions[:, k]] for k in range(4))
+
+    b0 = p0 - p1
+    b1 = p2 - p1
+    b2 = p3 - p2
+
+    b1 = b1 / np.linalg.norm(b1, axis=-1, keepdims=True)
+
+    v = b0 - (b0 * b1).sum(axis=-1, keepdims=True) * b1
+    w = b2 - (b2 * b1).sum(axis=-1, keepdims=True) * b1
+
+    x = (v * w).sum(axis=-1)
+    y = (np.cross(b1, v) * w).sum(axis=-1)
+
+    return np.arctan2(y, x)
+
+
+def cross_torsion_distance(angles_a, angles_b):
+    """
+    This function computes the RMS of the periodic torsion angle differences
+    between two batches of structures
+
+    Parameters
+    ----------
+    angles_a: numpy array
+        The (n_a, n_rotors) dihedral angles in radians
+    angles_b: numpy array
+        The (n_b, n_rotors) dihedral angles in radians
+
+    Returns
+    -------
+    dist: numpy array
+        The (n_a, n_b) distance matrix in radians
+    """
+
+    angles_a = np.asarray(angles_a, dtype=np.float64)
+    angles_b = np.asarray(angles_b, dtype=np.float64)
+
+    if not angles_a.shape[1]:
+        return np.zeros((len(angles_a), len(angles_b)))
+
+    diff = angles_a[:, None] - angles_b[None, :]
+    diff = (diff + np.pi) % (2.0 * np.pi) - np.pi
+
+    return np.sqrt((diff ** 2).mean(axis=-1))
+
+
+def pairwise_torsion_distance(angles, block_size=256, n_jobs=None):
+    """
+    This function computes the pairwise RMS of the periodic torsion angle
+    differences in the scipy condensed form
+
+    Parameters
+    ----------
+    angles: numpy array
+        The (n_frames, n_rotors) dihedral angles in radians
+    block_size: Int
+        The number of frames per block
+    n_jobs: Int or None
+        The number of threads. If None the number of cpus is used
+
+    Returns
+    -------
+    condensed: numpy array
+        The (n_frames*(n_frames-1)/2,) condensed distance matrix in radians
+    """
+
+    angles = np.asarray(angles, dtype=np.float64)
+    n_frames = len(angles)
+
+    if not angles.shape[1]:
+        return np.zeros(n_frames * (n_frames - 1) // 2, dtype=np.float32)
+
+    def kernel(si, sj):
+        return cross_torsion_distance(angles[si], angles[sj])
+
+    return _pairwise_blocks(n_frames, kernel, block_size, n_jobs)
+
+
+def _relabel_by_size(labels):
+    # Relabel the clusters by decreasing size, keeping the outliers at -1
+    labels = np.asarray(labels, dtype=np.int64)
+
+    ids, counts = np.unique(labels[labels >= 0], return_counts=True)
+    order = ids[np.argsort(-counts, kind='stable')]
+
+    relabel = np.full(labels.max() + 2 if len(labels) else 1, -1, dtype=np.int64)
+    relabel[order] = np.arange(len(order))
+
+    return np.where(labels >= 0, relabel[labels], -1)
+
+
+def nearest_landmarks(xyz, angles, landmarks, maps=None, tor_scale=0.5, block_size=1024, n_jobs=None):
+    """
+    This function finds for each frame the nearest landmark frame by the
+    combined RMSD and torsion distance. The frames are processed in blocks
+    so the memory scales with the block size times the number of landmarks
+
+    Parameters
+    ----------
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) coordinates
+    angles: numpy array
+        The (n_frames, n_rotors) dihedral angles in radians
+    landmarks: numpy array
+        The landmark frame indexes
+    maps: numpy array or None
+        The (n_maps, n_atoms) symmetry atom maps
+    tor_scale: Float
+        The torsion distance scaling factor
+    block_size: Int
+        The number of frames per block
+    n_jobs: Int or None
+        The number of threads. If None the number of cpus is used
+
+    Returns
+    -------
+    nearest: numpy array
+        The (n_frames,) positions in landmarks of the nearest landmark
+    dist: numpy array
+        The (n_frames,) distances from the nearest landmark
+    """
+
+    n_frames = len(xyz)
+
+    lm_xyz = np.asarray(xyz[landmarks], dtype=np.float64)
+    lm_angles = np.asarray(angles[landmarks], dtype=np.float64)
+
+    nearest = np.empty(n_frames, dtype=np.int64)
+    dist = np.empty(n_frames, dtype=np.float32)
+
+    def assign(start):
+        sl = slice(start, min(start + block_size, n_frames))
+        d = cross_rmsd(xyz[sl], lm_xyz, maps) + tor_scale * cross_torsion_distance(angles[sl], lm_angles)
+        nearest[sl] = d.argmin(axis=1)
+        dist[sl] = d.min(axis=1)
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+        list(executor.map(assign, range(0, n_frames, block_size)))
+
+    return nearest, dist
+
+
+def landmark_frames(n_frames, n_landmarks):
+    """
+    This function selects evenly strided landmark frames
+
+    Parameters
+    ----------
+    n_frames: Int
+        The number of frames
+    n_landmarks: Int
+        The number of landmark frames
+
+    Returns
+    -------
+    landmarks: numpy array
+        The sorted landmark frame indexes
+    """
+
+    return np.unique(np.linspace(0, n_frames - 1, min(n_landmarks, n_frames)).round().astype(np.int64))
+
+
+def assign_landmark_clusters(xyz, angles, landmarks, landmark_labels, maps=None, tor_scale=0.5):
+    """
+    This function extends the clustering of the landmark frames to the whole
+    trajectory: each frame takes the cluster label of its nearest landmark by
+    the combined RMSD and torsion distance, the outlier label included
+
+    Parameters
+    ----------
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) coordinates
+    angles: numpy array
+        The (n_frames, n_rotors) dihedral angles in radians
+    landmarks: numpy array
+        The landmark frame indexes
+    landmark_labels: list or numpy array
+        The cluster labels of the landmarks. The outliers are labelled -1
+    maps: numpy array or None
+        The (n_maps, n_atoms) symmetry atom maps
+    tor_scale: Float
+        The torsion distance scaling factor
+
+    Returns
+    -------
+    labels: numpy array
+        The (n_frames,) cluster labels ordered by decreasing cluster size.
+        The outliers are labelled -1
+    """
+
+    landmark_labels = np.asarray(landmark_labels, dtype=np.int64)
+
+    if len(landmark_labels) != len(landmarks):
+        raise ValueError("The number of landmarks and landmark labels do not match: {} vs {}".format(
+            len(landmarks), len(landmark_labels)))
+
+    nearest, dist = nearest_landmarks(xyz, angles, landmarks, maps, tor_scale)
+
+    return _relabel_by_size(landmark_labels[nearest])
+
+
+def medoid(xyz, members, maps=None, max_frames=2000, block_size=512):
+    """
+    This function selects the medoid of a group of frames, the member with
+    the min sum of RMSDs from the other members. The RMSDs are evaluated in
+    blocks of member rows over the member frames only. The groups larger
+    than max_frames are reduced to evenly strided members
+
+    Parameters
+    ----------
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) coordinates
+    members: numpy array
+        The member frame indexes
+    maps: numpy array or None
+        The (n_maps, n_atoms) symmetry atom maps
+    max_frames: Int
+        The max number of members the medoid is selected from
+    block_size: Int
+        The number of member rows per block
+
+    Returns
+    -------
+    medoid: Int
+        The medoid frame index
+    """
+
+    members = np.asarray(members, dtype=np.int64)
+
+    if not len(members):
+        raise ValueError("The medoid member selection is empty: {}".format(members))
+
+    if len(members) > max_frames:
+        members = members[landmark_frames(len(members), max_frames)]
+
+    if len(members) == 1:
+        return int(members[0])
+
+    member_xyz = np.asarray(xyz[members], dtype=np.float64)
+
+    sums = np.empty(len(members))
+
+    for start in range(0, len(members), block_size):
+        sums[start:start + block_size] = cross_rmsd(member_xyz[start:start + block_size], member_xyz,
+                                                    maps).sum(axis=1)
+
+    return int(members[np.argmin(sums)])
+
+
+def diverse_frames(xyz, frames, n_max, maps=None):
+    """
+    This function selects a bounded number of representative frames by
+    farthest point sampling over the in place RMSD. The first selected frame
+    is the one closest to the mean structure, then the frame farthest from
+    the already selected ones is added until n_max frames are selected
+
+    Parameters
+    ----------
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) coordinates
+    frames: numpy array
+        The candidate frame indexes
+    n_max: Int
+        The max number of selected frames
+    maps: numpy array or None
+        The (n_maps, n_atoms) symmetry atom maps
+
+    Returns
+    -------
+    selected: numpy array
+        The sorted selected frame indexes
+    """
+
+    frames = np.asarray(frames, dtype=np.int64)
+
+    if len(frames) <= n_max:
+        return frames
+
+    cand = np.asarray(xyz[frames], dtype=np.float64)
+
+    dist = inplace_rmsd(cand.mean(axis=0), cand, maps)
+    picked = [int(np.argmin(dist))]
+    dist = inplace_rmsd(cand[picked[0]], cand, maps)
+
+    while len(picked) < n_max:
+        nxt = int(np.argmax(dist))
+        picked.append(nxt)
+        dist = np.minimum(dist, inplace_rmsd(cand[nxt], cand, maps))
+
+    return np.sort(frames[picked])
+
+
+def save_distance_cache(atom_idx, maps, torsions):
+    """
+    This function serializes the clustering symmetry maps and torsion features
+    to a compressed NumPy archive suitable to be stored on a record Blob field
+
+    Parameters
+    ----------
+    atom_idx: numpy array
+        The selected atom indexes
+    maps: numpy array
+        The symmetry atom maps
+    torsions: numpy array
+        The (n_frames, n_rotors) dihedral angles
+
+    Returns
+    -------
+    blob: bytes
+        The serialized data
+    """
+
+    buf = io.BytesIO()
+    np.savez_compressed(buf, atom_idx=atom_idx, maps=maps,
+                        torsions=np.asarray(torsions, dtype=np.float32))
+
+    return buf.getvalue()
+
+
+def load_distance_cache(blob):
+    """
+    This function deserializes the clustering symmetry maps and torsion features
+
+    Parameters
+    ----------
+    blob: bytes
+        The serialized data
+
+    Returns
+    -------
+    cache: dict
+        The atom_idx, maps and torsions arrays
+    """
+
+    with np.load(io.BytesIO(bytes(blob))) as data:
+        return {key: data[key] for key in data.files}
+
+
+def cluster_rmsd_by_conf(ref_xyz, xyz, maps, cluster_vec, n_major):
+    """
+    This function computes the mean and standard error of the in place RMSD
+    of the frames of each major cluster from each starting conformer. The
+    frames of the minor clusters and the outliers are collected in the last
+    column
+
+    Parameters
+    ----------
+    ref_xyz: numpy array
+        The (n_confs, n_atoms, 3) starting conformer coordinates
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) trajectory coordinates
+    maps: numpy array
+        The (n_maps, n_atoms) symmetry atom maps
+    cluster_vec: list or numpy array
+        The (n_frames,) cluster labels
+    n_major: Int
+        The number of major clusters
+
+    Returns
+    -------
+    mean, serr: list
+        The (n_confs, n_major+1) RMSD means and standard errors
+    """
+
+    cols = np.asarray(cluster_vec)
+    cols = np.where((cols >= 0) & (cols < n_major), cols, n_major)
+
+    mean = np.zeros((len(ref_xyz), n_major + 1))
+    serr = np.zeros((len(ref_xyz), n_major + 1))
+
+    for conf, ref in enumerate(ref_xyz):
+        rmsd = inplace_rmsd(ref, xyz, maps)
+        for col in range(n_major + 1):
+            vals = rmsd[cols == col]
+            if len(vals):
+                mean[conf, col] = vals.mean()
+                serr[conf, col] = vals.std() / np.sqrt(len(vals))
+
+    return mean.tolist(), serr.tolist()
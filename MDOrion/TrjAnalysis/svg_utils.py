@@ -0,0 +1,128 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+import re
+
+from concurrent.futures import ProcessPoolExecutor
+
+import ensemble2img
+
+from MDOrion.TrjAnalysis.utils import (mol_from_bytes,
+                                      mol_to_bytes)
+
+
+# The elements whose content is left untouched: the scripts, the styles and the
+# text elements, where the white spaces between the tspan elements are rendered
+_preserved_re = re.compile(r'<(script|style|text)\b.*?</\1\s*>', re.DOTALL | re.IGNORECASE)
+
+_comment_re = re.compile(r'<!--.*?-->', re.DOTALL)
+
+_inter_tag_re = re.compile(r'>\s+<')
+
+_tag_re = re.compile(r'<(?:[^<>"\']|"[^"]*"|\'[^\']*\')+>')
+
+_attribute_re = re.compile(r'(\s[\w:.-]+)(\s*=\s*)("[^"]*"|\'[^\']*\')')
+
+_float_re = re.compile(r'(\d+\.\d{2})\d+')
+
+
+def _truncate_attribute(match):
+    # The event handler scripts are left untouched
+    if match.group(1).strip().lower().startswith('on'):
+        return match.group(0)
+
+    return match.group(1) + match.group(2) + _float_re.sub(r'\1', match.group(3))
+
+
+def _minify_markup(markup):
+    # The comments and the white spaces between tags are removed and the
+    # decimals are truncated only in the attribute values
+    markup = _comment_re.sub('', markup)
+    markup = _inter_tag_re.sub('><', markup)
+
+    return _tag_re.sub(lambda tag: _attribute_re.sub(_truncate_attribute, tag.group(0)), markup)
+
+
+def minify_svg(svg):
+    """
+    This function reduces the size of an SVG string by removing the comments
+    and the white spaces between tags and by truncating the decimals of the
+    attribute values e.g. the coordinates to two digits. The embedded scripts,
+    the styles and the text elements are left untouched
+
+    Parameters
+    ----------
+    svg: String
+        The SVG string
+
+    Returns
+    -------
+    svg: String
+        The minified SVG string
+    """
+
+    parts = []
+    last = 0
+
+    for match in _preserved_re.finditer(svg):
+        # White spaces next to the preserved elements
+        parts.append(_minify_markup(svg[last:match.start()]).rstrip())
+        parts.append(match.group(0))
+        last = match.end()
+
+    parts.append(_minify_markup(svg[last:]))
+
+    # White spaces after the preserved elements
+    for idx in range(2, len(parts), 2):
+        parts[idx] = parts[idx].lstrip()
+
+    return ''.join(parts).strip()
+
+
+def _render(job):
+    # Process pool worker, the molecules are passed as OEB bytes
+    lig_rep, prot_rep, lig_ens, prot_ens = (mol_from_bytes(data) for data in job)
+    return minify_svg(ensemble2img.run_ensemble2img(lig_rep, prot_rep, lig_ens, prot_ens))
+
+
+def render_ensembles(jobs, max_workers=1):
+    """
+    This function renders the interactive ensemble SVGs in a process pool
+
+    Parameters
+    ----------
+    jobs: list
+        The list of (ligand representative, protein representative, ligand
+        ensemble, protein ensemble) OEMol tuples
+    max_workers: Int
+        The max number of processes e.g. the cube cpu count. If 1 the SVGs
+        are rendered in the calling process
+
+    Returns
+    -------
+    svgs: list
+        The minified SVG strings in the job order
+    """
+
+    jobs = [tuple(mol_to_bytes(mol) for mol in job) for job in jobs]
+
+    max_workers = min(max_workers, len(jobs))
+
+    if max_workers <= 1:
+        return [_render(job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_render, jobs))
@@ -0,0 +1,55 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import pytest
+
+import numpy as np
+
+from MDOrion.TrjAnalysis.ensemble_utils import (bfactors,
+                                                closest_frame,
+                                                coordinate_moments)
+
+
+class EnsembleUtilsTests(unittest.TestCase):
+    """
+    Test the grouped coordinate statistics
+    """
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_coordinate_moments(self):
+        rng = np.random.RandomState(11)
+        xyz = rng.normal(size=(37, 6, 3)).astype(np.float32)
+        labels = rng.randint(-1, 4, size=len(xyz))
+
+        counts, mean, msf = coordinate_moments(xyz, labels, 2, chunk_size=5)
+
+        for group, sel in enumerate([labels == 0, labels == 1, np.ones(len(xyz), dtype=bool)]):
+            self.assertEqual(counts[group], sel.sum())
+            np.testing.assert_allclose(mean[group], xyz[sel].mean(axis=0), atol=1e-5)
+            ref = ((xyz[sel] - xyz[sel].mean(axis=0)) ** 2).sum(axis=2).mean(axis=0)
+            np.testing.assert_allclose(msf[group], ref, atol=1e-5)
+
+        np.testing.assert_allclose(bfactors(msf), 8.0 * np.pi ** 2 / 3.0 * msf)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_closest_frame(self):
+        xyz = np.arange(5, dtype=np.float64)[:, None, None] * np.ones((5, 2, 3))
+        self.assertEqual(closest_frame(xyz, np.full((2, 3), 2.2), [0, 1, 2, 4]), 2)
+        self.assertEqual(closest_frame(xyz, np.full((2, 3), 2.2), [0, 4]), 4)
@@ -0,0 +1,106 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import pytest
+
+import numpy as np
+
+from MDOrion.TrjAnalysis.nonbonded_utils import (COULOMB_CONSTANT,
+                                                 interaction_energies,
+                                                 load_residue_energies,
+                                                 save_residue_energies)
+
+
+def brute_force_energies(xyz_a, params_a, xyz_b, params_b, groups_b, n_groups, cutoff=None):
+
+    coulomb = np.zeros((len(xyz_a), n_groups))
+    lj = np.zeros((len(xyz_a), n_groups))
+
+    for f in range(len(xyz_a)):
+        for i in range(xyz_a.shape[1]):
+            for j in range(xyz_b.shape[1]):
+                r = np.linalg.norm(xyz_a[f, i] - xyz_b[f, j])
+                if cutoff is not None and r > cutoff:
+                    continue
+                sigma = 0.5 * (params_a[i, 1] + params_b[j, 1])
+                eps = np.sqrt(params_a[i, 2] * params_b[j, 2])
+                coulomb[f, groups_b[j]] += COULOMB_CONSTANT * params_a[i, 0] * params_b[j, 0] / r
+                lj[f, groups_b[j]] += 4.0 * eps * ((sigma / r) ** 12 - (sigma / r) ** 6)
+
+    return coulomb, lj
+
+
+class NonbondedUtilsTests(unittest.TestCase):
+    """
+    Test the vectorized interaction energies against a pair by pair evaluation
+    """
+    def setUp(self):
+        rng = np.random.RandomState(7)
+
+        self.xyz_a = rng.uniform(0.0, 4.0, size=(5, 4, 3))
+        self.xyz_b = rng.uniform(-8.0, 12.0, size=(5, 30, 3))
+
+        self.params_a = np.column_stack([rng.uniform(-0.8, 0.8, 4),
+                                         rng.uniform(2.5, 3.5, 4),
+                                         rng.uniform(0.05, 0.2, 4)])
+        self.params_b = np.column_stack([rng.uniform(-0.8, 0.8, 30),
+                                         rng.uniform(2.5, 3.5, 30),
+                                         rng.uniform(0.05, 0.2, 30)])
+
+        self.groups_b = np.repeat(np.arange(6), 5)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_interaction_energies(self):
+        coulomb, lj = interaction_energies(self.xyz_a, self.params_a, self.xyz_b, self.params_b,
+                                           groups_b=self.groups_b, frame_chunk=2, atom_block=7)
+
+        ref_coulomb, ref_lj = brute_force_energies(self.xyz_a, self.params_a, self.xyz_b, self.params_b,
+                                                   self.groups_b, 6)
+
+        np.testing.assert_allclose(coulomb, ref_coulomb, rtol=1e-10)
+        np.testing.assert_allclose(lj, ref_lj, rtol=1e-10)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_interaction_energies_cutoff(self):
+        coulomb, lj = interaction_energies(self.xyz_a, self.params_a, self.xyz_b, self.params_b,
+                                           cutoff=6.0, atom_block=4)
+
+        ref_coulomb, ref_lj = brute_force_energies(self.xyz_a, self.params_a, self.xyz_b, self.params_b,
+                                                   np.zeros(30, dtype=int), 1, cutoff=6.0)
+
+        self.assertEqual(coulomb.shape, (5, 1))
+        np.testing.assert_allclose(coulomb, ref_coulomb, rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(lj, ref_lj, rtol=1e-10, atol=1e-12)
+
+        with self.assertRaises(ValueError):
+            interaction_energies(self.xyz_a[:3], self.params_a, self.xyz_b, self.params_b)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_residue_energies_blob(self):
+        labels = ['ALA1', 'GLY2:A']
+        coulomb = np.arange(6.0).reshape(3, 2)
+
+        data = load_residue_energies(save_residue_energies(labels, coulomb, -coulomb))
+
+        self.assertEqual(list(data['labels']), labels)
+        np.testing.assert_allclose(data['coulomb'], coulomb)
+        np.testing.assert_allclose(data['lj'], -coulomb)
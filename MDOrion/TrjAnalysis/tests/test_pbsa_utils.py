@@ -0,0 +1,73 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import pytest
+
+import numpy as np
+
+from MDOrion.TrjAnalysis.pbsa_utils import (mean_serr_by_group,
+                                            select_frames,
+                                            stratified_serr)
+
+
+class PBSAUtilsTests(unittest.TestCase):
+    """
+    Test the PBSA frame selection and the NaN aware group statistics
+    """
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_select_frames(self):
+        times = np.arange(10) * 4.0
+
+        np.testing.assert_array_equal(select_frames(times), np.arange(10))
+        np.testing.assert_array_equal(select_frames(times, stride=3), [0, 3, 6, 9])
+        np.testing.assert_array_equal(select_frames(times, 2, start_time=8.0, end_time=28.0), [2, 4, 6])
+
+        with self.assertRaises(ValueError):
+            select_frames(times, stride=0)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_mean_serr_by_group(self):
+        values = [1.0, np.nan, 3.0, 2.0, np.nan, 6.0]
+        groups = [0, 0, 0, 1, 2, 1]
+
+        mean, serr = mean_serr_by_group(values, groups, 3)
+
+        np.testing.assert_allclose(mean[:2], [2.0, 4.0])
+        np.testing.assert_allclose(serr[:2], [1.0 / np.sqrt(2.0), 2.0 / np.sqrt(2.0)])
+        self.assertTrue(np.isnan(mean[2]))
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_weighted_mean_serr(self):
+        # A frame with weight 2 counts as two frames in the mean
+        mean, serr = mean_serr_by_group([1.0, 4.0, np.nan], [0, 0, 0], 1, [2.0, 1.0, 0.0])
+        self.assertAlmostEqual(mean[0], 2.0)
+        self.assertAlmostEqual(serr[0], np.sqrt(2.0 / (9.0 / 5.0)))
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_stratified_serr(self):
+        # Fully evaluated strata do not contribute
+        self.assertEqual(stratified_serr([[1.0, 2.0, 3.0]], [3]), 0.0)
+        self.assertEqual(stratified_serr([[1.0]], [4]), np.inf)
+
+        serr = stratified_serr([[1.0, 3.0], [2.0, 2.0]], [4, 4])
+        self.assertAlmostEqual(serr, np.sqrt(0.25 * 2.0 / 2.0 * 0.5))
@@ -0,0 +1,156 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import pytest
+
+import numpy as np
+
+from MDOrion.TrjAnalysis.rmsd_utils import (assign_landmark_clusters,
+                                            diverse_frames,
+                                            inplace_rmsd,
+                                            landmark_frames,
+                                            load_distance_cache,
+                                            medoid,
+                                            pairwise_rmsd,
+                                            pairwise_torsion_distance,
+                                            save_distance_cache,
+                                            superposed_rmsd,
+                                            torsion_angles)
+
+
+def _rotation(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]])
+
+
+class RMSDUtilsTests(unittest.TestCase):
+    """
+    Test the batched RMSD kernels
+    """
+    def setUp(self):
+        rng = np.random.RandomState(7)
+        self.xyz = rng.normal(size=(23, 9, 3))
+        # Atoms 0 and 1 are symmetry equivalent
+        self.maps = np.array([np.arange(9), np.r_[1, 0, np.arange(2, 9)]])
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_pairwise_inplace(self):
+        condensed = pairwise_rmsd(self.xyz, self.maps, block_size=5, n_jobs=2)
+
+        k = 0
+        for i in range(len(self.xyz)):
+            for j in range(i + 1, len(self.xyz)):
+                ref = min(np.sqrt(((self.xyz[i] - self.xyz[j][m]) ** 2).sum(axis=1).mean()) for m in self.maps)
+                self.assertAlmostEqual(condensed[k], ref, places=4)
+                k += 1
+
+        np.testing.assert_allclose(condensed[:len(self.xyz) - 1],
+                                   inplace_rmsd(self.xyz[0], self.xyz[1:], self.maps), atol=1e-4)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_superposed(self):
+        moved = self.xyz[0].dot(_rotation(0.7).T) + 3.0
+        self.assertAlmostEqual(superposed_rmsd(self.xyz[0], moved[None])[0], 0.0, places=5)
+
+        # The reflection is not a rigid motion
+        self.assertGreater(superposed_rmsd(self.xyz[0], -self.xyz[0][None])[0], 1e-3)
+
+        condensed = pairwise_rmsd(self.xyz, superpose=True, block_size=4)
+        np.testing.assert_allclose(condensed[:len(self.xyz) - 1],
+                                   superposed_rmsd(self.xyz[0], self.xyz[1:]), atol=1e-4)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_torsions(self):
+        xyz = np.array([[[1.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 1.0], [0.0, 1.0, 1.0]]])
+        angles = torsion_angles(xyz, np.array([[0, 1, 2, 3]]))
+        self.assertAlmostEqual(abs(angles[0, 0]), np.pi / 2.0)
+
+        # The angle differences are periodic
+        dist = pairwise_torsion_distance(np.array([[np.pi - 0.1], [-np.pi + 0.1]]))
+        self.assertAlmostEqual(dist[0], 0.2, places=5)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_assign_landmark_clusters(self):
+        rng = np.random.RandomState(5)
+        centers = np.array([[0.0, 0.0, 0.0], [10.0, 0.0, 0.0]])
+        xyz = np.concatenate([c + 0.1 * rng.normal(size=(n, 4, 3)) for c, n in zip(centers, (150, 250))])
+        xyz = np.concatenate((xyz, [[[5.0, 5.0, 5.0]] * 4]))
+        angles = np.zeros((len(xyz), 0))
+        maps = np.arange(4)[None, :]
+
+        landmarks = landmark_frames(len(xyz), 40)
+        self.assertEqual(len(landmarks), 40)
+        self.assertEqual(landmarks[0], 0)
+        self.assertEqual(landmarks[-1], len(xyz) - 1)
+
+        # The landmarks of the small cluster are labelled 0 and the last landmark is an outlier
+        lmLabels = np.where(landmarks < 150, 0, 1)
+        lmLabels[-1] = -1
+
+        labels = assign_landmark_clusters(xyz, angles, landmarks, lmLabels, maps)
+
+        # The clusters are relabelled by decreasing size and the outlier label is propagated
+        self.assertTrue(np.all(labels[150:400] == 0))
+        self.assertTrue(np.all(labels[:150] == 1))
+        self.assertEqual(labels[-1], -1)
+
+        with self.assertRaises(ValueError):
+            assign_landmark_clusters(xyz, angles, landmarks, lmLabels[1:], maps)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_distance_cache(self):
+        torsions = np.zeros((len(self.xyz), 2))
+        cache = load_distance_cache(save_distance_cache(np.arange(9), self.maps, torsions))
+
+        self.assertEqual(sorted(cache), ['atom_idx', 'maps', 'torsions'])
+        np.testing.assert_array_equal(cache['maps'], self.maps)
+        np.testing.assert_array_equal(cache['torsions'], torsions)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_medoid(self):
+        condensed = pairwise_rmsd(self.xyz, self.maps)
+        square = np.zeros((len(self.xyz), len(self.xyz)))
+        square[np.triu_indices(len(self.xyz), 1)] = condensed
+        square += square.T
+
+        members = np.array([2, 5, 7, 11, 19])
+        ref = members[np.argmin(square[np.ix_(members, members)].sum(axis=1))]
+        self.assertEqual(medoid(self.xyz, members, self.maps, block_size=2), ref)
+
+        # The large groups are reduced to evenly strided members
+        self.assertIn(medoid(self.xyz, np.arange(len(self.xyz)), self.maps, max_frames=5),
+                      [0, 6, 11, 16, 22])
+        self.assertEqual(medoid(self.xyz, [4], self.maps), 4)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_diverse_frames(self):
+        frames = np.arange(3, 20)
+        selected = diverse_frames(self.xyz, frames, 6, self.maps)
+
+        self.assertEqual(len(selected), 6)
+        self.assertTrue(np.all(np.isin(selected, frames)))
+        self.assertTrue(np.all(np.diff(selected) > 0))
+        np.testing.assert_array_equal(diverse_frames(self.xyz, frames[:4], 6), frames[:4])
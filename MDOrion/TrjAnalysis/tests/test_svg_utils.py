@@ -0,0 +1,49 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import pytest
+
+from MDOrion.TrjAnalysis.svg_utils import minify_svg
+
+
+class SVGUtilsTests(unittest.TestCase):
+    """
+    Test the SVG minification
+    """
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_minify_svg(self):
+        svg = ('<svg>\n  <!-- comment -->\n  <path d="M 1.234567 2.5 L 3.14159 4.0001"/>\n'
+               '  <script>var x = 1.23456;\n</script>\n</svg>\n')
+
+        self.assertEqual(minify_svg(svg),
+                         '<svg><path d="M 1.23 2.5 L 3.14 4.00"/><script>var x = 1.23456;\n</script></svg>')
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_minify_svg_text(self):
+        svg = ('<svg width="10.12345">\n <g onclick="show(1.23456)">\n'
+               ' <text x="1.5">\n  <tspan>pKa 4.12345</tspan> <tspan>label</tspan>\n </text>\n'
+               ' <rect x=\'0.55555\' title="a > b"/>\n </g>\n</svg>')
+
+        # The text elements and the event handlers are left untouched
+        self.assertEqual(minify_svg(svg),
+                         '<svg width="10.12"><g onclick="show(1.23456)">'
+                         '<text x="1.5">\n  <tspan>pKa 4.12345</tspan> <tspan>label</tspan>\n </text>'
+                         '<rect x=\'0.55\' title="a > b"/></g></svg>')
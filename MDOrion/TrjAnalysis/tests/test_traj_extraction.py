@@ -0,0 +1,356 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import os
+
+import logging
+
+import pytest
+
+import numpy as np
+
+import mdtraj as md
+
+from tempfile import TemporaryDirectory
+
+from openeye import oechem
+
+from MDOrion.Standards.chunked_traj import ChunkedTrajectoryWriter
+
+from MDOrion.TrjAnalysis.utils import (extract_aligned_prot_lig_wat_traj,
+                                     extract_aligned_prot_lig_wat_stores,
+                                     count_stream_waters)
+
+
+# The fixture system: 8 protein residues, a three atom ligand, two ions and 80 waters
+n_residues = 8
+n_waters = 80
+box_length = 4.0  # nm
+
+
+def _system_topology():
+    top = md.Topology()
+
+    chain = top.add_chain()
+    previous = None
+    for res_idx in range(n_residues):
+        res = top.add_residue('ALA', chain, resSeq=res_idx + 1)
+        atoms = [top.add_atom(name, md.element.get_by_symbol(name[0]), res) for name in ['N', 'CA', 'C', 'O']]
+        for at_a, at_b in zip(atoms[:-1], atoms[1:]):
+            top.add_bond(at_a, at_b)
+        if previous is not None:
+            top.add_bond(previous, atoms[0])
+        previous = atoms[2]
+
+    chain = top.add_chain()
+    res = top.add_residue('LIG', chain, resSeq=1)
+    atoms = [top.add_atom(name, md.element.carbon, res) for name in ['C1', 'C2', 'C3']]
+    top.add_bond(atoms[0], atoms[1])
+    top.add_bond(atoms[1], atoms[2])
+
+    chain = top.add_chain()
+    for ion_idx in range(2):
+        res = top.add_residue('NA', chain, resSeq=ion_idx + 1)
+        top.add_atom('NA', md.element.sodium, res)
+
+    chain = top.add_chain()
+    for wat_idx in range(n_waters):
+        res = top.add_residue('HOH', chain, resSeq=wat_idx + 1)
+        o = top.add_atom('O', md.element.oxygen, res)
+        top.add_bond(o, top.add_atom('H1', md.element.hydrogen, res))
+        top.add_bond(o, top.add_atom('H2', md.element.hydrogen, res))
+
+    return top
+
+
+def _system_trajectory(n_frames=7, seed=3):
+    rng = np.random.RandomState(seed)
+    top = _system_topology()
+
+    center = np.full(3, box_length / 2.0)
+
+    prot = center + rng.uniform(-0.6, 0.6, size=(4 * n_residues, 3))
+    lig = center + rng.uniform(-0.15, 0.15, size=(3, 3))
+    ions = rng.uniform(0.0, box_length, size=(2, 3))
+    wat_o = rng.uniform(0.0, box_length, size=(n_waters, 1, 3))
+    wat = np.concatenate([wat_o, wat_o + [0.0957, 0.0, 0.0], wat_o + [-0.024, 0.0927, 0.0]], axis=1)
+
+    first = np.concatenate([prot, lig, ions, wat.reshape(-1, 3)])
+
+    # Thermal noise, a drift of the whole system and the atoms wrapped in the box
+    xyz = first[np.newaxis] + rng.normal(0.0, 0.02, size=(n_frames,) + first.shape)
+    xyz += np.arange(n_frames)[:, np.newaxis, np.newaxis] * [0.15, -0.1, 0.05]
+    xyz = np.mod(xyz, box_length)
+
+    # The coordinates are on the 0.001 nm grid of the chunked trajectories
+    xyz = np.round(xyz, 3).astype(np.float32)
+
+    trj = md.Trajectory(xyz, top, time=np.arange(n_frames) * 4.0,
+                        unitcell_lengths=np.full((n_frames, 3), box_length),
+                        unitcell_angles=np.full((n_frames, 3), 90.0))
+
+    return trj
+
+
+class _MDComponents(object):
+    """
+    The setup flask and the protein and ligand components of the fixture system
+    """
+    def __init__(self, flask, prot_idx, lig_idx):
+        self.flask = flask
+        self.map_dic = {'protein': list(prot_idx), 'ligand': list(lig_idx)}
+
+    def _subset(self, idx):
+        bv = oechem.OEBitVector(self.flask.GetMaxAtomIdx())
+        for at_idx in idx:
+            bv.SetBitOn(int(at_idx))
+
+        mol = oechem.OEMol()
+        oechem.OESubsetMol(mol, self.flask, oechem.OEAtomIdxSelected(bv))
+
+        return mol
+
+    @property
+    def create_flask(self):
+        return oechem.OEMol(self.flask), self.map_dic
+
+    @property
+    def get_protein(self):
+        return self._subset(self.map_dic['protein'])
+
+    @property
+    def get_ligand(self):
+        return self._subset(self.map_dic['ligand'])
+
+
+def _baseline_extraction(trj, setup_xyz, prot_idx, lig_idx, nmax, water_cutoff):
+    # The reference extraction of the whole trajectory in memory, frame by frame.
+    # The waters are returned by increasing binding site metric
+    top = trj.topology
+
+    water_O_idx = top.select("water and element O")
+    prot_ca_idx = top.select("backbone and element C")
+
+    ca_bs_idx = md.compute_neighbors(trj[0], 0.5, lig_idx, haystack_indices=prot_ca_idx, periodic=True)[0]
+    ca_bs_lig_idx = np.concatenate((ca_bs_idx, lig_idx))
+
+    protligAtoms = [top.atom(int(idx)) for idx in np.concatenate((prot_idx, lig_idx))]
+    trj_imaged = trj.image_molecules(inplace=False, anchor_molecules=[protligAtoms], make_whole=True)
+
+    water_frames = []
+
+    for frame in trj_imaged:
+        water_O_bs_idx = md.compute_neighbors(frame, water_cutoff / 10.0, ca_bs_lig_idx,
+                                              haystack_indices=water_O_idx, periodic=True)[0]
+
+        pairs = np.array(np.meshgrid(water_O_bs_idx, lig_idx)).T.reshape(-1, 2)
+        d_lig = md.compute_distances(frame, pairs, periodic=True).reshape(len(water_O_bs_idx), -1).min(axis=1)
+
+        pairs = np.array(np.meshgrid(water_O_bs_idx, ca_bs_idx)).T.reshape(-1, 2)
+        d_ca = md.compute_distances(frame, pairs, periodic=True).reshape(len(water_O_bs_idx), -1).min(axis=1)
+
+        order = np.argsort(d_lig + d_ca, kind='stable')[:nmax]
+        water_frames.append([at.index for idx in water_O_bs_idx[order] for at in top.atom(int(idx)).residue.atoms])
+
+    reference = trj_imaged[0]
+    reference.xyz[0] = setup_xyz / 10.0
+    trj_imaged.superpose(reference, 0, ca_bs_idx)
+
+    xyz = 10 * trj_imaged.xyz
+    water_xyz = np.array([xyz[idx, water_idx] for idx, water_idx in enumerate(water_frames)])
+
+    return xyz[:, prot_idx], xyz[:, lig_idx], water_xyz, trj_imaged.time
+
+
+def _conformers(mol):
+    xyz = []
+    for conf in mol.GetConfs():
+        coords = oechem.OEFloatArray(3 * mol.GetMaxAtomIdx())
+        conf.GetCoords(coords)
+        xyz.append(np.array(coords).reshape(-1, 3))
+
+    return np.array(xyz)
+
+
+class TrajectoryExtractionTests(unittest.TestCase):
+    """
+    Test the chunked trajectory extraction against the whole trajectory reference
+    on the h5, chunked manifest, trr and atom subset stream trajectories
+    """
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.opt = {'Logger': logging.getLogger(__name__)}
+
+        self.nmax = 6
+        self.water_cutoff = 15.0
+
+        self.trj = _system_trajectory()
+
+        self.prot_idx = np.arange(4 * n_residues)
+        self.lig_idx = np.arange(4 * n_residues, 4 * n_residues + 3)
+
+        # The setup flask has the first frame coordinates
+        pdb_fn = os.path.join(self.tmp_dir.name, 'flask.pdb')
+        self.trj[0].save_pdb(pdb_fn)
+
+        self.flask = oechem.OEMol()
+        with oechem.oemolistream(pdb_fn) as ifs:
+            oechem.OEReadMolecule(ifs, self.flask)
+
+        self.assertEqual(self.flask.NumAtoms(), self.trj.n_atoms)
+
+        self.md_components = _MDComponents(self.flask, self.prot_idx, self.lig_idx)
+
+        self.reference = _baseline_extraction(self.trj, 10 * self.trj.xyz[0], self.prot_idx, self.lig_idx,
+                                              self.nmax, self.water_cutoff)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _extract(self, trj_fn, **kwargs):
+        return extract_aligned_prot_lig_wat_traj(self.md_components, oechem.OEMol(self.flask), trj_fn, self.opt,
+                                                 nmax=self.nmax, water_cutoff=self.water_cutoff, **kwargs)
+
+    def _check(self, result, time=True):
+        ptraj, ltraj, wtraj, times = result
+        prot_xyz, lig_xyz, water_xyz, ref_times = self.reference
+
+        self.assertEqual(ptraj.NumConfs(), self.trj.n_frames)
+        self.assertEqual(wtraj.NumAtoms(), 3 * self.nmax)
+
+        np.testing.assert_allclose(_conformers(ptraj), prot_xyz, atol=1e-3)
+        np.testing.assert_allclose(_conformers(ltraj), lig_xyz, atol=1e-3)
+
+        # The waters are in the binding site metric order frame by frame
+        np.testing.assert_allclose(_conformers(wtraj), water_xyz, atol=1e-3)
+
+        if time:
+            np.testing.assert_allclose(times, ref_times)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_h5_chunk_boundaries(self):
+        trj_fn = os.path.join(self.tmp_dir.name, 'trajectory.h5')
+        self.trj.save_hdf5(trj_fn)
+
+        # The chunk sizes that do not divide, divide and exceed the number of frames
+        for chunk_size in [3, 7, 100]:
+            self._check(self._extract(trj_fn, chunk_size=chunk_size))
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_chunked_manifest(self):
+        top_fn = os.path.join(self.tmp_dir.name, 'topology.h5')
+        self.trj[0].save_hdf5(top_fn)
+
+        writer = ChunkedTrajectoryWriter(os.path.join(self.tmp_dir.name, 'chunks'), chunk_frames=4,
+                                         upload=lambda fn: fn, remove_uploaded=False)
+        writer.set_topology(top_fn)
+
+        for frame in range(self.trj.n_frames):
+            writer.append(self.trj.xyz[frame], self.trj.time[frame], self.trj.unitcell_vectors[frame])
+
+        manifest_fn = writer.write_manifest(os.path.join(self.tmp_dir.name, 'trajectory_manifest.json'))
+
+        # The extraction chunks cross the trajectory chunk boundaries
+        self._check(self._extract(manifest_fn, chunk_size=3))
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_trr_first_frame(self):
+        trr_dir = os.path.join(self.tmp_dir.name, 'trr')
+        os.makedirs(trr_dir)
+
+        self.trj[0].save_pdb(os.path.join(trr_dir, 'system.pdb'))
+
+        # The first Gromacs frame is skipped
+        xyz = np.concatenate([np.zeros_like(self.trj.xyz[:1]), self.trj.xyz])
+        box = np.concatenate([self.trj.unitcell_vectors[:1], self.trj.unitcell_vectors])
+
+        trj_fn = os.path.join(trr_dir, 'trajectory.trr')
+        with md.formats.TRRTrajectoryFile(trj_fn, 'w') as f:
+            f.write(xyz, time=np.arange(len(xyz)) * 4.0 - 4.0, box=box)
+
+        self._check(self._extract(trj_fn, chunk_size=4))
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_atom_subset_stream(self):
+        # The stream saves the protein, ligand and water atoms, the ions are excluded
+        stream_idx = self.trj.topology.select("not resname NA")
+
+        trj_fn = os.path.join(self.tmp_dir.name, 'trajectory_stream_analysis.h5')
+        self.trj.atom_slice(stream_idx).save_hdf5(trj_fn)
+
+        self._check(self._extract(trj_fn, chunk_size=3, atom_indices=stream_idx))
+
+        with self.assertRaises(ValueError):
+            self._extract(trj_fn, atom_indices=stream_idx[1:])
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_near_waters_stream(self):
+        # The stream saves the protein, ligand and the waters near the ligand. The
+        # farthest water is partially saved and it is skipped by the extraction
+        water_o = self.trj.topology.select("water and element O")
+        dist = md.compute_distances(self.trj[0], [[self.lig_idx[1], idx] for idx in water_o], periodic=True)[0]
+        far = water_o[np.argsort(dist)[-30:]]
+
+        excluded = [at.index for idx in far[:-1] for at in self.trj.topology.atom(int(idx)).residue.atoms]
+        excluded.extend([int(far[-1]) + 1, int(far[-1]) + 2])
+
+        stream_idx = np.setdiff1d(self.trj.topology.select("not resname NA"), excluded)
+
+        self.assertEqual(count_stream_waters(self.flask, stream_idx), n_waters - 30)
+
+        trj_fn = os.path.join(self.tmp_dir.name, 'trajectory_stream_analysis.h5')
+        self.trj.atom_slice(stream_idx).save_hdf5(trj_fn)
+
+        self._check(self._extract(trj_fn, chunk_size=3, atom_indices=stream_idx))
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_trajectory_stores(self):
+        trj_fn = os.path.join(self.tmp_dir.name, 'trajectory.h5')
+        self.trj.save_hdf5(trj_fn)
+
+        store_dir = os.path.join(self.tmp_dir.name, 'stores')
+        os.makedirs(store_dir)
+
+        pstore, ltraj, wstore = extract_aligned_prot_lig_wat_stores(self.md_components, oechem.OEMol(self.flask),
+                                                                    trj_fn, self.opt, store_dir,
+                                                                    nmax=self.nmax, water_cutoff=self.water_cutoff,
+                                                                    chunk_size=3, pose_id=2)
+        prot_xyz, lig_xyz, water_xyz, ref_times = self.reference
+
+        # The protein and water frames are memory mapped from the store directory
+        self.assertEqual(sorted(os.listdir(store_dir)), ['protein_traj_xyz.npy', 'water_traj_xyz.npy'])
+        self.assertFalse(pstore.xyz.flags.owndata)
+        self.assertFalse(wstore.xyz.flags.owndata)
+
+        self.assertEqual(pstore.n_atoms, len(self.prot_idx))
+        self.assertEqual(wstore.n_atoms, 3 * self.nmax)
+
+        np.testing.assert_allclose(pstore.xyz, prot_xyz, atol=1e-3)
+        np.testing.assert_allclose(_conformers(ltraj), lig_xyz, atol=1e-3)
+        np.testing.assert_allclose(wstore.xyz, water_xyz, atol=1e-3)
+
+        for store in [pstore, wstore]:
+            np.testing.assert_allclose(store.frames['time'], ref_times)
+            self.assertTrue(np.all(store.frames['pose_id'] == 2))
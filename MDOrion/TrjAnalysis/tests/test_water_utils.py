@@ -0,0 +1,208 @@
+# (C) 2020 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+import unittest
+
+import MDOrion
+
+import os
+
+import pytest
+
+import itertools
+
+import logging
+
+import time
+
+import numpy as np
+
+from openeye import (oechem,
+                     oegrid,
+                     oespicoli)
+
+from MDOrion.TrjAnalysis.water_utils import (cavity_volume,
+                                             nmax_waters,
+                                             select_binding_site_waters)
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(MDOrion.__file__))
+FILE_DIR = os.path.join(PACKAGE_DIR, "tests", "data")
+
+
+def _brute_force_min_distances(query, points, box):
+    # Minimum image distances by checking all the neighbour images
+    shifts = np.array(list(itertools.product([-1, 0, 1], repeat=3))).dot(box)
+    delta = points[:, np.newaxis, np.newaxis, :] - query[np.newaxis, :, np.newaxis, :] + shifts
+    return np.linalg.norm(delta, axis=-1).min(axis=(1, 2))
+
+
+def _dist2(coord1, coord2):
+    return sum((c1 - c2) ** 2 for c1, c2 in zip(coord1, coord2))
+
+
+def _reference_cavity_count(protein, ligand, cutoff, spacing=0.5):
+    # Grid point by grid point cavity count used as reference
+    complex = oechem.OEMol(protein)
+    oechem.OEAddMols(complex, ligand)
+
+    surf = oespicoli.OESurface()
+    oespicoli.OEMakeMolecularSurface(surf, complex, spacing)
+
+    center = oechem.OEFloatArray(3)
+    extents = oechem.OEFloatArray(3)
+    oechem.OEGetCenterAndExtents(ligand, center, extents)
+    extents = oechem.OEFloatArray([max(extents) * 2, max(extents) * 2, max(extents) * 2])
+
+    grid = oegrid.OEScalarGrid()
+    oegrid.OEMakeGridFromCenterAndExtents(grid, center, extents, spacing)
+
+    grid_spicoli = oegrid.OEScalarGrid()
+    oespicoli.OEMakeBitGridFromSurface(grid_spicoli, surf)
+
+    ligand_coords = list(ligand.GetCoords().values())
+    protein_coords = list(protein.GetCoords().values())
+
+    count = 0
+
+    for iz in range(grid.GetZDim()):
+        for iy in range(grid.GetYDim()):
+            for ix in range(grid.GetXDim()):
+                point = (grid.GetX(ix), grid.GetY(iy), grid.GetZ(iz))
+
+                value = grid_spicoli.GetValue(grid_spicoli.GetXIdx(point[0]),
+                                              grid_spicoli.GetYIdx(point[1]),
+                                              grid_spicoli.GetZIdx(point[2]))
+                if value != 0.0:
+                    continue
+
+                if any(_dist2(coord, point) < cutoff * cutoff for coord in ligand_coords) and \
+                        any(_dist2(coord, point) < cutoff * cutoff for coord in protein_coords):
+                    count += 1
+
+    return count
+
+
+class CavityVolumeTests(unittest.TestCase):
+    """
+    Testing the binding site cavity volume
+    """
+    def setUp(self):
+        self.protein = oechem.OEMol()
+        with oechem.oemolistream(os.path.join(FILE_DIR, "4YFF_prot.oeb")) as ifs:
+            oechem.OEReadMolecule(ifs, self.protein)
+
+        self.ligand = oechem.OEMol()
+        with oechem.oemolistream(os.path.join(FILE_DIR, "4YFF_lig.oeb")) as ifs:
+            oechem.OEReadMolecule(ifs, self.ligand)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_cavity_volume(self):
+        cutoff = 5.0
+
+        # The vectorized estimator matches the grid point loop
+        count = _reference_cavity_count(self.protein, self.ligand, cutoff)
+        volume = cavity_volume(self.protein, self.ligand, cutoff)
+
+        self.assertEqual(volume, count * 0.5 ** 3)
+        self.assertEqual(nmax_waters(self.protein, self.ligand, cutoff), int(0.034 * count * 0.5 ** 3))
+
+
+class CavityVolumeBenchmark(unittest.TestCase):
+    """
+    Micro-benchmark of the vectorized cavity volume estimator against the
+    grid point loop. It runs only locally and reports the timings on the logger
+    """
+    def setUp(self):
+        self.protein = oechem.OEMol()
+        with oechem.oemolistream(os.path.join(FILE_DIR, "4YFF_prot.oeb")) as ifs:
+            oechem.OEReadMolecule(ifs, self.protein)
+
+        self.ligand = oechem.OEMol()
+        with oechem.oemolistream(os.path.join(FILE_DIR, "4YFF_lig.oeb")) as ifs:
+            oechem.OEReadMolecule(ifs, self.ligand)
+
+    @pytest.mark.local
+    def test_cavity_volume_benchmark(self):
+        cutoff = 5.0
+
+        start = time.perf_counter()
+        count = _reference_cavity_count(self.protein, self.ligand, cutoff)
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        volume = cavity_volume(self.protein, self.ligand, cutoff)
+        vectorized_time = time.perf_counter() - start
+
+        logging.getLogger(__name__).info("Cavity volume: reference {:.3f} s, vectorized {:.3f} s".format(
+            reference_time, vectorized_time))
+
+        self.assertEqual(volume, count * 0.5 ** 3)
+        self.assertLess(vectorized_time, reference_time)
+
+
+class WaterSelectionTests(unittest.TestCase):
+    """
+    Testing the binding site water selection
+    """
+    def setUp(self):
+        rng = np.random.RandomState(42)
+
+        self.n_frames = 3
+        self.box = np.tile(np.diag([3.0, 3.5, 4.0]), (self.n_frames, 1, 1))
+        self.xyz = rng.uniform(0.0, 3.0, size=(self.n_frames, 500, 3))
+
+        self.lig_idx = np.arange(0, 10)
+        self.ca_bs_idx = np.arange(10, 20)
+        self.water_idx = np.arange(20, 500)
+
+    def _check(self, box_vectors):
+        nmax = 15
+        cutoff = 1.0
+
+        selection, metrics = select_binding_site_waters(self.xyz, box_vectors, self.water_idx,
+                                                        self.lig_idx, self.ca_bs_idx, nmax, cutoff)
+
+        self.assertEqual(selection.shape, (self.n_frames, nmax))
+
+        for frame in range(self.n_frames):
+            xyz = self.xyz[frame]
+            box = box_vectors[frame]
+
+            d_lig = _brute_force_min_distances(xyz[self.lig_idx], xyz[self.water_idx], box)
+            d_ca = _brute_force_min_distances(xyz[self.ca_bs_idx], xyz[self.water_idx], box)
+
+            candidates = np.nonzero(np.minimum(d_lig, d_ca) < cutoff)[0]
+            metric = d_lig[candidates] + d_ca[candidates]
+            order = np.argsort(metric, kind='stable')[:nmax]
+
+            self.assertTrue(np.array_equal(selection[frame], self.water_idx[candidates[order]]))
+            self.assertTrue(np.allclose(metrics[frame], metric[order]))
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_rectangular_box(self):
+        self._check(self.box)
+
+    @pytest.mark.travis
+    @pytest.mark.local
+    def test_triclinic_box(self):
+        box = self.box.copy()
+        box[:, 1, 0] = 0.5
+        box[:, 2, 0] = 0.3
+        box[:, 2, 1] = 0.4
+        self._check(box)
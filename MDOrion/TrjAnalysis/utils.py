@@ -34,10 +34,18 @@ from tempfile import TemporaryDirectory
 
 import oetrajanalysis.Clustering_utils as clusutl
 
-from MDOrion.TrjAnalysis.water_utils import nmax_waters
+from MDOrion.TrjAnalysis.water_utils import (nmax_waters,
+                                             select_binding_site_waters)
 
+from MDOrion.Standards.chunked_traj import (load_manifest,
+                                           read_chunk)
 
-def extract_aligned_prot_lig_wat_traj(md_components, flask, trj_fn, opt, nmax=30, water_cutoff=15.0):
+from MDOrion.Standards.traj_store import (OETrajStore,
+                                          frame_dtype)
+
+
+def extract_aligned_prot_lig_wat_traj(md_components, flask, trj_fn, opt, nmax=30, water_cutoff=15.0,
+                                      chunk_size=100, atom_indices=None):
     """
     Extracts the aligned protein trajectory and aligned ligand trajectory and aligned
     Water trajectory from a MD trajectory of a larger system that includes other
@@ -58,280 +66,538 @@ def extract_aligned_prot_lig_wat_traj(md_components, flask, trj_fn, opt, nmax=30
             The system flask
 
         trj_fn: String
-            The filename of the hdf5-format MD trajectory or Gromacs .trr file format
+            The filename of the hdf5-format MD trajectory, the manifest of the chunked
+            trajectory or Gromacs .trr file format
         water_cutoff: Float
             The cutoff distance between the PL binding site and the waters in angstroms
         nmax: Integer
             max number of waters to select
+        chunk_size: Integer
+            The number of trajectory frames processed at a time. The peak memory
+            depends on the chunk size rather than on the trajectory length
+        atom_indices: numpy array or None
+            The sorted flask atom indexes of the trajectory atoms if the trajectory
+            is an atom subset trajectory stream. The stream must include the protein
+            and ligand atoms and at least nmax whole water molecules. If None the
+            trajectory includes all the flask atoms
     Outputs:
         multi_conf_protein: A multi conformer OEMol for the protein, one conformer per frame.
         multi_conf_ligand: A multi conformer OEMol for the ligand, one conformer per frame.
         multi_conf_water: A multi conformer OEMol for the waters, one conformer per frame.
+        frame_times: A numpy array of the frame times in ps.
     """
 
-    # Extract protein, ligand, water and excipients from the flask
-    # protein, ligand, water, excipients = oeommutils.split(flask, ligand_res_name="LIG")
+    aligned = AlignedTrajectory(md_components, flask, trj_fn, opt, nmax=nmax, water_cutoff=water_cutoff,
+                                atom_indices=atom_indices)
 
-    set_up_flask, map_dic = md_components.create_flask
-    protein = md_components.get_protein
-    ligand = md_components.get_ligand
+    multi_conf_protein = oechem.OEMol(aligned.protein)
+    multi_conf_ligand = oechem.OEMol(aligned.ligand)
+    multi_conf_water = oechem.OEMol(aligned.water)
 
-    check_nmax = nmax_waters(protein, ligand, water_cutoff)
+    count = 0
+    frame_times = []
 
-    if check_nmax < nmax:
-        opt['Logger'].warn("The selected number of max waters cannot fit around the protein binding site: {} vs {}".
-                           format(nmax, check_nmax))
+    for start, prot_xyz, lig_xyz, water_xyz, times in aligned.chunks(chunk_size):
 
-    void, traj_ext = os.path.splitext(trj_fn)
+        frame_times.append(times)
 
-    traj_dir = os.path.dirname(trj_fn)
+        # Attach the conformers on the multi conformer protein, ligand and water molecules
+        for frame_idx in range(len(times)):
 
-    if traj_ext == '.h5':
-        trj = md.load_hdf5(trj_fn)
+            prot_confxyz = oechem.OEFloatArray(prot_xyz[frame_idx].ravel())
+            lig_confxyz = oechem.OEFloatArray(lig_xyz[frame_idx].ravel())
+            water_confxyz = oechem.OEFloatArray(water_xyz[frame_idx].ravel())
 
-    elif traj_ext == '.trr':
-        pdb_fn = glob.glob(os.path.join(traj_dir, '*.pdb'))[0]
-        trj = md.load_trr(trj_fn, top=pdb_fn)
-        trj = trj[1:]
-    else:
-        raise ValueError("Trajectory file format {} not recognized in the trajectory {}".format(traj_ext, trj_fn))
+            if count == 0:
+                multi_conf_protein.SetCoords(prot_confxyz)
+                multi_conf_ligand.SetCoords(lig_confxyz)
+                multi_conf_water.SetCoords(water_confxyz)
+            else:
+                multi_conf_protein.NewConf(prot_confxyz)
+                multi_conf_ligand.NewConf(lig_confxyz)
+                multi_conf_water.NewConf(water_confxyz)
 
-    # System topology
-    top_trj = trj.topology
+            count += 1
 
-    # Ligand indexes
-    # lig_idx = top_trj.select("resname LIG")
-    lig_idx = map_dic['ligand']
+    if count == 0:
+        raise ValueError("The trajectory does not contain any frame: {}".format(trj_fn))
 
-    # Protein indexes
-    # prot_idx = top_trj.select("protein")
+    return multi_conf_protein, multi_conf_ligand, multi_conf_water, np.concatenate(frame_times)
 
-    # It is safer to use OE toolkits than mdtraj which is missing the protein caps
-    prot_idx = map_dic['protein']
 
-    # for at in protein.GetAtoms():
-    #     prot_idx.append(at.GetIdx())
+def extract_aligned_prot_lig_wat_stores(md_components, flask, trj_fn, opt, directory, nmax=30, water_cutoff=15.0,
+                                        chunk_size=100, atom_indices=None, pose_id=0):
+    """
+    Extracts the aligned protein, ligand and water trajectories as done by
+    extract_aligned_prot_lig_wat_traj, but the protein and water frames are written
+    chunk by chunk straight into memory mapped trajectory store arrays. The multi
+    conformer protein and water OEMols are never built, so the peak memory does not
+    depend on the trajectory length. The ligand is returned as multi conformer OEMol
 
-    # Water oxygen indexes
-    water_O_idx = top_trj.select("water and element O")
+    Inputs:
+        md_components: MDComponents object
+            The md components carrying the setup starting flask.
+        flask: OEMol
+            The system flask
+        trj_fn: String
+            The filename of the hdf5-format MD trajectory, the manifest of the chunked
+            trajectory or Gromacs .trr file format
+        opt: python dictionary
+            The options used to log
+        directory: String
+            The directory where the memory mapped protein and water coordinates are written.
+            The directory must outlive the returned stores
+        water_cutoff: Float
+            The cutoff distance between the PL binding site and the waters in angstroms
+        nmax: Integer
+            max number of waters to select
+        chunk_size: Integer
+            The number of trajectory frames processed at a time
+        atom_indices: numpy array or None
+            The sorted flask atom indexes of the trajectory atoms if the trajectory
+            is an atom subset trajectory stream
+        pose_id: Integer
+            The pose id of the trajectory store frames
+    Outputs:
+        protein_store: The protein OETrajStore
+        multi_conf_ligand: A multi conformer OEMol for the ligand, one conformer per frame.
+        water_store: The water OETrajStore
+    """
 
-    # Protein carbon alpha indexes
-    prot_ca_idx = top_trj.select("backbone and element C")
+    aligned = AlignedTrajectory(md_components, flask, trj_fn, opt, nmax=nmax, water_cutoff=water_cutoff,
+                                atom_indices=atom_indices)
 
-    # Cutoff for the selection of the binding site atoms in A
-    cutoff_bs = 5.0
+    if aligned.n_frames == 0:
+        raise ValueError("The trajectory does not contain any frame: {}".format(trj_fn))
 
-    # Carbon alpha binding site indexes
-    ca_bs_idx = md.compute_neighbors(trj[0], cutoff_bs / 10.0, lig_idx, haystack_indices=prot_ca_idx, periodic=True)[0]
+    protein_topology = oechem.OEMol(aligned.protein)
+    water_topology = oechem.OEMol(aligned.water)
 
-    # Carbon alpha binding site and ligand indexes
-    ca_bs_lig_idx = np.concatenate((ca_bs_idx, lig_idx))
+    protein_xyz = np.lib.format.open_memmap(os.path.join(directory, 'protein_traj_xyz.npy'), mode='w+',
+                                            dtype=np.float32,
+                                            shape=(aligned.n_frames, protein_topology.GetMaxAtomIdx(), 3))
 
-    # Image the protein-ligand trajectory so the complex does not jump across box boundaries
-    protlig = trj[0].atom_slice(np.concatenate((prot_idx, lig_idx)))
-    protligAtoms = [atom for atom in protlig.topology.atoms]
+    water_xyz = np.lib.format.open_memmap(os.path.join(directory, 'water_traj_xyz.npy'), mode='w+',
+                                          dtype=np.float32,
+                                          shape=(aligned.n_frames, water_topology.GetMaxAtomIdx(), 3))
 
-    with open(os.devnull, 'w') as devnull:
-        with contextlib.redirect_stderr(devnull):
-            trjImaged = trj.image_molecules(inplace=False, anchor_molecules=[protligAtoms], make_whole=True)
+    frames = np.zeros(aligned.n_frames, dtype=frame_dtype)
+    frames['pose_id'] = pose_id
 
-    # trjImaged = trj.image_molecules(inplace=False, anchor_molecules=[protligAtoms], make_whole=True)
+    multi_conf_ligand = oechem.OEMol(aligned.ligand)
 
     count = 0
-    water_max_frames = []
 
-    # TODO DEBUG
-    # trjImaged = trjImaged[:10]
+    for start, prot_xyz, lig_xyz, wat_xyz, times in aligned.chunks(chunk_size):
 
-    for frame in trjImaged:
-        # print(count, flush=True)
+        stop = start + len(times)
 
-        # Water oxygen binding site indexes
-        water_O_bs_idx = md.compute_neighbors(frame,
-                                              water_cutoff / 10.0,
-                                              ca_bs_lig_idx,
-                                              haystack_indices=water_O_idx,
-                                              periodic=True)
+        protein_xyz[start:stop] = prot_xyz
+        water_xyz[start:stop] = wat_xyz
+        frames['time'][start:stop] = times
 
-        # Pair combination water indexes times ligand indexes
-        wat_lig_pairs = np.array(np.meshgrid(water_O_bs_idx, lig_idx)).T.reshape(-1, 2)
+        for frame_idx in range(len(times)):
 
-        # Distances between the waters and the ligand in nm
-        wat_lig_distances = md.compute_distances(frame, wat_lig_pairs, periodic=True, opt=True)
+            lig_confxyz = oechem.OEFloatArray(lig_xyz[frame_idx].ravel())
 
-        # Reshape the wat_lig_distances
-        ns = np.reshape(wat_lig_distances, (len(water_O_bs_idx[0]), len(lig_idx)))
+            if count == 0:
+                multi_conf_ligand.SetCoords(lig_confxyz)
+            else:
+                multi_conf_ligand.NewConf(lig_confxyz)
 
-        # Min distances in nm between the oxygen waters and the ligand
-        min_wat_O_lig_distances = np.min(ns, axis=1)
+            count += 1
 
-        # Pair combination water indexes times protein binding site carbon alpha indexes
-        wat_ca_bs_pairs = np.array(np.meshgrid(water_O_bs_idx, ca_bs_idx)).T.reshape(-1, 2)
+    protein_xyz.flush()
+    water_xyz.flush()
 
-        # Distances between the waters and the protein binding site carbon alpha in nm
-        wat_ca_bs_distances = md.compute_distances(frame, wat_ca_bs_pairs, periodic=True, opt=True)
+    return (OETrajStore(protein_topology, protein_xyz, frames),
+            multi_conf_ligand,
+            OETrajStore(water_topology, water_xyz, frames.copy()))
 
-        # Reshape the wat_ca_bs_distances
-        ns = np.reshape(wat_ca_bs_distances, (len(water_O_bs_idx[0]), len(ca_bs_idx)))
 
-        # Min distances in nm between the oxygen waters and the protein binding site carbon alpha
-        min_wat_O_ca_bs_distances = np.min(ns, axis=1)
+def count_stream_waters(flask, atom_indices):
+    """
+    Counts the whole water molecules saved in an atom subset trajectory stream
 
-        metrics = min_wat_O_lig_distances + min_wat_O_ca_bs_distances
+    Inputs:
+        flask: OEMol
+            The system flask
+        atom_indices: numpy array
+            The flask atom indexes of the trajectory stream atoms
+    Outputs:
+        count: Integer
+            The number of water molecules with all the atoms in the stream
+    """
 
-        metric_distances = dict()
+    atom_indices = set(int(idx) for idx in atom_indices)
 
-        for wat_idx, m in zip(water_O_bs_idx[0], metrics):
-            metric_distances[int(wat_idx)] = m
+    water_oxygens = oechem.OEAndAtom(oechem.OEIsWater(checkHydrogens=True), oechem.OEIsOxygen())
 
-        water_list_sorted_max = sorted(metric_distances.items(), key=lambda x: x[1])[:nmax]
+    count = 0
 
-        if len(water_list_sorted_max) != nmax:
-            raise ValueError("The ordered water list has the wrong size {} vs expected {} for the frame {}".
-                             format(len(water_list_sorted_max), nmax, count))
+    for at in flask.GetAtoms(water_oxygens):
+        water_idx = [at.GetIdx()] + [nbr.GetIdx() for nbr in at.GetAtoms()]
 
-        water_max_frames.append(water_list_sorted_max)
+        if atom_indices.issuperset(water_idx):
+            count += 1
 
-        # print(min_wat_O_ca_bs_distances)
-        # print(pairs[:len(lig_idx), :])
-        # for p,d in zip(wat_ca_bs_pairs, wat_ca_bs_distances[0]):
-        #     print(p,d)
+    return count
 
-        count += 1
 
-    # Put the reference mol xyz into the 1-frame topologyTraj to use as a reference in the fit
-    setup_mol_array_coords = oechem.OEDoubleArray(3 * set_up_flask.GetMaxAtomIdx())
-    set_up_flask.GetCoords(setup_mol_array_coords)
+class AlignedTrajectory(object):
+    """
+    This class implements the chunked alignment of a protein-ligand MD trajectory.
+    The trajectory is processed in chunks of frames and only the needed atoms are read:
+    the binding site waters are selected by reading the ligand, the binding site carbon
+    alpha and the water oxygens. Then the protein, ligand and selected waters are read,
+    imaged, aligned to the setup flask reference and reduced to the protein, ligand
+    and water coordinates
+    """
+
+    def __init__(self, md_components, flask, trj_fn, opt, nmax=30, water_cutoff=15.0, atom_indices=None):
+        """
+        The Initialization function used to select the binding site and to build
+        the protein, ligand and water topologies
+
+        Parameters
+        ----------
+        md_components: MDComponents object
+            The md components carrying the setup starting flask
+        flask: OEMol
+            The system flask
+        trj_fn: String
+            The filename of the hdf5-format MD trajectory, the manifest of the chunked
+            trajectory or Gromacs .trr file format
+        opt: python dictionary
+            The options used to log
+        nmax: Integer
+            max number of waters to select
+        water_cutoff: Float
+            The cutoff distance between the PL binding site and the waters in angstroms
+        atom_indices: numpy array or None
+            The sorted flask atom indexes of the trajectory atoms if the trajectory
+            is an atom subset trajectory stream. If None the trajectory includes all
+            the flask atoms
+        """
 
-    setup_mol_xyzArr = np.array(setup_mol_array_coords)
-    setup_mol_xyzArr.shape = (-1, 3)
+        set_up_flask, map_dic = md_components.create_flask
+        self.protein = md_components.get_protein
+        self.ligand = md_components.get_ligand
 
-    trj_reference = trjImaged[0]
-    # convert from angstroms to nanometers
-    trj_reference.xyz[0] = setup_mol_xyzArr / 10.0
+        self.nmax = nmax
+        self.water_cutoff = water_cutoff
 
-    # Fitting
-    trjImaged.superpose(trj_reference, 0, ca_bs_idx)
+        check_nmax = nmax_waters(self.protein, self.ligand, water_cutoff)
 
-    # Delete Original Trajectory to save memory
-    del trj
+        if check_nmax < nmax:
+            opt['Logger'].warn("The selected number of max waters cannot fit around the protein binding site: {} vs {}".
+                               format(nmax, check_nmax))
 
-    # Molecule copies
-    ligand_reference = oechem.OEMol(ligand)
-    protein_reference = oechem.OEMol(protein)
+        # Put the reference mol xyz into the 1-frame topologyTraj to use as a reference in the fit
+        setup_mol_array_coords = oechem.OEDoubleArray(3 * set_up_flask.GetMaxAtomIdx())
+        set_up_flask.GetCoords(setup_mol_array_coords)
 
-    count = 0
+        setup_mol_xyzArr = np.array(setup_mol_array_coords)
+        setup_mol_xyzArr.shape = (-1, 3)
 
-    # Create the multi conformer protein, ligand and water molecules
-    for frame in trjImaged.xyz:
-        # print("Trj Image loop", count, flush=True)
-
-        # Extract coordinates in A
-        xyz = frame * 10
-
-        # Set flask Coordinates as the current frame for the water extraction
-        flask.SetCoords(xyz.flatten())
-        water_list_sorted_max = water_max_frames[count]
-
-        # print(water_list_sorted_max)
-
-        # TODO The following solution to extract the waters do not
-        #  keep the water order
-
-        # Mark the close water atoms and extract them
-        bv = oechem.OEBitVector(nmax * 3)
-        water_idx = []
-
-        for pair in water_list_sorted_max:
-
-            ow = flask.GetAtom(oechem.OEHasAtomIdx(pair[0]))
-
-            # Select the whole water molecule
-            for atw in oechem.OEGetResidueAtoms(ow):
-                bv.SetBitOn(atw.GetIdx())
-                water_idx.append(atw.GetIdx())
-
-        pred_vec = oechem.OEAtomIdxSelected(bv)
-        water_nmax_reference = oechem.OEMol()
-        oechem.OESubsetMol(water_nmax_reference, flask, pred_vec)
-
-        # TODO The following solution to extract the waters
-        #  keep the water order but is it seems extremely inefficient
-
-        # water_list = []
-        # for pair in water_list_sorted_max:
-        #     bv = oechem.OEBitVector(3)
-        #     water_idx = []
-        #     ow = flask.GetAtom(oechem.OEHasAtomIdx(pair[0]))
-        #
-        #     # Select the whole water molecule
-        #     for atw in oechem.OEGetResidueAtoms(ow):
-        #         bv.SetBitOn(atw.GetIdx())
-        #         water_idx.append(atw.GetIdx())
-        #
-        #     pred_vec = oechem.OEAtomIdxSelected(bv)
-        #     water = oechem.OEMol()
-        #     oechem.OESubsetMol(water, flask, pred_vec)
-        #
-        #     water_list.append(water)
-        #
-        #
-        # # print(len(water_list))
-        #
-        # water_nmax_reference = oechem.OEMol()
-
-        # for w in water_list:
-        #     oechem.OEAddMols(water_nmax_reference, w)
-
-        # ligand and protein conf coordinates
-        lig_xyz_list = [10 * frame[idx] for idx in lig_idx]
-        lig_confxyz = oechem.OEFloatArray(np.array(lig_xyz_list).ravel())
-
-        prot_xyz_list = [10 * frame[idx] for idx in prot_idx]
-        prot_confxyz = oechem.OEFloatArray(np.array(prot_xyz_list).ravel())
-
-        # Initialize the protein, ligand and water molecule topologies
-        if count == 0:
-
-            multi_conf_water = oechem.OEMol(water_nmax_reference)
-
-            if multi_conf_water.NumAtoms() % 3 != 0:
-                raise ValueError("Number of Water atoms is not multiple of 3")
-
-            # Clean ResNumber and Chain on the multi conf water molecule
-            # oechem.OEPerceiveResidues(multi_conf_water, oechem.OEPreserveResInfo_All)
-            multi_conf_water.SetTitle("Water_" + str(nmax))
-
-            res_num = 0
-            i = 0
-            for at in multi_conf_water.GetAtoms():
-
-                res = oechem.OEAtomGetResidue(at)
-                res.SetSerialNumber(i)
-                res.SetName("HOH")
-                res.SetChainID("Z")
-                if i % 3 == 0:
-                    res_num += 1
-                res.SetResidueNumber(res_num)
-                i += 1
-
-            ligand_reference.SetCoords(lig_confxyz)
-            protein_reference.SetCoords(prot_confxyz)
-            multi_conf_ligand = oechem.OEMol(ligand_reference)
-            multi_conf_protein = oechem.OEMol(protein_reference)
+        # Ligand indexes
+        # lig_idx = top_trj.select("resname LIG")
+        lig_idx = map_dic['ligand']
 
-        # Attach the conformers on the multi conformer protein, ligand and water molecules
+        # Protein indexes
+        # prot_idx = top_trj.select("protein")
+
+        # It is safer to use OE toolkits than mdtraj which is missing the protein caps
+        prot_idx = map_dic['protein']
+
+        # Cutoff for the selection of the binding site atoms in A
+        cutoff_bs = 5.0
+
+        self.reader = TrajectoryReader(trj_fn)
+        self.n_frames = self.reader.n_frames
+
+        # System topology
+        top_trj = self.reader.topology
+
+        # The flask atom indexes are mapped on the atom subset trajectory atoms
+        if atom_indices is not None:
+            atom_indices = np.asarray(atom_indices, dtype=np.int64)
+
+            if len(atom_indices) != top_trj.n_atoms:
+                raise ValueError("The number of trajectory atoms and atom indexes do not match: {} vs {}".format(
+                    top_trj.n_atoms, len(atom_indices)))
+
+            lig_idx = _subset_positions(atom_indices, lig_idx)
+            prot_idx = _subset_positions(atom_indices, prot_idx)
+            setup_mol_xyzArr = setup_mol_xyzArr[atom_indices]
+
+        # Water oxygen indexes. The atom subset streams can carry only the waters
+        # near the ligand, the partially saved water molecules are skipped
+        water_O_idx = top_trj.select("water and element O")
+        whole = np.array([top_trj.atom(int(idx)).residue.n_atoms == 3 for idx in water_O_idx], dtype=bool)
+        water_O_idx = water_O_idx[whole]
+
+        # The whole water molecule atoms selected by their oxygen indexes, one row per water
+        water_atoms = np.array([[at.index for at in top_trj.atom(int(idx)).residue.atoms] for idx in water_O_idx])
+
+        if water_atoms.ndim != 2 or water_atoms.shape[1] != 3:
+            raise ValueError("Number of Water atoms is not multiple of 3")
+
+        # Protein carbon alpha indexes
+        prot_ca_idx = top_trj.select("backbone and element C")
+
+        # Carbon alpha binding site indexes from the first frame
+        first_idx = np.union1d(lig_idx, prot_ca_idx)
+        first = self.reader.read(0, 1, atom_indices=first_idx)
+
+        ca_bs_idx = first_idx[md.compute_neighbors(first, cutoff_bs / 10.0, np.searchsorted(first_idx, lig_idx),
+                                                   haystack_indices=np.searchsorted(first_idx, prot_ca_idx),
+                                                   periodic=True)[0]]
+
+        # Carbon alpha binding site and ligand indexes
+        ca_bs_lig_idx = np.concatenate((ca_bs_idx, lig_idx))
+
+        # The atoms read to select the binding site waters
+        self.select_idx = np.union1d(ca_bs_lig_idx, water_O_idx)
+
+        # The fitting reference made of the binding site carbon alpha with the setup flask coordinates in nm
+        self.trj_reference = md.Trajectory(setup_mol_xyzArr[ca_bs_idx][np.newaxis] / 10.0, top_trj.subset(ca_bs_idx))
+
+        self.prot_idx = prot_idx
+        self.lig_idx = lig_idx
+        self.ca_bs_idx = ca_bs_idx
+        self.water_O_idx = water_O_idx
+        self.water_atoms = water_atoms
+
+        # The protein, ligand and water topologies are built once and the trajectory frames
+        # are attached as coordinates. The water topology is made of nmax copies of the
+        # first water molecule of the flask
+        bv = oechem.OEBitVector(flask.GetMaxAtomIdx())
+        for at_idx in (water_atoms[0] if atom_indices is None else atom_indices[water_atoms[0]]):
+            bv.SetBitOn(int(at_idx))
+
+        water_mol = oechem.OEMol()
+        oechem.OESubsetMol(water_mol, flask, oechem.OEAtomIdxSelected(bv))
+
+        self.water = oechem.OEMol()
+        for i in range(nmax):
+            oechem.OEAddMols(self.water, water_mol)
+
+        # Clean ResNumber and Chain on the multi conf water molecule
+        self.water.SetTitle("Water_" + str(nmax))
+
+        res_num = 0
+        i = 0
+        for at in self.water.GetAtoms():
+
+            res = oechem.OEAtomGetResidue(at)
+            res.SetSerialNumber(i)
+            res.SetName("HOH")
+            res.SetChainID("Z")
+            if i % 3 == 0:
+                res_num += 1
+            res.SetResidueNumber(res_num)
+            oechem.OEAtomSetResidue(at, res)
+            i += 1
+
+    def chunks(self, chunk_size=100):
+        """
+        This method iterates over the aligned trajectory chunks
+
+        Parameters
+        ----------
+        chunk_size: Integer
+            The number of trajectory frames processed at a time
+
+        Returns
+        -------
+        chunks: iterator
+            The (first frame, protein xyz, ligand xyz, water xyz, frame times) of each
+            chunk. The coordinates are (n_frames, n_atoms, 3) arrays in A and the
+            times are in ps
+        """
+
+        select_idx = self.select_idx
+        prot_idx = self.prot_idx
+        lig_idx = self.lig_idx
+        ca_bs_idx = self.ca_bs_idx
+        water_O_idx = self.water_O_idx
+
+        for start in range(0, self.n_frames, chunk_size):
+
+            chunk = self.reader.read(start, chunk_size, atom_indices=select_idx)
+
+            # The binding site water oxygen indexes of the chunk frames ordered by increasing metric
+            selection, metrics = select_binding_site_waters(chunk.xyz,
+                                                            chunk.unitcell_vectors,
+                                                            np.searchsorted(select_idx, water_O_idx),
+                                                            np.searchsorted(select_idx, lig_idx),
+                                                            np.searchsorted(select_idx, ca_bs_idx),
+                                                            self.nmax,
+                                                            self.water_cutoff / 10.0)
+
+            water_max_frames = select_idx[selection]
+
+            # The protein, ligand, binding site and selected water atoms of the chunk
+            water_uniq, water_inv = np.unique(water_max_frames, return_inverse=True)
+            chunk_water_idx = self.water_atoms[np.searchsorted(water_O_idx, water_uniq)]
+            subset_idx = np.union1d(np.union1d(np.union1d(prot_idx, lig_idx), ca_bs_idx), chunk_water_idx.ravel())
+
+            # Positions of the system atoms in the subset
+            prot_pos = np.searchsorted(subset_idx, prot_idx)
+            lig_pos = np.searchsorted(subset_idx, lig_idx)
+
+            # Positions of the selected water atoms in the subset, frame by frame in the
+            # water selection order. The water order is preserved by the index permutation
+            chunk_water_pos = np.searchsorted(subset_idx, chunk_water_idx)
+            water_pos = chunk_water_pos[water_inv.reshape(water_max_frames.shape)].reshape(len(water_max_frames), -1)
+
+            chunk = self.reader.read(start, chunk_size, atom_indices=subset_idx)
+
+            # Image the protein-ligand chunk so the complex does not jump across box boundaries
+            protligAtoms = [chunk.topology.atom(int(pos)) for pos in np.concatenate((prot_pos, lig_pos))]
+
+            with open(os.devnull, 'w') as devnull:
+                with contextlib.redirect_stderr(devnull):
+                    chunk.image_molecules(inplace=True, anchor_molecules=[protligAtoms], make_whole=True)
+
+            # Fitting
+            chunk.superpose(self.trj_reference, 0, atom_indices=np.searchsorted(subset_idx, ca_bs_idx),
+                            ref_atom_indices=np.arange(len(ca_bs_idx)))
+
+            # The protein, ligand and water coordinates of the chunk frames in A
+            prot_xyz = 10 * chunk.xyz[:, prot_pos]
+            lig_xyz = 10 * chunk.xyz[:, lig_pos]
+            water_xyz = 10 * chunk.xyz[np.arange(len(chunk.xyz))[:, np.newaxis], water_pos]
+
+            yield start, prot_xyz, lig_xyz, water_xyz, chunk.time
+
+
+def _subset_positions(atom_indices, idx):
+    # The positions of the selected atom indexes in the sorted atom subset indexes
+    idx = np.asarray(idx, dtype=np.int64)
+    pos = np.searchsorted(atom_indices, idx)
+
+    if np.any(pos >= len(atom_indices)) or np.any(atom_indices[np.minimum(pos, len(atom_indices) - 1)] != idx):
+        raise ValueError("The trajectory atom subset does not include all the selected atoms")
+
+    return pos
+
+
+class TrajectoryReader(object):
+    """
+    This class implements a random access reader of the MD trajectories which
+    reads only the selected atoms of the selected frames. The supported formats
+    are the mdtraj HDF5 trajectories, the chunked trajectory manifests and the
+    Gromacs .trr trajectories
+    """
+
+    def __init__(self, trj_fn):
+        """
+        The Initialization function used to open the trajectory
+
+        Parameters
+        ----------
+        trj_fn: String
+            The filename of the hdf5-format MD trajectory, the manifest of the chunked
+            trajectory or Gromacs .trr file format
+        """
+
+        void, self.traj_ext = os.path.splitext(trj_fn)
+
+        self.trj_fn = trj_fn
+
+        # Last chunked trajectory chunk read
+        self._chunk = (None, None)
+
+        if self.traj_ext == '.h5':
+            with md.formats.HDF5TrajectoryFile(trj_fn) as f:
+                self.topology = f.topology
+                self.n_frames = len(f)
+
+        elif self.traj_ext == '.json':
+            self.manifest = load_manifest(trj_fn)
+            self.topology = md.load_topology(self.manifest['topology'])
+            self.n_frames = self.manifest['n_frames']
+
+        elif self.traj_ext == '.trr':
+            pdb_fn = glob.glob(os.path.join(os.path.dirname(trj_fn), '*.pdb'))[0]
+            self.topology = md.load_topology(pdb_fn)
+            with md.formats.TRRTrajectoryFile(trj_fn) as f:
+                # The first Gromacs frame is skipped
+                self.n_frames = max(len(f) - 1, 0)
         else:
-            water_confxyz = oechem.OEFloatArray(water_nmax_reference.NumAtoms() * 3)
-            water_nmax_reference.GetCoords(water_confxyz)
+            raise ValueError("Trajectory file format {} not recognized in the trajectory {}".format(self.traj_ext,
+                                                                                                   trj_fn))
+
+    def read(self, start, n_frames, atom_indices=None):
+        """
+        This method reads the selected frames and atoms of the trajectory
+
+        Parameters
+        ----------
+        start: Int
+            The first frame to read
+        n_frames: Int
+            The number of frames to read
+        atom_indices: numpy array or None
+            The sorted indices of the atoms to read. If None all the atoms are read
 
-            multi_conf_water.NewConf(water_confxyz)
-            multi_conf_ligand.NewConf(lig_confxyz)
-            multi_conf_protein.NewConf(prot_confxyz)
+        Returns
+        -------
+        trajectory: mdtraj Trajectory
+            The trajectory frames
+        """
 
-        count += 1
+        n_frames = min(n_frames, self.n_frames - start)
 
-    return multi_conf_protein, multi_conf_ligand, multi_conf_water
+        if atom_indices is not None:
+            atom_indices = np.asarray(atom_indices, dtype=np.int64)
+
+        if self.traj_ext == '.h5':
+            with md.formats.HDF5TrajectoryFile(self.trj_fn) as f:
+                f.seek(start)
+                return f.read_as_traj(n_frames=n_frames, atom_indices=atom_indices)
+
+        if self.traj_ext == '.trr':
+            with md.formats.TRRTrajectoryFile(self.trj_fn) as f:
+                f.seek(start + 1)
+                return f.read_as_traj(self.topology, n_frames=n_frames, atom_indices=atom_indices)
+
+        xyz = []
+        time = []
+        box = []
+
+        for idx, chunk in enumerate(self.manifest['chunks']):
+
+            first = max(start - chunk['first_frame'], 0)
+            last = min(start + n_frames - chunk['first_frame'], chunk['n_frames'])
+
+            if first >= last:
+                continue
+
+            # The chunks are read once by consecutive reads of the same frames
+            if self._chunk[0] != idx:
+                self._chunk = (idx, read_chunk(chunk['file_id']))
+
+            c_xyz, c_time, c_box = self._chunk[1]
+
+            c_xyz = c_xyz[first:last]
+            if atom_indices is not None:
+                c_xyz = c_xyz[:, atom_indices]
+
+            xyz.append(c_xyz)
+            time.append(c_time[first:last])
+            box.append(None if c_box is None else c_box[first:last])
+
+        topology = self.topology if atom_indices is None else self.topology.subset(atom_indices)
+
+        trj = md.Trajectory(np.concatenate(xyz), topology, time=np.concatenate(time))
+
+        if all(b is not None for b in box):
+            trj.unitcell_vectors = np.concatenate(box)
+
+        return trj
 
 
 def RequestOEField(record, field, rType):
@@ -352,6 +618,48 @@ def RequestOEFieldType(record, field):
         return record.get_value(field)
 
 
+def mol_to_bytes(mol):
+    """
+    This function serializes a molecule to OEB bytes, e.g. to pass it to a
+    process pool worker
+
+    Parameters
+    ----------
+    mol: OEMol
+        The molecule
+
+    Returns
+    -------
+    data: bytes
+        The serialized molecule
+    """
+
+    return oechem.OEWriteMolToBytes('.oeb', mol)
+
+
+def mol_from_bytes(data):
+    """
+    This function deserializes a molecule from OEB bytes
+
+    Parameters
+    ----------
+    data: bytes
+        The serialized molecule
+
+    Returns
+    -------
+    mol: OEMol
+        The molecule
+    """
+
+    mol = oechem.OEMol()
+
+    if not oechem.OEReadMolFromBytes(mol, '.oeb', data):
+        raise ValueError("The molecule could not be read from the serialized data")
+
+    return mol
+
+
 def PoseInteractionsSVG(md_components, width=400, height=300):
     """Generate a OEGrapheme interaction plot for a protein-ligand complex.
     The input protein may have other non-protein components as well so
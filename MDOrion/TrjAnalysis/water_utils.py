@@ -2,19 +2,34 @@ from openeye import (oechem,
                      oegrid,
                      oespicoli)
 
-
-def dist2(coord1, coord2):
-    distsq = (coord1[0] - coord2[0])**2 + \
-             (coord1[1] - coord2[1])**2 + \
-             (coord1[2] - coord2[2])**2
-
-    return distsq
-
-
-def nmax_waters(protein, ligand, cutoff):
-
-    # Grid Spacing in A
-    spacing = 0.5
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+
+def cavity_volume(protein, ligand, cutoff, spacing=0.5):
+    """
+    This function estimates the volume of the cavity around the ligand which can
+    be filled by waters. The grid points in a box twice the ligand extents are
+    selected if they are outside the protein-ligand molecular surface and within
+    the cutoff distance from both the ligand and the protein atoms
+
+    Parameters
+    ----------
+    protein: OEMol
+        The protein
+    ligand: OEMol
+        The ligand
+    cutoff: Float
+        The cutoff distance in A
+    spacing: Float
+        The grid spacing in A
+
+    Returns
+    -------
+    volume: Float
+        The cavity volume in A^3
+    """
 
     complex = oechem.OEMol(protein)
 
@@ -23,8 +38,6 @@ def nmax_waters(protein, ligand, cutoff):
     surf = oespicoli.OESurface()
     oespicoli.OEMakeMolecularSurface(surf, complex, spacing)
 
-    # oespicoli.OEWriteSurface("test_surf.oesrf", surf)
-
     center = oechem.OEFloatArray(3)
     extents = oechem.OEFloatArray(3)
 
@@ -38,89 +51,60 @@ def nmax_waters(protein, ligand, cutoff):
     grid_spicoli = oegrid.OEScalarGrid()
     oespicoli.OEMakeBitGridFromSurface(grid_spicoli, surf)
 
-    for iz in range(grid_reference.GetZDim()):
-        for iy in range(grid_reference.GetYDim()):
-            for ix in range(grid_reference.GetXDim()):
-                x = grid_reference.GetX(ix)
-                y = grid_reference.GetY(iy)
-                z = grid_reference.GetZ(iz)
-
-                ix_spicoli = grid_spicoli.GetXIdx(x)
-                iy_spicoli = grid_spicoli.GetYIdx(y)
-                iz_spicoli = grid_spicoli.GetZIdx(z)
-
-                value = grid_spicoli.GetValue(ix_spicoli,
-                                              iy_spicoli,
-                                              iz_spicoli)
-
-                grid_reference.SetValue(ix,
-                                        iy,
-                                        iz,
-                                        value)
-    # Invert Grid
-    for iz in range(grid_reference.GetZDim()):
-        for iy in range(grid_reference.GetYDim()):
-            for ix in range(grid_reference.GetXDim()):
-                # print("ix = {} iy = {} iz = {} value = {}".format(ix, iy, iz , grid.GetValue(ix, iy, iz)))
-                if grid_reference.GetValue(ix, iy, iz) == 0.0:
-                    grid_reference.SetValue(ix, iy, iz, 1.0)
-                else:
-                    grid_reference.SetValue(ix, iy, iz, 0.0)
-
-    ligand_coords = ligand.GetCoords()
-
-    for iz in range(grid_reference.GetZDim()):
-        for iy in range(grid_reference.GetYDim()):
-            for ix in range(grid_reference.GetXDim()):
-                if grid_reference.GetValue(ix, iy, iz) == 1.0:
-
-                    x = grid_reference.GetX(ix)
-                    y = grid_reference.GetY(iy)
-                    z = grid_reference.GetZ(iz)
-
-                    min_sq = cutoff * cutoff
-
-                    for coord in ligand_coords.values():
-                        distsq = dist2(coord, (x, y, z))
-                        if distsq < min_sq:
-                            min_sq = distsq
-                            break
-                    if min_sq == cutoff * cutoff:
-                        grid_reference.SetValue(ix, iy, iz, 0.0)
-
-    protein_coords = protein.GetCoords()
-
-    for iz in range(grid_reference.GetZDim()):
-        for iy in range(grid_reference.GetYDim()):
-            for ix in range(grid_reference.GetXDim()):
-                if grid_reference.GetValue(ix, iy, iz) == 1.0:
-
-                    x = grid_reference.GetX(ix)
-                    y = grid_reference.GetY(iy)
-                    z = grid_reference.GetZ(iz)
-
-                    min_sq = cutoff * cutoff
-
-                    for coord in protein_coords.values():
-                        distsq = dist2(coord, (x, y, z))
-                        if distsq < min_sq:
-                            min_sq = distsq
-                            break
-                    if min_sq == cutoff * cutoff:
-                        grid_reference.SetValue(ix, iy, iz, 0.0)
-
-    # oegrid.OEWriteGrid("protein_ligand.grd", grid_reference)
-
-    count = 0
-
-    for iz in range(grid_reference.GetZDim()):
-        for iy in range(grid_reference.GetYDim()):
-            for ix in range(grid_reference.GetXDim()):
-                if grid_reference.GetValue(ix, iy, iz) == 1.0:
-                    count += 1
+    # The grid point coordinates and their surface grid indexes along each axis
+    x = np.array([grid_reference.GetX(ix) for ix in range(grid_reference.GetXDim())])
+    y = np.array([grid_reference.GetY(iy) for iy in range(grid_reference.GetYDim())])
+    z = np.array([grid_reference.GetZ(iz) for iz in range(grid_reference.GetZDim())])
+
+    ix_spicoli = [grid_spicoli.GetXIdx(float(v)) for v in x]
+    iy_spicoli = [grid_spicoli.GetYIdx(float(v)) for v in y]
+    iz_spicoli = [grid_spicoli.GetZIdx(float(v)) for v in z]
+
+    # The grid points outside the molecular surface, in (z, y, x) order
+    surface = np.fromiter((grid_spicoli.GetValue(isx, isy, isz)
+                           for isz in iz_spicoli for isy in iy_spicoli for isx in ix_spicoli),
+                          dtype=np.float64, count=len(x) * len(y) * len(z))
+
+    mask = surface == 0.0
+
+    zz, yy, xx = np.meshgrid(z, y, x, indexing='ij')
+    points = np.column_stack((xx.ravel(), yy.ravel(), zz.ravel()))[mask]
+
+    # The points within the cutoff distance from both the ligand and the protein
+    for mol in [ligand, protein]:
+        if not len(points):
+            break
+
+        coords = np.array(list(mol.GetCoords().values()), dtype=np.float64)
+        dist = cKDTree(coords).query(points, k=1)[0]
+        points = points[dist < cutoff]
 
     # Calculate Volume from count in Angstrom
-    vcount = (spacing ** 3) * count
+    return (spacing ** 3) * len(points)
+
+
+def nmax_waters(protein, ligand, cutoff):
+    """
+    This function estimates the max number of waters which can fit in the
+    binding site cavity within the cutoff distance from the ligand and the
+    protein
+
+    Parameters
+    ----------
+    protein: OEMol
+        The protein
+    ligand: OEMol
+        The ligand
+    cutoff: Float
+        The cutoff distance in A
+
+    Returns
+    -------
+    nwaters: Int
+        The max number of waters
+    """
+
+    vcount = cavity_volume(protein, ligand, cutoff)
 
     # Number of water molecule in vcount volume
     nwaters = int(0.034 * vcount)
@@ -128,4 +112,111 @@ def nmax_waters(protein, ligand, cutoff):
     return nwaters
 
 
-# def select_nmax_waters()
\ No newline at end of file
+def select_binding_site_waters(xyz, box_vectors, water_idx, lig_idx, ca_bs_idx, nmax, cutoff):
+    """
+    This function selects for each trajectory frame the nmax binding site waters.
+    The waters within the cutoff distance from the ligand or the binding site
+    carbon alpha atoms are the candidates and they are ranked by the sum of
+    their minimum distances from the ligand and from the binding site carbon
+    alpha atoms. The minimum distances are computed with the minimum image
+    convention by using periodic KD-trees for rectangular boxes and a vectorized
+    minimum image pass over all the candidates otherwise
+
+    Parameters
+    ----------
+    xyz: numpy array
+        The (n_frames, n_atoms, 3) coordinates in nm
+    box_vectors: numpy array or None
+        The (n_frames, 3, 3) box vectors in nm. If None the distances are not periodic
+    water_idx: numpy array
+        The water oxygen atom indexes
+    lig_idx: numpy array
+        The ligand atom indexes
+    ca_bs_idx: numpy array
+        The binding site carbon alpha atom indexes
+    nmax: Int
+        The number of waters to select
+    cutoff: Float
+        The cutoff distance in nm
+
+    Returns
+    -------
+    selection: numpy array
+        The (n_frames, nmax) selected water oxygen atom indexes ordered by increasing metric
+    metrics: numpy array
+        The (n_frames, nmax) metric of the selected waters in nm
+    """
+
+    water_idx = np.asarray(water_idx)
+
+    selection = np.empty((len(xyz), nmax), dtype=np.int64)
+    metrics = np.empty((len(xyz), nmax), dtype=np.float64)
+
+    for frame in range(len(xyz)):
+
+        box = None if box_vectors is None else box_vectors[frame]
+
+        waters = xyz[frame, water_idx]
+
+        d_lig = _min_distances(xyz[frame, lig_idx], waters, box)
+        d_ca = _min_distances(xyz[frame, ca_bs_idx], waters, box)
+
+        candidates = np.nonzero(np.minimum(d_lig, d_ca) < cutoff)[0]
+
+        if len(candidates) < nmax:
+            raise ValueError("The ordered water list has the wrong size {} vs expected {} for the frame {}".
+                             format(len(candidates), nmax, frame))
+
+        metric = d_lig[candidates] + d_ca[candidates]
+
+        # The nmax smallest metrics ordered by increasing value
+        top = np.argpartition(metric, nmax - 1)[:nmax] if len(candidates) > nmax else np.arange(len(candidates))
+        top = top[np.argsort(metric[top], kind='stable')]
+
+        selection[frame] = water_idx[candidates[top]]
+        metrics[frame] = metric[top]
+
+    return selection, metrics
+
+
+def _min_distances(query, points, box):
+    # Minimum distance of each point from the query atoms
+    query = np.asarray(query, dtype=np.float64)
+    points = np.asarray(points, dtype=np.float64)
+
+    if box is None:
+        return cKDTree(query).query(points, k=1)[0]
+
+    box = np.asarray(box, dtype=np.float64)
+
+    if np.count_nonzero(box - np.diag(np.diag(box))) == 0:
+        # Rectangular box: periodic KD-tree on the wrapped coordinates
+        lengths = np.diag(box)
+        tree = cKDTree(_wrap(query, lengths), boxsize=lengths)
+        return tree.query(_wrap(points, lengths), k=1)[0]
+
+    # Triclinic box: minimum image in fractional coordinates
+    inv_box = np.linalg.inv(box)
+    frac_query = query.dot(inv_box)
+    frac_points = points.dot(inv_box)
+
+    # The rounded image is not always the closest one in skewed boxes
+    # so the neighbour images are checked as well
+    shifts = np.array([[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)], dtype=np.float64)
+
+    min_dist = np.full(len(points), np.inf)
+
+    for fq in frac_query:
+        delta = frac_points - fq
+        delta -= np.round(delta)
+        images = (delta[:, np.newaxis, :] + shifts).dot(box)
+        min_dist = np.minimum(min_dist, np.linalg.norm(images, axis=2).min(axis=1))
+
+    return min_dist
+
+
+def _wrap(coords, lengths):
+    # Coordinates wrapped in the [0, length) periodic box required by the KD-tree
+    wrapped = np.mod(coords, lengths)
+    wrapped[wrapped >= lengths] = 0.0
+    return wrapped
@@ -36,6 +36,12 @@ from .MDEngines.cubes import ParallelMDNvtCube
 from .MDEngines.cubes import MDNptCube
 from .MDEngines.cubes import ParallelMDNptCube
 
+from .MDEngines.cubes import MDStagePlanCube
+from .MDEngines.cubes import ParallelMDStagePlanCube
+
+from .MDEngines.cubes import MDCycleProxyCube
+from .MDEngines.cubes import MDNptCycleCube
+
 from .System.cubes import IDSettingCube
 from .System.cubes import SolvationCube
 from .System.cubes import ParallelSolvationCube
@@ -61,6 +61,9 @@ coll_open = CollectionSetting("OpenCollection", title="Open Collection")
 coll_open.set_parameters(open=True)
 
 trajCube = ParallelTrajToOEMolCube("TrajToOEMolCube", title="Trajectory To OEMols")
+trajCube.promote_parameter('trajectory_stream', promoted_name='analysis_trajectory_stream', default='analysis',
+                           description='The atom subset trajectory stream analyzed in place of the full system '
+                                       'trajectory when present')
 IntECube = ParallelTrajInteractionEnergyCube("TrajInteractionEnergyCube", title="MM Energies")
 PBSACube = ParallelTrajPBSACube("TrajPBSACube", title="PBSA Energies")
 
@@ -94,8 +94,12 @@ mdcomp.promote_parameter("flask_title", promoted_name="flask_title", default="")
 prod = ParallelMDNptCube("Production", title="Production")
 prod.promote_parameter('time', promoted_name='prod_ns', default=2.0,
                        description='Length of MD run in nanoseconds')
-prod.promote_parameter('trajectory_interval', promoted_name='prod_trajectory_interval', default=0.004,
-                       description='Trajectory saving interval in ns')
+prod.promote_parameter('trajectory_interval', promoted_name='prod_trajectory_interval', default=0.04,
+                       description='Full system trajectory saving interval in ns')
+prod.promote_parameter('trajectory_streams', promoted_name='prod_trajectory_streams',
+                       default='analysis:0.004:protein or ligand or (water and (12.0 around ligand))',
+                       description='Atom subset trajectory streams as name:interval in ns:mask separated by '
+                                   'semicolons. The analysis stream is used by the trajectory analysis')
 prod.promote_parameter('hmr', promoted_name="HMR", title='Use Hydrogen Mass Repartitioning', default=True,
                        description='Give hydrogens more mass to speed up the MD')
 prod.promote_parameter('md_engine', promoted_name='md_engine', default='OpenMM',
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# (C) 2019 OpenEye Scientific Software Inc. All rights reserved.
+#
+# TERMS FOR USE OF SAMPLE CODE The software below ("Sample Code") is
+# provided to current licensees or subscribers of OpenEye products or
+# SaaS offerings (each a "Customer").
+# Customer is hereby permitted to use, copy, and modify the Sample Code,
+# subject to these terms. OpenEye claims no rights to Customer's
+# modifications. Modification of Sample Code is at Customer's sole and
+# exclusive risk. Sample Code may require Customer to have a then
+# current license or subscription to the applicable OpenEye offering.
+# THE SAMPLE CODE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED.  OPENEYE DISCLAIMS ALL WARRANTIES, INCLUDING, BUT
+# NOT LIMITED TO, WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. In no event shall OpenEye be
+# liable for any damages or liability in connection with the Sample Code
+# or its use.
+
+from floe.api import WorkFloe
+
+from MDOrion.MDEngines.cubes import (MDCycleProxyCube,
+                                     MDNptCycleCube)
+
+from orionplatform.cubes import DatasetReaderCube, DatasetWriterCube
+
+job = WorkFloe("NPT Production Cycles",
+               title="NPT Production Cycles")
+
+job.description = """
+NPT production of an OpenMM-ready System run in wall clock bounded cycles.
+Each cycle checkpoints the OpenMM Context on the record so that the production
+resumes from the last checkpoint if a cycle is interrupted
+
+Ex: python floes_dev/MDproductionCycles.py --system complex.oeb --nanoseconds 0.01
+
+Parameters:
+-----------
+complex (file): OEB file of the prepared system
+
+Optional:
+--------
+nanoseconds (float): Length of the production in nanoseconds
+cube_run_time (float): Wall clock time of each cycle in hours
+temperature (decimal): target final temperature in K
+pressure (decimal): target final pressure in atm
+
+Outputs:
+--------
+ofs: Outputs the constant temperature and pressure system
+"""
+
+job.classification = [['NPT']]
+job.uuid = "c3a0e5d2-7b4f-4e81-a6d9-1f2b8c4e7a35"
+job.tags = [tag for lists in job.classification for tag in lists]
+
+ifs = DatasetReaderCube("SystemReader", title="System Reader")
+ifs.promote_parameter("data_in", promoted_name="system", title='System Input File',
+                      description="System input file")
+
+proxy = MDCycleProxyCube('proxy', title="Production Cycle Proxy")
+
+npt = MDNptCycleCube('npt', title="Production")
+npt.promote_parameter('time', promoted_name='nanoseconds', default=0.01,
+                      description='Length of MD run in nanoseconds')
+npt.promote_parameter('cube_run_time', promoted_name='cube_run_time', default=10.0,
+                      description='Wall clock time of each production cycle in hours')
+npt.promote_parameter('temperature', promoted_name='temperature', default=300.0,
+                      description='Selected temperature in K')
+npt.promote_parameter('pressure', promoted_name='pressure', default=1.0,
+                      description='Selected pressure in atm')
+
+# Trajectory and logging info frequency intervals
+npt.promote_parameter('trajectory_interval', promoted_name='trajectory_interval', default=0.001,
+                      description='Trajectory saving interval in ns')
+npt.promote_parameter('reporter_interval', promoted_name='reporter_interval', default=0.001,
+                      description='Reporter saving interval in ns')
+
+npt.set_parameters(suffix='prod')
+
+ofs = DatasetWriterCube('ofs', title='Out')
+ofs.promote_parameter("data_out", promoted_name="out")
+
+fail = DatasetWriterCube('fail', title='Failures')
+fail.promote_parameter("data_out", promoted_name="fail")
+
+job.add_cubes(ifs, proxy, npt, ofs, fail)
+
+ifs.success.connect(proxy.intake)
+proxy.success.connect(npt.intake)
+npt.success.connect(proxy.intake)
+proxy.completed.connect(ofs.intake)
+proxy.failure.connect(fail.intake)
+npt.failure.connect(fail.intake)
+
+if __name__ == "__main__":
+    job.run()